@@ -0,0 +1,33 @@
+import posix_ipc
+import utils
+
+params = utils.read_params()
+
+try:
+    posix_ipc.unlink_shared_memory(params["SHARED_MEMORY_NAME"])
+    s = "memory segment %s removed" % params["SHARED_MEMORY_NAME"]
+    print(s)
+except:
+    print("memory doesn't need cleanup")
+
+
+for name in (params["PING_SEMAPHORE_NAME"], params["PONG_SEMAPHORE_NAME"]):
+    try:
+        posix_ipc.unlink_semaphore(name)
+        s = "semaphore %s removed" % name
+        print(s)
+    except:
+        print("semaphore %s doesn't need cleanup" % name)
+
+
+if posix_ipc.MESSAGE_QUEUES_SUPPORTED:
+    for name in (params["PING_QUEUE_NAME"], params["PONG_QUEUE_NAME"]):
+        try:
+            posix_ipc.unlink_message_queue(name)
+            s = "message queue %s removed" % name
+            print(s)
+        except:
+            print("message queue %s doesn't need cleanup" % name)
+
+
+print("\nAll clean!")
@@ -0,0 +1,11 @@
+#!/usr/bin/env bash
+
+# Linker opts should be blank for OS X, FreeBSD and OpenSolaris
+#LINKER_OPTIONS=""
+
+# On Linux, we must link with realtime and thread libraries
+LINKER_OPTIONS="-lrt -lpthread"
+
+gcc -Wall -O2 -c -o utils.o utils.c
+gcc -Wall -O2 utils.o -o ping ping.c -L. -lm $LINKER_OPTIONS
+gcc -Wall -O2 utils.o -o pong pong.c -L. -lm $LINKER_OPTIONS
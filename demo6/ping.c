@@ -0,0 +1,109 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+#include <stdint.h>
+
+#include "utils.h"
+
+const char MY_NAME[] = "Pinger";
+
+// Time round trips between this program and the ponger (pong.c or pong.py).
+
+int main() {
+    struct param_struct params;
+    struct channel channel;
+    struct histogram *pHistogram;
+    char *pMessage;
+    char *pReply;
+    char s[1024];
+    uint64_t i;
+    uint64_t total;
+    uint64_t sequence;
+    uint64_t start;
+    uint64_t elapsed;
+    int rc = 0;
+
+    say(MY_NAME, "Oooo 'ello, I'm the pinger!");
+
+    read_params(&params);
+
+    pin_to_cpu(MY_NAME, params.ping_cpu);
+
+    // The histogram is ~30k so it lives on the heap rather than the stack.
+    pHistogram = (struct histogram *)malloc(sizeof(struct histogram));
+    pMessage = (char *)malloc(params.message_size);
+    pReply = (char *)malloc(params.message_size);
+    if ((!pHistogram) || (!pMessage) || (!pReply)) {
+        say(MY_NAME, "Out of memory");
+        return 1;
+    }
+
+    histogram_init(pHistogram);
+    // The payload is meaningless except for the sequence number at the front.
+    memset(pMessage, 'x', params.message_size);
+
+    // Create the IPC objects. The ponger will open them once they exist.
+    if (channel_open(MY_NAME, &channel, &params, 1))
+        return 1;
+
+    say(MY_NAME, "Waiting for the ponger...");
+
+    total = (uint64_t)params.warmup + (uint64_t)params.iterations;
+    for (i = 0; (!rc) && (i < total); i++) {
+        if (i == (uint64_t)params.warmup) {
+            sprintf(s, "Warmup complete; timing %d round trips", params.iterations);
+            say(MY_NAME, s);
+        }
+
+        memcpy(pMessage, &i, sizeof(i));
+
+        start = now_ns();
+        rc = channel_send(&channel, pMessage);
+        if (!rc)
+            rc = channel_receive(&channel, pReply);
+        elapsed = now_ns() - start;
+
+        if (rc) {
+            sprintf(s, "Round trip %llu failed; errno is %d", (unsigned long long)i, errno);
+            say(MY_NAME, s);
+        }
+        else {
+            // The ponger adds 1 to the sequence number, so anything else means
+            // the reply was lost or corrupted.
+            memcpy(&sequence, pReply, sizeof(sequence));
+            if (sequence != i + 1) {
+                sprintf(s, "Expected reply %llu, got %llu", (unsigned long long)(i + 1),
+                        (unsigned long long)sequence);
+                say(MY_NAME, s);
+                rc = -1;
+            }
+            else if (i >= (uint64_t)params.warmup)
+                histogram_record(pHistogram, elapsed);
+        }
+    }
+
+    // Tell the ponger to exit and wait for it to acknowledge.
+    sequence = STOP;
+    memcpy(pMessage, &sequence, sizeof(sequence));
+    if (!channel_send(&channel, pMessage))
+        channel_receive(&channel, pReply);
+
+    channel_close(MY_NAME, &channel);
+
+    histogram_print_summary(pHistogram, &params);
+
+    if (strlen(params.histogram_file_name)) {
+        if (histogram_write_distribution(pHistogram, params.histogram_file_name))
+            sprintf(s, "Writing %s failed; errno is %d", params.histogram_file_name, errno);
+        else
+            sprintf(s, "Percentile distribution written to %s", params.histogram_file_name);
+        say(MY_NAME, s);
+    }
+
+    free(pHistogram);
+    free(pMessage);
+    free(pReply);
+
+    return rc ? 1 : 0;
+}
@@ -0,0 +1,58 @@
+# Python modules
+import struct
+import time
+
+# Utils for this demo
+import utils
+
+
+utils.say("Oooo 'ello, I'm the pinger!")
+
+params = utils.read_params()
+
+utils.pin_to_cpu(params["PING_CPU"])
+
+# Create the IPC objects. The ponger will open them once they exist.
+channel = utils.Channel(params, True)
+
+# The payload is meaningless except for the sequence number at the front.
+message = bytearray(b'x' * params["MESSAGE_SIZE"])
+
+histogram = utils.Histogram()
+
+utils.say("Waiting for the ponger...")
+
+total = params["WARMUP"] + params["ITERATIONS"]
+for i in range(total):
+    if i == params["WARMUP"]:
+        utils.say("Warmup complete; timing %d round trips" % params["ITERATIONS"])
+
+    struct.pack_into(utils.SEQUENCE_FORMAT, message, 0, i)
+
+    start = time.perf_counter_ns()
+    channel.send(message)
+    reply = channel.receive()
+    elapsed = time.perf_counter_ns() - start
+
+    # The ponger adds 1 to the sequence number, so anything else means
+    # the reply was lost or corrupted.
+    sequence, = struct.unpack_from(utils.SEQUENCE_FORMAT, reply, 0)
+    if sequence != i + 1:
+        raise AssertionError("Expected reply %d, got %d" % (i + 1, sequence))
+
+    if i >= params["WARMUP"]:
+        histogram.record(elapsed)
+
+# Tell the ponger to exit and wait for it to acknowledge.
+struct.pack_into(utils.SEQUENCE_FORMAT, message, 0, utils.STOP)
+channel.send(message)
+channel.receive()
+
+utils.say("Destroying the IPC objects.")
+channel.close()
+
+histogram.print_summary(params)
+
+if params.get("HISTOGRAM_FILE_NAME"):
+    histogram.write_distribution(params["HISTOGRAM_FILE_NAME"])
+    utils.say("Percentile distribution written to %s" % params["HISTOGRAM_FILE_NAME"])
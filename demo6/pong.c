@@ -0,0 +1,70 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+#include <stdint.h>
+
+#include "utils.h"
+
+const char MY_NAME[] = "Ponger";
+
+// Answer the pinger (ping.c or ping.py) until it says stop.
+
+int main() {
+    struct param_struct params;
+    struct channel channel;
+    char *pMessage;
+    char s[1024];
+    uint64_t sequence;
+    uint64_t count = 0;
+    int done = 0;
+
+    say(MY_NAME, "Oooo 'ello, I'm the ponger!");
+
+    read_params(&params);
+
+    pin_to_cpu(MY_NAME, params.pong_cpu);
+
+    pMessage = (char *)malloc(params.message_size);
+    if (!pMessage) {
+        say(MY_NAME, "Out of memory");
+        return 1;
+    }
+
+    // The pinger has already created the IPC objects. I just need to open them.
+    if (channel_open(MY_NAME, &channel, &params, 0))
+        return 1;
+
+    while (!done) {
+        if (channel_receive(&channel, pMessage)) {
+            sprintf(s, "Receiving failed; errno is %d", errno);
+            say(MY_NAME, s);
+            break;
+        }
+
+        memcpy(&sequence, pMessage, sizeof(sequence));
+        done = (sequence == STOP);
+
+        // Echo the message with the sequence number incremented so the pinger
+        // knows that I really saw it.
+        sequence++;
+        memcpy(pMessage, &sequence, sizeof(sequence));
+
+        if (channel_send(&channel, pMessage)) {
+            sprintf(s, "Sending failed; errno is %d", errno);
+            say(MY_NAME, s);
+            break;
+        }
+
+        count++;
+    }
+
+    channel_close(MY_NAME, &channel);
+
+    sprintf(s, "%llu messages answered", (unsigned long long)(count - 1));
+    say(MY_NAME, s);
+
+    free(pMessage);
+
+    return 0;
+}
@@ -0,0 +1,37 @@
+# Python modules
+import struct
+
+# Utils for this demo
+import utils
+
+
+utils.say("Oooo 'ello, I'm the ponger!")
+
+params = utils.read_params()
+
+utils.pin_to_cpu(params["PONG_CPU"])
+
+# The pinger has already created the IPC objects. I just need to open them.
+channel = utils.Channel(params, False)
+
+reply = bytearray(params["MESSAGE_SIZE"])
+
+done = False
+count = 0
+while not done:
+    message = channel.receive()
+
+    sequence, = struct.unpack_from(utils.SEQUENCE_FORMAT, message, 0)
+    done = (sequence == utils.STOP)
+
+    # Echo the message with the sequence number incremented so the pinger
+    # knows that I really saw it.
+    reply[:] = message
+    struct.pack_into(utils.SEQUENCE_FORMAT, reply, 0, (sequence + 1) & utils.SEQUENCE_MASK)
+    channel.send(reply)
+
+    count += 1
+
+channel.close()
+
+utils.say("%d messages answered" % (count - 1))
@@ -0,0 +1,398 @@
+// sched_setaffinity() is a GNU extension.
+#define _GNU_SOURCE
+
+#include <time.h>
+#include <stdlib.h>
+#include <stdio.h>
+#include <unistd.h>
+#include <errno.h>
+#include <string.h>
+#include <math.h>
+#include <fcntl.h>
+#include <sched.h>
+#include <semaphore.h>
+#include <mqueue.h>
+#include <sys/mman.h>
+
+#include "utils.h"
+
+static const double PERCENTILES[] = {50, 90, 99, 99.9, 99.99};
+
+
+void say(const char *pName, char *pMessage) {
+    time_t the_time;
+    struct tm *the_localtime;
+    char timestamp[256];
+
+    the_time = time(NULL);
+
+    the_localtime = localtime(&the_time);
+
+    strftime(timestamp, 255, "%H:%M:%S", the_localtime);
+
+    printf("%s @ %s: %s\n", pName, timestamp, pMessage);
+}
+
+
+void read_params(struct param_struct *params) {
+    char line[1024];
+    char name[1024];
+    char value[1024];
+
+    FILE *fp;
+
+    memset(params, 0, sizeof(struct param_struct));
+    name[0] = '\0';
+    value[0] = '\0';
+
+    fp = fopen("params.txt", "r");
+
+    while (fgets(line, 1024, fp)) {
+        if (strlen(line) && ('#' == line[0]))
+            ; // comment in input, ignore
+        else {
+            sscanf(line, "%[ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghjiklmnopqrstuvwxyz]=%s\n", name, value);
+
+            if (!strcmp(name, "ITERATIONS"))
+                params->iterations = atoi(value);
+            if (!strcmp(name, "WARMUP"))
+                params->warmup = atoi(value);
+            if (!strcmp(name, "TRANSPORT"))
+                params->transport = strcmp(value, "mq") ? TRANSPORT_SHM : TRANSPORT_MQ;
+            if (!strcmp(name, "MESSAGE_SIZE"))
+                params->message_size = atoi(value);
+            if (!strcmp(name, "PING_CPU"))
+                params->ping_cpu = atoi(value);
+            if (!strcmp(name, "PONG_CPU"))
+                params->pong_cpu = atoi(value);
+            if (!strcmp(name, "HISTOGRAM_FILE_NAME"))
+                strcpy(params->histogram_file_name, value);
+            if (!strcmp(name, "PING_SEMAPHORE_NAME"))
+                strcpy(params->ping_semaphore_name, value);
+            if (!strcmp(name, "PONG_SEMAPHORE_NAME"))
+                strcpy(params->pong_semaphore_name, value);
+            if (!strcmp(name, "SHARED_MEMORY_NAME"))
+                strcpy(params->shared_memory_name, value);
+            if (!strcmp(name, "PING_QUEUE_NAME"))
+                strcpy(params->ping_queue_name, value);
+            if (!strcmp(name, "PONG_QUEUE_NAME"))
+                strcpy(params->pong_queue_name, value);
+            if (!strcmp(name, "PERMISSIONS"))
+                params->permissions = (int)strtol(value, NULL, 8);
+
+            name[0] = '\0';
+            value[0] = '\0';
+        }
+    }
+
+    fclose(fp);
+
+    if (params->message_size < (int)sizeof(uint64_t))
+        params->message_size = (int)sizeof(uint64_t);
+
+    printf("iterations = %d\n", params->iterations);
+    printf("warmup = %d\n", params->warmup);
+    printf("transport = %s\n", (params->transport == TRANSPORT_MQ) ? "mq" : "shm");
+    printf("message size = %d\n", params->message_size);
+}
+
+
+void pin_to_cpu(const char *pName, int cpu) {
+    char s[1024];
+
+    if (cpu >= 0) {
+#ifdef __linux__
+        cpu_set_t cpu_set;
+
+        CPU_ZERO(&cpu_set);
+        CPU_SET(cpu, &cpu_set);
+
+        if (sched_setaffinity(0, sizeof(cpu_set), &cpu_set))
+            sprintf(s, "Pinning to CPU %d failed; errno is %d", cpu, errno);
+        else
+            sprintf(s, "pinned to CPU %d", cpu);
+#else
+        sprintf(s, "CPU pinning isn't supported on this platform; not pinning");
+#endif
+        say(pName, s);
+    }
+}
+
+
+uint64_t now_ns(void) {
+    struct timespec now;
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+
+    return ((uint64_t)now.tv_sec * 1000000000) + (uint64_t)now.tv_nsec;
+}
+
+
+/*   =====  Histogram  =====   */
+
+static int histogram_index_for(uint64_t value) {
+    int shift;
+
+    if (value < SUB_BUCKET_COUNT)
+        return (int)value;
+
+    // 64 - (number of leading zeros) is the value's bit length.
+    shift = (64 - __builtin_clzll(value)) - SUB_BUCKET_BITS;
+
+    return (shift * SUB_BUCKET_HALF_COUNT) + (int)(value >> shift);
+}
+
+
+static uint64_t histogram_highest_equivalent_value(int index) {
+    int shift;
+    uint64_t top;
+
+    if (index < SUB_BUCKET_COUNT)
+        return (uint64_t)index;
+
+    shift = (index / SUB_BUCKET_HALF_COUNT) - 1;
+    top = (uint64_t)(index - (shift * SUB_BUCKET_HALF_COUNT));
+
+    return ((top + 1) << shift) - 1;
+}
+
+
+void histogram_init(struct histogram *pHistogram) {
+    memset(pHistogram, 0, sizeof(struct histogram));
+}
+
+
+void histogram_record(struct histogram *pHistogram, uint64_t value) {
+    pHistogram->counts[histogram_index_for(value)]++;
+
+    if ((!pHistogram->total_count) || (value < pHistogram->min))
+        pHistogram->min = value;
+    if (value > pHistogram->max)
+        pHistogram->max = value;
+
+    pHistogram->total_count++;
+    pHistogram->sum += (double)value;
+}
+
+
+uint64_t histogram_value_at_percentile(struct histogram *pHistogram, double percentile) {
+    uint64_t target;
+    uint64_t running_count = 0;
+    uint64_t value;
+    int i;
+
+    if (!pHistogram->total_count)
+        return 0;
+
+    target = (uint64_t)ceil((percentile / 100) * (double)pHistogram->total_count);
+    if (!target)
+        target = 1;
+
+    for (i = 0; i < BUCKET_COUNT; i++) {
+        running_count += pHistogram->counts[i];
+        if (running_count >= target) {
+            value = histogram_highest_equivalent_value(i);
+            return (value < pHistogram->max) ? value : pHistogram->max;
+        }
+    }
+
+    return pHistogram->max;
+}
+
+
+void histogram_print_summary(struct histogram *pHistogram, struct param_struct *params) {
+    char label[32];
+    int i;
+
+    printf("\n");
+    printf("transport=%s message_size=%d round trips=%llu\n",
+           (params->transport == TRANSPORT_MQ) ? "mq" : "shm",
+           params->message_size,
+           (unsigned long long)pHistogram->total_count);
+    printf("Round trip latency (usec):\n");
+    printf("%8s: %10.3f\n", "min", (double)pHistogram->min / 1000);
+    for (i = 0; i < (int)(sizeof(PERCENTILES) / sizeof(PERCENTILES[0])); i++) {
+        sprintf(label, "p%g", PERCENTILES[i]);
+        printf("%8s: %10.3f\n", label,
+               (double)histogram_value_at_percentile(pHistogram, PERCENTILES[i]) / 1000);
+    }
+    printf("%8s: %10.3f\n", "max", (double)pHistogram->max / 1000);
+    if (pHistogram->total_count)
+        printf("%8s: %10.3f\n", "mean", pHistogram->sum / (double)pHistogram->total_count / 1000);
+}
+
+
+int histogram_write_distribution(struct histogram *pHistogram, const char *filename) {
+    // Writes the same HdrHistogram-style text as utils.py.
+    FILE *fp;
+    uint64_t running_count = 0;
+    uint64_t value;
+    double fraction;
+    int i;
+
+    fp = fopen(filename, "w");
+    if (!fp)
+        return -1;
+
+    fprintf(fp, "%12s %14s %10s %14s\n\n", "Value", "Percentile", "TotalCount", "1/(1-Percentile)");
+
+    for (i = 0; i < BUCKET_COUNT; i++) {
+        if (pHistogram->counts[i]) {
+            running_count += pHistogram->counts[i];
+            fraction = (double)running_count / (double)pHistogram->total_count;
+            value = histogram_highest_equivalent_value(i);
+            if (value > pHistogram->max)
+                value = pHistogram->max;
+
+            fprintf(fp, "%12.3f %2.12f %10llu ", (double)value / 1000, fraction,
+                    (unsigned long long)running_count);
+            if (fraction < 1)
+                fprintf(fp, "%14.2f\n", 1 / (1 - fraction));
+            else
+                fprintf(fp, "%14s\n", "inf");
+        }
+    }
+
+    if (pHistogram->total_count)
+        fprintf(fp, "#[Mean    = %12.3f]\n", pHistogram->sum / (double)pHistogram->total_count / 1000);
+    fprintf(fp, "#[Max     = %12.3f, Total count    = %12llu]\n",
+            (double)pHistogram->max / 1000, (unsigned long long)pHistogram->total_count);
+
+    fclose(fp);
+
+    return 0;
+}
+
+
+/*   =====  Channel  =====   */
+
+int channel_open(const char *pName, struct channel *pChannel, struct param_struct *params,
+                 int is_pinger) {
+    // The pinger creates everything; the ponger opens existing objects.
+    int flags = is_pinger ? (O_CREAT | O_EXCL) : 0;
+    int fd;
+    char s[1024];
+    sem_t *pPing;
+    sem_t *pPong;
+    mqd_t ping_queue;
+    mqd_t pong_queue;
+    struct mq_attr attr;
+
+    memset(pChannel, 0, sizeof(struct channel));
+    pChannel->params = params;
+    pChannel->is_pinger = is_pinger;
+    pChannel->incoming_queue = (mqd_t)-1;
+    pChannel->outgoing_queue = (mqd_t)-1;
+
+    if (params->transport == TRANSPORT_SHM) {
+        fd = shm_open(params->shared_memory_name, O_RDWR | flags, params->permissions);
+        if (fd == -1) {
+            sprintf(s, "Opening the shared memory failed; errno is %d", errno);
+            say(pName, s);
+            return -1;
+        }
+
+        if (is_pinger && ftruncate(fd, params->message_size)) {
+            sprintf(s, "Resizing the shared memory failed; errno is %d", errno);
+            say(pName, s);
+            close(fd);
+            return -1;
+        }
+
+        pChannel->pSharedMemory = mmap((void *)0, (size_t)params->message_size,
+                                       PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+        // Once I've mmapped the file descriptor, I can close it without
+        // interfering with the mmap.
+        close(fd);
+        if (pChannel->pSharedMemory == MAP_FAILED) {
+            pChannel->pSharedMemory = NULL;
+            sprintf(s, "MMapping the shared memory failed; errno is %d", errno);
+            say(pName, s);
+            return -1;
+        }
+
+        pPing = sem_open(params->ping_semaphore_name, flags, params->permissions, 0);
+        pPong = sem_open(params->pong_semaphore_name, flags, params->permissions, 0);
+        if ((pPing == SEM_FAILED) || (pPong == SEM_FAILED)) {
+            sprintf(s, "Opening the semaphores failed; errno is %d", errno);
+            say(pName, s);
+            return -1;
+        }
+
+        pChannel->pOutgoingSemaphore = is_pinger ? pPing : pPong;
+        pChannel->pIncomingSemaphore = is_pinger ? pPong : pPing;
+    }
+    else {
+        attr.mq_flags = 0;
+        attr.mq_maxmsg = 1;
+        attr.mq_msgsize = params->message_size;
+        attr.mq_curmsgs = 0;
+
+        ping_queue = mq_open(params->ping_queue_name, O_RDWR | flags, params->permissions, &attr);
+        pong_queue = mq_open(params->pong_queue_name, O_RDWR | flags, params->permissions, &attr);
+        if ((ping_queue == (mqd_t)-1) || (pong_queue == (mqd_t)-1)) {
+            sprintf(s, "Opening the message queues failed; errno is %d", errno);
+            say(pName, s);
+            return -1;
+        }
+
+        pChannel->outgoing_queue = is_pinger ? ping_queue : pong_queue;
+        pChannel->incoming_queue = is_pinger ? pong_queue : ping_queue;
+    }
+
+    return 0;
+}
+
+
+int channel_send(struct channel *pChannel, char *pMessage) {
+    size_t size = (size_t)pChannel->params->message_size;
+
+    if (pChannel->params->transport == TRANSPORT_SHM) {
+        memcpy(pChannel->pSharedMemory, pMessage, size);
+        return sem_post(pChannel->pOutgoingSemaphore);
+    }
+    else
+        return mq_send(pChannel->outgoing_queue, pMessage, size, 0);
+}
+
+
+int channel_receive(struct channel *pChannel, char *pMessage) {
+    size_t size = (size_t)pChannel->params->message_size;
+    int rc;
+
+    if (pChannel->params->transport == TRANSPORT_SHM) {
+        rc = sem_wait(pChannel->pIncomingSemaphore);
+        if (!rc)
+            memcpy(pMessage, pChannel->pSharedMemory, size);
+        return rc;
+    }
+    else
+        return (mq_receive(pChannel->incoming_queue, pMessage, size, NULL) == -1) ? -1 : 0;
+}
+
+
+void channel_close(const char *pName, struct channel *pChannel) {
+    struct param_struct *params = pChannel->params;
+
+    if (params->transport == TRANSPORT_SHM) {
+        munmap(pChannel->pSharedMemory, (size_t)params->message_size);
+        sem_close(pChannel->pIncomingSemaphore);
+        sem_close(pChannel->pOutgoingSemaphore);
+        // The pinger created everything so it's responsible for destroying it.
+        if (pChannel->is_pinger) {
+            say(pName, "Destroying the shared memory and semaphores.");
+            shm_unlink(params->shared_memory_name);
+            sem_unlink(params->ping_semaphore_name);
+            sem_unlink(params->pong_semaphore_name);
+        }
+    }
+    else {
+        mq_close(pChannel->incoming_queue);
+        mq_close(pChannel->outgoing_queue);
+        if (pChannel->is_pinger) {
+            say(pName, "Destroying the message queues.");
+            mq_unlink(params->ping_queue_name);
+            mq_unlink(params->pong_queue_name);
+        }
+    }
+}
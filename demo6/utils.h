@@ -0,0 +1,66 @@
+#include <stdint.h>
+#include <semaphore.h>
+#include <mqueue.h>
+
+#define TRANSPORT_SHM   0
+#define TRANSPORT_MQ    1
+
+// The pinger sends this sequence number to tell the ponger to exit.
+#define STOP            UINT64_MAX
+
+// See utils.py for an explanation of the histogram layout.
+#define SUB_BUCKET_BITS         7
+#define SUB_BUCKET_COUNT        (1 << SUB_BUCKET_BITS)
+#define SUB_BUCKET_HALF_COUNT   (SUB_BUCKET_COUNT >> 1)
+#define BUCKET_COUNT            (SUB_BUCKET_COUNT + ((64 - SUB_BUCKET_BITS) * SUB_BUCKET_HALF_COUNT))
+
+struct param_struct {
+    int iterations;
+    int warmup;
+    int transport;
+    int message_size;
+    int ping_cpu;
+    int pong_cpu;
+    char histogram_file_name[512];
+    char ping_semaphore_name[512];
+    char pong_semaphore_name[512];
+    char shared_memory_name[512];
+    char ping_queue_name[512];
+    char pong_queue_name[512];
+    int permissions;
+};
+
+struct histogram {
+    uint64_t counts[BUCKET_COUNT];
+    uint64_t total_count;
+    uint64_t min;
+    uint64_t max;
+    double sum;
+};
+
+struct channel {
+    struct param_struct *params;
+    int is_pinger;
+    void *pSharedMemory;
+    sem_t *pIncomingSemaphore;
+    sem_t *pOutgoingSemaphore;
+    mqd_t incoming_queue;
+    mqd_t outgoing_queue;
+};
+
+
+void say(const char *, char *);
+void read_params(struct param_struct *);
+void pin_to_cpu(const char *, int);
+uint64_t now_ns(void);
+
+void histogram_init(struct histogram *);
+void histogram_record(struct histogram *, uint64_t);
+uint64_t histogram_value_at_percentile(struct histogram *, double);
+void histogram_print_summary(struct histogram *, struct param_struct *);
+int histogram_write_distribution(struct histogram *, const char *);
+
+int channel_open(const char *, struct channel *, struct param_struct *, int);
+int channel_send(struct channel *, char *);
+int channel_receive(struct channel *, char *);
+void channel_close(const char *, struct channel *);
@@ -0,0 +1,238 @@
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+
+# 3rd party modules
+import posix_ipc
+
+# Every message starts with a sequence number in native byte order so that
+# the Python and C versions of the programs can talk to one another.
+SEQUENCE_FORMAT = "Q"
+SEQUENCE_MASK = 0xFFFFFFFFFFFFFFFF
+# The pinger sends this sequence number to tell the ponger to exit.
+STOP = SEQUENCE_MASK
+
+# The histogram is log-linear in the style of HdrHistogram. Values below
+# 2 ** SUB_BUCKET_BITS are counted exactly. Above that, each power of 2 is
+# split into 2 ** (SUB_BUCKET_BITS - 1) buckets, so the reported value is
+# never more than 1/64th (about 1.5%) larger than the real one.
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF_COUNT = SUB_BUCKET_COUNT >> 1
+BUCKET_COUNT = SUB_BUCKET_COUNT + ((64 - SUB_BUCKET_BITS) * SUB_BUCKET_HALF_COUNT)
+
+# These are the percentiles printed in the summary.
+PERCENTILES = (50, 90, 99, 99.9, 99.99)
+
+
+def say(s):
+    """Prints a timestamped, self-identified message"""
+    who = sys.argv[0]
+    if who.endswith(".py"):
+        who = who[:-3]
+
+    s = "%s@%1.6f: %s" % (who, time.time(), s)
+    print(s)
+
+
+def read_params():
+    """Reads the contents of params.txt and returns them as a dict"""
+    params = {}
+
+    f = open("params.txt")
+
+    for line in f:
+        line = line.strip()
+        if line:
+            if line.startswith('#'):
+                pass  # comment in input, ignore
+            else:
+                name, value = line.split('=')
+                name = name.upper().strip()
+                value = value.strip()
+
+                if name == "PERMISSIONS":
+                    # Think octal, young man!
+                    value = int(value, 8)
+                elif ("NAME" in name) or (name == "TRANSPORT"):
+                    # This is a string; leave it alone.
+                    pass
+                else:
+                    value = int(value)
+
+                params[name] = value
+
+    f.close()
+
+    if params["MESSAGE_SIZE"] < struct.calcsize(SEQUENCE_FORMAT):
+        raise ValueError("MESSAGE_SIZE must be at least %d" % struct.calcsize(SEQUENCE_FORMAT))
+
+    if params["TRANSPORT"] not in ("shm", "mq"):
+        raise ValueError("TRANSPORT must be shm or mq")
+
+    return params
+
+
+def pin_to_cpu(cpu):
+    """Restricts this process to the given CPU. A negative value means don't pin."""
+    if cpu >= 0:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, {cpu})
+            say("pinned to CPU %d" % cpu)
+        else:
+            say("CPU pinning isn't supported on this platform; not pinning")
+
+
+class Histogram:
+    """A log-linear histogram of round trip times in nanoseconds"""
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.total_count = 0
+        self.min = 0
+        self.max = 0
+        self.sum = 0
+
+    @staticmethod
+    def index_for(value):
+        if value < SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return (shift * SUB_BUCKET_HALF_COUNT) + (value >> shift)
+
+    @staticmethod
+    def highest_equivalent_value(index):
+        if index < SUB_BUCKET_COUNT:
+            return index
+        shift = (index // SUB_BUCKET_HALF_COUNT) - 1
+        top = index - (shift * SUB_BUCKET_HALF_COUNT)
+        return ((top + 1) << shift) - 1
+
+    def record(self, value):
+        self.counts[self.index_for(value)] += 1
+        if (not self.total_count) or (value < self.min):
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.total_count += 1
+        self.sum += value
+
+    def value_at_percentile(self, percentile):
+        """Returns the value at or below which percentile % of the samples fall"""
+        if not self.total_count:
+            return 0
+
+        target = max(1, math.ceil((percentile / 100) * self.total_count))
+        running_count = 0
+        for i, count in enumerate(self.counts):
+            running_count += count
+            if running_count >= target:
+                return min(self.highest_equivalent_value(i), self.max)
+
+        return self.max
+
+    def print_summary(self, params):
+        """Prints min, max, mean and the standard percentiles in microseconds"""
+        print("")
+        print("transport=%s message_size=%d round trips=%d" %
+              (params["TRANSPORT"], params["MESSAGE_SIZE"], self.total_count))
+        print("Round trip latency (usec):")
+        print("%8s: %10.3f" % ("min", self.min / 1000))
+        for percentile in PERCENTILES:
+            print("%8s: %10.3f" % ("p%g" % percentile,
+                                   self.value_at_percentile(percentile) / 1000))
+        print("%8s: %10.3f" % ("max", self.max / 1000))
+        if self.total_count:
+            print("%8s: %10.3f" % ("mean", self.sum / self.total_count / 1000))
+
+    def write_distribution(self, filename):
+        """Writes the percentile distribution in HdrHistogram's text format
+        (values in microseconds) so it can be fed to HdrHistogram's plotter.
+        """
+        f = open(filename, "w")
+
+        f.write("%12s %14s %10s %14s\n\n" %
+                ("Value", "Percentile", "TotalCount", "1/(1-Percentile)"))
+
+        running_count = 0
+        for i, count in enumerate(self.counts):
+            if count:
+                running_count += count
+                fraction = running_count / self.total_count
+                if fraction < 1:
+                    inverse = "%14.2f" % (1 / (1 - fraction))
+                else:
+                    inverse = "%14s" % "inf"
+                value = min(self.highest_equivalent_value(i), self.max)
+                f.write("%12.3f %2.12f %10d %s\n" %
+                        (value / 1000, fraction, running_count, inverse))
+
+        if self.total_count:
+            f.write("#[Mean    = %12.3f]\n" % (self.sum / self.total_count / 1000))
+        f.write("#[Max     = %12.3f, Total count    = %12d]\n" %
+                (self.max / 1000, self.total_count))
+
+        f.close()
+
+
+class Channel:
+    """One end of a two-way conversation over either shared memory + two
+    semaphores or a pair of message queues.
+
+    The pinger sends on the "ping" objects and receives on the "pong" objects;
+    the ponger does the opposite.
+    """
+    def __init__(self, params, is_pinger):
+        self.params = params
+        self.size = params["MESSAGE_SIZE"]
+        self.is_pinger = is_pinger
+        # The pinger creates everything; the ponger opens existing objects.
+        flags = posix_ipc.O_CREX if is_pinger else 0
+        mode = params["PERMISSIONS"]
+
+        if params["TRANSPORT"] == "shm":
+            memory = posix_ipc.SharedMemory(params["SHARED_MEMORY_NAME"], flags, mode,
+                                            size=self.size if is_pinger else 0)
+            self.mapfile = mmap.mmap(memory.fd, self.size)
+            memory.close_fd()
+            ping = posix_ipc.Semaphore(params["PING_SEMAPHORE_NAME"], flags, mode)
+            pong = posix_ipc.Semaphore(params["PONG_SEMAPHORE_NAME"], flags, mode)
+        else:
+            ping = posix_ipc.MessageQueue(params["PING_QUEUE_NAME"], flags, mode,
+                                          max_messages=1, max_message_size=self.size)
+            pong = posix_ipc.MessageQueue(params["PONG_QUEUE_NAME"], flags, mode,
+                                          max_messages=1, max_message_size=self.size)
+
+        if is_pinger:
+            self.outgoing, self.incoming = ping, pong
+        else:
+            self.outgoing, self.incoming = pong, ping
+
+    def send(self, message):
+        if self.params["TRANSPORT"] == "shm":
+            self.mapfile[:self.size] = message
+            self.outgoing.release()
+        else:
+            self.outgoing.send(message)
+
+    def receive(self):
+        if self.params["TRANSPORT"] == "shm":
+            self.incoming.acquire()
+            return self.mapfile[:self.size]
+        else:
+            return self.incoming.receive()[0]
+
+    def close(self):
+        # The pinger created everything so it's responsible for destroying it.
+        if self.is_pinger:
+            if self.params["TRANSPORT"] == "shm":
+                posix_ipc.unlink_shared_memory(self.params["SHARED_MEMORY_NAME"])
+            self.outgoing.unlink()
+            self.incoming.unlink()
+
+        if self.params["TRANSPORT"] == "shm":
+            self.mapfile.close()
+        self.outgoing.close()
+        self.incoming.close()
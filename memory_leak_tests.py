@@ -1,509 +1,652 @@
 # Python modules
+import argparse
+import ctypes
 import gc
 import os
-import subprocess
+import pickle
 import random
-import re
 import sys
+import tempfile
+import tracemalloc
 
 # My module
 import posix_ipc
 
-# TEST_COUNT = 10
-TEST_COUNT = 1024 * 102
-
-SKIP_SEMAPHORE_TESTS = False
-SKIP_SHARED_MEMORY_TESTS = False
-SKIP_MESSAGE_QUEUE_TESTS = False
-
-if not posix_ipc.MESSAGE_QUEUES_SUPPORTED:
-    SKIP_MESSAGE_QUEUE_TESTS = True
-
-# ps output looks like this:
-#   RSZ      VSZ
-#   944    75964
-ps_output_regex = re.compile("""
-    ^
-    \s*   # whitespace before first heading
-    \S*   # first heading (e.g. RSZ)
-    \s+   # whitespace between headings
-    \S*   # second heading (e.g VSZ)
-    \s+   # newline and whitespace before first numeric value
-    (\d+) # first value
-    \s+   # whitespace between values
-    (\d+) # second value
-    \s*   # trailing whitespace if any
-    $
-""", re.MULTILINE | re.VERBOSE)
-
-# On OS X, Ubuntu and OpenSolaris, both create/destroy tests show some growth
-# is rsz and vsz. (e.g. 3248 versus 3240 -- I guess these are measured
-# in kilobytes?) When I increased the number of iterations by a factor of 10,
-# the delta didn't change which makes me think it isn't an actual leak
-# but just some memory consumed under normal circumstances.
-
+# This script measures how much memory each posix_ipc operation allocates and
+# fails if any operation exceeds its budget. It replaces an older version that
+# polled RSS/VSZ via `ps`, which was too coarse to catch small leaks and too
+# noisy to catch anything else.
+#
+# Each operation is run many times and measured three ways --
+#
+#   - blocks/op: the growth in sys.getallocatedblocks() (the number of blocks
+#     Python's allocator has handed out and not gotten back) divided by the
+#     number of iterations. A leak of a Python object or of memory from
+#     PyMem_Malloc() shows up here as >= 1.
+#   - bytes/op: the growth in memory traced by tracemalloc divided by the
+#     number of iterations. Same idea as blocks/op, but in bytes.
+#   - peak bytes: the high water mark of memory traced by tracemalloc while
+#     the operation ran, relative to where it started. This is how much an
+#     operation allocates on the way to completing, even if it frees it all
+#     before returning -- e.g. receive() allocates a buffer of
+#     max_message_size every time.
+#
+# Optionally (with --malloc), it also reports the growth in memory allocated
+# via the C library's malloc() per operation, which catches leaks that
+# bypass Python's allocators entirely. This uses mallinfo2() and so is only
+# available with glibc >= 2.33.
+#
+# Every operation has a budget for peak bytes. blocks/op and bytes/op must
+# be (almost) zero for every operation since none of them should retain
+# memory.
+#
+# The tests cover the basic operations of Semaphore, SharedMemory and
+# MessageQueue plus send_large()/receive_large(), send_obj()/receive_obj(),
+# codecs, wait_any()/receive_any(), atomic_array(), records(), load_from()/
+# dump_to(), SemaphoreArray, RobustLock and Barrier. They don't cover
+# checkpoint()/restore(), list_objects()/reap(), VersionedSegment or the
+# futures, rpc, metrics, arrow and work stealing modules. Those are built in
+# Python from the operations above and most of them start processes or scan
+# directories and files, which is too slow to repeat thousands of times.
+#
 # When I created an intentional leak by commenting out the call to
-# PyMem_Free(self->name);  in Semaphore_dealloc(), here's what
-# happened to the memory usage:
-#    Memory usage before, RSS = 3264, VSZ = 84116
-#    Python's GC reports no leftover garbage
-#    Memory usage after, RSS = 19912, VSZ = 100500
-
+# PyMem_Free(self->name);  in Semaphore_dealloc(), the semaphore create/destroy
+# tests reported 1 block/op and ~12 bytes/op and failed.
 
-NAME_CHARACTERS = "abcdefghijklmnopqrstuvwxyz"
-NAME_LENGTH = 10
+ITERATIONS_DEFAULT = 10000
 
+# A few iterations are run before measuring so that one-time allocations
+# (caches, free lists, interned strings) don't count against an operation.
+WARMUP_ITERATIONS = 100
 
-def say(s):
-    """A wrapper for print() that's compatible with Python 2 & 3"""
-    print(s)
-
+# Measured values smaller than these are considered noise.
+BLOCKS_PER_OP_TOLERANCE = 0.01
+BYTES_PER_OP_TOLERANCE = 1
 
-def random_string(length):
-    return ''.join(random.sample("abcdefghijklmnopqrstuvwxyz", length))
+# The peak bytes budget for operations that don't specify one. Most operations
+# allocate at most a name string and a return value.
+PEAK_BUDGET_DEFAULT = 1024
 
+NAME_CHARACTERS = "abcdefghijklmnopqrstuvwxyz"
+NAME_LENGTH = 10
 
-def print_mem_before():
-    say("Memory usage before, RSS = %d, VSZ = %d" % get_memory_usage())
-
-
-def print_mem_after():
-    gc.collect()
-
-    if gc.garbage:
-        say("Leftover garbage:" + str(gc.garbage))
-    else:
-        say("Python's GC reports no leftover garbage")
-
-    say("Memory usage after, RSS = %d, VSZ = %d" % get_memory_usage())
+TEST_NAME = "/p_ipc_test"
 
+# Too large to send through a queue with the default max_message_size, so send_large() and
+# send_obj() spill it to shared memory.
+LARGE_MESSAGE = bytes(range(256)) * 64
 
-def get_memory_usage():
-    # `ps` has lots of format options that vary from OS to OS, and some of
-    # those options have aliases (e.g. vsz, vsize). The ones I use below
-    # appear to be the most portable.
-    s = subprocess.Popen(["ps", "-p", str(os.getpid()), "-o", "rss,vsz"],
-                         stdout=subprocess.PIPE).communicate()[0]
+COMPRESSIBLE_MESSAGE = b"abcdefghijklmno" * 256
 
-    # Output looks like this:
-    #   RSZ      VSZ
-    #   944    75964
+# zlib's compression state at the default windowBits and memLevel is about 256KB, and its
+# decompression state about 40KB.
+ZLIB_WORKING_MEMORY = 320 * 1024
 
-    s = s.decode(sys.getfilesystemencoding())
 
-    m = ps_output_regex.match(s)
+def say(s):
+    print(s)
 
-    rsz = int(m.groups()[0])
-    vsz = int(m.groups()[1])
 
-    return rsz, vsz
+def random_name():
+    return "/" + ''.join(random.sample(NAME_CHARACTERS, NAME_LENGTH))
 
-    # chunks = [ item for item in s.split(' ') if item.strip() ]
-    #
-    # rss = chunks[0]
-    # vsize = chunks[1]
-    #
-    # rss = int(rss.strip())
-    # vsize = int(vsize.strip())
-    #
-    # return rss, vsize
 
+class MallInfo2(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_size_t) for name in ("arena", "ordblks", "smblks", "hblks",
+                                                     "hblkhd", "usmblks", "fsmblks",
+                                                     "uordblks", "fordblks", "keepcost")]
 
-# Assert manual control over the garbage collector
-gc.disable()
 
-the_range = range(TEST_COUNT)
+def get_malloc_counter():
+    """Return a function that reports the bytes currently allocated by malloc(), or None
+    if the C library doesn't support mallinfo2()."""
+    try:
+        mallinfo2 = ctypes.CDLL(None).mallinfo2
+    except (OSError, AttributeError):
+        return None
 
-if SKIP_SEMAPHORE_TESTS:
-    say("Skipping semaphore tests")
-else:
-    say("Running semaphore create/destroy test...")
-    print_mem_before()
+    mallinfo2.restype = MallInfo2
+    mallinfo2.argtypes = []
 
-    for i in the_range:
-        name = "/" + ''.join(random.sample(NAME_CHARACTERS, NAME_LENGTH))
-        sem = posix_ipc.Semaphore(name, posix_ipc.O_CREX)
-        sem.unlink()
-        sem.close()
+    def malloc_bytes():
+        info = mallinfo2()
+        # uordblks is memory in use from the heap, hblkhd is memory in use that
+        # was allocated directly via mmap().
+        return info.uordblks + info.hblkhd
 
-    print_mem_after()
+    return malloc_bytes
 
-    say("Running semaphore create/destroy test 2...")
-    print_mem_before()
 
-    for i in the_range:
-        name = "/" + ''.join(random.sample(NAME_CHARACTERS, NAME_LENGTH))
-        sem = posix_ipc.Semaphore(name, posix_ipc.O_CREX)
-        sem.close()
-        posix_ipc.unlink_semaphore(name)
+class MemoryTest:
+    """One operation to measure, with optional setup and teardown.
 
-    print_mem_after()
+    setup() returns a state object that's passed to operation() and teardown().
+    """
+    def __init__(self, name, operation, setup=None, teardown=None,
+                 peak_budget=PEAK_BUDGET_DEFAULT):
+        self.name = name
+        self.operation = operation
+        self.setup = setup or (lambda: None)
+        self.teardown = teardown or (lambda state: None)
+        self.peak_budget = peak_budget
 
-    say("Running semaphore create/destroy test 3...")
-    print_mem_before()
+    def _run(self, state, iterations):
+        operation = self.operation
+        for i in range(iterations):
+            operation(state)
 
-    for i in the_range:
-        sem = posix_ipc.Semaphore(None, posix_ipc.O_CREX)
-        sem.unlink()
-        sem.close()
+    def measure(self, iterations, malloc_bytes=None, baseline=None):
+        """Returns a dict of measurements for this test.
 
-    print_mem_after()
+        If provided, baseline is the result of measuring an operation that does nothing.
+        It's subtracted from this test's results so that only the operation is measured,
+        not the loop around it.
+        """
+        results = {}
 
-    say("Running semaphore create/destroy test 4...")
-    print_mem_before()
+        state = self.setup()
+        peak_budget = self.peak_budget(state) if callable(self.peak_budget) else self.peak_budget
 
-    name = "/abcdefghijklm"
-    sem = posix_ipc.Semaphore(name, posix_ipc.O_CREX)
-    for i in the_range:
         try:
-            foo = posix_ipc.Semaphore(name, posix_ipc.O_CREX)
-        except posix_ipc.ExistentialError:
-            pass
+            self._run(state, WARMUP_ITERATIONS)
 
-    sem.close()
-    posix_ipc.unlink_semaphore(name)
+            # Pass 1: allocated blocks (and optionally malloc) without tracemalloc,
+            # since tracemalloc's bookkeeping would otherwise be measured too.
+            gc.collect()
+            blocks_before = sys.getallocatedblocks()
+            if malloc_bytes:
+                malloc_before = malloc_bytes()
 
-    print_mem_after()
+            self._run(state, iterations)
 
-    say("Running semaphore acquire/release test...")
-    print_mem_before()
+            gc.collect()
+            if malloc_bytes:
+                results["malloc_bytes_per_op"] = (malloc_bytes() - malloc_before) / iterations
+            results["blocks_per_op"] = (sys.getallocatedblocks() - blocks_before) / iterations
 
-    sem = posix_ipc.Semaphore("/p_ipc_test", posix_ipc.O_CREX)
+            # Pass 2: bytes retained and peak bytes via tracemalloc.
+            tracemalloc.start()
+            gc.collect()
+            traced_before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
 
-    for i in the_range:
-        sem.release()
-        sem.acquire()
+            self._run(state, iterations)
 
-    sem.unlink()
-    sem.close()
+            gc.collect()
+            traced_after, traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
 
-    print_mem_after()
+            results["bytes_per_op"] = (traced_after - traced_before) / iterations
+            results["peak_bytes"] = traced_peak - traced_before
+        finally:
+            self.teardown(state)
 
-    if posix_ipc.SEMAPHORE_TIMEOUT_SUPPORTED:
-        say("Running semaphore acquire timeout test...")
-        print_mem_before()
+        if baseline:
+            for key in ("blocks_per_op", "bytes_per_op", "peak_bytes", "malloc_bytes_per_op"):
+                if key in results:
+                    results[key] -= baseline[key]
 
-        sem = posix_ipc.Semaphore("/p_ipc_test", posix_ipc.O_CREX)
+        results["peak_budget"] = peak_budget
+        results["failures"] = []
+        if results["blocks_per_op"] > BLOCKS_PER_OP_TOLERANCE:
+            results["failures"].append("blocks/op")
+        if results["bytes_per_op"] > BYTES_PER_OP_TOLERANCE:
+            results["failures"].append("bytes/op")
+        if results["peak_bytes"] > peak_budget:
+            results["failures"].append("peak bytes > %d" % peak_budget)
+        if results.get("malloc_bytes_per_op", 0) > BYTES_PER_OP_TOLERANCE:
+            results["failures"].append("malloc bytes/op")
 
-        for i in the_range:
-            try:
-                sem.acquire(.001)
-            except posix_ipc.BusyError:
-                pass
+        return results
 
-        sem.unlink()
-        sem.close()
 
-        print_mem_after()
-    else:
-        say("Skipping semaphore acquire timeout test (not supported on this platform)")
+# ============== Helpers for setup & teardown ==============
 
-    say("Running semaphore name read test...")
-    print_mem_before()
+def create_semaphore():
+    return posix_ipc.Semaphore(TEST_NAME, posix_ipc.O_CREX)
 
-    sem = posix_ipc.Semaphore("/p_ipc_test", posix_ipc.O_CREX)
-
-    for i in the_range:
-        foo = sem.name
 
+def destroy_semaphore(sem):
     sem.unlink()
     sem.close()
 
-    print_mem_after()
-
-    if posix_ipc.SEMAPHORE_VALUE_SUPPORTED:
-        say("Running semaphore value read test...")
-        print_mem_before()
-
-        sem = posix_ipc.Semaphore("/p_ipc_test", posix_ipc.O_CREX)
-
-        for i in the_range:
-            foo = sem.value
-
-        sem.unlink()
-        sem.close()
-
-        print_mem_after()
-    else:
-        say("Skipping semaphore value read test (not supported on this platform)")
-
-
-# ============== Memory tests ==============
-
-if SKIP_SHARED_MEMORY_TESTS:
-    say("Skipping shared memory tests")
-else:
-    say("Running memory create/destroy test...")
-    print_mem_before()
-
-    for i in the_range:
-        name = "/" + ''.join(random.sample(NAME_CHARACTERS, NAME_LENGTH))
-        mem = posix_ipc.SharedMemory(name, posix_ipc.O_CREX, size=4096)
-
-        os.close(mem.fd)
-
-        mem.unlink()
-
-    print_mem_after()
-
-    say("Running memory create/destroy test 2...")
-    print_mem_before()
-
-    for i in the_range:
-        name = "/" + ''.join(random.sample(NAME_CHARACTERS, NAME_LENGTH))
-        mem = posix_ipc.SharedMemory(name, posix_ipc.O_CREX, size=4096)
-
-        os.close(mem.fd)
-
-        posix_ipc.unlink_shared_memory(name)
-
-    print_mem_after()
-
-    say("Running memory create/destroy test 3...")
-    print_mem_before()
-
-    for i in the_range:
-        mem = posix_ipc.SharedMemory(None, posix_ipc.O_CREX, size=4096)
-
-        os.close(mem.fd)
-
-        mem.unlink()
-
-    print_mem_after()
-
-    say("Running memory name read test...")
-    print_mem_before()
-
-    mem = posix_ipc.SharedMemory("/p_ipc_test", posix_ipc.O_CREX)
-
-    for i in the_range:
-        foo = mem.name
-
-    mem.unlink()
-
-    print_mem_after()
-
-    say("Running memory fd read test...")
-    print_mem_before()
 
-    mem = posix_ipc.SharedMemory("/p_ipc_test", posix_ipc.O_CREX)
+def create_memory(size=0):
+    return posix_ipc.SharedMemory(TEST_NAME, posix_ipc.O_CREX, size=size)
 
-    for i in the_range:
-        foo = mem.fd
 
+def destroy_memory(mem):
+    mem.close_fd()
     mem.unlink()
 
-    print_mem_after()
 
-    say("Running memory size read test...")
-    print_mem_before()
+def create_queue():
+    return posix_ipc.MessageQueue(TEST_NAME, posix_ipc.O_CREX)
 
-    mem = posix_ipc.SharedMemory("/p_ipc_test", posix_ipc.O_CREX)
-
-    for i in the_range:
-        foo = mem.size
-
-    mem.unlink()
-
-    print_mem_after()
-
-    say("Running memory size read test 2...")
-    print_mem_before()
-
-    mem = posix_ipc.SharedMemory("/p_ipc_test", posix_ipc.O_CREX, size=4096)
-
-    for i in the_range:
-        foo = mem.size
-
-    mem.unlink()
-
-    print_mem_after()
-
-# ============== Message queue tests ==============
-
-if SKIP_MESSAGE_QUEUE_TESTS:
-    say("Skipping message queue tests")
-else:
-    say("Running message queue create/destroy test...")
-    print_mem_before()
-
-    for i in the_range:
-        name = "/" + ''.join(random.sample(NAME_CHARACTERS, NAME_LENGTH))
-        mq = posix_ipc.MessageQueue(name, posix_ipc.O_CREX)
-
-        mq.close()
-        mq.unlink()
-
-    print_mem_after()
-
-    say("Running message queue create/destroy test 2...")
-    print_mem_before()
-
-    for i in the_range:
-        name = "/" + ''.join(random.sample(NAME_CHARACTERS, NAME_LENGTH))
-        mq = posix_ipc.MessageQueue(name, posix_ipc.O_CREX)
-
-        mq.close()
-        posix_ipc.unlink_message_queue(name)
-
-    print_mem_after()
-
-    say("Running message queue create/destroy test 3...")
-    print_mem_before()
-
-    for i in the_range:
-        mq = posix_ipc.MessageQueue(None, posix_ipc.O_CREX)
-        mq.close()
-        mq.unlink()
-
-    print_mem_after()
-
-    say("Running message queue create/destroy test 4...")
-    print_mem_before()
-
-    name = "/abcdefghijklm"
-    mq = posix_ipc.MessageQueue(name, posix_ipc.O_CREX)
-    for i in the_range:
-        try:
-            foo = posix_ipc.MessageQueue(name, posix_ipc.O_CREX)
-        except posix_ipc.ExistentialError:
-            pass
-
-    mq.close()
-    posix_ipc.unlink_message_queue(name)
-
-    print_mem_after()
-
-    say("Running message queue send/receive() test with strings...")
-    print_mem_before()
-
-    mq = posix_ipc.MessageQueue("/p_ipc_test", posix_ipc.O_CREX)
-
-    for i in the_range:
-        mq.send(random_string(15))
-        mq.receive()
 
+def destroy_queue(mq):
     mq.close()
     mq.unlink()
 
-    print_mem_after()
 
-    say("Running message queue send/receive() test with bytes...")
-    print_mem_before()
+def try_to_create(ipc_class, name):
+    try:
+        ipc_class(name, posix_ipc.O_CREX)
+    except posix_ipc.ExistentialError:
+        pass
 
-    mq = posix_ipc.MessageQueue("/p_ipc_test", posix_ipc.O_CREX)
 
-    for i in the_range:
-        mq.send(random_string(15).encode("utf-8"))
-        mq.receive()
+def acquire_with_timeout(sem):
+    try:
+        sem.acquire(.00001)
+    except posix_ipc.BusyError:
+        pass
 
-    mq.close()
-    mq.unlink()
 
-    print_mem_after()
+def send_and_receive(mq, message):
+    mq.send(message)
+    mq.receive()
 
-    say("Running lame message queue request_notification() test...")
-    print_mem_before()
 
-    mq = posix_ipc.MessageQueue("/p_ipc_test", posix_ipc.O_CREX)
+def set_block(mq):
+    mq.block = True
 
-    for i in the_range:
-        mq.request_notification(posix_ipc.USER_SIGNAL_MIN)
-        mq.request_notification(None)
 
-    mq.close()
-    mq.unlink()
-
-    print_mem_after()
+def create_codec_queue():
+    return posix_ipc.MessageQueue(TEST_NAME, posix_ipc.O_CREX, codec="zlib")
 
-    say("Running  message queue name read test...")
-    print_mem_before()
 
-    mq = posix_ipc.MessageQueue("/p_ipc_test", posix_ipc.O_CREX)
+def create_queues():
+    # Returns two queues. The wait_any() and receive_any() tests send to the second one, so
+    # both are polled.
+    return (create_queue(),
+            posix_ipc.MessageQueue(TEST_NAME + "_2", posix_ipc.O_CREX))
 
-    for i in the_range:
-        foo = mq.name
 
-    mq.close()
-    mq.unlink()
+def destroy_queues(queues):
+    for mq in queues:
+        destroy_queue(mq)
 
-    print_mem_after()
 
-    say("Running  message queue mqd read test...")
-    print_mem_before()
+def send_and_receive_large(mq, message):
+    mq.send_large(message)
+    mq.receive_large().release()
 
-    mq = posix_ipc.MessageQueue("/p_ipc_test", posix_ipc.O_CREX)
 
-    for i in the_range:
-        foo = mq.mqd
+def send_and_receive_obj(mq, obj):
+    mq.send_obj(obj)
+    mq.receive_obj()
 
-    mq.close()
-    mq.unlink()
 
-    print_mem_after()
+def send_and_receive_any(queues):
+    queues[1].send(b"abcdefghijklmno")
+    posix_ipc.receive_any(queues)
 
-    say("Running  message queue block read test...")
-    print_mem_before()
 
-    mq = posix_ipc.MessageQueue("/p_ipc_test", posix_ipc.O_CREX)
+def send_and_wait_any(queues):
+    queues[1].send(b"abcdefghijklmno")
+    posix_ipc.wait_any(queues)
+    queues[1].receive()
 
-    for i in the_range:
-        foo = mq.block
 
-    mq.close()
-    mq.unlink()
+def create_codec_and_plain_queue():
+    # Returns a handle with a codec and a handle without one to the same queue.
+    mq = create_codec_queue()
+    return (mq, posix_ipc.MessageQueue(mq.name))
 
-    print_mem_after()
 
-    say("Running  message queue block write test...")
-    print_mem_before()
+def destroy_codec_and_plain_queue(queues):
+    queues[1].close()
+    destroy_queue(queues[0])
 
-    mq = posix_ipc.MessageQueue("/p_ipc_test", posix_ipc.O_CREX)
 
-    foo = mq.block
-    for i in the_range:
-        mq.block = foo
+def send_and_receive_undecodable(queues):
+    # The message lacks the header that the codec expects, so receive_any() returns a
+    # ValueError in its place.
+    queues[1].send(b"\x07abcdefghijklmno")
+    posix_ipc.receive_any(queues[:1])
 
-    mq.close()
-    mq.unlink()
 
-    print_mem_after()
+def create_memory_and_file(size=65536):
+    # Returns a segment and the path of a file of the same size.
+    mem = create_memory(size)
+    fd, path = tempfile.mkstemp()
+    os.write(fd, os.urandom(size))
+    os.close(fd)
+    return (mem, path)
 
-    say("Running  message queue max_messages read test...")
-    print_mem_before()
 
-    mq = posix_ipc.MessageQueue("/p_ipc_test", posix_ipc.O_CREX)
+def destroy_memory_and_file(state):
+    mem, path = state
+    destroy_memory(mem)
+    os.unlink(path)
 
-    for i in the_range:
-        foo = mq.max_messages
 
-    mq.close()
-    mq.unlink()
+def create_atomic_array():
+    mem = create_memory(4096)
+    return (mem, mem.atomic_array("i64", 8))
 
-    print_mem_after()
 
-    say("Running  message queue max_message_size read test...")
-    print_mem_before()
+def create_records():
+    mem = create_memory(4096)
+    return (mem, mem.records("<qd4s", 16, names=("id", "price", "tag")))
 
-    mq = posix_ipc.MessageQueue("/p_ipc_test", posix_ipc.O_CREX)
 
-    for i in the_range:
-        foo = mq.max_message_size
+def create_semaphore_array():
+    mem = create_memory(posix_ipc.SemaphoreArray.size_of(4))
+    return (mem, posix_ipc.SemaphoreArray(mem, 4))
 
-    mq.close()
-    mq.unlink()
 
-    print_mem_after()
+def destroy_memory_and_view(state):
+    mem, view = state
+    view.close()
+    destroy_memory(mem)
 
-    say("Running  message queue current_messages read test...")
-    print_mem_before()
 
-    mq = posix_ipc.MessageQueue("/p_ipc_test", posix_ipc.O_CREX)
+def create_robust_lock():
+    return posix_ipc.RobustLock(TEST_NAME, posix_ipc.O_CREX)
+
+
+def create_barrier():
+    return posix_ipc.Barrier(TEST_NAME, 1, posix_ipc.O_CREX)
+
+
+def destroy_lock_or_barrier(obj):
+    obj.unlink()
+    obj.close()
+
+
+# ============== Tests ==============
+
+TESTS = []
+
+# Semaphore tests
+TESTS += [
+    MemoryTest("Semaphore create/destroy",
+               lambda state: destroy_semaphore(posix_ipc.Semaphore(state, posix_ipc.O_CREX)),
+               setup=random_name),
+    MemoryTest("Semaphore create/destroy via unlink_semaphore()",
+               lambda state: (posix_ipc.Semaphore(state, posix_ipc.O_CREX).close(),
+                              posix_ipc.unlink_semaphore(state)),
+               setup=random_name),
+    MemoryTest("Semaphore create/destroy with random name",
+               lambda state: destroy_semaphore(posix_ipc.Semaphore(None, posix_ipc.O_CREX))),
+    MemoryTest("Semaphore create existing (fails)",
+               lambda sem: try_to_create(posix_ipc.Semaphore, sem.name),
+               create_semaphore, destroy_semaphore),
+    MemoryTest("Semaphore release/acquire",
+               lambda sem: (sem.release(), sem.acquire()),
+               create_semaphore, destroy_semaphore),
+    MemoryTest("Semaphore name read",
+               lambda sem: sem.name,
+               create_semaphore, destroy_semaphore),
+    MemoryTest("Semaphore context manager",
+               lambda sem: (sem.release(), sem.__enter__(), sem.__exit__(None, None, None),
+                            sem.acquire()),
+               create_semaphore, destroy_semaphore),
+]
+
+if posix_ipc.SEMAPHORE_TIMEOUT_SUPPORTED:
+    TESTS.append(MemoryTest("Semaphore acquire timeout",
+                            acquire_with_timeout,
+                            create_semaphore, destroy_semaphore))
+
+if posix_ipc.SEMAPHORE_VALUE_SUPPORTED:
+    TESTS.append(MemoryTest("Semaphore value read",
+                            lambda sem: sem.value,
+                            create_semaphore, destroy_semaphore))
+
+# Shared memory tests
+TESTS += [
+    MemoryTest("SharedMemory create/destroy",
+               lambda state: destroy_memory(posix_ipc.SharedMemory(state, posix_ipc.O_CREX,
+                                                                   size=4096)),
+               setup=random_name),
+    MemoryTest("SharedMemory create/destroy via unlink_shared_memory()",
+               lambda state: (os.close(posix_ipc.SharedMemory(state, posix_ipc.O_CREX,
+                                                              size=4096).fd),
+                              posix_ipc.unlink_shared_memory(state)),
+               setup=random_name),
+    MemoryTest("SharedMemory create/destroy with random name",
+               lambda state: destroy_memory(posix_ipc.SharedMemory(None, posix_ipc.O_CREX,
+                                                                   size=4096))),
+    MemoryTest("SharedMemory create existing (fails)",
+               lambda mem: try_to_create(posix_ipc.SharedMemory, mem.name),
+               create_memory, destroy_memory),
+    MemoryTest("SharedMemory name read",
+               lambda mem: mem.name,
+               create_memory, destroy_memory),
+    MemoryTest("SharedMemory fd read",
+               lambda mem: mem.fd,
+               create_memory, destroy_memory),
+    MemoryTest("SharedMemory fileno()",
+               lambda mem: mem.fileno(),
+               create_memory, destroy_memory),
+    MemoryTest("SharedMemory size read",
+               lambda mem: mem.size,
+               lambda: create_memory(4096), destroy_memory),
+]
+
+# Message queue tests
+if posix_ipc.MESSAGE_QUEUES_SUPPORTED:
+    TESTS += [
+        MemoryTest("MessageQueue create/destroy",
+                   lambda state: destroy_queue(posix_ipc.MessageQueue(state, posix_ipc.O_CREX)),
+                   setup=random_name),
+        MemoryTest("MessageQueue create/destroy via unlink_message_queue()",
+                   lambda state: (posix_ipc.MessageQueue(state, posix_ipc.O_CREX).close(),
+                                  posix_ipc.unlink_message_queue(state)),
+                   setup=random_name),
+        MemoryTest("MessageQueue create/destroy with random name",
+                   lambda state: destroy_queue(posix_ipc.MessageQueue(None, posix_ipc.O_CREX))),
+        MemoryTest("MessageQueue create existing (fails)",
+                   lambda mq: try_to_create(posix_ipc.MessageQueue, mq.name),
+                   create_queue, destroy_queue),
+        # receive() allocates a buffer of max_message_size on every call.
+        MemoryTest("MessageQueue send/receive with strings",
+                   lambda mq: send_and_receive(mq, "abcdefghijklmno"),
+                   create_queue, destroy_queue,
+                   peak_budget=lambda mq: mq.max_message_size + PEAK_BUDGET_DEFAULT),
+        MemoryTest("MessageQueue send/receive with bytes",
+                   lambda mq: send_and_receive(mq, b"abcdefghijklmno"),
+                   create_queue, destroy_queue,
+                   peak_budget=lambda mq: mq.max_message_size + PEAK_BUDGET_DEFAULT),
+        MemoryTest("MessageQueue request_notification()",
+                   lambda mq: (mq.request_notification(posix_ipc.USER_SIGNAL_MIN),
+                               mq.request_notification(None)),
+                   create_queue, destroy_queue),
+        MemoryTest("MessageQueue name read",
+                   lambda mq: mq.name,
+                   create_queue, destroy_queue),
+        MemoryTest("MessageQueue mqd read",
+                   lambda mq: mq.mqd,
+                   create_queue, destroy_queue),
+        MemoryTest("MessageQueue block read",
+                   lambda mq: mq.block,
+                   create_queue, destroy_queue),
+        MemoryTest("MessageQueue block write",
+                   set_block,
+                   create_queue, destroy_queue),
+        MemoryTest("MessageQueue max_messages read",
+                   lambda mq: mq.max_messages,
+                   create_queue, destroy_queue),
+        MemoryTest("MessageQueue max_message_size read",
+                   lambda mq: mq.max_message_size,
+                   create_queue, destroy_queue),
+        MemoryTest("MessageQueue current_messages read",
+                   lambda mq: mq.current_messages,
+                   create_queue, destroy_queue),
+        MemoryTest("MessageQueue send_large/receive_large inline",
+                   lambda mq: send_and_receive_large(mq, b"abcdefghijklmno"),
+                   create_queue, destroy_queue,
+                   peak_budget=lambda mq: mq.max_message_size + PEAK_BUDGET_DEFAULT),
+        # The message is spilled to a segment from the sender's pool, which is created
+        # during warmup and then reused. Receiving it also allocates a LargeMessage, its
+        # finalizer and a mapping of the segment.
+        MemoryTest("MessageQueue send_large/receive_large via shared memory",
+                   lambda mq: send_and_receive_large(mq, LARGE_MESSAGE),
+                   create_queue, destroy_queue,
+                   peak_budget=lambda mq: mq.max_message_size + 8 * PEAK_BUDGET_DEFAULT),
+        MemoryTest("MessageQueue send_obj/receive_obj",
+                   lambda mq: send_and_receive_obj(mq, {"key": [1, 2.0, "three"]}),
+                   create_queue, destroy_queue,
+                   peak_budget=lambda mq: mq.max_message_size + 2 * PEAK_BUDGET_DEFAULT),
+        # receive_obj() copies the out-of-band buffer into a bytearray.
+        MemoryTest("MessageQueue send_obj/receive_obj out-of-band",
+                   lambda mq: send_and_receive_obj(mq, pickle.PickleBuffer(LARGE_MESSAGE)),
+                   create_queue, destroy_queue,
+                   peak_budget=lambda mq: (mq.max_message_size + len(LARGE_MESSAGE) +
+                                           PEAK_BUDGET_DEFAULT)),
+        # With a codec, send() and receive() also allocate the compressed and decompressed
+        # messages and zlib's working memory.
+        MemoryTest("MessageQueue send/receive with codec",
+                   lambda mq: send_and_receive(mq, COMPRESSIBLE_MESSAGE),
+                   create_codec_queue, destroy_queue,
+                   peak_budget=lambda mq: (mq.max_message_size + 2 * len(COMPRESSIBLE_MESSAGE) +
+                                           ZLIB_WORKING_MEMORY + PEAK_BUDGET_DEFAULT)),
+    ]
+
+if posix_ipc.MESSAGE_QUEUES_SUPPORTED and posix_ipc.MESSAGE_QUEUE_WAIT_SUPPORTED:
+    TESTS += [
+        MemoryTest("wait_any()",
+                   send_and_wait_any,
+                   create_queues, destroy_queues,
+                   peak_budget=lambda queues: queues[1].max_message_size + PEAK_BUDGET_DEFAULT),
+        # receive_any() allocates a buffer of max_message_size for each queue.
+        MemoryTest("receive_any()",
+                   send_and_receive_any,
+                   create_queues, destroy_queues,
+                   peak_budget=lambda queues: (sum(mq.max_message_size for mq in queues) +
+                                               PEAK_BUDGET_DEFAULT)),
+        # Decoding allocates another buffer of max_message_size, and the failure allocates
+        # an exception and its traceback.
+        MemoryTest("receive_any() with undecodable message",
+                   send_and_receive_undecodable,
+                   create_codec_and_plain_queue, destroy_codec_and_plain_queue,
+                   peak_budget=lambda queues: (2 * queues[0].max_message_size +
+                                               2 * PEAK_BUDGET_DEFAULT)),
+    ]
+
+# Shared memory views and file copies
+TESTS += [
+    MemoryTest("SharedMemory atomic_array() create/close",
+               lambda mem: mem.atomic_array("i64", 8).close(),
+               lambda: create_memory(4096), destroy_memory),
+    MemoryTest("AtomicArray store/load/fetch_add/compare_exchange",
+               lambda state: (state[1].store(0, 42), state[1].load(0), state[1].fetch_add(0, 1),
+                              state[1].compare_exchange(0, 43, 42)),
+               create_atomic_array, destroy_memory_and_view),
+    MemoryTest("AtomicArray snapshot()",
+               lambda state: state[1].snapshot(),
+               create_atomic_array, destroy_memory_and_view,
+               peak_budget=2 * PEAK_BUDGET_DEFAULT),
+    # A RecordArray is a Python object with a mapping and a few attributes.
+    MemoryTest("SharedMemory records() create/close",
+               lambda mem: mem.records("<qd4s", 16).close(),
+               lambda: create_memory(4096), destroy_memory,
+               peak_budget=4 * PEAK_BUDGET_DEFAULT),
+    MemoryTest("RecordArray record write/read",
+               lambda state: (state[1].__setitem__(3, (1, 2.0, b"abcd")), state[1][3]),
+               create_records, destroy_memory_and_view),
+    MemoryTest("RecordArray field()/set_field()",
+               lambda state: state[1].set_field("id", state[1].field("id")),
+               create_records, destroy_memory_and_view),
+    MemoryTest("SharedMemory load_from()",
+               lambda state: state[0].load_from(state[1]),
+               create_memory_and_file, destroy_memory_and_file),
+    MemoryTest("SharedMemory dump_to()",
+               lambda state: state[0].dump_to(state[1]),
+               create_memory_and_file, destroy_memory_and_file),
+]
+
+if posix_ipc.SEMAPHORE_ARRAY_SUPPORTED:
+    TESTS += [
+        MemoryTest("SemaphoreArray create/close",
+                   lambda mem: posix_ipc.SemaphoreArray(mem, 4).close(),
+                   lambda: create_memory(posix_ipc.SemaphoreArray.size_of(4)), destroy_memory),
+        MemoryTest("SemaphoreArray release/acquire",
+                   lambda state: (state[1].release(2), state[1].acquire(2)),
+                   create_semaphore_array, destroy_memory_and_view),
+    ]
+
+    if posix_ipc.SEMAPHORE_VALUE_SUPPORTED:
+        TESTS.append(MemoryTest("SemaphoreArray value()",
+                                lambda state: state[1].value(2),
+                                create_semaphore_array, destroy_memory_and_view))
+
+if posix_ipc.ROBUST_LOCK_SUPPORTED:
+    TESTS += [
+        MemoryTest("RobustLock create/destroy",
+                   lambda state: destroy_lock_or_barrier(posix_ipc.RobustLock(state,
+                                                                             posix_ipc.O_CREX)),
+                   setup=random_name),
+        MemoryTest("RobustLock acquire/release",
+                   lambda lock: (lock.acquire(), lock.release()),
+                   create_robust_lock, destroy_lock_or_barrier),
+    ]
+
+if posix_ipc.BARRIER_SUPPORTED:
+    TESTS += [
+        MemoryTest("Barrier create/destroy",
+                   lambda state: destroy_lock_or_barrier(posix_ipc.Barrier(state, 1,
+                                                                          posix_ipc.O_CREX)),
+                   setup=random_name),
+        MemoryTest("Barrier wait",
+                   lambda barrier: barrier.wait(),
+                   create_barrier, destroy_lock_or_barrier),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-operation memory allocation "
+                                                 "of posix_ipc and enforce budgets.")
+    parser.add_argument("-n", "--iterations", type=int, default=ITERATIONS_DEFAULT,
+                        help="iterations per test (default %d)" % ITERATIONS_DEFAULT)
+    parser.add_argument("-k", "--keyword", default="",
+                        help="only run tests whose names contain this string")
+    parser.add_argument("--malloc", action="store_true",
+                        help="also measure malloc() growth (requires glibc >= 2.33)")
+    args = parser.parse_args()
+
+    malloc_bytes = None
+    if args.malloc:
+        malloc_bytes = get_malloc_counter()
+        if not malloc_bytes:
+            say("mallinfo2() isn't available on this platform; ignoring --malloc")
+
+    # Assert manual control over the garbage collector
+    gc.disable()
+
+    header = "%-55s %9s %9s %11s" % ("test", "blocks/op", "bytes/op", "peak bytes")
+    if malloc_bytes:
+        header += " %9s" % "malloc/op"
+    say(header)
+
+    baseline = MemoryTest("baseline", lambda state: None).measure(args.iterations, malloc_bytes)
+
+    failure_count = 0
+    for test in TESTS:
+        if args.keyword.lower() not in test.name.lower():
+            continue
+
+        results = test.measure(args.iterations, malloc_bytes, baseline)
+
+        line = "%-55s %9.3f %9.1f %11d" % (test.name, results["blocks_per_op"],
+                                           results["bytes_per_op"], results["peak_bytes"])
+        if malloc_bytes:
+            line += " %9.1f" % results["malloc_bytes_per_op"]
+        if results["failures"]:
+            failure_count += 1
+            line += "  FAILED (%s)" % ', '.join(results["failures"])
+        say(line)
+
+    if failure_count:
+        say("\n%d test(s) exceeded their allocation budget" % failure_count)
+    else:
+        say("\nAll tests are within their allocation budgets")
 
-    for i in the_range:
-        foo = mq.current_messages
+    return 1 if failure_count else 0
 
-    mq.close()
-    mq.unlink()
 
-    print_mem_after()
+if __name__ == "__main__":
+    sys.exit(main())
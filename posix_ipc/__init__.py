@@ -0,0 +1,12 @@
+"""POSIX IPC primitives (semaphores, shared memory and message queues) for Python
+
+The primitives are implemented in C in the extension module posix_ipc._posix_ipc. Everything
+in it is available from this package, along with the few features that are written in Python.
+"""
+from ._posix_ipc import *  # noqa: F401, F403
+from ._posix_ipc import __version__, __copyright__, __author__, __license__  # noqa: F401
+
+from ._large import LargeMessage  # noqa: F401
+from ._inventory import IPCObject, list_objects, reap  # noqa: F401
+from ._versioned import VersionedSegment  # noqa: F401
+from ._workstealing import WorkStealingPool  # noqa: F401
@@ -0,0 +1,85 @@
+"""Command line tools
+
+    python -m posix_ipc top [--prefix PREFIX] [--interval SECONDS] [--polls-per-second N]
+                            [--count N] [--json]
+    python -m posix_ipc rpc-bench [--calls N] [--size BYTES] [--pipeline N] [--json]
+"""
+# Python imports
+import argparse
+import json
+import sys
+
+# Project imports
+from . import _top
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m posix_ipc")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    top = subparsers.add_parser("top", help="live view of queue depths, semaphore values and "
+                                            "shared memory segment sizes")
+    top.add_argument("--prefix", default=None,
+                     help="only show objects whose names start with this")
+    top.add_argument("--interval", type=float, default=1.0,
+                     help="seconds between reports (default 1)")
+    top.add_argument("--polls-per-second", type=float, default=10.0,
+                     help="how often to sample the objects between reports (default 10); "
+                          "more often gives more accurate high-water marks and rates")
+    top.add_argument("--count", type=int, default=None,
+                     help="exit after this many reports")
+    top.add_argument("--json", action="store_true",
+                     help="write each report as a line of JSON")
+
+    rpc_bench = subparsers.add_parser("rpc-bench", help="measure the round trip time of "
+                                                        "posix_ipc.rpc calls")
+    rpc_bench.add_argument("--calls", type=int, default=10000,
+                           help="number of calls to make (default 10000)")
+    rpc_bench.add_argument("--size", type=int, default=0,
+                           help="bytes of data to send with each call and receive with "
+                                "each reply (default 0)")
+    rpc_bench.add_argument("--pipeline", type=int, default=1,
+                           help="number of calls to have outstanding at once (default 1)")
+    rpc_bench.add_argument("--json", action="store_true",
+                           help="write the results as JSON")
+
+    args = parser.parse_args(args)
+
+    if args.command == "rpc-bench":
+        return rpc_bench_main(parser, args)
+
+    if (args.interval <= 0) or (args.polls_per_second <= 0):
+        parser.error("--interval and --polls-per-second must be greater than 0")
+
+    try:
+        _top.run(args.prefix, args.interval, args.polls_per_second, args.count, args.json)
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+def rpc_bench_main(parser, args):
+    # rpc needs message queues, so it's imported only when it's needed.
+    from . import rpc
+
+    if (args.calls <= 0) or (args.pipeline <= 0) or (args.size < 0):
+        parser.error("--calls and --pipeline must be greater than 0 and --size can't be "
+                     "negative")
+
+    results = rpc.benchmark(args.calls, args.size, args.pipeline)
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print("%(calls)d calls of %(size)d bytes, %(pipeline)d at a time" % results)
+        print("round trip: mean %(mean_us).1f us, median %(median_us).1f us, "
+              "99th percentile %(p99_us).1f us" % results)
+        print("throughput: %(calls_per_second).0f calls per second" % results)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
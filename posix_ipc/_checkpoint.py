@@ -0,0 +1,356 @@
+"""The implementation of SharedMemory.checkpoint() and SharedMemory.restore()
+
+A checkpoint file holds a header, an image of the segment and a hash of each page of the image.
+checkpoint() hashes the pages of the segment and writes only the ones whose hashes differ from
+those in the file, so its I/O is proportional to the amount of the segment that has changed
+rather than to its size. Hashing pages works no matter which process wrote to them, unlike the
+kernel's soft-dirty page bits which only track the calling process' writes.
+
+Updating the image in place would leave neither the old checkpoint nor the new one if the
+process crashed halfway, so once the file holds a complete checkpoint, the changed pages go to a
+journal first. The journal is a second file (the checkpoint's path plus JOURNAL_SUFFIX) that
+holds the changed pages, the new hashes and the new size. Its header is written (and synced)
+last, which commits it. Then the pages are copied into the image, the checkpoint's header is
+marked complete and the journal is removed. A crash before the commit leaves the old checkpoint
+untouched (and an uncommitted journal that's ignored). A crash after it leaves a committed
+journal, which restore() lays over the image and the next checkpoint() finishes copying in.
+Copying is idempotent, so a crash during recovery is harmless too.
+
+The first checkpoint to a file (or one that follows a checkpoint that crashed before it was ever
+complete) has nothing to protect, so it writes the image directly. The header is marked
+incomplete before any pages are written and complete after they and their hashes have been
+synced, so restore() refuses a file whose first checkpoint never finished.
+"""
+# Python imports
+import mmap
+import os
+import struct
+
+# Project imports
+from ._posix_ipc import PAGE_SIZE, _hash_pages
+
+MAGIC = b"PIPCCKPT"
+VERSION = 1
+
+STATE_COMPLETE = 0
+STATE_INCOMPLETE = 1
+# The image is being updated from a committed journal.
+STATE_JOURNALED = 2
+
+# magic, version, state, page size, segment size
+HEADER_FORMAT = "=8sIIQQ"
+# The image starts after the header, at an offset that's a multiple of any likely page size.
+HEADER_SIZE = 64 * 1024
+
+HASH_SIZE = 8
+
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_MAGIC = b"PIPCJRNL"
+
+# magic, version, page size, old segment size, new segment size, number of runs, offset of
+# the runs. The new hashes follow the header (at HEADER_SIZE) and the changed pages follow them
+# (at the next page boundary). The runs are (first page, last page + 1) pairs.
+JOURNAL_HEADER_FORMAT = "=8sIIQQQQ"
+RUN_FORMAT = "=QQ"
+
+# Changed pages are copied out of the segment in runs no larger than this.
+MAX_RUN_SIZE = 64 * 1024 * 1024
+
+
+def _hashes_offset(size):
+    # The hashes follow the image, which is padded to a whole number of pages.
+    return HEADER_SIZE + (_page_count(size) * PAGE_SIZE)
+
+
+def _page_count(size):
+    return (size + PAGE_SIZE - 1) // PAGE_SIZE
+
+
+def _read_header(fd):
+    header = os.pread(fd, struct.calcsize(HEADER_FORMAT), 0)
+    if len(header) < struct.calcsize(HEADER_FORMAT):
+        return None
+    magic, version, state, page_size, size = struct.unpack(HEADER_FORMAT, header)
+    if (magic != MAGIC) or (version != VERSION):
+        return None
+    return state, page_size, size
+
+
+def _write_header(fd, state, size):
+    _pwrite_all(fd, struct.pack(HEADER_FORMAT, MAGIC, VERSION, state, PAGE_SIZE, size), 0)
+    os.fsync(fd)
+
+
+def _pwrite_all(fd, data, offset):
+    data = memoryview(data)
+    while data:
+        n = os.pwrite(fd, data, offset)
+        data = data[n:]
+        offset += n
+
+
+def _read_hashes(fd, size):
+    # Returns the hashes from a complete checkpoint of a segment of this size, or None if the
+    # file doesn't hold one.
+    header = _read_header(fd)
+    if header != (STATE_COMPLETE, PAGE_SIZE, size):
+        return None
+    n = _page_count(size) * HASH_SIZE
+    hashes = os.pread(fd, n, _hashes_offset(size))
+    return hashes if (len(hashes) == n) else None
+
+
+def _zero_hashes(size):
+    # Returns the hashes of a segment of this size that's all zeros.
+    n_pages = _page_count(size)
+    if not n_pages:
+        return b''
+    hashes, _ = _hash_pages(bytes(PAGE_SIZE), PAGE_SIZE)
+    remainder = size % PAGE_SIZE
+    last_hash = _hash_pages(bytes(remainder), PAGE_SIZE)[0] if remainder else hashes
+    return (hashes * (n_pages - 1)) + last_hash
+
+
+def _runs(pages):
+    # Groups a sorted list of page indices into (first, last + 1) runs of consecutive pages.
+    max_pages = MAX_RUN_SIZE // PAGE_SIZE
+    runs = []
+    for page in pages:
+        if runs and (runs[-1][1] == page) and ((page - runs[-1][0]) < max_pages):
+            runs[-1][1] = page + 1
+        else:
+            runs.append([page, page + 1])
+    return runs
+
+
+def _run_size(first, last, size):
+    return min(last * PAGE_SIZE, size) - (first * PAGE_SIZE)
+
+
+def _journal_data_offset(size):
+    # The changed pages start at the first page boundary after the hashes.
+    return _page_count(HEADER_SIZE + (_page_count(size) * HASH_SIZE)) * PAGE_SIZE
+
+
+def _sync_directory(path):
+    # Makes the creation or removal of a file in the directory durable.
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _open_journal(path):
+    # Returns (fd, old size, new size, runs) for a committed journal at path, or None if there
+    # isn't one.
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+
+    try:
+        header = os.pread(fd, struct.calcsize(JOURNAL_HEADER_FORMAT), 0)
+        if len(header) < struct.calcsize(JOURNAL_HEADER_FORMAT):
+            raise ValueError
+        magic, version, page_size, old_size, new_size, run_count, runs_offset = \
+            struct.unpack(JOURNAL_HEADER_FORMAT, header)
+        if (magic != JOURNAL_MAGIC) or (version != VERSION) or (page_size != PAGE_SIZE):
+            raise ValueError
+        n = run_count * struct.calcsize(RUN_FORMAT)
+        runs = os.pread(fd, n, runs_offset)
+        if len(runs) != n:
+            raise ValueError
+    except ValueError:
+        # It was never committed.
+        os.close(fd)
+        return None
+
+    return fd, old_size, new_size, list(struct.iter_unpack(RUN_FORMAT, runs))
+
+
+def _journal_pages(journal_fd, new_size, runs):
+    # Yields (offset in the image, pages) for each run in the journal.
+    offset = _journal_data_offset(new_size)
+    for first, last in runs:
+        n = _run_size(first, last, new_size)
+        data = os.pread(journal_fd, n, offset)
+        if len(data) != n:
+            raise ValueError("The checkpoint's journal is truncated")
+        yield first * PAGE_SIZE, data
+        offset += n
+
+
+def _write_journal(path, mapfile, old_size, size, previous, changed):
+    # Writes the changed pages of the segment and the new hashes to a journal at path and
+    # commits it. Returns the number of bytes of the segment that were written.
+    written = 0
+    data_offset = _journal_data_offset(size)
+    hashes = bytearray(previous)
+    runs = _runs(changed)
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        for first, last in runs:
+            start = first * PAGE_SIZE
+            # Slicing copies the pages, so the hashes describe exactly what's written even if
+            # the segment is changing.
+            data = mapfile[start:min(last * PAGE_SIZE, size)]
+            hashes[first * HASH_SIZE:last * HASH_SIZE], _ = _hash_pages(data, PAGE_SIZE)
+            _pwrite_all(fd, data, data_offset + written)
+            written += len(data)
+
+        runs_offset = data_offset + written
+        _pwrite_all(fd, hashes, HEADER_SIZE)
+        _pwrite_all(fd, b''.join(struct.pack(RUN_FORMAT, first, last) for first, last in runs),
+                    runs_offset)
+        os.fsync(fd)
+
+        # This commits the journal.
+        _pwrite_all(fd, struct.pack(JOURNAL_HEADER_FORMAT, JOURNAL_MAGIC, VERSION, PAGE_SIZE,
+                                    old_size, size, len(runs), runs_offset), 0)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    _sync_directory(path)
+
+    return written
+
+
+def _apply_journal(fd, journal):
+    # Copies a committed journal's pages and hashes into the checkpoint and marks it complete.
+    journal_fd, old_size, new_size, runs = journal
+    _write_header(fd, STATE_JOURNALED, old_size)
+
+    # Pages past the old image must start out as zeros (the journal only holds the ones that
+    # aren't), so the file is cut back to the part of the old image that's still in use.
+    os.ftruncate(fd, HEADER_SIZE + (min(_page_count(old_size), _page_count(new_size)) *
+                                    PAGE_SIZE))
+    os.ftruncate(fd, _hashes_offset(new_size))
+
+    for offset, data in _journal_pages(journal_fd, new_size, runs):
+        _pwrite_all(fd, data, HEADER_SIZE + offset)
+    hashes = os.pread(journal_fd, _page_count(new_size) * HASH_SIZE, HEADER_SIZE)
+    _pwrite_all(fd, hashes, _hashes_offset(new_size))
+    os.fsync(fd)
+
+    _write_header(fd, STATE_COMPLETE, new_size)
+
+
+def _recover(fd, journal_path):
+    # Finishes applying a committed journal left behind by a checkpoint that crashed, and
+    # removes any journal.
+    journal = _open_journal(journal_path)
+    if journal is not None:
+        try:
+            _apply_journal(fd, journal)
+        finally:
+            os.close(journal[0])
+
+    try:
+        os.unlink(journal_path)
+    except FileNotFoundError:
+        return
+    _sync_directory(journal_path)
+
+
+def checkpoint(memory, path):
+    size = memory.size
+    journal_path = path + JOURNAL_SUFFIX
+    written = 0
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        _recover(fd, journal_path)
+
+        header = _read_header(fd)
+        previous = None
+        if (header is not None) and (header[:2] == (STATE_COMPLETE, PAGE_SIZE)):
+            old_size = header[2]
+            previous = _read_hashes(fd, old_size)
+
+        if previous is not None:
+            # There's a checkpoint to protect, so the changes go through the journal. If the
+            # segment has been resized, the pages that it shares with the old image are
+            # compared with the old hashes and the rest with zeros.
+            shared = min(_page_count(old_size), _page_count(size))
+            previous = previous[:shared * HASH_SIZE] + _zero_hashes(size)[shared * HASH_SIZE:]
+            journaled = True
+        else:
+            # Start over. Truncating the file fills it with zeros (and makes it sparse where the
+            # file system allows), so only the segment's nonzero pages need to be written.
+            _write_header(fd, STATE_INCOMPLETE, size)
+            os.ftruncate(fd, HEADER_SIZE)
+            os.ftruncate(fd, _hashes_offset(size))
+            old_size = size
+            previous = _zero_hashes(size)
+            journaled = False
+
+        mapfile = mmap.mmap(memory.fd, size, prot=mmap.PROT_READ) if size else b''
+        try:
+            _, changed = _hash_pages(mapfile, PAGE_SIZE, previous)
+            if (old_size != size) and (old_size % PAGE_SIZE) and (old_size < size):
+                # The old image's partial last page was hashed without the padding after it,
+                # so its hash can't be compared with that of a longer page.
+                changed = sorted(set(changed) | {old_size // PAGE_SIZE})
+
+            if journaled:
+                if changed or (old_size != size):
+                    written = _write_journal(journal_path, mapfile, old_size, size, previous,
+                                             changed)
+                    _recover(fd, journal_path)
+            else:
+                hashes = bytearray(previous)
+                for first, last in _runs(changed):
+                    start = first * PAGE_SIZE
+                    # Slicing copies the pages, so the hashes describe exactly what's written
+                    # even if the segment is changing.
+                    data = mapfile[start:min(last * PAGE_SIZE, size)]
+                    hashes[first * HASH_SIZE:last * HASH_SIZE], _ = _hash_pages(data, PAGE_SIZE)
+                    _pwrite_all(fd, data, HEADER_SIZE + start)
+                    written += len(data)
+                _pwrite_all(fd, hashes, _hashes_offset(size))
+                os.fsync(fd)
+                _write_header(fd, STATE_COMPLETE, size)
+        finally:
+            if size:
+                mapfile.close()
+    finally:
+        os.close(fd)
+
+    return written
+
+
+def restore(memory, path, threads=1):
+    with open(path, 'rb') as f:
+        header = _read_header(f.fileno())
+
+    if header is None:
+        raise ValueError("%s is not a checkpoint" % path)
+
+    journal = _open_journal(path + JOURNAL_SUFFIX)
+    if journal is not None:
+        # The last checkpoint crashed after committing its journal, so the image is the old
+        # checkpoint, partly updated, and the journal holds the rest of the new one.
+        journal_fd, old_size, size, runs = journal
+        try:
+            os.ftruncate(memory.fd, 0)
+            os.ftruncate(memory.fd, size)
+            shared = min(old_size, size)
+            if shared:
+                memory.load_from(path, size=shared, source_offset=HEADER_SIZE, threads=threads)
+            for offset, data in _journal_pages(journal_fd, size, runs):
+                _pwrite_all(memory.fd, data, offset)
+        finally:
+            os.close(journal_fd)
+        return size
+
+    state, _, size = header
+    if state != STATE_COMPLETE:
+        raise ValueError("The checkpoint in %s is incomplete" % path)
+
+    os.ftruncate(memory.fd, size)
+    if size:
+        memory.load_from(path, size=size, source_offset=HEADER_SIZE, threads=threads)
+
+    return size
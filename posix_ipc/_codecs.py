@@ -0,0 +1,138 @@
+"""Compression of MessageQueue messages (the codec parameter of MessageQueue)
+
+A queue with a codec compresses each message that's at least COMPRESSION_THRESHOLD bytes long
+before sending it and decompresses it on receipt, so the kernel stores and copies the smaller
+compressed form and messages that compress well can be larger than max_message_size. Every
+message on such a queue starts with a header that says whether it's compressed --
+
+    RAW                         followed by the message
+    COMPRESSED, original size   followed by the compressed message
+
+so small and incompressible messages are sent as they are. The header isn't optional, so
+every process using the queue must open it with the same codec.
+
+A codec is any object with compress(data) and decompress(data, size) methods, where size is
+the length of the original message (so the codec can decompress into a buffer of exactly the
+right size). The built-in codecs release the GIL while they work.
+"""
+# Python imports
+import struct
+import zlib
+
+RAW = 0
+COMPRESSED = 1
+
+RAW_HEADER_SIZE = 1
+COMPRESSED_HEADER_FORMAT = "=BQ"
+COMPRESSED_HEADER_SIZE = struct.calcsize(COMPRESSED_HEADER_FORMAT)
+
+# Shorter messages aren't worth compressing.
+COMPRESSION_THRESHOLD = 256
+
+
+class ZlibCodec:
+    """Compresses with zlib, favoring speed over size by default"""
+    def __init__(self, level=1):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data, size):
+        return zlib.decompress(data, bufsize=max(size, 1))
+
+    def __repr__(self):
+        return "ZlibCodec(level=%d)" % self.level
+
+    def __eq__(self, other):
+        return isinstance(other, ZlibCodec) and (other.level == self.level)
+
+    def __hash__(self):
+        return hash((ZlibCodec, self.level))
+
+
+class Lz4Codec:
+    """Compresses with LZ4 (requires the lz4 package)"""
+    def __init__(self):
+        import lz4.block
+        self._block = lz4.block
+
+    def compress(self, data):
+        # The header already records the size.
+        return self._block.compress(data, store_size=False)
+
+    def decompress(self, data, size):
+        return self._block.decompress(data, uncompressed_size=size)
+
+    def __repr__(self):
+        return "Lz4Codec()"
+
+    def __eq__(self, other):
+        return isinstance(other, Lz4Codec)
+
+    def __hash__(self):
+        return hash(Lz4Codec)
+
+    def __reduce__(self):
+        # Modules can't be pickled, so this pickles as the class alone.
+        return (Lz4Codec, ())
+
+
+CODECS = {"zlib": ZlibCodec,
+          "lz4": Lz4Codec,
+          }
+
+
+def get_codec(mq, codec):
+    # Called by MessageQueue.__init__() to turn its codec parameter into a codec object.
+    if isinstance(codec, str):
+        if codec not in CODECS:
+            raise ValueError("Unknown codec %r; the choices are %s" %
+                             (codec, ", ".join(sorted(CODECS))))
+        return CODECS[codec]()
+    if not (callable(getattr(codec, "compress", None)) and
+            callable(getattr(codec, "decompress", None))):
+        raise TypeError("A codec must be a name or have compress() and decompress() methods")
+    return codec
+
+
+def max_payload(mq):
+    # Returns the length of the longest message that can be sent on the queue whether or not it
+    # compresses. send_large() and send_obj() use this rather than max_message_size.
+    return mq.max_message_size - (RAW_HEADER_SIZE if mq.codec else 0)
+
+
+def encode(mq, message):
+    # Called by MessageQueue.send() with the message (as bytes or a memoryview).
+    message = memoryview(message).cast('B')
+    encoded = None
+    if len(message) >= COMPRESSION_THRESHOLD:
+        compressed = mq.codec.compress(message)
+        if len(compressed) + COMPRESSED_HEADER_SIZE < len(message) + RAW_HEADER_SIZE:
+            encoded = struct.pack(COMPRESSED_HEADER_FORMAT, COMPRESSED, len(message))
+            encoded += compressed
+
+    if encoded is None:
+        encoded = bytes((RAW, )) + message
+
+    if len(encoded) > mq.max_message_size:
+        raise ValueError("The message must be no longer than %d bytes unless it compresses "
+                         "to fit" % max_payload(mq))
+
+    return encoded
+
+
+def decode(mq, message):
+    # Called by MessageQueue.receive() with the message as received.
+    if message and (message[0] == RAW):
+        return message[RAW_HEADER_SIZE:]
+
+    if (len(message) >= COMPRESSED_HEADER_SIZE) and (message[0] == COMPRESSED):
+        size = struct.unpack_from(COMPRESSED_HEADER_FORMAT, message)[1]
+        data = mq.codec.decompress(memoryview(message)[COMPRESSED_HEADER_SIZE:], size)
+        if len(data) != size:
+            raise ValueError("The message decompressed to %d bytes rather than %d" %
+                             (len(data), size))
+        return bytes(data)
+
+    raise ValueError("The message wasn't sent by a queue with a codec")
@@ -0,0 +1,195 @@
+"""The machinery shared by IPCExecutor and WorkStealingPool
+
+Both executors hand each task to the worker processes as soon as it's submitted, and a thread in
+the parent (the result thread) delivers results to futures and cleans up once the workers have
+exited. They differ in how tasks and results travel. A subclass starts its workers (appending
+them to _workers), calls _start() and provides --
+
+    _dumps(task)            pickles a task (task_id, fn, args, kwargs) for _send()
+    _send(payload, block)   hands a pickled task to the workers and returns True, or returns
+                            False if there's no room and block is False
+    _stop(block)            tells the workers to finish up once they've run every task and
+                            returns True, or returns False if that would have to wait for room
+                            and block is False, in which case it's called again later
+    _collect_results()      runs in the result thread until the workers have exited. It calls
+                            _send_backlog() each time around its loop and _deliver() with each
+                            result, and destroys the IPC objects before it returns.
+
+Futures' done-callbacks run in the result thread. A callback that submits a task mustn't wait
+for room to send it, because the room is made by collecting results. So tasks submitted from
+that thread go into a backlog, which the result thread sends when there's room. If the executor
+is shut down in the meantime, the workers aren't told to finish up until the backlog is empty.
+"""
+# Python imports
+import atexit
+import collections
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import itertools
+import threading
+import weakref
+
+# Executors whose result thread hasn't finished cleaning up, so they can be shut down (or
+# waited for) at exit. Otherwise a process that exits right after shutdown(wait=False) would
+# leave the IPC objects behind, since the result thread is a daemon.
+_live_executors = weakref.WeakSet()
+
+
+@atexit.register
+def _shutdown_live_executors():
+    for executor in list(_live_executors):
+        executor.shutdown(wait=True)
+
+
+class _RemoteTraceback(Exception):
+    """Carries the formatted traceback of an exception raised in a worker"""
+    def __init__(self, tb):
+        self.tb = tb
+
+    def __str__(self):
+        return self.tb
+
+
+class _Executor(concurrent.futures.Executor):
+    """The base class of IPCExecutor and WorkStealingPool"""
+    def __init__(self):
+        self._futures = {}
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._broken = None
+        self._workers = []
+        self._result_thread = None
+        # Tasks waiting to be sent by the result thread
+        self._backlog = collections.deque()
+        # True if the result thread is to call _stop() once the backlog is empty
+        self._stop_pending = False
+
+    def _start(self):
+        self._result_thread = threading.Thread(target=self._run_result_thread, daemon=True)
+        self._result_thread.start()
+        _live_executors.add(self)
+
+    def _run_result_thread(self):
+        try:
+            self._collect_results()
+        finally:
+            _live_executors.discard(self)
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._broken:
+                raise BrokenProcessPool(self._broken)
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+
+            future = concurrent.futures.Future()
+            future.set_running_or_notify_cancel()
+            task_id = next(self._task_ids)
+            self._futures[task_id] = future
+            task = (task_id, fn, args, kwargs)
+
+            if threading.current_thread() is self._result_thread:
+                # A done-callback is submitting. See the module docstring. This happens under
+                # the lock so that shutdown() can't stop the workers before the task is sent.
+                self._backlog.append(task)
+                return future
+
+        try:
+            payload = self._dumps(task)
+        except Exception as e:
+            # ProcessPoolExecutor reports pickling errors via the future.
+            self._fail(task_id, e)
+            return future
+
+        try:
+            self._send(payload, True)
+        except BaseException:
+            with self._lock:
+                self._futures.pop(task_id, None)
+            raise
+
+        return future
+
+    def _fail(self, task_id, exception):
+        with self._lock:
+            future = self._futures.pop(task_id, None)
+        if future is not None:
+            future.set_exception(exception)
+
+    def _deliver(self, task_id, succeeded, value):
+        with self._lock:
+            future = self._futures.pop(task_id, None)
+        if future is not None:
+            if succeeded:
+                future.set_result(value)
+            else:
+                exception, tb = value
+                if tb:
+                    exception.__cause__ = _RemoteTraceback(tb)
+                future.set_exception(exception)
+
+    def _send_backlog(self):
+        # Sends what it can of the backlog without waiting, and then stops the workers if
+        # shutdown() left that to this thread. Only the result thread adds to the backlog, so it
+        # can check for an empty one without the lock.
+        if not (self._backlog or self._stop_pending):
+            return
+
+        failed = []
+        with self._lock:
+            while self._backlog:
+                task = self._backlog[0]
+                try:
+                    payload = self._dumps(task)
+                except Exception as e:
+                    failed.append((task[0], e))
+                else:
+                    if not self._send(payload, False):
+                        # Try again after collecting some results.
+                        break
+                self._backlog.popleft()
+            stop = self._stop_pending and not self._backlog
+
+        # Failing a future runs its callbacks, which might submit, so this happens without the
+        # lock.
+        for task_id, exception in failed:
+            self._fail(task_id, exception)
+
+        if stop and self._stop(False):
+            self._stop_pending = False
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        # Every submitted task has already been dispatched (or is in the backlog), so there's
+        # nothing for cancel_futures to cancel.
+        in_result_thread = threading.current_thread() is self._result_thread
+        with self._lock:
+            stop = (not self._shutdown) and (not self._broken)
+            self._shutdown = True
+            if stop and (self._backlog or in_result_thread):
+                # The workers mustn't be told to finish before the backlog has been sent, and
+                # the result thread mustn't wait for room to tell them.
+                self._stop_pending = True
+                stop = False
+
+        if stop:
+            self._stop(True)
+
+        if wait and not in_result_thread:
+            self._result_thread.join()
+
+    def _break(self, reason):
+        with self._lock:
+            self._broken = reason
+            self._shutdown = True
+            futures = list(self._futures.values())
+            self._futures.clear()
+            self._backlog.clear()
+            self._stop_pending = False
+
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.terminate()
+
+        for future in futures:
+            future.set_exception(BrokenProcessPool(reason))
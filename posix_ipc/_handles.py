@@ -0,0 +1,116 @@
+"""Pickling support for Semaphore, SharedMemory and MessageQueue
+
+These objects pickle as their name plus the options needed to open them again (e.g. whether a
+SharedMemory is read-only). Unpickling calls reopen(), which keeps one handle per object per
+process, so a worker that receives the same semaphore with every task opens it only once.
+
+A cached handle is reused as long as it's open and its name still refers to the object that it
+has open. Where objects are files (Linux), that's checked by comparing the file's device and
+inode with the ones recorded when the handle was opened. If the object has been unlinked (and
+perhaps re-created under the same name), the stale handle is closed and dropped so that it
+doesn't keep the old object's memory alive, and unpickling opens the name again. If the
+process closes a handle (or, for a SharedMemory, closes its file descriptor), the next
+unpickling opens a new one. Unpickling never creates anything, so if the name doesn't exist,
+it raises ExistentialError.
+
+The cache holds at most MAX_HANDLES handles. When it's full, the least recently unpickled one
+is closed to make room.
+"""
+# Python imports
+import collections
+import os
+import threading
+
+# Project imports
+from . import _posix_ipc
+from ._inventory import SHARED_MEMORY_DIRECTORY, MESSAGE_QUEUE_DIRECTORY, SEMAPHORE_FILE_PREFIX
+
+# The most handles that a process keeps open on behalf of unpickling
+MAX_HANDLES = 256
+
+# (kind, name, options...) --> (handle, identity), least recently used first
+_cache = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def _open(kind, name, options):
+    if kind == "Semaphore":
+        return _posix_ipc.Semaphore(name)
+    if kind == "SharedMemory":
+        return _posix_ipc.SharedMemory(name, read_only=options["read_only"])
+    if kind == "MessageQueue":
+        return _posix_ipc.MessageQueue(name, read=options["read"], write=options["write"],
+                                       codec=options["codec"])
+    raise ValueError("Unknown kind of handle: %r" % kind)
+
+
+def _close(kind, handle):
+    try:
+        if kind == "SharedMemory":
+            handle.close_fd()
+        else:
+            handle.close()
+    except _posix_ipc.Error:
+        # Someone else closed it.
+        pass
+
+
+def _path(kind, name):
+    filename = name.lstrip('/')
+    if kind == "Semaphore":
+        return os.path.join(SHARED_MEMORY_DIRECTORY, SEMAPHORE_FILE_PREFIX + filename)
+    if kind == "SharedMemory":
+        return os.path.join(SHARED_MEMORY_DIRECTORY, filename)
+    return os.path.join(MESSAGE_QUEUE_DIRECTORY, filename)
+
+
+def _stat(path):
+    # Returns the device and inode of the file at path, or None if there isn't one.
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+def _identify(kind, name, handle):
+    # Returns the device and inode of the object that the handle has open, or None if objects
+    # aren't visible as files on this platform, in which case stale handles can't be detected.
+    path = _path(kind, name)
+    if not os.path.isdir(os.path.dirname(path)):
+        return None
+    if kind == "SharedMemory":
+        # This is exact, whereas stat()ing the name could see an object that replaced this one.
+        st = os.fstat(handle.fd)
+        return (st.st_dev, st.st_ino)
+    return _stat(path)
+
+
+def reopen(kind, name, options):
+    # The codec isn't part of the key because a custom codec may not be hashable. A cached
+    # queue with a different codec is replaced instead.
+    codec = options.get("codec")
+    key = (kind, name) + tuple(value for option, value in sorted(options.items())
+                               if option != "codec")
+
+    with _lock:
+        handle, identity = _cache.pop(key, (None, None))
+        if handle is not None:
+            if (not _posix_ipc._is_open(handle)) or \
+               ((kind == "MessageQueue") and (handle.codec != codec)):
+                handle = None
+            elif (identity is not None) and (_stat(_path(kind, name)) != identity):
+                # The object was unlinked, and maybe replaced by a new one with the same name.
+                _close(kind, handle)
+                handle = None
+
+        if handle is None:
+            handle = _open(kind, name, options)
+            identity = _identify(kind, name, handle)
+
+        _cache[key] = (handle, identity)
+        while len(_cache) > MAX_HANDLES:
+            evicted_key, (evicted, ignored) = _cache.popitem(last=False)
+            _close(evicted_key[0], evicted)
+
+    return handle
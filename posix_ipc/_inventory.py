@@ -0,0 +1,169 @@
+"""list_objects() and reap()
+
+POSIX doesn't provide a way to enumerate IPC objects, but Linux exposes them as files. Shared
+memory segments live in /dev/shm, semaphores live there too with a "sem." prefix, and message
+queues live in /dev/mqueue if the mqueue filesystem is mounted there. Each file in /dev/mqueue
+contains a line like "QSIZE:129 NOTIFY:0 SIGNO:0 NOTIFY_PID:0" where QSIZE is the number of
+bytes of messages in the queue. The number of messages isn't there. Counting them means
+opening each queue and asking mq_getattr(), which is a few system calls per queue, so
+list_objects() only does that if asked to.
+
+reap() judges whether an object is abandoned by its file's modification time. The kernel updates
+that when a message queue is sent to or received from, and when a shared memory segment is
+written with write() or resized, but not when a semaphore is posted or waited on, or when a
+segment is written through a mapping (which is how this package writes to segments). So a
+semaphore or segment that's in constant use can still look old.
+"""
+# Python imports
+import collections
+import datetime
+import os
+import time
+
+# Project imports
+from ._posix_ipc import unlink_semaphore, unlink_shared_memory, Error, ExistentialError
+try:
+    from ._posix_ipc import MessageQueue, unlink_message_queue
+except ImportError:
+    # Message queues aren't supported on this platform.
+    MessageQueue = unlink_message_queue = None
+
+SHARED_MEMORY_DIRECTORY = "/dev/shm"
+MESSAGE_QUEUE_DIRECTORY = "/dev/mqueue"
+SEMAPHORE_FILE_PREFIX = "sem."
+
+KINDS = ("semaphore", "shared_memory", "message_queue")
+
+IPCObject = collections.namedtuple("IPCObject",
+                                   ("kind", "name", "size", "uid", "mtime", "queued_bytes",
+                                    "queued_messages"))
+IPCObject.__doc__ = """An IPC object found by list_objects()"""
+
+
+def _parse_queue_size(path):
+    try:
+        with open(path) as f:
+            for field in f.read().split():
+                key, _, value = field.partition(':')
+                if key == "QSIZE":
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def _count_messages(name):
+    if MessageQueue is None:
+        return None
+    try:
+        mq = MessageQueue(name, write=False)
+    except Error:
+        # It's gone or the permissions don't allow it to be opened.
+        return None
+    try:
+        return mq.current_messages
+    finally:
+        mq.close()
+
+
+def _scan(directory, kind, prefix, count_messages):
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        # The directory doesn't exist (not Linux, or /dev/mqueue isn't mounted) or isn't
+        # readable.
+        return
+
+    with entries:
+        for entry in entries:
+            filename = entry.name
+            if kind == "semaphore":
+                if not filename.startswith(SEMAPHORE_FILE_PREFIX):
+                    continue
+                filename = filename[len(SEMAPHORE_FILE_PREFIX):]
+            elif (kind == "shared_memory") and filename.startswith(SEMAPHORE_FILE_PREFIX):
+                continue
+
+            name = '/' + filename
+            if not name.startswith(prefix):
+                continue
+
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                # It was unlinked after scandir() saw it.
+                continue
+
+            queued_bytes = queued_messages = None
+            if kind == "message_queue":
+                queued_bytes = _parse_queue_size(entry.path)
+                if count_messages:
+                    queued_messages = _count_messages(name)
+
+            yield IPCObject(kind, name, st.st_size, st.st_uid, st.st_mtime, queued_bytes,
+                            queued_messages)
+
+
+def _normalize_kinds(kind):
+    if kind is None:
+        return KINDS
+    elif kind in KINDS:
+        return (kind, )
+    else:
+        raise ValueError("kind must be None or one of %s" % ', '.join(KINDS))
+
+
+def list_objects(prefix=None, kind=None, count_messages=False):
+    """Returns a list of IPCObjects describing the semaphores, shared memory segments and
+    message queues whose names start with prefix. If kind is not None, only objects of that
+    kind ("semaphore", "shared_memory" or "message_queue") are listed. A message queue's
+    queued_messages is None unless count_messages is True, since counting them means opening
+    the queue.
+    """
+    prefix = prefix or ''
+    if not prefix.startswith('/'):
+        prefix = '/' + prefix
+
+    objects = []
+    for kind in _normalize_kinds(kind):
+        directory = MESSAGE_QUEUE_DIRECTORY if (kind == "message_queue") \
+                    else SHARED_MEMORY_DIRECTORY
+        objects += _scan(directory, kind, prefix, count_messages)
+
+    return objects
+
+
+def reap(prefix, older_than=None, kind=None):
+    """Unlinks the objects that list_objects(prefix, kind) would return and that haven't been
+    modified in the last older_than seconds (a number or a datetime.timedelta). Returns a list
+    of the IPCObjects that were unlinked.
+
+    Semaphores and shared memory segments written through a mapping don't update their
+    modification time, so older_than only tells whether they're abandoned if their users don't
+    need them for longer than that. See the module docstring.
+    """
+    if not prefix or (prefix == '/'):
+        raise ValueError("A prefix is required")
+
+    if isinstance(older_than, datetime.timedelta):
+        older_than = older_than.total_seconds()
+
+    cutoff = None if (older_than is None) else (time.time() - older_than)
+
+    unlinkers = {"semaphore": unlink_semaphore,
+                 "shared_memory": unlink_shared_memory,
+                 "message_queue": unlink_message_queue,
+                 }
+
+    reaped = []
+    for ipc_object in list_objects(prefix, kind):
+        if (cutoff is None) or (ipc_object.mtime < cutoff):
+            try:
+                unlinkers[ipc_object.kind](ipc_object.name)
+            except ExistentialError:
+                # Someone else got there first.
+                continue
+            reaped.append(ipc_object)
+
+    return reaped
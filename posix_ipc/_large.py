@@ -0,0 +1,244 @@
+"""The implementation of MessageQueue.send_large() and MessageQueue.receive_large()
+
+Messages that fit in the queue travel through it as usual. Larger ones are copied into a shared
+memory segment and only a small descriptor travels through the queue. The receiver gets a
+memoryview of the segment (no copy) and hands the segment back to the sender by calling
+LargeMessage.release(), or when the LargeMessage is garbage collected.
+
+Segments belong to a pool owned by the sending process. The first few bytes of each segment
+hold its state. The sender marks a segment busy before sending its descriptor and the receiver
+marks it free when it's done, after which the sender can reuse it. The pool keeps at most
+MAX_POOL_SEGMENTS segments. More can exist while many messages are outstanding, but the surplus
+is unlinked as it becomes free. The sender unlinks its remaining segments when it exits,
+including busy ones. That destroys any message that's still waiting in a queue (the receiver
+gets ExistentialError), but otherwise a sender whose receiver never shows up would leave its
+segments in /dev/shm forever. A receiver that has already received a message keeps its mapping,
+so it's unaffected.
+"""
+# Python imports
+import atexit
+import collections
+import mmap
+import os
+import struct
+import threading
+import weakref
+
+# Project imports
+from ._posix_ipc import SharedMemory, O_CREX, ExistentialError, unlink_shared_memory
+from . import _codecs
+
+# The first byte of every message says how to interpret the rest.
+INLINE = 0
+SPILLED = 1
+
+# A spilled message is SPILLED and the payload size followed by the segment's name.
+DESCRIPTOR_FORMAT = "=BQ"
+DESCRIPTOR_SIZE = struct.calcsize(DESCRIPTOR_FORMAT)
+
+# Each segment starts with its state. The payload starts at a cache line boundary.
+STATE_FORMAT = "=Q"
+STATE_FREE = 0
+STATE_BUSY = 1
+PAYLOAD_OFFSET = 64
+
+# Segment sizes are rounded up to a multiple of this so that a segment is likely to be
+# reusable for the next payload even if it's a little larger than the last one.
+SEGMENT_SIZE_GRANULARITY = 64 * 1024
+
+# The number of segments that the sender keeps for reuse
+MAX_POOL_SEGMENTS = 8
+
+# The receiver keeps this many segments mapped so that it doesn't have to reopen them for
+# every message.
+MAPPING_CACHE_SIZE = 64
+
+
+class _Segment:
+    """A shared memory segment in the sending process' pool"""
+    def __init__(self, size):
+        memory = SharedMemory(None, O_CREX, size=size)
+        self.name = memory.name
+        self.size = size
+        self.mapfile = mmap.mmap(memory.fd, size)
+        memory.close_fd()
+
+    @property
+    def is_free(self):
+        return struct.unpack_from(STATE_FORMAT, self.mapfile)[0] == STATE_FREE
+
+    def set_state(self, state):
+        struct.pack_into(STATE_FORMAT, self.mapfile, 0, state)
+
+    def destroy(self):
+        try:
+            unlink_shared_memory(self.name)
+        except ExistentialError:
+            pass
+        self.mapfile.close()
+
+
+# The sender's pool of segments
+_pool = []
+_pool_lock = threading.Lock()
+
+# The receiver's cache of mapped segments (name --> mmap), least recently used first
+_mappings = collections.OrderedDict()
+_mappings_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # A child process doesn't own its parent's segments, so it mustn't reuse or unlink them.
+    global _pool, _pool_lock, _mappings_lock
+    _pool = []
+    _pool_lock = threading.Lock()
+    _mappings_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@atexit.register
+def _unlink_pool():
+    for segment in _pool:
+        try:
+            unlink_shared_memory(segment.name)
+        except ExistentialError:
+            pass
+
+
+def _allocate(size):
+    """Returns the smallest free segment in the pool that can hold size bytes, creating one
+    if necessary. The segment is marked busy.
+    """
+    with _pool_lock:
+        best = None
+        for segment in _pool:
+            if (segment.size >= size) and ((best is None) or (segment.size < best.size)):
+                if segment.is_free:
+                    best = segment
+
+        if best is None:
+            size = -(-size // SEGMENT_SIZE_GRANULARITY) * SEGMENT_SIZE_GRANULARITY
+            best = _Segment(size)
+            _pool.append(best)
+
+        best.set_state(STATE_BUSY)
+
+        if len(_pool) > MAX_POOL_SEGMENTS:
+            # A burst of outstanding messages made the pool grow. Get rid of free segments
+            # (smallest first, since they're the least likely to be reusable) until it's back
+            # to size.
+            surplus = len(_pool) - MAX_POOL_SEGMENTS
+            for segment in sorted((segment for segment in _pool if segment.is_free),
+                                  key=lambda segment: segment.size)[:surplus]:
+                _pool.remove(segment)
+                segment.destroy()
+
+    return best
+
+
+def _map(name):
+    """Returns an mmap of the named segment"""
+    with _mappings_lock:
+        mapfile = _mappings.get(name)
+        if mapfile is None:
+            memory = SharedMemory(name)
+            mapfile = mmap.mmap(memory.fd, memory.size)
+            memory.close_fd()
+            _mappings[name] = mapfile
+            if len(_mappings) > MAPPING_CACHE_SIZE:
+                # Dropping the reference is enough; the mmap is closed once the messages
+                # that refer to it have been released.
+                _mappings.popitem(last=False)
+        else:
+            _mappings.move_to_end(name)
+
+    return mapfile
+
+
+def _free(mapfile):
+    # Hands a received segment back to the sender.
+    struct.pack_into(STATE_FORMAT, mapfile, 0, STATE_FREE)
+
+
+class LargeMessage:
+    """A message received by MessageQueue.receive_large()
+
+    The data attribute is a memoryview of the message. If the message was spilled to shared
+    memory, the memoryview refers directly to the shared memory segment, which the sender can't
+    reuse until release() is called or the message is garbage collected. Views taken of data
+    mustn't outlive the message. A LargeMessage is a context manager that calls release() on
+    exit.
+    """
+    def __init__(self, data, priority, mapfile=None):
+        self.data = data
+        self.priority = priority
+        # Frees the segment if the message is dropped without being released, which would
+        # otherwise leave the segment busy for the life of the sender.
+        self._finalizer = None if (mapfile is None) else weakref.finalize(self, _free, mapfile)
+
+    def release(self):
+        """Releases the message's data. It's safe to call this more than once."""
+        self.data.release()
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __bytes__(self):
+        return self.data.tobytes()
+
+
+def send_large(mq, message, timeout=None, priority=0, threshold=None):
+    if isinstance(message, str):
+        message = message.encode()
+
+    payload = memoryview(message).cast('B')
+
+    limit = _codecs.max_payload(mq)
+
+    if threshold is None:
+        threshold = limit - 1
+
+    if (len(payload) <= threshold) and (len(payload) < limit):
+        mq.send(bytes((INLINE, )) + payload, timeout, priority)
+    else:
+        segment = None
+        try:
+            segment = _allocate(PAYLOAD_OFFSET + len(payload))
+            descriptor = struct.pack(DESCRIPTOR_FORMAT, SPILLED, len(payload))
+            descriptor += segment.name.encode()
+            if len(descriptor) > limit:
+                raise ValueError("The queue's max_message_size is too small for send_large()")
+            segment.mapfile[PAYLOAD_OFFSET:PAYLOAD_OFFSET + len(payload)] = payload
+            mq.send(descriptor, timeout, priority)
+        except BaseException:
+            if segment:
+                segment.set_state(STATE_FREE)
+            raise
+
+
+def receive_large(mq, timeout=None):
+    message, priority = mq.receive(timeout)
+
+    if not message:
+        raise ValueError("The message wasn't sent with send_large()")
+
+    if message[0] == INLINE:
+        return LargeMessage(memoryview(message)[1:], priority)
+    elif (message[0] == SPILLED) and (len(message) > DESCRIPTOR_SIZE):
+        size = struct.unpack_from(DESCRIPTOR_FORMAT, message)[1]
+        mapfile = _map(message[DESCRIPTOR_SIZE:].decode())
+        data = memoryview(mapfile)[PAYLOAD_OFFSET:PAYLOAD_OFFSET + size]
+        return LargeMessage(data, priority, mapfile)
+    else:
+        raise ValueError("The message wasn't sent with send_large()")
@@ -0,0 +1,143 @@
+"""The implementation of MessageQueue.send_obj() and MessageQueue.receive_obj()
+
+Objects are pickled with protocol 5. Buffers that the pickler offers out-of-band (e.g. the
+contents of a large bytearray or NumPy array) are copied into a shared memory segment from the
+same pool used by send_large() rather than being serialized into the pickle stream. Only the
+pickle stream and a small descriptor travel through the queue, and if even that's too large
+for the queue, the stream goes into the segment too.
+
+A segment holding an object contains a table of (offset, size) pairs, one per out-of-band
+buffer, followed by the pickle stream, followed by the buffers, each starting at a multiple of
+BUFFER_ALIGNMENT bytes.
+"""
+# Python imports
+import pickle
+import struct
+
+# Project imports
+from . import _codecs, _large
+
+# The first byte of every message says how to interpret the rest. These follow the values used
+# by send_large() so that a message sent by one can't be mistaken for a message sent by the
+# other.
+OBJECT_INLINE = 2
+OBJECT_SPILLED = 3
+
+# A spilled object is OBJECT_SPILLED, the size of the pickle stream and the number of buffers,
+# followed by the segment's name.
+DESCRIPTOR_FORMAT = "=BQQ"
+DESCRIPTOR_SIZE = struct.calcsize(DESCRIPTOR_FORMAT)
+
+BUFFER_ENTRY_FORMAT = "=QQ"
+BUFFER_ENTRY_SIZE = struct.calcsize(BUFFER_ENTRY_FORMAT)
+
+# Buffers start on a cache line boundary which also satisfies the alignment requirements of
+# any NumPy dtype.
+BUFFER_ALIGNMENT = 64
+
+# Buffers smaller than this aren't worth the bookkeeping, so they're pickled in-band.
+OUT_OF_BAND_THRESHOLD = 1024
+
+PROTOCOL = 5
+
+
+def _align(n):
+    return -(-n // BUFFER_ALIGNMENT) * BUFFER_ALIGNMENT
+
+
+def _dumps(obj):
+    # Returns the pickle stream and the out-of-band buffers. The caller should release the
+    # buffers once they've been sent.
+    buffers = []
+
+    def buffer_callback(pickle_buffer):
+        try:
+            raw = pickle_buffer.raw()
+        except BufferError:
+            # Non-contiguous buffers can't be sent out-of-band.
+            return True
+        if raw.nbytes < OUT_OF_BAND_THRESHOLD:
+            return True
+        buffers.append(raw)
+        return False
+
+    stream = pickle.dumps(obj, protocol=PROTOCOL, buffer_callback=buffer_callback)
+
+    return stream, buffers
+
+
+def _send_dumped(mq, stream, buffers, timeout, priority):
+    # Sends what _dumps() returned.
+    limit = _codecs.max_payload(mq)
+
+    if (not buffers) and (len(stream) < limit):
+        mq.send(bytes((OBJECT_INLINE, )) + stream, timeout, priority)
+    else:
+        # Lay out the segment -- the buffer table, then the stream, then the buffers.
+        offset = _align(_large.PAYLOAD_OFFSET + (BUFFER_ENTRY_SIZE * len(buffers)) + len(stream))
+        table = []
+        for buffer in buffers:
+            table.append((offset, buffer.nbytes))
+            offset = _align(offset + buffer.nbytes)
+
+        segment = None
+        try:
+            segment = _large._allocate(offset)
+            descriptor = struct.pack(DESCRIPTOR_FORMAT, OBJECT_SPILLED, len(stream),
+                                     len(buffers))
+            descriptor += segment.name.encode()
+            if len(descriptor) > limit:
+                raise ValueError("The queue's max_message_size is too small for send_obj()")
+
+            mapfile = segment.mapfile
+            position = _large.PAYLOAD_OFFSET
+            for entry in table:
+                struct.pack_into(BUFFER_ENTRY_FORMAT, mapfile, position, *entry)
+                position += BUFFER_ENTRY_SIZE
+            mapfile[position:position + len(stream)] = stream
+            for (buffer_offset, size), buffer in zip(table, buffers):
+                mapfile[buffer_offset:buffer_offset + size] = buffer
+
+            mq.send(descriptor, timeout, priority)
+        except BaseException:
+            if segment:
+                segment.set_state(_large.STATE_FREE)
+            raise
+
+
+def send_obj(mq, obj, timeout=None, priority=0):
+    stream, buffers = _dumps(obj)
+    try:
+        _send_dumped(mq, stream, buffers, timeout, priority)
+    finally:
+        for buffer in buffers:
+            buffer.release()
+
+
+def receive_obj(mq, timeout=None):
+    message, priority = mq.receive(timeout)
+
+    if not message:
+        raise ValueError("The message wasn't sent with send_obj()")
+
+    if message[0] == OBJECT_INLINE:
+        return pickle.loads(memoryview(message)[1:])
+    elif (message[0] == OBJECT_SPILLED) and (len(message) > DESCRIPTOR_SIZE):
+        stream_size, buffer_count = struct.unpack_from(DESCRIPTOR_FORMAT, message)[1:]
+        mapfile = _large._map(message[DESCRIPTOR_SIZE:].decode())
+        view = memoryview(mapfile)
+        try:
+            position = _large.PAYLOAD_OFFSET
+            buffers = []
+            for i in range(buffer_count):
+                buffer_offset, size = struct.unpack_from(BUFFER_ENTRY_FORMAT, mapfile, position)
+                position += BUFFER_ENTRY_SIZE
+                # The one and only copy on the receiving side. It means the objects don't
+                # refer to the segment, so it can go back to the sender's pool right away.
+                buffers.append(bytearray(view[buffer_offset:buffer_offset + size]))
+            return pickle.loads(view[position:position + stream_size], buffers=buffers)
+        finally:
+            view.release()
+            struct.pack_into(_large.STATE_FORMAT, mapfile, 0, _large.STATE_FREE)
+    else:
+        raise ValueError("The message wasn't sent with send_obj()")
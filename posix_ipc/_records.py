@@ -0,0 +1,411 @@
+"""The implementation of SharedMemory.records()
+
+A RecordArray is a view of fixed-layout records in a shared memory segment. The layout is a
+struct format string or a ctypes Structure. Either way it's converted to a list of fields, each
+with a struct code of a standard size, an offset in the record and a size, plus a byte order
+that applies to all of them. That makes it possible to decode a whole record with one
+struct.Struct and many records with its iter_unpack() (no Python code per record).
+
+Records are stored one after another (an array of structures) or, if columnar, as one column
+per field (a structure of arrays). A field of every record can be read or written at once.
+Columns are contiguous so they're zero-copy views. Fields of interleaved records are copied
+with _gather() and _scatter(), which loop in C with the GIL released.
+"""
+# Python imports
+import array
+import collections
+import ctypes
+import mmap
+import re
+import struct
+import sys
+
+# Project imports
+from ._posix_ipc import PermissionsError, _gather, _scatter
+
+Field = collections.namedtuple("Field", ("name", "code", "offset", "size"))
+Field.__doc__ = """A field of a RecordArray's records
+
+code is a struct format code (without a byte order) and offset is the field's offset in the
+record. For a field that's not a number (e.g. a ctypes array or nested Structure) code is "Ns"
+where N is the size.
+"""
+
+_TOKEN = re.compile(r"\s*(\d*)([xcbB?hHiIlLqQnNefdspP])")
+
+_NATIVE_BYTE_ORDER = '<' if (sys.byteorder == "little") else '>'
+
+# Native struct codes that don't have a standard size, by their standard equivalents
+_SIGNED_CODES = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+_UNSIGNED_CODES = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+# memoryview.cast() and array.array() only understand native codes. These are the native codes
+# for each standard code.
+_NATIVE_CODES = {'?': '?', 'c': 'c', 'f': 'f', 'd': 'd'}
+for _size, _code in _SIGNED_CODES.items():
+    _NATIVE_CODES[_code] = next(c for c in "bhiql" if struct.calcsize(c) == _size)
+for _size, _code in _UNSIGNED_CODES.items():
+    _NATIVE_CODES[_code] = next(c for c in "BHIQL" if struct.calcsize(c) == _size)
+
+
+def _standard_code(code, size):
+    # Returns the standard-size struct code for a code that might only have a native size.
+    if code in "bhilqn":
+        return _SIGNED_CODES[size]
+    if code in "BHILQNP":
+        return _UNSIGNED_CODES[size]
+    return code
+
+
+def _buffer_code(buffer_format):
+    # Returns the standard-size struct code for the items of a buffer with the given format
+    # (e.g. a memoryview's), or None if they aren't in native byte order.
+    byte_order = buffer_format[:1]
+    if byte_order in ('<', '>', '!'):
+        if byte_order.replace('!', '>') != _NATIVE_BYTE_ORDER:
+            return None
+    code = buffer_format.lstrip('@=<>!')
+    if code in "bhilqnBHILQNP":
+        return _standard_code(code, struct.calcsize(buffer_format))
+    return code
+
+
+def _parse_format(layout, names):
+    # Returns the byte order, fields and record size described by a struct format.
+    byte_order = '@'
+    body = layout.strip()
+    if body[:1] in ('@', '=', '<', '>', '!'):
+        byte_order, body = body[0], body[1:]
+
+    fields = []
+    prefix = byte_order
+    position = 0
+    while body[position:].strip():
+        match = _TOKEN.match(body, position)
+        if not match:
+            raise ValueError("Bad struct format: %r" % layout)
+        position = match.end()
+        count, code = match.groups()
+        if code in "sp":
+            items = [count + code]
+        elif (code == 'x') or (count and not int(count)):
+            # Padding
+            prefix += count + code
+            continue
+        else:
+            items = [code] * (int(count) if count else 1)
+        for item in items:
+            prefix += item
+            size = struct.calcsize(byte_order + item)
+            fields.append(Field(len(fields), item if (code in "sp") else
+                                _standard_code(code, size),
+                                struct.calcsize(prefix) - size, size))
+
+    if names is not None:
+        names = tuple(names)
+        if len(names) != len(fields):
+            raise ValueError("The format has %d fields but %d names were given" %
+                             (len(fields), len(names)))
+        fields = [field._replace(name=name) for field, name in zip(fields, names)]
+
+    return ('=' if (byte_order == '@') else byte_order), fields, struct.calcsize(layout)
+
+
+def _parse_structure(layout):
+    # Returns the byte order, fields and record size described by a ctypes Structure.
+    if issubclass(layout, ctypes.BigEndianStructure if (_NATIVE_BYTE_ORDER == '<') else
+                  ctypes.LittleEndianStructure):
+        byte_order = '>' if (_NATIVE_BYTE_ORDER == '<') else '<'
+    else:
+        byte_order = '='
+
+    fields = []
+    for field in layout._fields_:
+        if len(field) > 2:
+            raise ValueError("Bit fields aren't supported")
+        name, ctype = field
+        descriptor = getattr(layout, name)
+        code = getattr(ctype, "_type_", None)
+        if isinstance(code, str) and (code in "?cbBhHiIlLqQnNfdP"):
+            code = _standard_code(code, descriptor.size)
+        else:
+            code = "%ds" % descriptor.size
+        fields.append(Field(name, code, descriptor.offset, descriptor.size))
+
+    return byte_order, fields, ctypes.sizeof(layout)
+
+
+def _record_format(byte_order, fields, itemsize):
+    # Returns a struct format that decodes a whole record.
+    parts = [byte_order]
+    position = 0
+    for field in sorted(fields, key=lambda field: field.offset):
+        if field.offset < position:
+            raise ValueError("Overlapping fields (e.g. in a Union) aren't supported")
+        if field.offset > position:
+            parts.append("%dx" % (field.offset - position))
+        parts.append(field.code)
+        position = field.offset + field.size
+    if itemsize > position:
+        parts.append("%dx" % (itemsize - position))
+    return ''.join(parts)
+
+
+class RecordArray:
+    """Fixed-layout records in a SharedMemory segment, as returned by SharedMemory.records()
+
+    Indexing returns a record as a tuple of its fields' values, and assigning a tuple to an
+    index writes a record. Slicing (with a step of 1) returns a RecordArray of those records.
+    field() and set_field() read and write one field of every record at once.
+    """
+    def __init__(self, mapfile, buffer, read_only, byte_order, fields, itemsize, columnar,
+                 start, count, column_length):
+        self._mapfile = mapfile
+        self._buffer = buffer
+        self.read_only = read_only
+        self.byte_order = byte_order
+        self.fields = tuple(fields)
+        self.itemsize = itemsize
+        self.columnar = columnar
+        self._start = start
+        self._count = count
+        self._column_length = column_length
+        self._fields_by_key = {}
+        column_offset = 0
+        self._column_offsets = []
+        for i, field in enumerate(self.fields):
+            self._fields_by_key[i] = i
+            self._fields_by_key[field.name] = i
+            self._column_offsets.append(column_offset)
+            column_offset += field.size * column_length
+        if columnar:
+            self._field_structs = [struct.Struct(byte_order + field.code)
+                                   for field in self.fields]
+        else:
+            self.format = _record_format(byte_order, self.fields, itemsize)
+            self._struct = struct.Struct(self.format)
+
+    def _check_open(self):
+        if self._buffer is None:
+            raise ValueError("The RecordArray has been closed")
+
+    def _check_writable(self):
+        self._check_open()
+        if self.read_only:
+            raise PermissionsError("The segment is read-only")
+
+    def _index(self, index):
+        if index < 0:
+            index += self._count
+        if not (0 <= index < self._count):
+            raise IndexError("RecordArray index out of range")
+        return self._start + index
+
+    def _field(self, key):
+        try:
+            return self._fields_by_key[key]
+        except (KeyError, TypeError):
+            raise KeyError("No such field: %r" % (key, )) from None
+
+    def _field_location(self, i):
+        # Returns the offset of field i of the first record and the distance between records.
+        field = self.fields[i]
+        if self.columnar:
+            return self._column_offsets[i] + (self._start * field.size), field.size
+        return (self._start * self.itemsize) + field.offset, self.itemsize
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        self._check_open()
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._count)
+            if step != 1:
+                raise ValueError("RecordArray slices must have a step of 1")
+            # Only the original RecordArray owns the mapping.
+            return RecordArray(None, self._buffer, self.read_only, self.byte_order,
+                               self.fields, self.itemsize, self.columnar, self._start + start,
+                               max(stop - start, 0), self._column_length)
+
+        index = self._index(index)
+        if self.columnar:
+            return tuple(field_struct.unpack_from(self._buffer,
+                                                  self._column_offsets[i] + (index * field.size))[0]
+                         for i, (field, field_struct) in
+                         enumerate(zip(self.fields, self._field_structs)))
+        return self._struct.unpack_from(self._buffer, index * self.itemsize)
+
+    def __setitem__(self, index, record):
+        self._check_writable()
+        index = self._index(index)
+        if self.columnar:
+            if len(record) != len(self.fields):
+                raise ValueError("A record has %d fields" % len(self.fields))
+            for i, (field, value) in enumerate(zip(self.fields, record)):
+                self._field_structs[i].pack_into(self._buffer,
+                                                 self._column_offsets[i] + (index * field.size),
+                                                 value)
+        else:
+            self._struct.pack_into(self._buffer, index * self.itemsize, *record)
+
+    def __iter__(self):
+        self._check_open()
+        if self.columnar:
+            # Each column is unpacked with the same struct as __getitem__() uses, so that
+            # (e.g.) "4s" fields are bytes rather than lists of ints.
+            columns = []
+            for i, (field, field_struct) in enumerate(zip(self.fields, self._field_structs)):
+                offset = self._column_offsets[i] + (self._start * field.size)
+                column = self._buffer[offset:offset + (self._count * field.size)]
+                columns.append(value for value, in field_struct.iter_unpack(column))
+            return zip(*columns)
+        start = self._start * self.itemsize
+        return self._struct.iter_unpack(self._buffer[start:start + (self._count * self.itemsize)])
+
+    def tolist(self):
+        """Returns a list of every record (as a tuple)"""
+        return list(self)
+
+    def field(self, key):
+        """Returns the values of one field (identified by name or index) of every record
+
+        The result is a memoryview with the field's native format (e.g. "d" for a double), so
+        it can be passed to array.array(), numpy.frombuffer() and so on. A field that isn't a
+        number is returned as a two dimensional memoryview of bytes. If the records are
+        columnar and in native byte order, the memoryview refers to the segment itself.
+        Otherwise it refers to a copy.
+        """
+        self._check_open()
+        i = self._field(key)
+        field = self.fields[i]
+        offset, stride = self._field_location(i)
+        size = self._count * field.size
+
+        native_code = _NATIVE_CODES.get(field.code)
+        swapped = (self.byte_order in ('<', '>', '!')) and \
+                  (self.byte_order.replace('!', '>') != _NATIVE_BYTE_ORDER)
+
+        if self.columnar:
+            data = self._buffer[offset:offset + size]
+        else:
+            data = memoryview(_gather(self._buffer, offset, stride, field.size, self._count))
+
+        if native_code is None:
+            if field.code == 'e':
+                # memoryview doesn't support half precision floats, so they're widened.
+                return memoryview(array.array('f', (value for value, in struct.iter_unpack(
+                    self.byte_order + 'e', data))))
+            return data.cast('B', (self._count, field.size)) if self._count else data
+        if swapped and (field.size > 1):
+            values = array.array(native_code)
+            values.frombytes(data)
+            values.byteswap()
+            return memoryview(values)
+        return data.cast(native_code)
+
+    def set_field(self, key, values):
+        """Writes one field (identified by name or index) of every record
+
+        values is a bytes-like object with the same format as field() returns (e.g. an
+        array.array or a NumPy array with the field's type) and one value per record. A half
+        precision field accepts half or single precision values (field() returns the latter)
+        and narrows them. A field that isn't a number accepts bytes.
+        """
+        self._check_writable()
+        i = self._field(key)
+        field = self.fields[i]
+        offset, stride = self._field_location(i)
+
+        values = memoryview(values)
+        code = _buffer_code(values.format)
+        if field.code == 'e':
+            if code not in ('e', 'f'):
+                raise ValueError("values must have format 'e' or 'f', not %r" % values.format)
+            if values.nbytes != self._count * values.itemsize:
+                raise ValueError("values must contain exactly one value per record")
+            # This is the field's byte order, so there's nothing to swap below.
+            values = memoryview(struct.pack("%s%de" % (self.byte_order, self._count),
+                                            *(value for value, in struct.iter_unpack(
+                                                '=' + code, values.cast('B')))))
+        elif field.code in _NATIVE_CODES:
+            # A char field also accepts bytes.
+            if (code != field.code) and not ((field.code == 'c') and (values.itemsize == 1)):
+                raise ValueError("values must have format %r, not %r" %
+                                 (_NATIVE_CODES[field.code], values.format))
+        elif values.itemsize != 1:
+            raise ValueError("values of a field that isn't a number must be bytes")
+
+        if values.nbytes != self._count * field.size:
+            raise ValueError("values must contain exactly one value per record")
+        swapped = (self.byte_order in ('<', '>', '!')) and \
+                  (self.byte_order.replace('!', '>') != _NATIVE_BYTE_ORDER)
+        if swapped and (field.size > 1) and (field.code in _NATIVE_CODES):
+            swapped_values = array.array(_NATIVE_CODES[field.code])
+            swapped_values.frombytes(values.cast('B'))
+            swapped_values.byteswap()
+            values = swapped_values
+
+        _scatter(self._buffer, offset, stride, field.size, self._count, values)
+
+    def close(self):
+        """Unmaps the records. RecordArrays sliced from this one are closed too."""
+        if self._buffer is None:
+            return
+        if self._mapfile is None:
+            # This is a slice or it's empty.
+            self._buffer = None
+            return
+        self._buffer.release()
+        self._buffer = None
+        try:
+            self._mapfile.close()
+        except BufferError:
+            # Memoryviews returned by field() still refer to the mapping. It'll be closed when
+            # they're garbage collected.
+            pass
+
+
+def records(memory, layout, count=None, offset=0, names=None, columnar=False):
+    if isinstance(layout, str):
+        byte_order, fields, itemsize = _parse_format(layout, names)
+    elif isinstance(layout, type) and issubclass(layout, ctypes.Structure):
+        if names is not None:
+            raise ValueError("names can only be given with a struct format")
+        byte_order, fields, itemsize = _parse_structure(layout)
+    else:
+        raise TypeError("The layout must be a struct format or a ctypes.Structure subclass")
+
+    if not fields:
+        raise ValueError("The layout must have at least one field")
+
+    # A columnar record doesn't contain padding.
+    record_size = sum(field.size for field in fields) if columnar else itemsize
+    if not record_size:
+        raise ValueError("The records must not be empty")
+
+    if offset < 0:
+        raise ValueError("The offset must be non-negative")
+    available = memory.size - offset
+    if count is None:
+        count = max(available, 0) // record_size
+    if (count < 0) or (count * record_size > available):
+        raise ValueError("The records don't fit in the segment")
+
+    # mmap() offsets must be a multiple of the allocation granularity.
+    map_offset = offset - (offset % mmap.ALLOCATIONGRANULARITY)
+    map_size = (offset - map_offset) + (count * record_size)
+    read_only = False
+    if map_size:
+        try:
+            mapfile = mmap.mmap(memory.fd, map_size, offset=map_offset)
+        except PermissionError:
+            mapfile = mmap.mmap(memory.fd, map_size, access=mmap.ACCESS_READ, offset=map_offset)
+            read_only = True
+        buffer = memoryview(mapfile)[offset - map_offset:]
+    else:
+        mapfile = None
+        buffer = memoryview(bytearray())
+
+    return RecordArray(mapfile, buffer, read_only, byte_order, fields, itemsize, columnar, 0,
+                       count, count)
@@ -0,0 +1,231 @@
+"""The implementation of python -m posix_ipc top
+
+A Monitor polls the objects whose names match a prefix (as found by list_objects()) and keeps
+statistics about each one's depth -- the number of messages in a message queue or the value
+of a semaphore. Shared memory segments have a size but no depth.
+
+The kernel doesn't count the messages that pass through a queue, so the rates are estimated
+from the changes in depth between polls. An increase of n means that at least n messages
+arrived and a decrease of n means that at least n departed. Messages that arrive and depart
+between two polls aren't seen, so the rates are lower bounds, and polling more often makes
+them more accurate.
+"""
+# Python imports
+import json
+import shutil
+import sys
+import time
+
+# Project imports
+from ._posix_ipc import Semaphore, Error, SEMAPHORE_VALUE_SUPPORTED
+try:
+    from ._posix_ipc import MessageQueue
+except ImportError:
+    # Message queues aren't supported on this platform.
+    MessageQueue = None
+from ._inventory import list_objects, SHARED_MEMORY_DIRECTORY
+
+CLEAR_SCREEN = "\x1b[H\x1b[2J"
+
+
+class _Tracker:
+    """Statistics about one object"""
+    def __init__(self, ipc_object):
+        self.ipc_object = ipc_object
+        self.handle = None
+        self.depth = None
+        self.high_water = None
+        self.arrived = 0
+        self.departed = 0
+
+
+def _open(ipc_object):
+    # Returns a handle that can report the object's depth, or None.
+    try:
+        if ipc_object.kind == "message_queue":
+            if MessageQueue:
+                return MessageQueue(ipc_object.name, write=False)
+        elif (ipc_object.kind == "semaphore") and SEMAPHORE_VALUE_SUPPORTED:
+            return Semaphore(ipc_object.name)
+    except Error:
+        # It's gone or the permissions don't allow it to be opened.
+        pass
+    return None
+
+
+def _close(handle):
+    if handle is not None:
+        handle.close()
+
+
+def _depth(handle):
+    try:
+        if isinstance(handle, Semaphore):
+            return handle.value
+        return handle.current_messages
+    except Error:
+        return None
+
+
+def _filesystem_usage(path):
+    try:
+        usage = shutil.disk_usage(path)
+    except OSError:
+        return None
+    return {"path": path, "total": usage.total, "used": usage.used, "free": usage.free}
+
+
+class Monitor:
+    """Polls the IPC objects whose names start with prefix and reports on them"""
+    def __init__(self, prefix=None):
+        self.prefix = prefix
+        self._trackers = {}
+        self._last_report = time.monotonic()
+
+    def poll(self):
+        """Samples every object's depth"""
+        seen = set()
+        for ipc_object in list_objects(self.prefix):
+            key = (ipc_object.kind, ipc_object.name)
+            seen.add(key)
+            tracker = self._trackers.get(key)
+            if tracker is None:
+                tracker = self._trackers[key] = _Tracker(ipc_object)
+                tracker.handle = _open(ipc_object)
+            tracker.ipc_object = ipc_object
+
+            if tracker.handle is None:
+                continue
+            depth = _depth(tracker.handle)
+            if depth is None:
+                continue
+
+            if tracker.depth is not None:
+                if depth > tracker.depth:
+                    tracker.arrived += depth - tracker.depth
+                else:
+                    tracker.departed += tracker.depth - depth
+            tracker.depth = depth
+            tracker.high_water = depth if (tracker.high_water is None) \
+                else max(tracker.high_water, depth)
+
+        # Forget objects that have been unlinked.
+        for key in set(self._trackers) - seen:
+            _close(self._trackers.pop(key).handle)
+
+    def report(self):
+        """Returns a dict describing the objects as of the most recent poll(), with arrival
+        and departure rates averaged since the previous report()
+        """
+        now = time.monotonic()
+        elapsed = now - self._last_report
+        self._last_report = now
+
+        objects = []
+        for key in sorted(self._trackers):
+            tracker = self._trackers[key]
+            ipc_object = tracker.ipc_object
+            has_rates = (ipc_object.kind == "message_queue") and (tracker.depth is not None)
+            objects.append({
+                "kind": ipc_object.kind,
+                "name": ipc_object.name,
+                "size": ipc_object.size,
+                "queued_bytes": ipc_object.queued_bytes,
+                "depth": tracker.depth,
+                "high_water": tracker.high_water,
+                "in_per_second": (tracker.arrived / elapsed) if (has_rates and elapsed) else None,
+                "out_per_second": (tracker.departed / elapsed) if (has_rates and elapsed) else None,
+            })
+            tracker.arrived = tracker.departed = 0
+
+        return {"time": time.time(),
+                "prefix": self.prefix,
+                "shared_memory_filesystem": _filesystem_usage(SHARED_MEMORY_DIRECTORY),
+                "objects": objects,
+                }
+
+    def close(self):
+        """Closes the handles that the monitor has opened"""
+        for tracker in self._trackers.values():
+            _close(tracker.handle)
+        self._trackers.clear()
+
+
+def _format_bytes(n):
+    if n is None:
+        return '-'
+    for unit in ('', 'K', 'M', 'G', 'T'):
+        if abs(n) < 1024:
+            break
+        n /= 1024
+    return ("%d%s" % (n, unit)) if (unit == '') else ("%.1f%s" % (n, unit))
+
+
+def _format_number(n, precision=0):
+    return '-' if (n is None) else ("%.*f" % (precision, n))
+
+
+def format_report(report, interval):
+    """Returns a report from Monitor.report() as text for a terminal"""
+    lines = ["posix_ipc top - %s   prefix: %s   interval: %gs" %
+             (time.strftime("%H:%M:%S", time.localtime(report["time"])),
+              report["prefix"] or '(all)', interval)]
+
+    usage = report["shared_memory_filesystem"]
+    if usage:
+        percent = (100.0 * usage["used"] / usage["total"]) if usage["total"] else 0
+        lines.append("%s: %s used of %s (%.1f%%)" % (usage["path"],
+                                                     _format_bytes(usage["used"]),
+                                                     _format_bytes(usage["total"]), percent))
+    lines.append('')
+
+    row_format = "%-13s %-24s %8s %8s %8s %9s %9s"
+    lines.append(row_format % ("KIND", "NAME", "SIZE", "DEPTH", "HIGH", "IN/S", "OUT/S"))
+    for ipc_object in report["objects"]:
+        size = ipc_object["size"] if (ipc_object["queued_bytes"] is None) \
+               else ipc_object["queued_bytes"]
+        lines.append(row_format % (ipc_object["kind"], ipc_object["name"],
+                                   _format_bytes(size),
+                                   _format_number(ipc_object["depth"]),
+                                   _format_number(ipc_object["high_water"]),
+                                   _format_number(ipc_object["in_per_second"], 1),
+                                   _format_number(ipc_object["out_per_second"], 1)))
+
+    return '\n'.join(lines)
+
+
+def run(prefix=None, interval=1.0, polls_per_second=10.0, count=None, as_json=False,
+        output=None):
+    """Polls the objects matching prefix and writes a report every interval seconds, count
+    times (or forever if count is None). JSON reports are written one per line.
+    """
+    output = output or sys.stdout
+    clear = (not as_json) and output.isatty()
+    poll_interval = min(interval, 1.0 / polls_per_second)
+
+    monitor = Monitor(prefix)
+    reports = 0
+    try:
+        monitor.poll()
+        monitor.report()
+        while (count is None) or (reports < count):
+            deadline = time.monotonic() + interval
+            while True:
+                time.sleep(max(0, min(poll_interval, deadline - time.monotonic())))
+                monitor.poll()
+                if time.monotonic() >= deadline:
+                    break
+
+            report = monitor.report()
+            if as_json:
+                output.write(json.dumps(report) + '\n')
+            else:
+                if clear:
+                    output.write(CLEAR_SCREEN)
+                elif reports:
+                    output.write('\n')
+                output.write(format_report(report, interval) + '\n')
+            output.flush()
+            reports += 1
+    finally:
+        monitor.close()
@@ -0,0 +1,362 @@
+"""VersionedSegment, generations of a dataset in shared memory that readers can pin
+
+Each generation of the data lives in its own shared memory segment named after the
+VersionedSegment and the generation number (e.g. /dataset.7). A writer fills the next
+generation off to the side and then publishes it, which atomically makes it current. Readers
+pin the current generation and see exactly that generation until they release it, no matter
+how many generations are published meanwhile. An old generation's segment is unlinked as soon
+as it's neither current nor pinned, by the writer if nobody has it pinned when it's superseded
+or otherwise by the last reader to release it.
+
+The VersionedSegment's own segment is an array of 64 bit words --
+
+    word 0                  MAGIC, written last by the creator
+    word 1                  the current generation and its slot, as
+                            (generation << SLOT_BITS) | slot (0 if nothing has been published)
+    word 2                  the most recently allocated generation
+    word 3 + (2 * i)        the generation using slot i (0 if none)
+    word 4 + (2 * i)        the number of pins on that generation
+
+A writer claims a slot that isn't current by changing its pin count from 0 to 1, and holds
+that pin until it publishes or discards its draft. So a slot that's pinned, whether by readers
+or by another writer's draft, can't be claimed. A reader pins a generation by incrementing its
+slot's pin count and then checking that the generation is still current. If it isn't, the
+reader unpins and tries again. A writer that supersedes a generation checks the pin count after
+changing the current generation. Because all of these operations are sequentially consistent,
+either the reader sees the new generation (and backs off) or the writer sees the reader's pin,
+so a generation is never unlinked while it's pinned.
+
+Pins are counts, not records of who holds them, so there's no telling whether the process that
+took a pin is still alive. A reader (or a writer with a draft) that dies while holding a pin
+leaks it, and with it the slot and the generation's segment, until the VersionedSegment is
+unlinked. Once SLOTS - 1 slots have leaked (which takes as few as SLOTS - 1 crashes, each
+holding a different generation), only the current generation's slot is left and build() always
+raises BusyError.
+"""
+# Python imports
+import mmap
+import os
+import time
+
+# Project imports
+from ._posix_ipc import SharedMemory, O_CREAT, O_EXCL, O_CREX, BusyError, ExistentialError, \
+                        unlink_shared_memory
+
+MAGIC = 0x316e6f6973726576   # "version1"
+
+WORD_SIZE = 8
+CURRENT = 1
+LATEST = 2
+FIRST_SLOT = 3
+
+# The number of generations that can exist at once (the current one, those that are still
+# pinned and those being built).
+SLOTS = 8
+SLOT_BITS = 8
+SLOT_MASK = (1 << SLOT_BITS) - 1
+
+HEADER_WORDS = FIRST_SLOT + (2 * SLOTS)
+
+# Seconds that a process opening a VersionedSegment waits for its creator to finish
+# initializing it
+OPEN_TIMEOUT = 1
+
+
+class Version:
+    """A pinned generation of a VersionedSegment, as returned by VersionedSegment.pin()
+
+    buffer is a read-only memoryview of the generation's data. The generation can't be
+    unlinked until release() is called (which happens automatically when a Version is used
+    as a context manager).
+    """
+    def __init__(self, versioned_segment, generation, slot):
+        self.generation = generation
+        self._slot = slot
+        self._versioned_segment = versioned_segment
+        try:
+            memory = SharedMemory(versioned_segment._generation_name(generation),
+                                  read_only=True)
+        except BaseException:
+            versioned_segment._unpin(generation, slot)
+            raise
+        self.size = memory.size
+        self._mapfile = None
+        try:
+            if self.size:
+                self._mapfile = mmap.mmap(memory.fd, self.size, access=mmap.ACCESS_READ)
+                self.buffer = memoryview(self._mapfile)
+            else:
+                self.buffer = memoryview(b'')
+        except BaseException:
+            versioned_segment._unpin(generation, slot)
+            raise
+        finally:
+            memory.close_fd()
+
+    def release(self):
+        """Unpins the generation. buffer can no longer be used."""
+        if self._versioned_segment is None:
+            return
+        self.buffer.release()
+        if self._mapfile is not None:
+            try:
+                self._mapfile.close()
+            except BufferError:
+                # The caller still has views derived from buffer. The mapping will be closed
+                # when they're garbage collected.
+                pass
+        versioned_segment, self._versioned_segment = self._versioned_segment, None
+        versioned_segment._unpin(self.generation, self._slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class Draft:
+    """The next generation of a VersionedSegment, as returned by VersionedSegment.build()
+
+    memory is the generation's SharedMemory object and buffer is a writable memoryview of its
+    data. Fill it in and call publish(), or call discard() to abandon it. Used as a context
+    manager, a Draft is published if the block succeeds and discarded if it raises.
+    """
+    def __init__(self, versioned_segment, generation, slot, size):
+        self.generation = generation
+        self._slot = slot
+        self._versioned_segment = versioned_segment
+        self.memory = SharedMemory(versioned_segment._generation_name(generation), O_CREX,
+                                   versioned_segment._mode, size)
+        self._mapfile = mmap.mmap(self.memory.fd, size) if size else None
+        self.buffer = memoryview(self._mapfile) if size else memoryview(bytearray())
+
+    def _close(self):
+        self.buffer.release()
+        if self._mapfile is not None:
+            try:
+                self._mapfile.close()
+            except BufferError:
+                pass
+        self.memory.close_fd()
+        versioned_segment, self._versioned_segment = self._versioned_segment, None
+        return versioned_segment
+
+    def publish(self):
+        """Makes this generation current. Returns False (and discards this generation) if a
+        newer one was published first, True otherwise.
+        """
+        if self._versioned_segment is None:
+            raise ExistentialError("The draft has already been published or discarded")
+        return self._close()._publish(self.generation, self._slot)
+
+    def discard(self):
+        """Abandons this generation"""
+        if self._versioned_segment is None:
+            return
+        self._close()._discard(self.generation, self._slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.publish()
+        else:
+            self.discard()
+
+
+class VersionedSegment:
+    """Generations of data in shared memory that readers can pin while writers publish new ones
+
+    name, flags and mode have the same meaning as they do for SharedMemory. The mode also
+    applies to the segments that hold the generations.
+    """
+    def __init__(self, name, flags=0, mode=0o600):
+        memory, created = self._open(name, flags, mode)
+        try:
+            if created:
+                self._initialize(memory)
+            self._array = self._read_header(memory)
+        except BaseException:
+            if created:
+                memory.unlink()
+            raise
+        finally:
+            memory.close_fd()
+
+        self.name = memory.name
+        self._mode = mode
+
+    @staticmethod
+    def _open(name, flags, mode):
+        # The creator initializes the header, so this tries O_EXCL first to find out whether
+        # it's the creator.
+        if name is None:
+            return SharedMemory(None, O_CREX, mode), True
+        if flags & O_CREAT:
+            try:
+                return SharedMemory(name, O_CREX, mode), True
+            except ExistentialError:
+                if flags & O_EXCL:
+                    raise
+        return SharedMemory(name, 0, mode), False
+
+    @staticmethod
+    def _initialize(memory):
+        os.ftruncate(memory.fd, HEADER_WORDS * WORD_SIZE)
+        header = memory.atomic_array("i64", HEADER_WORDS)
+        # Tell processes waiting in _read_header() that the header is ready.
+        header.store(0, MAGIC)
+        header.close()
+
+    @staticmethod
+    def _read_header(memory):
+        deadline = time.monotonic() + OPEN_TIMEOUT
+        while True:
+            if memory.size >= HEADER_WORDS * WORD_SIZE:
+                array = memory.atomic_array("i64", HEADER_WORDS)
+                magic = array.load(0)
+                if magic == MAGIC:
+                    return array
+                array.close()
+                if magic:
+                    raise ValueError("The shared memory segment isn't a VersionedSegment")
+            if time.monotonic() > deadline:
+                raise ValueError("The shared memory segment was never initialized")
+            # The creator might not have set the size or the magic yet.
+            time.sleep(0.001)
+
+    def _generation_name(self, generation):
+        return "%s.%d" % (self.name, generation)
+
+    @staticmethod
+    def _slot_indices(slot):
+        # Returns the indices of the words holding the slot's generation and pins.
+        index = FIRST_SLOT + (2 * slot)
+        return index, index + 1
+
+    def _unlink_generation(self, generation):
+        try:
+            unlink_shared_memory(self._generation_name(generation))
+        except ExistentialError:
+            # Someone else got there first.
+            pass
+
+    def _unpin(self, generation, slot):
+        generation_index, pins_index = self._slot_indices(slot)
+        if (self._array.fetch_add(pins_index, -1) == 1) and (self.generation != generation):
+            # This was the last pin on a generation that has been superseded.
+            self._unlink_generation(generation)
+
+    def _publish(self, generation, slot):
+        array = self._array
+        current = array.load(CURRENT)
+        while (current >> SLOT_BITS) < generation:
+            previous = array.compare_exchange(CURRENT, current,
+                                              (generation << SLOT_BITS) | slot)
+            if previous == current:
+                break
+            current = previous
+        else:
+            # A newer generation was published while this one was being built.
+            self._discard(generation, slot)
+            return False
+
+        # The slot is current now, so the writer's pin is no longer needed to protect it.
+        array.fetch_add(self._slot_indices(slot)[1], -1)
+
+        if current:
+            # Unlink the superseded generation unless a reader has it pinned, in which case the
+            # last reader to unpin it will.
+            generation_index, pins_index = self._slot_indices(current & SLOT_MASK)
+            if array.load(pins_index) == 0:
+                self._unlink_generation(current >> SLOT_BITS)
+
+        return True
+
+    def _discard(self, generation, slot):
+        self._unlink_generation(generation)
+        generation_index, pins_index = self._slot_indices(slot)
+        self._array.compare_exchange(generation_index, generation, 0)
+        # Release the writer's pin.
+        self._array.fetch_add(pins_index, -1)
+
+    @property
+    def generation(self):
+        """The current generation (0 if nothing has been published)"""
+        return self._array.load(CURRENT) >> SLOT_BITS
+
+    def build(self, size):
+        """Returns a Draft of the next generation, a new segment of size bytes
+
+        Raises BusyError if every slot is current, pinned or being built.
+        """
+        array = self._array
+        generation = array.fetch_add(LATEST, 1) + 1
+
+        # Claim a slot that isn't current by pinning it. Nobody else can claim it while it's
+        # pinned.
+        for slot in range(SLOTS):
+            generation_index, pins_index = self._slot_indices(slot)
+            current = self.generation
+            if current and (array.load(generation_index) == current):
+                continue
+            if array.compare_exchange(pins_index, 0, 1) != 0:
+                # Readers have it pinned or another writer is building in it.
+                continue
+            # Another writer might have published the slot's generation between the check
+            # above and the pin.
+            previous = array.load(generation_index)
+            if previous and (previous == self.generation):
+                array.fetch_add(pins_index, -1)
+                continue
+            array.store(generation_index, generation)
+            break
+        else:
+            raise BusyError("%d generations are current, pinned or being built, which is the "
+                            "limit" % SLOTS)
+
+        if previous:
+            # It was probably unlinked when it was superseded or unpinned, but make sure.
+            self._unlink_generation(previous)
+
+        try:
+            return Draft(self, generation, slot, size)
+        except BaseException:
+            array.store(generation_index, 0)
+            array.fetch_add(pins_index, -1)
+            raise
+
+    def pin(self):
+        """Returns a Version for the current generation, which stays available until it's
+        released
+        """
+        array = self._array
+        while True:
+            current = array.load(CURRENT)
+            if not current:
+                raise ExistentialError("Nothing has been published")
+            generation = current >> SLOT_BITS
+            slot = current & SLOT_MASK
+            generation_index, pins_index = self._slot_indices(slot)
+            array.fetch_add(pins_index, 1)
+            if (array.load(CURRENT) == current) and \
+               (array.load(generation_index) == generation):
+                return Version(self, generation, slot)
+            # A new generation was published meanwhile.
+            self._unpin(generation, slot)
+
+    def close(self):
+        """Unmaps the VersionedSegment's header. Versions and Drafts obtained from it must be
+        released first.
+        """
+        self._array.close()
+
+    def unlink(self):
+        """Unlinks (removes) the VersionedSegment and every generation that's still around"""
+        for slot in range(SLOTS):
+            generation = self._array.load(self._slot_indices(slot)[0])
+            if generation:
+                self._unlink_generation(generation)
+        unlink_shared_memory(self.name)
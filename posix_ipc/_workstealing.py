@@ -0,0 +1,478 @@
+"""WorkStealingPool, a concurrent.futures Executor whose workers steal tasks from one another
+
+Tasks don't pass through a kernel queue. Every worker has a deque of tasks in one shared
+memory segment, and the parent submits to the deques in turn. A worker takes tasks from its
+own deque first. When that's empty it steals from the others, so a worker that draws long
+tasks doesn't hold up the short ones queued behind it. Results come back the same way, through
+a deque per worker that only the parent takes from.
+
+Each deque is a bounded Chase-Lev deque. Its owner (the one process that adds to it) writes a
+slot and then advances the bottom index. Any process takes the task at the top by copying the
+slot and then advancing the top index with a compare-and-exchange. If the exchange fails,
+another process got there first and the copy is discarded. The indices are in an AtomicArray,
+so taking a task costs a few atomic operations and no system calls.
+
+A semaphore is used only to park workers that have found no work anywhere. A worker announces
+that it's idle (by incrementing IDLE_WORKERS) and checks the deques once more before it waits
+on the semaphore. The parent checks IDLE_WORKERS after adding a task and releases the
+semaphore only if someone is waiting. Because these operations are sequentially consistent,
+either the worker sees the task or the parent sees the worker. The parent waits for results
+the same way (with PARENT_IDLE and a second semaphore).
+
+The segment is laid out as --
+
+    header                      SHUTDOWN, IDLE_WORKERS and PARENT_IDLE, a cache line each
+    per deque                   top and bottom indices (a cache line each) followed by the
+                                slots
+
+with the workers' task deques followed by their result deques. A slot holds a pickled task or
+result. One that's too big for a slot is copied to a shared memory segment (as
+MessageQueue.send_large() does) and the slot holds the segment's name.
+
+The futures, the backlog of tasks submitted by done-callbacks, shutdown and breaking are
+handled by _executor._Executor, which IPCExecutor shares.
+"""
+# Python imports
+from concurrent.futures.process import BrokenProcessPool
+import mmap
+import multiprocessing
+import os
+import pickle
+import struct
+import threading
+import time
+import traceback
+
+# Project imports
+from ._posix_ipc import SharedMemory, Semaphore, O_CREX, BusyError, ExistentialError, \
+                        SEMAPHORE_TIMEOUT_SUPPORTED, unlink_shared_memory
+from . import _large
+from ._executor import _Executor
+
+WORD_SIZE = 8
+CACHE_LINE_SIZE = 64
+WORDS_PER_LINE = CACHE_LINE_SIZE // WORD_SIZE
+
+# The header's words
+SHUTDOWN = 0
+IDLE_WORKERS = WORDS_PER_LINE
+PARENT_IDLE = 2 * WORDS_PER_LINE
+HEADER_SIZE = 3 * CACHE_LINE_SIZE
+
+# A deque's words
+TOP = 0
+BOTTOM = WORDS_PER_LINE
+CONTROL_SIZE = 2 * CACHE_LINE_SIZE
+
+# Each slot starts with its kind and the size of the pickle.
+SLOT_HEADER_FORMAT = "=II"
+SLOT_HEADER_SIZE = struct.calcsize(SLOT_HEADER_FORMAT)
+INLINE = 0
+SPILLED = 1
+
+# The number of times that an idle worker looks through every deque before it parks. It doesn't
+# spin on a machine with one CPU, where spinning only delays the process that would give it work.
+IDLE_SPINS = 16
+
+# Seconds between the result thread's checks for dead workers. This doesn't affect latency;
+# results are delivered as soon as they arrive.
+WORKER_CHECK_INTERVAL = 0.1
+
+# Seconds that a process sleeps while waiting for room in a full deque
+FULL_DEQUE_SLEEP = 0.0005
+
+# Seconds that an exiting worker waits for the parent to collect its results before it unlinks
+# its segments.
+WORKER_EXIT_TIMEOUT = 5
+
+class _Deque:
+    """A bounded Chase-Lev deque of pickles in the pool's segment"""
+    def __init__(self, memory, mapfile, offset, capacity, slot_size):
+        self._indices = memory.atomic_array("i64", CONTROL_SIZE // WORD_SIZE, offset)
+        self._mapfile = mapfile
+        self._slots = offset + CONTROL_SIZE
+        self._capacity = capacity
+        self._slot_size = slot_size
+
+    @staticmethod
+    def size_of(capacity, slot_size):
+        return CONTROL_SIZE + (capacity * slot_size)
+
+    def is_empty(self):
+        return self._indices.load(TOP) >= self._indices.load(BOTTOM)
+
+    def push(self, data):
+        """Adds data (a bytes-like object) at the bottom and returns True, or returns False if
+        the deque is full. Only the deque's owner may call this.
+        """
+        bottom = self._indices.load(BOTTOM)
+        if bottom - self._indices.load(TOP) >= self._capacity:
+            return False
+
+        offset = self._slots + ((bottom % self._capacity) * self._slot_size)
+        if len(data) <= self._slot_size - SLOT_HEADER_SIZE:
+            struct.pack_into(SLOT_HEADER_FORMAT, self._mapfile, offset, INLINE, len(data))
+            start = offset + SLOT_HEADER_SIZE
+            self._mapfile[start:start + len(data)] = data
+        else:
+            segment = _large._allocate(_large.PAYLOAD_OFFSET + len(data))
+            segment_name = segment.name.encode()
+            segment.mapfile[_large.PAYLOAD_OFFSET:_large.PAYLOAD_OFFSET + len(data)] = data
+            struct.pack_into(SLOT_HEADER_FORMAT, self._mapfile, offset, SPILLED, len(data))
+            start = offset + SLOT_HEADER_SIZE
+            self._mapfile[start:start + len(segment_name)] = segment_name
+            self._mapfile[start + len(segment_name)] = 0
+
+        # This publishes the slot. The store is sequentially consistent, so a process that sees
+        # the new bottom also sees what was written to the slot.
+        self._indices.store(BOTTOM, bottom + 1)
+        return True
+
+    def steal(self):
+        """Removes the item at the top and returns it as bytes, or returns None if the deque is
+        empty. Any process may call this.
+        """
+        while True:
+            top = self._indices.load(TOP)
+            if top >= self._indices.load(BOTTOM):
+                return None
+
+            # Copy the slot before claiming it. Once the top moves on, the owner may reuse the
+            # slot. If it has already done so, the exchange below fails and the copy (which may
+            # be garbage) is discarded.
+            offset = self._slots + ((top % self._capacity) * self._slot_size)
+            kind, size = struct.unpack_from(SLOT_HEADER_FORMAT, self._mapfile, offset)
+            start = offset + SLOT_HEADER_SIZE
+            data = self._mapfile[start:start + min(size, self._slot_size - SLOT_HEADER_SIZE)]
+
+            if self._indices.compare_exchange(TOP, top, top + 1) == top:
+                break
+
+        if kind == SPILLED:
+            segment_name = data.split(b"\0", 1)[0].decode()
+            mapfile = _large._map(segment_name)
+            data = mapfile[_large.PAYLOAD_OFFSET:_large.PAYLOAD_OFFSET + size]
+            # Hand the segment back to the process that pushed it.
+            struct.pack_into(_large.STATE_FORMAT, mapfile, 0, _large.STATE_FREE)
+
+        return data
+
+    def close(self):
+        self._indices.close()
+
+
+class _PoolMemory:
+    """The pool's shared memory segment, as seen by the parent or by a worker"""
+    def __init__(self, name, workers, capacity, slot_size, create=False):
+        deque_size = _Deque.size_of(capacity, slot_size)
+        size = HEADER_SIZE + (2 * workers * deque_size)
+        if create:
+            memory = SharedMemory(name, O_CREX, size=size)
+        else:
+            memory = SharedMemory(name)
+        self.name = memory.name
+
+        try:
+            self._mapfile = mmap.mmap(memory.fd, size)
+            self.header = memory.atomic_array("i64", HEADER_SIZE // WORD_SIZE)
+            deques = [_Deque(memory, self._mapfile, HEADER_SIZE + (i * deque_size), capacity,
+                             slot_size)
+                      for i in range(2 * workers)]
+        except BaseException:
+            if create:
+                memory.unlink()
+            raise
+        finally:
+            memory.close_fd()
+
+        self.tasks = deques[:workers]
+        self.results = deques[workers:]
+
+    def close(self):
+        for deque in self.tasks + self.results:
+            deque.close()
+        self.header.close()
+        self._mapfile.close()
+
+
+def _claim(header, counter):
+    # Claims one of the announcements counted by the counter (IDLE_WORKERS or PARENT_IDLE) and
+    # returns True, or returns False if there aren't any.
+    while True:
+        waiting = header.load(counter)
+        if waiting <= 0:
+            return False
+        if header.compare_exchange(counter, waiting, waiting - 1) == waiting:
+            return True
+
+
+def _wake_one(header, counter, semaphore):
+    # Releases the semaphore if a process has announced that it's waiting on it.
+    if _claim(header, counter):
+        semaphore.release()
+
+
+def _unannounce(header, counter):
+    # Withdraws an announcement made by a process that found something to do after all. If
+    # someone else has already claimed it, the semaphore has been (or is about to be) released
+    # and the process's next wait returns immediately, which does no harm.
+    _claim(header, counter)
+
+
+def _find_task(memory, index):
+    # Looks in the worker's own deque and then in the others'.
+    workers = len(memory.tasks)
+    for i in range(workers):
+        data = memory.tasks[(index + i) % workers].steal()
+        if data is not None:
+            return data
+    return None
+
+
+def _worker(name, index, workers, capacity, slot_size, work_name, results_name, initializer,
+            initargs):
+    memory = _PoolMemory(name, workers, capacity, slot_size)
+    work = Semaphore(work_name)
+    results_available = Semaphore(results_name)
+    results = memory.results[index]
+    header = memory.header
+
+    def send(result):
+        data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        while not results.push(data):
+            _wake_one(header, PARENT_IDLE, results_available)
+            time.sleep(FULL_DEQUE_SLEEP)
+        _wake_one(header, PARENT_IDLE, results_available)
+
+    max_spins = IDLE_SPINS if ((os.cpu_count() or 1) > 1) else 0
+
+    try:
+        if initializer is not None:
+            initializer(*initargs)
+
+        spins = 0
+        while True:
+            data = _find_task(memory, index)
+            if data is None:
+                if header.load(SHUTDOWN):
+                    # Every task was submitted before SHUTDOWN was set, so one more look is
+                    # enough to be sure that they've all been taken.
+                    data = _find_task(memory, index)
+                    if data is None:
+                        break
+                elif spins < max_spins:
+                    spins += 1
+                    continue
+                else:
+                    header.fetch_add(IDLE_WORKERS, 1)
+                    data = _find_task(memory, index)
+                    if (data is None) and not header.load(SHUTDOWN):
+                        work.acquire()
+                        continue
+                    _unannounce(header, IDLE_WORKERS)
+                    if data is None:
+                        continue
+
+            spins = 0
+            task_id, fn, args, kwargs = pickle.loads(data)
+            try:
+                result = (task_id, True, fn(*args, **kwargs))
+            except BaseException as e:
+                # Tracebacks can't be pickled, so the worker sends a formatted copy which the
+                # parent attaches to the exception (as ProcessPoolExecutor does).
+                tb = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+                result = (task_id, False, (e, tb))
+
+            try:
+                send(result)
+            except Exception as e:
+                # The result (or exception) couldn't be pickled.
+                send((task_id, False, (e, '')))
+    finally:
+        # multiprocessing ends workers with os._exit() which skips atexit handlers, so the
+        # worker has to clean up its shared memory pool itself, but not before the parent has
+        # copied the results out of it.
+        deadline = time.monotonic() + WORKER_EXIT_TIMEOUT
+        while (time.monotonic() < deadline) and \
+              not (results.is_empty() and all(segment.is_free for segment in _large._pool)):
+            _wake_one(header, PARENT_IDLE, results_available)
+            time.sleep(0.001)
+        _large._unlink_pool()
+        memory.close()
+        work.close()
+        # Let the parent know promptly that this worker is finished.
+        results_available.release()
+        results_available.close()
+
+
+class WorkStealingPool(_Executor):
+    """An Executor that runs calls in worker processes that steal work from one another
+
+    max_workers, mp_context, initializer and initargs are the same as ProcessPoolExecutor's.
+    Each worker's deque holds up to capacity tasks, and tasks and results of up to slot_size
+    bytes (pickled) are stored in the deques themselves. Tasks are handed to the workers as
+    soon as they're submitted, so their futures can't be cancelled. submit() blocks if every
+    deque is full, except when it's called from a done-callback.
+    """
+    def __init__(self, max_workers=None, mp_context=None, initializer=None, initargs=(),
+                 capacity=128, slot_size=512):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_workers <= 0:
+            raise ValueError("max_workers must be greater than 0")
+        if capacity <= 0:
+            raise ValueError("capacity must be greater than 0")
+        if slot_size < CACHE_LINE_SIZE:
+            raise ValueError("slot_size must be at least %d" % CACHE_LINE_SIZE)
+        if mp_context is None:
+            mp_context = multiprocessing.get_context()
+
+        # Keep the slots aligned to cache lines.
+        slot_size = -(-slot_size // CACHE_LINE_SIZE) * CACHE_LINE_SIZE
+
+        super().__init__()
+        # Only one thread at a time may push tasks, because the parent owns the task deques.
+        self._submit_lock = threading.Lock()
+        self._next_worker = 0
+        # True once the workers have been told to finish up
+        self._stopping = False
+
+        self._memory = _PoolMemory(None, max_workers, capacity, slot_size, create=True)
+        self._work = None
+        self._results_available = None
+        try:
+            self._work = Semaphore(None, O_CREX)
+            self._results_available = Semaphore(None, O_CREX)
+
+            # The workers are started before the result thread so that forking doesn't copy a
+            # process that has threads running.
+            for i in range(max_workers):
+                worker = mp_context.Process(target=_worker,
+                                            args=(self._memory.name, i, max_workers, capacity,
+                                                  slot_size, self._work.name,
+                                                  self._results_available.name, initializer,
+                                                  initargs))
+                worker.start()
+                self._workers.append(worker)
+        except BaseException:
+            for worker in self._workers:
+                worker.terminate()
+            for worker in self._workers:
+                worker.join()
+            self._destroy_ipc_objects()
+            raise
+
+        self._start()
+
+    def _dumps(self, task):
+        return pickle.dumps(task, pickle.HIGHEST_PROTOCOL)
+
+    def _send(self, payload, block):
+        # Hands the pickled task to the next worker whose deque has room.
+        tasks = self._memory.tasks
+        while True:
+            with self._submit_lock:
+                if self._memory.header.load(SHUTDOWN):
+                    raise RuntimeError("cannot schedule new futures after shutdown")
+                for i in range(len(tasks)):
+                    deque = tasks[self._next_worker]
+                    self._next_worker = (self._next_worker + 1) % len(tasks)
+                    if deque.push(payload):
+                        _wake_one(self._memory.header, IDLE_WORKERS, self._work)
+                        return True
+            if not block:
+                return False
+            if self._broken:
+                raise BrokenProcessPool(self._broken)
+            time.sleep(FULL_DEQUE_SLEEP)
+
+    def _stop(self, block):
+        # This happens with the lock held so that the result thread can't destroy the
+        # semaphores until it's done.
+        with self._lock:
+            if not self._broken:
+                # A task that another thread is pushing right now gets in before this.
+                with self._submit_lock:
+                    self._memory.header.store(SHUTDOWN, 1)
+                for i in range(len(self._workers)):
+                    self._work.release()
+                self._stopping = True
+                # Wake the result thread so it notices.
+                self._results_available.release()
+        return True
+
+    def _receive_results(self):
+        # Takes every result that's waiting and returns True if there were any.
+        received = False
+        for deque in self._memory.results:
+            while True:
+                data = deque.steal()
+                if data is None:
+                    break
+                received = True
+                try:
+                    task_id, succeeded, value = pickle.loads(data)
+                except Exception as e:
+                    # There's no telling which future the result belongs to.
+                    # ProcessPoolExecutor breaks the pool in this case too.
+                    self._break("A result couldn't be unpickled: %r" % e)
+                    return received
+                self._deliver(task_id, succeeded, value)
+        return received
+
+    def _wait_for_results(self):
+        header = self._memory.header
+        header.store(PARENT_IDLE, 1)
+        if self._receive_results():
+            _unannounce(header, PARENT_IDLE)
+            return
+        try:
+            if SEMAPHORE_TIMEOUT_SUPPORTED:
+                self._results_available.acquire(WORKER_CHECK_INTERVAL)
+            else:
+                # A timeout would be treated as infinite, so poll instead.
+                self._results_available.acquire(0)
+        except BusyError:
+            if not SEMAPHORE_TIMEOUT_SUPPORTED:
+                time.sleep(FULL_DEQUE_SLEEP)
+        _unannounce(header, PARENT_IDLE)
+
+    def _collect_results(self):
+        # This runs in a thread and delivers results to futures until the pool has been shut
+        # down and every future has its result. It's also responsible for cleaning up.
+        while True:
+            self._send_backlog()
+
+            self._receive_results()
+
+            with self._lock:
+                finished = self._stopping and not self._futures
+
+            if finished or self._broken:
+                break
+
+            # A worker that exits cleanly only does so after shutdown, once every task has
+            # been taken.
+            shutting_down = self._memory.header.load(SHUTDOWN)
+            if any((not worker.is_alive()) and (worker.exitcode or not shutting_down)
+                   for worker in self._workers):
+                self._break("A worker process terminated abruptly")
+                break
+
+            self._wait_for_results()
+
+        for worker in self._workers:
+            worker.join()
+
+        self._destroy_ipc_objects()
+
+    def _destroy_ipc_objects(self):
+        try:
+            unlink_shared_memory(self._memory.name)
+        except ExistentialError:
+            pass
+        self._memory.close()
+        for semaphore in (self._work, self._results_available):
+            if semaphore is not None:
+                semaphore.unlink()
+                semaphore.close()
@@ -0,0 +1,71 @@
+"""Apache Arrow tables in shared memory
+
+write_table() writes a table to a shared memory segment in the Arrow IPC streaming format and
+read_table() reads it back without copying. The table returned by read_table() refers to the
+segment's memory, so any number of processes can share one copy of a table. It's read-only;
+to change it, write a new one.
+
+This module requires pyarrow, which isn't installed with posix_ipc. Importing this module
+raises ImportError if pyarrow isn't available.
+"""
+# Python imports
+import mmap
+
+# 3rd party imports
+import pyarrow
+import pyarrow.ipc
+
+# Project imports
+from ._posix_ipc import SharedMemory, O_CREX, O_EXCL
+
+
+def _write_stream(mapfile, table):
+    # The Arrow objects that refer to the mapping go away when this returns, so that the mapping
+    # can be closed.
+    stream = pyarrow.FixedSizeBufferWriter(pyarrow.py_buffer(mapfile))
+    with pyarrow.ipc.new_stream(stream, table.schema) as writer:
+        writer.write(table)
+    stream.close()
+
+
+def write_table(name, table, flags=O_CREX, mode=0o600):
+    """Writes table (a pyarrow.Table or pyarrow.RecordBatch) to a new shared memory segment that
+    is exactly big enough to hold it and returns the segment's name. name, flags and mode have
+    the same meaning as they do for SharedMemory.
+    """
+    # Measure the stream before creating the segment so that it's the right size.
+    sink = pyarrow.MockOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write(table)
+    size = sink.size()
+
+    memory = SharedMemory(name, flags, mode, size)
+    try:
+        with mmap.mmap(memory.fd, size) as mapfile:
+            _write_stream(mapfile, table)
+    except BaseException:
+        # Don't leave a partial table behind, unless the segment was someone else's.
+        if (name is None) or (flags & O_EXCL):
+            memory.unlink()
+        raise
+    finally:
+        memory.close_fd()
+
+    return memory.name
+
+
+def read_table(name):
+    """Returns the pyarrow.Table written to the shared memory segment with the given name by
+    write_table(). The table's columns refer to the segment rather than to a copy of it. The
+    segment stays mapped as long as the table (or anything derived from it without copying)
+    exists, even if the segment is unlinked meanwhile.
+    """
+    memory = SharedMemory(name, read_only=True)
+    try:
+        mapfile = mmap.mmap(memory.fd, memory.size, access=mmap.ACCESS_READ)
+    finally:
+        memory.close_fd()
+
+    # The buffer refers to the mapping, so the mapping lasts as long as the table does.
+    reader = pyarrow.ipc.open_stream(pyarrow.BufferReader(pyarrow.py_buffer(mapfile)))
+    return reader.read_all()
@@ -0,0 +1,190 @@
+"""A concurrent.futures Executor that runs tasks in worker processes
+
+IPCExecutor is a drop-in replacement for concurrent.futures.ProcessPoolExecutor. Tasks travel
+to the workers through one MessageQueue and results come back through another, both via
+MessageQueue.send_obj(), so large arguments and results pass through shared memory rather than
+through the queues. Idle workers sleep in mq_receive() and the kernel wakes exactly one of
+them per task, so there's no feeder thread and no pipe.
+
+The futures, the backlog of tasks submitted by done-callbacks, shutdown and breaking are
+handled by _executor._Executor, which WorkStealingPool shares.
+"""
+# Python imports
+import multiprocessing
+import os
+import time
+import traceback
+
+# Project imports
+from ._posix_ipc import MessageQueue, O_CREX, Error, BusyError, ExistentialError
+from . import _large, _objects
+from ._executor import _Executor
+
+# The geometry of the task and result queues. It's kept small because RLIMIT_MSGQUEUE limits
+# the total size of a user's queues. Larger tasks and results spill into shared memory.
+QUEUE_MAX_MESSAGES = 8
+QUEUE_MAX_MESSAGE_SIZE = 1024
+
+# Seconds between the result thread's checks for dead workers. This doesn't affect latency;
+# results are delivered as soon as they arrive.
+WORKER_CHECK_INTERVAL = 0.1
+
+# Seconds that an exiting worker waits for the parent to collect the results that it sent
+# through shared memory before it unlinks its segments.
+WORKER_EXIT_TIMEOUT = 5
+
+
+def _worker(task_queue_name, result_queue_name, initializer, initargs):
+    tasks = MessageQueue(task_queue_name)
+    results = MessageQueue(result_queue_name)
+
+    try:
+        if initializer is not None:
+            initializer(*initargs)
+
+        while True:
+            task = tasks.receive_obj()
+            if task is None:
+                # Shutdown was requested. Tell the parent that this worker is done.
+                results.send_obj((None, None, os.getpid()))
+                break
+
+            task_id, fn, args, kwargs = task
+            try:
+                result = (task_id, True, fn(*args, **kwargs))
+            except BaseException as e:
+                # Tracebacks can't be pickled, so the worker sends a formatted copy which the
+                # parent attaches to the exception (as ProcessPoolExecutor does).
+                tb = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+                result = (task_id, False, (e, tb))
+
+            try:
+                results.send_obj(result)
+            except Exception as e:
+                # The result (or exception) couldn't be pickled.
+                results.send_obj((task_id, False, (e, '')))
+    finally:
+        # multiprocessing ends workers with os._exit() which skips atexit handlers, so the
+        # worker has to clean up its shared memory pool itself, but not before the parent has
+        # copied the results out of it.
+        deadline = time.monotonic() + WORKER_EXIT_TIMEOUT
+        while (time.monotonic() < deadline) and \
+              not all(segment.is_free for segment in _large._pool):
+            time.sleep(0.001)
+        _large._unlink_pool()
+        tasks.close()
+        results.close()
+
+
+class IPCExecutor(_Executor):
+    """An Executor that runs calls in a pool of worker processes
+
+    The parameters are the same as ProcessPoolExecutor's. Tasks are handed to the workers as
+    soon as they're submitted, so their futures can't be cancelled.
+    submit() blocks if the task queue is full, except when it's called from a done-callback.
+    """
+    def __init__(self, max_workers=None, mp_context=None, initializer=None, initargs=()):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_workers <= 0:
+            raise ValueError("max_workers must be greater than 0")
+        if mp_context is None:
+            mp_context = multiprocessing.get_context()
+
+        super().__init__()
+        # The number of workers that have been sent the None that tells them to exit
+        self._stopped_workers = 0
+
+        self._tasks = MessageQueue(None, O_CREX, max_messages=QUEUE_MAX_MESSAGES,
+                                   max_message_size=QUEUE_MAX_MESSAGE_SIZE)
+        try:
+            self._results = MessageQueue(None, O_CREX, max_messages=QUEUE_MAX_MESSAGES,
+                                         max_message_size=QUEUE_MAX_MESSAGE_SIZE)
+        except BaseException:
+            self._tasks.unlink()
+            self._tasks.close()
+            raise
+
+        # The workers are started before the result thread so that forking doesn't copy a
+        # process that has threads running.
+        try:
+            for i in range(max_workers):
+                worker = mp_context.Process(target=_worker,
+                                            args=(self._tasks.name, self._results.name,
+                                                  initializer, initargs))
+                worker.start()
+                self._workers.append(worker)
+        except BaseException:
+            for worker in self._workers:
+                worker.terminate()
+            self._destroy_queues()
+            raise
+
+        self._start()
+
+    def _dumps(self, task):
+        return _objects._dumps(task)
+
+    def _send(self, payload, block):
+        stream, buffers = payload
+        try:
+            _objects._send_dumped(self._tasks, stream, buffers, None if block else 0, 0)
+        except BusyError:
+            if block:
+                raise
+            return False
+        return True
+
+    def _stop(self, block):
+        # Sends a None to each worker, picking up where a previous call left off.
+        while self._stopped_workers < len(self._workers):
+            try:
+                self._tasks.send_obj(None, None if block else 0)
+            except BusyError:
+                if block:
+                    raise
+                return False
+            self._stopped_workers += 1
+        return True
+
+    def _collect_results(self):
+        # This runs in a thread and delivers results to futures until all of the workers have
+        # exited. It's also responsible for cleaning up.
+        exited = set()
+
+        while len(exited) < len(self._workers):
+            self._send_backlog()
+
+            try:
+                task_id, succeeded, value = self._results.receive_obj(WORKER_CHECK_INTERVAL)
+            except BusyError:
+                if any((worker.pid not in exited) and (not worker.is_alive())
+                       for worker in self._workers):
+                    self._break("A worker process terminated abruptly")
+                    break
+                continue
+            except Error:
+                raise
+            except Exception as e:
+                # A result couldn't be unpickled, so there's no telling which future it
+                # belongs to. ProcessPoolExecutor breaks the pool in this case too.
+                self._break("A result couldn't be unpickled: %r" % e)
+                break
+
+            if task_id is None:
+                exited.add(value)
+            else:
+                self._deliver(task_id, succeeded, value)
+
+        for worker in self._workers:
+            worker.join()
+
+        self._destroy_queues()
+
+    def _destroy_queues(self):
+        for mq in (self._tasks, self._results):
+            try:
+                mq.unlink()
+            except ExistentialError:
+                pass
+            mq.close()
@@ -0,0 +1,402 @@
+"""Counters, gauges and histograms shared between processes
+
+A Registry is a shared memory segment divided into slots, one per process. Each process
+writes only to its own slot (with atomic instructions, so threads don't need a lock either)
+and a scraper adds up the slots whenever it likes. Nobody waits for anybody, and recording a
+value is a memory write rather than a message.
+
+The segment starts with a header that describes the metrics so that processes that open the
+registry don't need to know them in advance. All values are 64 bit words --
+
+    word 0                  MAGIC, written last by the creator
+    word 1                  the number of slots
+    word 2                  the number of words in each slot
+    word 3                  the length of the schema (JSON, starting at byte SCHEMA_OFFSET)
+    word 4                  the word at which the first slot starts
+
+Each slot starts with the pid of the process that owns it (0 if it's free) followed by the
+metrics in the order given in the schema. A counter is one word, a gauge is one word (a double)
+and a histogram is HISTOGRAM_BUCKETS words of counts followed by its sum (a double). Slots
+are padded to a multiple of a cache line so that processes don't contend for cache lines.
+"""
+# Python imports
+import collections
+import collections.abc
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import weakref
+
+# Project imports
+from ._posix_ipc import SharedMemory, O_CREAT, O_EXCL, O_CREX, BusyError, ExistentialError, \
+                        unlink_shared_memory
+
+MAGIC = 0x317363697274656d   # "metrics1"
+
+WORD_SIZE = 8
+CACHE_LINE_WORDS = 8
+HEADER_WORDS = 5
+SCHEMA_OFFSET = HEADER_WORDS * WORD_SIZE
+
+KINDS = ("counter", "gauge", "histogram")
+
+# Histogram bucket i counts values v with 2 ** (i - 1 - HISTOGRAM_BUCKET_OFFSET) <= v <
+# 2 ** (i - HISTOGRAM_BUCKET_OFFSET), so the buckets span about 0.2 nanoseconds to 34 years
+# when measuring seconds. The first bucket also counts 0 and the last bucket also counts
+# everything larger.
+HISTOGRAM_BUCKETS = 64
+HISTOGRAM_BUCKET_OFFSET = 32
+HISTOGRAM_WORDS = HISTOGRAM_BUCKETS + 1
+
+# The upper bound of each histogram bucket
+BUCKET_BOUNDS = tuple(2.0 ** (i - HISTOGRAM_BUCKET_OFFSET)
+                      for i in range(HISTOGRAM_BUCKETS - 1)) + (math.inf, )
+
+# Seconds that a process opening a registry waits for its creator to finish initializing it
+OPEN_TIMEOUT = 1
+
+_WIDTHS = {"counter": 1, "gauge": 1, "histogram": HISTOGRAM_WORDS}
+
+HistogramSnapshot = collections.namedtuple("HistogramSnapshot", ("count", "sum", "buckets"))
+HistogramSnapshot.__doc__ = """A histogram's aggregate value as reported by Registry.collect()
+
+buckets is a list of (upper_bound, count) pairs for the buckets that aren't empty.
+"""
+
+# Registries that have claimed a slot in this process, so that a child process can forget its
+# parent's slot after a fork.
+_registries = weakref.WeakSet()
+
+
+def _reset_after_fork():
+    for registry in _registries:
+        registry._slot_base = None
+        registry._slot_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+_DOUBLE = struct.Struct("=d")
+_WORD = struct.Struct("=q")
+
+
+def _double_to_word(value):
+    return _WORD.unpack(_DOUBLE.pack(value))[0]
+
+
+def _word_to_double(word):
+    return _DOUBLE.unpack(_WORD.pack(word))[0]
+
+
+def _add_to_double(array, index, amount):
+    # Atomically adds amount to the double at index.
+    current = array.load(index)
+    while True:
+        new = _double_to_word(_word_to_double(current) + amount)
+        previous = array.compare_exchange(index, current, new)
+        if previous == current:
+            break
+        current = previous
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # It exists but belongs to someone else.
+        pass
+    return True
+
+
+def _bucket(value):
+    if value <= 0:
+        return 0
+    exponent = math.frexp(value)[1]
+    return min(max(exponent + HISTOGRAM_BUCKET_OFFSET, 0), HISTOGRAM_BUCKETS - 1)
+
+
+def _normalize_schema(metrics):
+    if isinstance(metrics, collections.abc.Mapping):
+        metrics = metrics.items()
+    schema = [[str(name), kind] for name, kind in metrics]
+    if not schema:
+        raise ValueError("A registry needs at least one metric")
+    for name, kind in schema:
+        if kind not in KINDS:
+            raise ValueError("The kind of a metric must be one of %s" % ', '.join(KINDS))
+    if len(set(name for name, kind in schema)) != len(schema):
+        raise ValueError("Metric names must be unique")
+    return schema
+
+
+class _Metric:
+    def __init__(self, registry, offset):
+        self._registry = registry
+        self._offset = offset
+
+    def _index(self):
+        # The index of this metric's first word in the calling process' slot
+        base = self._registry._slot_base
+        if base is None:
+            base = self._registry._claim_slot()
+        return base + self._offset
+
+
+class Counter(_Metric):
+    """A count that only goes up, e.g. of requests served"""
+    def inc(self, amount=1):
+        """Adds amount (a non-negative integer) to the counter"""
+        if amount < 0:
+            raise ValueError("Counters can't decrease")
+        self._registry._array.fetch_add(self._index(), amount)
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, e.g. the number of requests in progress"""
+    def set(self, value):
+        """Sets the gauge to value"""
+        self._registry._array.store(self._index(), _double_to_word(float(value)))
+
+    def inc(self, amount=1):
+        """Adds amount to the gauge"""
+        _add_to_double(self._registry._array, self._index(), amount)
+
+    def dec(self, amount=1):
+        """Subtracts amount from the gauge"""
+        self.inc(-amount)
+
+
+class Histogram(_Metric):
+    """A distribution of non-negative values (e.g. latencies) in power-of-2 buckets"""
+    def observe(self, value):
+        """Records value"""
+        array = self._registry._array
+        index = self._index()
+        array.fetch_add(index + _bucket(value))
+        _add_to_double(array, index + HISTOGRAM_BUCKETS, value)
+
+
+_METRIC_CLASSES = {"counter": Counter, "gauge": Gauge, "histogram": Histogram}
+
+
+class Registry:
+    """A set of metrics shared by up to slots processes
+
+    When creating a registry, metrics is a mapping (or a sequence of pairs) of metric names to
+    kinds ("counter", "gauge" or "histogram"). When opening an existing registry, it can be
+    omitted. name, flags and mode have the same meaning as they do for SharedMemory.
+    """
+    def __init__(self, name, metrics=None, slots=64, flags=0, mode=0o600):
+        if (flags & O_CREAT) and (metrics is None):
+            raise ValueError("metrics must be specified when creating a registry")
+        if slots < 1:
+            raise ValueError("slots must be at least 1")
+
+        schema = None if (metrics is None) else _normalize_schema(metrics)
+
+        memory, created = self._open(name, flags, mode)
+        try:
+            if created:
+                self._initialize(memory, schema, slots)
+            self._array = memory.atomic_array("i64")
+            self._read_header(memory)
+        except BaseException:
+            if created:
+                memory.unlink()
+            raise
+        finally:
+            memory.close_fd()
+
+        self.name = memory.name
+
+        if (schema is not None) and (schema != self._schema):
+            raise ValueError("The registry was created with different metrics")
+
+        self._offsets = {}
+        offset = 1
+        for metric_name, kind in self._schema:
+            self._offsets[metric_name] = (kind, offset)
+            offset += _WIDTHS[kind]
+
+        self._slot_base = None
+        self._slot_lock = threading.Lock()
+
+    @staticmethod
+    def _open(name, flags, mode):
+        # The creator initializes the registry, so like the C objects that keep their state in
+        # shared memory, this tries O_EXCL first to find out whether it's the creator.
+        if name is None:
+            return SharedMemory(None, O_CREX, mode), True
+        if flags & O_CREAT:
+            try:
+                return SharedMemory(name, O_CREX, mode), True
+            except ExistentialError:
+                if flags & O_EXCL:
+                    raise
+        return SharedMemory(name, 0, mode), False
+
+    @staticmethod
+    def _initialize(memory, schema, slots):
+        encoded_schema = json.dumps(schema).encode()
+        slot_words = 1 + sum(_WIDTHS[kind] for name, kind in schema)
+        slot_words = -(-slot_words // CACHE_LINE_WORDS) * CACHE_LINE_WORDS
+        first_slot = -(-(SCHEMA_OFFSET + len(encoded_schema)) //
+                       (CACHE_LINE_WORDS * WORD_SIZE)) * CACHE_LINE_WORDS
+        os.ftruncate(memory.fd, (first_slot + (slots * slot_words)) * WORD_SIZE)
+
+        header = memory.atomic_array("i64", HEADER_WORDS)
+        header.store(1, slots)
+        header.store(2, slot_words)
+        header.store(3, len(encoded_schema))
+        header.store(4, first_slot)
+        os.pwrite(memory.fd, encoded_schema, SCHEMA_OFFSET)
+        # Tell processes waiting in _read_header() that the registry is ready.
+        header.store(0, MAGIC)
+
+    def _read_header(self, memory):
+        deadline = time.monotonic() + OPEN_TIMEOUT
+        while True:
+            if (len(self._array) >= HEADER_WORDS) and (self._array.load(0) == MAGIC):
+                break
+            if (len(self._array) >= HEADER_WORDS) and self._array.load(0):
+                raise ValueError("The shared memory segment isn't a metrics registry")
+            if time.monotonic() > deadline:
+                raise ValueError("The shared memory segment was never initialized")
+            time.sleep(0.001)
+            # The creator might not have set the size yet.
+            self._array.close()
+            self._array = memory.atomic_array("i64")
+
+        self.slots = self._array.load(1)
+        self._slot_words = self._array.load(2)
+        schema_length = self._array.load(3)
+        self._first_slot = self._array.load(4)
+
+        with mmap.mmap(memory.fd, SCHEMA_OFFSET + schema_length, access=mmap.ACCESS_READ) as m:
+            self._schema = json.loads(m[SCHEMA_OFFSET:SCHEMA_OFFSET + schema_length].decode())
+
+    def _claim_slot(self):
+        # Returns the index of the first word of this process' slot, claiming one if
+        # necessary.
+        if self._slot_base is not None:
+            return self._slot_base
+
+        with self._slot_lock:
+            if self._slot_base is None:
+                self._slot_base = self._find_slot()
+                _registries.add(self)
+
+        return self._slot_base
+
+    def _find_slot(self):
+        pid = os.getpid()
+        bases = [self._first_slot + (i * self._slot_words) for i in range(self.slots)]
+
+        for base in bases:
+            if self._array.compare_exchange(base, 0, pid) == 0:
+                return base
+
+        # Take over the slot of a process that has exited. Its counters and histograms carry
+        # on from where it left off so that totals never go backwards, but its gauges are
+        # meaningless now.
+        for base in bases:
+            owner = self._array.load(base)
+            if (owner != pid) and not _is_alive(owner):
+                if self._array.compare_exchange(base, owner, pid) == owner:
+                    for metric_name, (kind, offset) in self._offsets.items():
+                        if kind == "gauge":
+                            self._array.store(base + offset, _double_to_word(0.0))
+                    return base
+
+        raise BusyError("All of the registry's slots are in use")
+
+    def _metric(self, metric_name, kind):
+        try:
+            actual_kind, offset = self._offsets[metric_name]
+        except KeyError:
+            raise KeyError("The registry has no metric named %r" % metric_name) from None
+        if actual_kind != kind:
+            raise TypeError("%r is a %s, not a %s" % (metric_name, actual_kind, kind))
+        return _METRIC_CLASSES[kind](self, offset)
+
+    @property
+    def metrics(self):
+        """A dict of the registry's metric names and kinds"""
+        return dict((name, kind) for name, kind in self._schema)
+
+    def counter(self, metric_name):
+        """Returns the Counter with the given name"""
+        return self._metric(metric_name, "counter")
+
+    def gauge(self, metric_name):
+        """Returns the Gauge with the given name"""
+        return self._metric(metric_name, "gauge")
+
+    def histogram(self, metric_name):
+        """Returns the Histogram with the given name"""
+        return self._metric(metric_name, "histogram")
+
+    def collect(self):
+        """Returns a dict of each metric's name and its value summed over all processes
+
+        Counters are ints, gauges are floats (summed over live processes only) and histograms
+        are HistogramSnapshots. Writers aren't blocked, so values that are changing during the
+        call might be counted in some metrics and not (yet) in others.
+        """
+        words = self._array.snapshot()
+
+        totals = {}
+        for metric_name, (kind, offset) in self._offsets.items():
+            if kind == "histogram":
+                totals[metric_name] = [[0] * HISTOGRAM_BUCKETS, 0.0]
+            elif kind == "gauge":
+                totals[metric_name] = 0.0
+            else:
+                totals[metric_name] = 0
+
+        for i in range(self.slots):
+            base = self._first_slot + (i * self._slot_words)
+            owner = words[base]
+            if not owner:
+                continue
+            alive = None
+            for metric_name, (kind, offset) in self._offsets.items():
+                index = base + offset
+                if kind == "counter":
+                    totals[metric_name] += words[index]
+                elif kind == "gauge":
+                    if alive is None:
+                        alive = _is_alive(owner)
+                    if alive:
+                        totals[metric_name] += _word_to_double(words[index])
+                else:
+                    buckets, total = totals[metric_name]
+                    for bucket in range(HISTOGRAM_BUCKETS):
+                        buckets[bucket] += words[index + bucket]
+                    totals[metric_name][1] = \
+                        total + _word_to_double(words[index + HISTOGRAM_BUCKETS])
+
+        for metric_name, (kind, offset) in self._offsets.items():
+            if kind == "histogram":
+                buckets, total = totals[metric_name]
+                totals[metric_name] = HistogramSnapshot(
+                    sum(buckets), total,
+                    [(bound, count) for bound, count in zip(BUCKET_BOUNDS, buckets) if count])
+
+        return totals
+
+    def close(self):
+        """Unmaps the registry. Metrics obtained from it can no longer be used."""
+        self._array.close()
+
+    def unlink(self):
+        """Unlinks (removes) the registry's shared memory segment"""
+        unlink_shared_memory(self.name)
@@ -0,0 +1,385 @@
+"""Request/response calls between local processes
+
+A Server owns a request queue with a well-known name. Each Client creates a private reply
+queue and sends requests to the server's queue, each carrying a call id and the name of the
+client's reply queue. The server calls the handler and sends the result (or the exception) to
+that reply queue, tagged with the same call id. Everything travels via
+MessageQueue.send_obj(), so large arguments and results pass through shared memory rather than
+through the queues.
+
+A Client can have several calls outstanding at once (pipelining). Replies are matched to calls
+by id, so they can arrive in any order. A client never has more calls outstanding than its
+reply queue can hold, which means that a server never waits on a well-behaved client's reply
+queue. It gives up on a reply queue that stays full for REPLY_TIMEOUT seconds so that one
+stuck client can't stall the others. A call that's abandoned (by Call.cancel(), or by a
+Client.call() that times out) no longer counts against the client's limit, and its reply is
+discarded if it arrives later. A request that can't be decoded (e.g. because it refers
+to a class that the server can't import) is logged and dropped rather than stopping the server.
+
+benchmark() (or python -m posix_ipc rpc-bench) measures the round trip time of calls to a
+server in another process.
+"""
+# Python imports
+import collections
+import collections.abc
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing
+import time
+import traceback
+
+# Project imports
+from ._posix_ipc import MessageQueue, O_CREAT, O_CREX, Error, BusyError, ExistentialError
+from . import _large
+from ._executor import _RemoteTraceback
+
+# The geometry of the request and reply queues. It's kept small because RLIMIT_MSGQUEUE limits
+# the total size of a user's queues, and every client has a reply queue. Larger requests and
+# replies spill into shared memory.
+QUEUE_MAX_MESSAGES = 8
+QUEUE_MAX_MESSAGE_SIZE = 1024
+
+# Seconds that a server waits for room in a client's reply queue before dropping the reply
+REPLY_TIMEOUT = 5
+
+# The number of reply queues that a server keeps open
+REPLY_QUEUE_CACHE_SIZE = 64
+
+_logger = logging.getLogger(__name__)
+
+
+class RemoteError(Exception):
+    """Raised by a call whose exception couldn't be sent back from the server"""
+
+
+class Server:
+    """Dispatches calls that arrive on the request queue to handlers
+
+    handlers is a mapping of names to callables, or an object whose public methods are the
+    handlers. name, flags and mode have the same meaning as they do for MessageQueue.
+    """
+    def __init__(self, name, handlers, flags=O_CREAT, mode=0o600):
+        self._requests = MessageQueue(name, flags, mode, max_messages=QUEUE_MAX_MESSAGES,
+                                      max_message_size=QUEUE_MAX_MESSAGE_SIZE)
+        self.name = self._requests.name
+        self.handlers = handlers
+        self._reply_queues = collections.OrderedDict()
+        self._shutdown = False
+
+    def _get_handler(self, method):
+        if isinstance(self.handlers, collections.abc.Mapping):
+            handler = self.handlers.get(method)
+        elif not method.startswith('_'):
+            handler = getattr(self.handlers, method, None)
+        else:
+            handler = None
+        if not callable(handler):
+            raise AttributeError("The server has no method named %r" % method)
+        return handler
+
+    def _get_reply_queue(self, name):
+        # Opening a queue is a system call, so the server keeps the most recently used ones
+        # open.
+        mq = self._reply_queues.pop(name, None)
+        if mq is None:
+            mq = MessageQueue(name, read=False)
+            if len(self._reply_queues) >= REPLY_QUEUE_CACHE_SIZE:
+                self._reply_queues.popitem(last=False)[1].close()
+        self._reply_queues[name] = mq
+        return mq
+
+    def _reply(self, reply_queue_name, reply):
+        try:
+            mq = self._get_reply_queue(reply_queue_name)
+        except ExistentialError:
+            # The client has gone away.
+            return
+        try:
+            try:
+                mq.send_obj(reply, REPLY_TIMEOUT)
+            except (BusyError, ExistentialError):
+                raise
+            except Exception as e:
+                # The result (or exception) couldn't be pickled.
+                mq.send_obj((reply[0], False, (RemoteError(repr(e)), '')), REPLY_TIMEOUT)
+        except (BusyError, ExistentialError):
+            # The client is stuck or gone. Its call will time out.
+            pass
+
+    def handle_request(self, timeout=None):
+        """Waits for one request and handles it. Raises BusyError if no request arrives
+        within the timeout.
+        """
+        try:
+            request = self._requests.receive_obj(timeout)
+        except Error:
+            # BusyError (no request arrived) or a problem with the queue itself
+            raise
+        except Exception as e:
+            # The request was received but couldn't be unpickled, so there's nobody to tell.
+            _logger.warning("Dropped a request that couldn't be decoded: %r", e)
+            return
+
+        try:
+            call_id, reply_queue_name, method, args, kwargs = request
+        except (TypeError, ValueError) as e:
+            _logger.warning("Dropped a malformed request: %r", e)
+            if isinstance(request, tuple) and (len(request) >= 2) and \
+               isinstance(request[1], str):
+                # The client can be told.
+                self._reply(request[1], (request[0], False,
+                                         (RemoteError("Malformed request: %s" % e), '')))
+            return
+
+        try:
+            reply = (call_id, True, self._get_handler(method)(*args, **kwargs))
+        except Exception as e:
+            # Tracebacks can't be pickled, so the server sends a formatted copy which the
+            # client attaches to the exception.
+            tb = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+            reply = (call_id, False, (e, tb))
+        self._reply(reply_queue_name, reply)
+
+    def serve_forever(self, poll_interval=0.5):
+        """Handles requests until shutdown() is called. shutdown() can be called from another
+        thread or from a handler, and takes effect within poll_interval seconds.
+        """
+        self._shutdown = False
+        while not self._shutdown:
+            try:
+                self.handle_request(poll_interval)
+            except BusyError:
+                pass
+
+    def shutdown(self):
+        """Stops serve_forever()"""
+        self._shutdown = True
+
+    def close(self):
+        """Closes the server's queues. Call unlink() first to remove the request queue."""
+        while self._reply_queues:
+            self._reply_queues.popitem()[1].close()
+        self._requests.close()
+
+    def unlink(self):
+        """Unlinks (removes) the request queue"""
+        self._requests.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Call:
+    """A call in progress, as returned by Client.submit()"""
+    def __init__(self, client, call_id):
+        self._client = client
+        self._call_id = call_id
+        self._done = False
+        self._cancelled = False
+        self._succeeded = None
+        self._value = None
+
+    def _set_reply(self, succeeded, value):
+        self._done = True
+        self._succeeded = succeeded
+        self._value = value
+
+    def done(self):
+        """Returns True if the reply has arrived or the call was cancelled"""
+        if not (self._done or self._cancelled):
+            self._client._collect_replies()
+        return self._done or self._cancelled
+
+    def cancel(self):
+        """Abandons the call so that it no longer counts against the Client's limit on
+        outstanding calls. Its reply is discarded if it arrives later. Returns False if the
+        reply has already arrived, otherwise True.
+        """
+        if self._done:
+            return False
+        self._cancelled = True
+        self._client._pending.pop(self._call_id, None)
+        return True
+
+    def cancelled(self):
+        """Returns True if the call was cancelled"""
+        return self._cancelled
+
+    def result(self, timeout=None):
+        """Waits for the reply and returns the result or raises the exception that the
+        handler raised. Raises BusyError if the reply doesn't arrive within the timeout, in
+        which case result() can be called again, or the call can be cancelled. Raises
+        concurrent.futures.CancelledError if the call was cancelled.
+        """
+        if self._cancelled:
+            raise concurrent.futures.CancelledError()
+        deadline = None if (timeout is None) else (time.monotonic() + timeout)
+        while not self._done:
+            remaining = None if (deadline is None) else max(deadline - time.monotonic(), 0)
+            try:
+                self._client._receive_reply(remaining)
+            except BusyError:
+                raise BusyError("The call timed out") from None
+
+        if self._succeeded:
+            return self._value
+        exception, tb = self._value
+        if tb:
+            exception.__cause__ = _RemoteTraceback(tb)
+        raise exception
+
+
+class Client:
+    """Calls handlers in the Server whose request queue has the given name
+
+    timeout is the default timeout (in seconds) for call(). A Client isn't thread-safe; give
+    each thread its own.
+    """
+    def __init__(self, name, timeout=None):
+        self.timeout = timeout
+        self._requests = MessageQueue(name, read=False)
+        try:
+            self._replies = MessageQueue(None, O_CREX, max_messages=QUEUE_MAX_MESSAGES,
+                                         max_message_size=QUEUE_MAX_MESSAGE_SIZE)
+        except BaseException:
+            self._requests.close()
+            raise
+        self._call_ids = itertools.count()
+        # Calls (by id) whose replies haven't been received yet
+        self._pending = {}
+
+    def _receive_reply(self, timeout):
+        call_id, succeeded, value = self._replies.receive_obj(timeout)
+        # A reply to a cancelled call isn't pending, so it's dropped here.
+        call = self._pending.pop(call_id, None)
+        if call is not None:
+            call._set_reply(succeeded, value)
+
+    def _collect_replies(self):
+        while self._pending:
+            try:
+                self._receive_reply(0)
+            except BusyError:
+                break
+
+    def submit(self, method, *args, **kwargs):
+        """Sends a request to call the named handler and returns a Call without waiting for the
+        reply
+        """
+        # Leave room in the reply queue for every outstanding call so that the server never
+        # has to wait for it.
+        deadline = None if (self.timeout is None) else (time.monotonic() + self.timeout)
+        while len(self._pending) >= self._replies.max_messages:
+            remaining = None if (deadline is None) else max(deadline - time.monotonic(), 0)
+            try:
+                self._receive_reply(remaining)
+            except BusyError:
+                raise BusyError("Too many calls are outstanding") from None
+
+        call_id = next(self._call_ids)
+        call = Call(self, call_id)
+        self._requests.send_obj((call_id, self._replies.name, method, args, kwargs),
+                                self.timeout)
+        self._pending[call_id] = call
+        return call
+
+    def call(self, method, *args, **kwargs):
+        """Calls the named handler and returns its result, waiting no longer than the
+        Client's timeout. A call that times out is cancelled.
+        """
+        call = self.submit(method, *args, **kwargs)
+        try:
+            return call.result(self.timeout)
+        except BusyError:
+            call.cancel()
+            raise
+
+    def close(self):
+        """Removes the Client's reply queue and closes its queues"""
+        self._pending.clear()
+        self._replies.unlink()
+        self._replies.close()
+        self._requests.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _echo(data):
+    return data
+
+
+def _benchmark_server(name):
+    handlers = {"echo": _echo}
+    server = Server(name, handlers, 0)
+    handlers["stop"] = server.shutdown
+    try:
+        server.serve_forever()
+    finally:
+        server.close()
+        # multiprocessing ends the process with os._exit() which skips atexit handlers. The
+        # client has already received every reply, so the segments can go.
+        _large._unlink_pool()
+
+
+def benchmark(calls=10000, size=0, pipeline=1, mp_context=None):
+    """Measures calls to a server in another process that echoes a bytearray of size bytes
+    back to the caller, with up to pipeline calls outstanding at once. Returns a dict with the
+    mean, median and 99th percentile round trip times in microseconds and the number of calls
+    per second.
+    """
+    if (calls <= 0) or (pipeline <= 0) or (size < 0):
+        raise ValueError("calls and pipeline must be greater than 0 and size can't be negative")
+    if mp_context is None:
+        mp_context = multiprocessing.get_context()
+
+    server = Server(None, {}, O_CREX)
+    process = None
+    try:
+        process = mp_context.Process(target=_benchmark_server, args=(server.name, ))
+        process.start()
+        with Client(server.name) as client:
+            data = bytearray(size)
+            for i in range(min(calls, 100)):
+                client.call("echo", data)
+
+            latencies = []
+            started = time.perf_counter()
+            remaining = calls
+            while remaining:
+                batch = min(remaining, pipeline)
+                batch_started = time.perf_counter()
+                pending = [client.submit("echo", data) for i in range(batch)]
+                for call in pending:
+                    call.result()
+                    latencies.append(time.perf_counter() - batch_started)
+                remaining -= batch
+            elapsed = time.perf_counter() - started
+
+            client.call("stop")
+    except BaseException:
+        if process is not None:
+            process.terminate()
+        raise
+    finally:
+        server.unlink()
+        server.close()
+        if process is not None:
+            process.join()
+
+    latencies.sort()
+    return {"calls": calls,
+            "size": size,
+            "pipeline": pipeline,
+            "mean_us": sum(latencies) / len(latencies) * 1e6,
+            "median_us": latencies[len(latencies) // 2] * 1e6,
+            "p99_us": latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1e6,
+            "calls_per_second": calls / elapsed,
+            }
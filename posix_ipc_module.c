@@ -55,9 +55,24 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #include <sys/stat.h>
 #include <sys/mman.h>
 
+// For the state that RobustLock and Barrier keep in shared memory
+#include <stdint.h>
+
+#ifdef FUTEX_EXISTS
+// For Barrier
+#include <sys/syscall.h>
+#include <linux/futex.h>
+#endif
+
 #ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
 // For msg queues
 #include <mqueue.h>
+// For RLIMIT_MSGQUEUE
+#include <sys/resource.h>
+#ifdef MESSAGE_QUEUE_POLL_EXISTS
+// For wait_any() and receive_any()
+#include <poll.h>
+#endif
 #endif
 
 /* POSIX says that a mode_t "shall be an integer type". To avoid the need
@@ -71,6 +86,11 @@ typedef struct {
     char *name;
     long mode;
     sem_t *pSemaphore;
+    // The maximum number of times that acquire() polls the semaphore before
+    // it blocks, and the (adaptively tuned) number that it actually uses.
+    // See semaphore_spin().
+    long spin;
+    long spin_average;
 } Semaphore;
 
 
@@ -79,8 +99,127 @@ typedef struct {
     char *name;
     long mode;
     int fd;
+    char read_only;
 } SharedMemory;
 
+/* An AtomicArray is a view of integers in a shared memory segment that are
+   read and modified with atomic instructions. It's created by
+   SharedMemory.atomic_array(). All arithmetic is done on the unsigned
+   representation of the values, which gives two's complement wraparound for
+   signed types too.
+*/
+typedef struct {
+    const char *name;
+    // The format character used by memoryview/struct for this type
+    const char *format;
+    int itemsize;
+    int is_signed;
+} AtomicDtype;
+
+typedef struct {
+    PyObject_HEAD
+    const AtomicDtype *dtype;
+    // The mapping starts at a page boundary, so the first element is
+    // usually somewhere inside it.
+    void *mapping;
+    size_t mapping_size;
+    char *data;
+    Py_ssize_t length;
+    int read_only;
+} AtomicArray;
+
+/* Some objects (e.g. RobustLock and Barrier) keep their state in a small shared memory
+   segment. The state always begins with a uint32_t that's zero until the
+   process that created the segment has initialized the rest of the state, at
+   which point it's set to a value that identifies the type of object. See
+   open_shared_state().
+*/
+#define SHARED_STATE_WAIT_MILLISECONDS  1000
+
+#ifdef ROBUST_MUTEX_EXISTS
+#define ROBUST_LOCK_MAGIC   0x726c636bU     // "rlck"
+
+typedef struct {
+    uint32_t magic;
+    pthread_mutex_t mutex;
+} RobustLockState;
+
+typedef struct {
+    PyObject_HEAD
+    char *name;
+    long mode;
+    RobustLockState *state;
+    int owner_died;
+    // The number of this process's threads blocked in acquire(). They've
+    // released the GIL, so close() mustn't unmap the state under them.
+    Py_ssize_t waiters;
+    // True while a thread holds the mutex via this object's mapping. The
+    // mutex is on that thread's robust list, which glibc and the kernel walk,
+    // so the mapping mustn't go away while it's held.
+    int held;
+} RobustLock;
+#endif
+
+#ifdef FUTEX_EXISTS
+#define BARRIER_MAGIC       0x62617272U     // "barr"
+
+// The low bit of a barrier's phase is set when the barrier is broken. The
+// rest of the phase counts the number of times that the barrier has tripped.
+#define BARRIER_BROKEN      1U
+#define BARRIER_PHASE_STEP  2U
+
+typedef struct {
+    uint32_t magic;
+    uint32_t parties;
+    // The number of processes that have arrived in the current phase
+    uint32_t count;
+    // The futex that waiting processes sleep on
+    uint32_t phase;
+} BarrierState;
+
+typedef struct {
+    PyObject_HEAD
+    char *name;
+    long mode;
+    BarrierState *state;
+    // The number of this process's threads blocked in wait(). They've
+    // released the GIL, so close() mustn't unmap the state under them.
+    Py_ssize_t waiters;
+} Barrier;
+#endif
+
+#ifdef UNNAMED_SEMAPHORE_EXISTS
+/* A SemaphoreArray is a header followed by unnamed (sem_init()) semaphores
+   in a region of a shared memory segment. Like the state of a RobustLock or
+   Barrier, the header begins with a uint32_t that's zero until the
+   semaphores have been initialized. The first process to attach claims the
+   job of initializing them by changing it to SEMAPHORE_ARRAY_INITIALIZING.
+*/
+#define SEMAPHORE_ARRAY_MAGIC           0x73656d61U     // "sema"
+#define SEMAPHORE_ARRAY_INITIALIZING    1U
+// The header is padded to a cache line, which also aligns the semaphores.
+#define SEMAPHORE_ARRAY_HEADER_SIZE     64
+
+typedef struct {
+    uint32_t magic;
+    uint32_t count;
+} SemaphoreArrayHeader;
+
+typedef struct {
+    PyObject_HEAD
+    // The mapping starts at a page boundary, so the header is usually
+    // somewhere inside it.
+    void *mapping;
+    size_t mapping_size;
+    sem_t *semaphores;
+    Py_ssize_t count;
+    Py_ssize_t offset;
+    // The number of this process's threads blocked in acquire(). They've
+    // released the GIL, so close() mustn't unmap the semaphores under them.
+    Py_ssize_t waiters;
+} SemaphoreArray;
+#endif
+
 
 #ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
 typedef struct {
@@ -94,6 +233,8 @@ typedef struct {
     int receive_permitted;
     PyObject *notification_callback;
     PyObject *notification_callback_param;
+    // The codec that compresses messages (see posix_ipc/_codecs.py), or NULL
+    PyObject *codec;
     // In the event that the user requests notifications in a new thread,
     // I'll need a reference to the interpreter in order to create the
     // thread for the callback. See request_notification() and
@@ -138,6 +279,37 @@ typedef struct {
 } NoneableName;
 
 
+/* Struct to contain a message queue max_messages or max_message_size which
+   can be "auto" */
+typedef struct {
+    int is_auto;
+    long value;
+} AutoableLong;
+
+
+#ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
+/* Struct to contain the system's message queue limits. Values that can't be
+   determined on this platform are -1. */
+typedef struct {
+    long max_messages;
+    long max_message_size;
+    long max_queues;
+    long default_max_messages;
+    long default_max_message_size;
+    long rlimit_msgqueue;
+} MessageQueueLimits;
+
+// Under Linux, each queue is charged against RLIMIT_MSGQUEUE like so --
+//    max_messages * sizeof(struct msg_msg) +
+//    min(max_messages, HARD_MSGMAX) * sizeof(struct posix_msg_tree_node) +
+//    max_messages * max_message_size
+// The kernel structs aren't visible from userland, so this is a (generous)
+// estimate of the per-message overhead used when choosing "auto" geometry.
+// ref: https://man7.org/linux/man-pages/man2/getrlimit.2.html
+#define QUEUE_MESSAGE_OVERHEAD_ESTIMATE  128
+#endif
+
+
 /*
       Exceptions for this module
 */
@@ -147,16 +319,83 @@ static PyObject *pPermissionsException;
 static PyObject *pSignalException;
 static PyObject *pExistentialException;
 static PyObject *pBusyException;
+static PyObject *pBrokenBarrierException;
 
 
 #define ONE_BILLION 1000000000
 
+// CPU_RELAX() tells the CPU that it's in a spin loop, which saves power and
+// lets a hyperthread sibling make progress.
+#if defined(__x86_64__) || defined(__i386__)
+#define CPU_RELAX() __asm__ __volatile__("pause")
+#elif defined(__aarch64__) || defined(__arm__)
+#define CPU_RELAX() __asm__ __volatile__("yield")
+#else
+#define CPU_RELAX()
+#endif
+
+// The number of polls that an adaptive spin always allows itself beyond
+// twice its running average, so that the average can grow.
+#define SPIN_MARGIN  10
+
 #ifdef POSIX_IPC_DEBUG
 #define DPRINTF(fmt, args...) fprintf(stderr, "+++ " fmt, ## args)
 #else
 #define DPRINTF(fmt, args...)
 #endif
 
+/* USDT (statically defined tracing) probes for perf, bpftrace, SystemTap,
+   etc. Each probe is a single nop until a tracer attaches to it. Each probe
+   also has a semaphore which is non-zero while a tracer is attached, so
+   arguments that are costly to compute (e.g. elapsed times) are computed
+   only when someone is listening.
+*/
+#ifdef USDT_PROBES_EXIST
+#define _SDT_HAS_SEMAPHORES 1
+#include <sys/sdt.h>
+
+#define USDT_SEMAPHORE(probe) \
+    unsigned short posix_ipc_##probe##_semaphore __attribute__((unused)) \
+                                                 __attribute__((section(".probes")))
+#define USDT_IS_ENABLED(probe) __builtin_expect(posix_ipc_##probe##_semaphore, 0)
+
+#define USDT_PROBE1(probe, a) DTRACE_PROBE1(posix_ipc, probe, a)
+#define USDT_PROBE2(probe, a, b) DTRACE_PROBE2(posix_ipc, probe, a, b)
+#define USDT_PROBE3(probe, a, b, c) DTRACE_PROBE3(posix_ipc, probe, a, b, c)
+#define USDT_PROBE5(probe, a, b, c, d, e) DTRACE_PROBE5(posix_ipc, probe, a, b, c, d, e)
+
+#define USDT_START_TIMER(probe, started) \
+    (started) = USDT_IS_ENABLED(probe) ? monotonic_ns() : 0
+#define USDT_ELAPSED_NS(started) ((started) ? (monotonic_ns() - (started)) : 0)
+
+USDT_SEMAPHORE(semaphore__acquire__entry);
+USDT_SEMAPHORE(semaphore__acquire__return);
+USDT_SEMAPHORE(semaphore__release__entry);
+USDT_SEMAPHORE(semaphore__release__return);
+USDT_SEMAPHORE(message_queue__send__entry);
+USDT_SEMAPHORE(message_queue__send__return);
+USDT_SEMAPHORE(message_queue__receive__entry);
+USDT_SEMAPHORE(message_queue__receive__return);
+USDT_SEMAPHORE(message_queue__notification__entry);
+USDT_SEMAPHORE(message_queue__notification__return);
+
+static unsigned long long
+monotonic_ns(void) {
+    struct timespec now;
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+
+    return ((unsigned long long)now.tv_sec * ONE_BILLION) + now.tv_nsec;
+}
+#else
+#define USDT_PROBE1(probe, a)
+#define USDT_PROBE2(probe, a, b)
+#define USDT_PROBE3(probe, a, b, c)
+#define USDT_PROBE5(probe, a, b, c, d, e)
+
+#define USDT_START_TIMER(probe, started) (void)(started)
+#endif
+
 static char *
 bytes_to_c_string(PyObject* o, int lock) {
 /* Convert a bytes object to a char *. Optionally lock the buffer if it is a
@@ -343,11 +582,141 @@ int convert_timeout(PyObject *py_timeout, void *converted_timeout) {
     return rc;
 }
 
+static size_t
+page_size(void) {
+    // Returns the page size of the machine this is running on, which can differ from the
+    // PAGE_SIZE of the machine it was built on (e.g. 16K or 64K pages on some ARM systems).
+    static size_t size = 0;
+    long rc;
+
+    if (!size) {
+        rc = sysconf(_SC_PAGESIZE);
+        size = (rc > 0) ? (size_t)rc : (size_t)PAGE_SIZE;
+    }
+
+    return size;
+}
+
+static int
+convert_autoable_long(PyObject *py_value, void *converted_value) {
+    // Converts a PyObject into an AutoableLong if possible. The PyObject
+    // should be an integer or the string "auto". When this function returns,
+    // if the AutoableLong's is_auto is true, then value is undefined.
+    int rc = 0;
+    AutoableLong *p_value = (AutoableLong *)converted_value;
+
+    p_value->is_auto = 0;
+
+    if (PyUnicode_Check(py_value)) {
+        if (0 == PyUnicode_CompareWithASCIIString(py_value, "auto")) {
+            rc = 1;
+            p_value->is_auto = 1;
+        }
+        else
+            PyErr_SetString(PyExc_ValueError, "The only string value permitted is \"auto\"");
+    }
+    else if (PyIndex_Check(py_value)) {
+        // PyNumber_Index() accepts anything with __index__ (e.g. NumPy integers), as
+        // PyArg_ParseTuple's "l" format does.
+        PyObject *py_index = PyNumber_Index(py_value);
+        if (py_index) {
+            p_value->value = PyLong_AsLong(py_index);
+            Py_DECREF(py_index);
+            if (!PyErr_Occurred())
+                rc = 1;
+        }
+    }
+    else
+        PyErr_SetString(PyExc_TypeError, "The value must be an integer or \"auto\"");
+
+    return rc;
+}
+
 static PyObject *
 generic_str(char *name) {
     return PyUnicode_FromString(name ? name : "(no name)");
 }
 
+static PyObject *
+call_python_implementation(const char *module_name, const char *function_name,
+                           PyObject *self, PyObject *args, PyObject *keywords) {
+    // A few methods are mostly bookkeeping rather than system calls, so
+    // they're written in Python (in the posix_ipc package). The C method is
+    // a thin wrapper that calls module_name.function_name(self, *args, **keywords).
+    PyObject *py_module = NULL;
+    PyObject *py_function = NULL;
+    PyObject *py_args = NULL;
+    PyObject *py_item;
+    PyObject *py_result = NULL;
+    Py_ssize_t i;
+    Py_ssize_t arg_count;
+
+    if (!(py_module = PyImport_ImportModule(module_name)))
+        goto error_return;
+
+    if (!(py_function = PyObject_GetAttrString(py_module, function_name)))
+        goto error_return;
+
+    arg_count = args ? PyTuple_GET_SIZE(args) : 0;
+
+    if (!(py_args = PyTuple_New(arg_count + 1)))
+        goto error_return;
+
+    Py_INCREF(self);
+    PyTuple_SET_ITEM(py_args, 0, self);
+
+    for (i = 0; i < arg_count; i++) {
+        py_item = PyTuple_GET_ITEM(args, i);
+        Py_INCREF(py_item);
+        PyTuple_SET_ITEM(py_args, i + 1, py_item);
+    }
+
+    py_result = PyObject_Call(py_function, py_args, keywords);
+
+    error_return:
+    Py_XDECREF(py_args);
+    Py_XDECREF(py_function);
+    Py_XDECREF(py_module);
+
+    return py_result;
+}
+
+
+static PyObject *
+reduce_handle(const char *kind, const char *name, PyObject *py_options) {
+    // Semaphores, SharedMemory and MessageQueues pickle as their name plus
+    // a few options. Unpickling calls posix_ipc._handles.reopen(kind, name,
+    // options), which reuses a handle that this process already has open
+    // if it can. Steals the reference to py_options.
+    PyObject *py_module = NULL;
+    PyObject *py_reopen = NULL;
+    PyObject *py_result = NULL;
+
+    if (!py_options)
+        goto error_return;
+
+    if (!name) {
+        PyErr_Format(PyExc_TypeError, "Can't pickle an uninitialized %s", kind);
+        goto error_return;
+    }
+
+    if (!(py_module = PyImport_ImportModule("posix_ipc._handles")))
+        goto error_return;
+
+    if (!(py_reopen = PyObject_GetAttrString(py_module, "reopen")))
+        goto error_return;
+
+    py_result = Py_BuildValue("(O(ssO))", py_reopen, kind, name, py_options);
+
+    error_return:
+    Py_XDECREF(py_options);
+    Py_XDECREF(py_reopen);
+    Py_XDECREF(py_module);
+
+    return py_result;
+}
+
+
 static void
 mode_to_str(long mode, char *mode_str) {
     // Given a numeric mode and preallocated string space, populates the
@@ -464,6 +833,8 @@ Semaphore_init(Semaphore *self, PyObject *args, PyObject *keywords) {
     self->pSemaphore = SEM_FAILED;
     self->name = NULL;
     self->mode = 0600;
+    self->spin = 0;
+    self->spin_average = 0;
 
     // Semaphore(name, [flags = 0, [mode = 0600, [initial_value = 0]]])
 
@@ -578,10 +949,18 @@ Semaphore_init(Semaphore *self, PyObject *args, PyObject *keywords) {
 
 static PyObject *
 Semaphore_release(Semaphore *self) {
+    int rc;
+
     if (!test_semaphore_validity(self))
         goto error_return;
 
-    if (-1 == sem_post(self->pSemaphore)) {
+    USDT_PROBE1(semaphore__release__entry, self->name);
+
+    rc = sem_post(self->pSemaphore);
+
+    USDT_PROBE2(semaphore__release__return, self->name, (-1 == rc) ? errno : 0);
+
+    if (-1 == rc) {
         switch (errno) {
             case EINVAL:
             case EBADF:
@@ -603,31 +982,66 @@ Semaphore_release(Semaphore *self) {
 }
 
 
-static PyObject *
-Semaphore_acquire(Semaphore *self, PyObject *args, PyObject *keywords) {
-    NoneableTimeout timeout;
-    int rc = 0;
-    static char *keyword_list[] = {"timeout", NULL};
+static int
+semaphore_spin(Semaphore *self, long spin) {
+    // Polls the semaphore with sem_trywait() up to a limit, pausing between
+    // polls. Returns 1 if the semaphore was acquired, 0 if the caller has to
+    // block after all.
+    // The limit adapts the way glibc's adaptive mutexes do -- it's twice
+    // the running average of the number of polls that recent spins needed
+    // (plus a margin), but never more than spin. A spin that fails counts as
+    // having needed the whole limit, so the limit grows until spinning pays
+    // off or spin is reached, and it shrinks when the semaphore tends to be
+    // available quickly.
+    // On a uniprocessor, the process that would release the semaphore can't
+    // run while this one spins, so there's no spinning at all.
+    // The caller must not hold the GIL.
+    static long n_cpus = 0;
+    long limit;
+    long i;
+    int acquired = 0;
+
+    if (!n_cpus)
+        n_cpus = sysconf(_SC_NPROCESSORS_ONLN);
+    if (n_cpus == 1)
+        return 0;
+
+    limit = (self->spin_average * 2) + SPIN_MARGIN;
+    if (limit > spin)
+        limit = spin;
+
+    for (i = 0; i < limit; i++) {
+        if (0 == sem_trywait(self->pSemaphore)) {
+            acquired = 1;
+            break;
+        }
+        if (EAGAIN != errno)
+            // e.g. EINTR or EINVAL. Let the blocking call sort it out.
+            break;
+        CPU_RELAX();
+    }
 
-    if (!test_semaphore_validity(self))
-        goto error_return;
+    self->spin_average += (i - self->spin_average) / 8;
 
-    // Initialize this to the default of None.
-    timeout.is_none = 1;
+    return acquired;
+}
 
-    // acquire([timeout=None])
 
-    if (!PyArg_ParseTupleAndKeywords(args, keywords, "|O&", keyword_list,
-                                     convert_timeout, &timeout))
-        goto error_return;
+static int
+semaphore_wait(sem_t *semaphore, NoneableTimeout *timeout) {
+    // Waits for the semaphore according to the timeout. Returns the return
+    // code of the sem_xxx() call, so -1 means that errno says why it failed.
+    // The caller must not hold the GIL. Semaphore.acquire() and
+    // SemaphoreArray.acquire() share this so that their timeouts behave
+    // identically.
+    int rc;
 
-    Py_BEGIN_ALLOW_THREADS
     // timeout == None: no timeout, i.e. wait forever.
     // timeout == 0: raise an error if a wait would occur.
     // timeout  > 0: wait no longer than t seconds before raising an error.
-    if (timeout.is_none) {
+    if (timeout->is_none) {
         DPRINTF("calling sem_wait()\n");
-        rc = sem_wait(self->pSemaphore);
+        rc = sem_wait(semaphore);
     }
     else {
         // Timeout is not None (i.e. is numeric)
@@ -635,9 +1049,9 @@ Semaphore_acquire(Semaphore *self, PyObject *args, PyObject *keywords) {
         // sem_trywait() so I call that instead. Doing so makes it easier
         // to ensure this code behaves consistently regardless of whether
         // or not sem_timedwait() is available.
-        if (timeout.is_zero) {
+        if (timeout->is_zero) {
             DPRINTF("calling sem_trywait()\n");
-            rc = sem_trywait(self->pSemaphore);
+            rc = sem_trywait(semaphore);
         }
         else {
             // timeout is not None and is > 0.0
@@ -646,65 +1060,127 @@ Semaphore_acquire(Semaphore *self, PyObject *args, PyObject *keywords) {
 #ifdef SEM_TIMEDWAIT_EXISTS
             DPRINTF("calling sem_timedwait()\n");
             DPRINTF("timeout tv_sec = %ld; timeout tv_nsec = %ld\n",
-                    timeout.timestamp.tv_sec, timeout.timestamp.tv_nsec);
+                    timeout->timestamp.tv_sec, timeout->timestamp.tv_nsec);
 
-            rc = sem_timedwait(self->pSemaphore, &(timeout.timestamp));
+            rc = sem_timedwait(semaphore, &(timeout->timestamp));
 #else
             DPRINTF("calling sem_wait()\n");
-            rc = sem_wait(self->pSemaphore);
+            rc = sem_wait(semaphore);
 #endif
         }
     }
-    Py_END_ALLOW_THREADS
 
-    if (-1 == rc) {
-        DPRINTF("sem_wait() rc = %d, errno = %d\n", rc, errno);
+    return rc;
+}
 
-        switch (errno) {
-            case EBADF:
-            case EINVAL:
-                // Linux documentation says that EINVAL has two meanings --
-                // 1) self->pSemaphore no longer points to a valid semaphore
-                // 2) timeout is < 0 or > one billion.
-                // Since my code above guards against out-of-range
-                // timeout values, I expect the second condition is
-                // impossible here.
-                PyErr_SetString(pExistentialException,
-                                "The semaphore does not exist");
-            break;
 
-            case EINTR:
-                /* If the signal was generated by Ctrl-C, calling
-                PyErr_CheckSignals() here has the side effect of setting
-                Python's error indicator. Otherwise there's a good chance
-                it won't be set.
-                http://groups.google.com/group/comp.lang.python/browse_thread/thread/ada39e984dfc3da6/fd6becbdce91a6be?#fd6becbdce91a6be
-                */
-                PyErr_CheckSignals();
+static void
+set_semaphore_wait_error(void) {
+    // Sets the Python exception that corresponds to the errno left by a
+    // failed call to semaphore_wait().
+    switch (errno) {
+        case EBADF:
+        case EINVAL:
+            // Linux documentation says that EINVAL has two meanings --
+            // 1) the semaphore pointer no longer points to a valid semaphore
+            // 2) timeout is < 0 or > one billion.
+            // Since my code guards against out-of-range timeout values,
+            // I expect the second condition is impossible here.
+            PyErr_SetString(pExistentialException,
+                            "The semaphore does not exist");
+        break;
+
+        case EINTR:
+            /* If the signal was generated by Ctrl-C, calling
+            PyErr_CheckSignals() here has the side effect of setting
+            Python's error indicator. Otherwise there's a good chance
+            it won't be set.
+            http://groups.google.com/group/comp.lang.python/browse_thread/thread/ada39e984dfc3da6/fd6becbdce91a6be?#fd6becbdce91a6be
+            */
+            PyErr_CheckSignals();
+
+            if (!(PyErr_Occurred() &&
+                  PyErr_ExceptionMatches(PyExc_KeyboardInterrupt))
+               ) {
+                PyErr_Clear();
+                PyErr_SetString(pSignalException,
+                                "The wait was interrupted by a signal");
+            }
+            // else
+                // If KeyboardInterrupt error is set, I propogate that
+                // up to the caller.
+        break;
+
+        case EAGAIN:
+        case ETIMEDOUT:
+            PyErr_SetString(pBusyException,
+                            "Semaphore is busy");
+        break;
+
+        default:
+            PyErr_SetFromErrno(PyExc_OSError);
+        break;
+    }
+}
 
-                if (!(PyErr_Occurred() &&
-                      PyErr_ExceptionMatches(PyExc_KeyboardInterrupt))
-                   ) {
-                    PyErr_Clear();
-                    PyErr_SetString(pSignalException,
-                                    "The wait was interrupted by a signal");
-                }
-                // else
-                    // If KeyboardInterrupt error is set, I propogate that
-                    // up to the caller.
-            break;
 
-            case EAGAIN:
-            case ETIMEDOUT:
-                PyErr_SetString(pBusyException,
-                                "Semaphore is busy");
-            break;
+static PyObject *
+Semaphore_acquire(Semaphore *self, PyObject *args, PyObject *keywords) {
+    NoneableTimeout timeout;
+    int rc = 0;
+    unsigned long long started = 0;
+    PyObject *py_spin = Py_None;
+    long spin;
+    int spun = 0;
+    static char *keyword_list[] = {"timeout", "spin", NULL};
 
-            default:
-                PyErr_SetFromErrno(PyExc_OSError);
-            break;
+    if (!test_semaphore_validity(self))
+        goto error_return;
+
+    // Initialize this to the default of None.
+    timeout.is_none = 1;
+
+    // acquire([timeout=None, [spin=None]])
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "|O&O", keyword_list,
+                                     convert_timeout, &timeout, &py_spin))
+        goto error_return;
+
+    // spin == None means use the semaphore's spin attribute.
+    if (Py_None == py_spin)
+        spin = self->spin;
+    else {
+        spin = PyLong_AsLong(py_spin);
+        if ((-1 == spin) && PyErr_Occurred())
+            goto error_return;
+        if (spin < 0) {
+            PyErr_SetString(PyExc_ValueError, "spin must be a non-negative integer");
+            goto error_return;
         }
+    }
+
+    USDT_PROBE1(semaphore__acquire__entry, self->name);
+    USDT_START_TIMER(semaphore__acquire__return, started);
+
+    Py_BEGIN_ALLOW_THREADS
+    // Before blocking (which costs a trip through the scheduler when the
+    // semaphore is released), optionally poll for a while in the hope that
+    // it'll be released soon. There's no point when timeout == 0.
+    if (spin && (timeout.is_none || !timeout.is_zero))
+        spun = semaphore_spin(self, spin);
+
+    if (spun)
+        rc = 0;
+    else
+        rc = semaphore_wait(self->pSemaphore, &timeout);
 
+    USDT_PROBE3(semaphore__acquire__return, self->name, (-1 == rc) ? errno : 0,
+                USDT_ELAPSED_NS(started));
+    Py_END_ALLOW_THREADS
+
+    if (-1 == rc) {
+        DPRINTF("sem_wait() rc = %d, errno = %d\n", rc, errno);
+        set_semaphore_wait_error();
         goto error_return;
     }
 
@@ -715,6 +1191,36 @@ Semaphore_acquire(Semaphore *self, PyObject *args, PyObject *keywords) {
 }
 
 
+static PyObject *
+Semaphore_get_spin(Semaphore *self, void *closure) {
+    return PyLong_FromLong(self->spin);
+}
+
+
+static int
+Semaphore_set_spin(Semaphore *self, PyObject *py_value, void *closure) {
+    long spin;
+
+    if (!py_value) {
+        PyErr_SetString(PyExc_AttributeError, "spin can't be deleted");
+        return -1;
+    }
+
+    spin = PyLong_AsLong(py_value);
+    if ((-1 == spin) && PyErr_Occurred())
+        return -1;
+
+    if (spin < 0) {
+        PyErr_SetString(PyExc_ValueError, "spin must be a non-negative integer");
+        return -1;
+    }
+
+    self->spin = spin;
+
+    return 0;
+}
+
+
 // sem_getvalue isn't available on all systems.
 #ifdef SEM_GETVALUE_EXISTS
 static PyObject *
@@ -747,6 +1253,12 @@ Semaphore_getvalue(Semaphore *self, void *closure) {
 #endif
 
 
+static PyObject *
+Semaphore_reduce(Semaphore *self) {
+    return reduce_handle("Semaphore", self->name, PyDict_New());
+}
+
+
 static PyObject *
 Semaphore_unlink(Semaphore *self) {
     if (!test_semaphore_validity(self))
@@ -868,34 +1380,78 @@ my_shm_unlink(const char *name) {
 }
 
 
-static PyObject *
-SharedMemory_new(PyTypeObject *type, PyObject *args, PyObject *kwlist) {
-    SharedMemory *self;
-
-    self = (SharedMemory *)type->tp_alloc(type, 0);
-
-    return (PyObject *)self;
+static void
+set_shm_open_error(unsigned int flags) {
+    // Translates the errno from shm_open() into a Python exception.
+    switch (errno) {
+        case EACCES:
+            PyErr_Format(pPermissionsException,
+                            "No permission to %s this segment",
+                            (flags & O_TRUNC) ? "truncate" : "access"
+                            );
+        break;
+
+        case EEXIST:
+            PyErr_SetString(pExistentialException,
+                            "Shared memory with the specified name already exists");
+        break;
+
+        case ENOENT:
+            PyErr_SetString(pExistentialException,
+                            "No shared memory exists with the specified name");
+        break;
+
+        case EINVAL:
+            PyErr_SetString(PyExc_ValueError, "Invalid parameter(s)");
+        break;
+
+        case EMFILE:
+            PyErr_SetString(PyExc_OSError,
+                             "This process already has the maximum number of files open");
+        break;
+
+        case ENFILE:
+            PyErr_SetString(PyExc_OSError,
+                             "The system limit on the total number of open files has been reached");
+        break;
+
+        case ENAMETOOLONG:
+            PyErr_SetString(PyExc_ValueError,
+                             "The name is too long");
+        break;
+
+        default:
+            PyErr_SetFromErrno(PyExc_OSError);
+        break;
+    }
 }
 
 
-static int
-SharedMemory_init(SharedMemory *self, PyObject *args, PyObject *keywords) {
-    NoneableName name;
+static void *
+open_shared_state(NoneableName *name, unsigned int flags, long mode, size_t size,
+                  uint32_t magic, char **p_name, int *p_created) {
+    // Opens or creates (according to flags) a shared memory segment of the
+    // given size to hold an object's state, maps it and closes the file
+    // descriptor. On success, returns the address of the mapping, *p_name
+    // points to the name (which the caller must PyMem_Free()) and *p_created
+    // tells the caller whether or not it must initialize the state and then
+    // call publish_shared_state(). When opening an existing segment, this
+    // waits (briefly) for the creator to publish the state.
+    // On failure, returns NULL with a Python exception set and name->name
+    // has been freed.
     char temp_name[MAX_SAFE_NAME_LENGTH + 1];
-    unsigned int flags = 0;
-    unsigned long size = 0;
-    int read_only = 0;
-    static char *keyword_list[ ] = {"name", "flags", "mode", "size", "read_only", NULL};
+    char *the_name = NULL;
+    int fd = -1;
+    void *address = NULL;
+    struct stat file_info;
+    uint32_t current_magic;
+    int i;
 
-    // First things first -- initialize the self struct.
-    self->name = NULL;
-    self->fd = POSIX_IPC_SHM_NO_VALUE;
-    self->mode = 0600;
+    *p_created = 0;
+    *p_name = NULL;
 
-    if (!PyArg_ParseTupleAndKeywords(args, keywords, "O&|Iiki", keyword_list,
-                                    &convert_name_param, &name, &flags,
-                                    &(self->mode), &size, &read_only))
-        goto error_return;
+    if (!name->is_none)
+        the_name = name->name;
 
     if ( !(flags & O_CREAT) && (flags & O_EXCL) ) {
         PyErr_SetString(PyExc_ValueError,
@@ -903,14 +1459,174 @@ SharedMemory_init(SharedMemory *self, PyObject *args, PyObject *keywords) {
         goto error_return;
     }
 
-    if (name.is_none && ((flags & O_EXCL) != O_EXCL)) {
+    if (name->is_none && ((flags & O_EXCL) != O_EXCL)) {
         PyErr_SetString(PyExc_ValueError,
                 "Name can only be None if O_EXCL is set");
         goto error_return;
     }
 
-    flags |= (read_only ? O_RDONLY : O_RDWR);
-
+    if (name->is_none) {
+        // (name == None) ==> generate a name for the caller
+        do {
+            errno = 0;
+            create_random_name(temp_name);
+            fd = shm_open(temp_name, O_CREAT | O_EXCL | O_RDWR, (mode_t)mode);
+        } while ( (-1 == fd) && (EEXIST == errno) );
+
+        the_name = (char *)PyMem_Malloc(strlen(temp_name) + 1);
+        if (the_name)
+            strcpy(the_name, temp_name);
+        else {
+            if (-1 != fd) {
+                close(fd);
+                shm_unlink(temp_name);
+            }
+            PyErr_SetString(PyExc_MemoryError, "Out of memory");
+            goto error_return;
+        }
+        *p_created = (-1 != fd);
+    }
+    else if (flags & O_CREAT) {
+        // I need to know whether or not I created the segment because the
+        // creator is responsible for initializing it, so I try O_EXCL first.
+        fd = shm_open(the_name, O_CREAT | O_EXCL | O_RDWR, (mode_t)mode);
+        *p_created = (-1 != fd);
+        if ((-1 == fd) && (EEXIST == errno) && !(flags & O_EXCL))
+            fd = shm_open(the_name, O_RDWR, (mode_t)mode);
+    }
+    else
+        fd = shm_open(the_name, O_RDWR, (mode_t)mode);
+
+    DPRINTF("shared state fd = %d, created = %d\n", fd, *p_created);
+
+    if (-1 == fd) {
+        set_shm_open_error(flags);
+        goto error_return;
+    }
+
+    if (*p_created) {
+        if (-1 == ftruncate(fd, (off_t)size)) {
+            PyErr_SetFromErrno(PyExc_OSError);
+            goto error_return;
+        }
+    }
+    else {
+        // The creator might not have set the size yet.
+        for (i = 0; ; i++) {
+            if (-1 == fstat(fd, &file_info)) {
+                PyErr_SetFromErrno(PyExc_OSError);
+                goto error_return;
+            }
+            if ((size_t)file_info.st_size >= size)
+                break;
+            if (i >= SHARED_STATE_WAIT_MILLISECONDS) {
+                PyErr_SetString(PyExc_ValueError,
+                                "The shared memory segment is too small for this type of object");
+                goto error_return;
+            }
+            usleep(1000);
+        }
+    }
+
+    address = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+
+    if (MAP_FAILED == address) {
+        address = NULL;
+        PyErr_SetFromErrno(PyExc_OSError);
+        goto error_return;
+    }
+
+    close(fd);
+    fd = -1;
+
+    if (!*p_created) {
+        // Wait for the creator to finish initializing the state.
+        for (i = 0; ; i++) {
+            current_magic = __atomic_load_n((uint32_t *)address, __ATOMIC_ACQUIRE);
+            if (current_magic == magic)
+                break;
+            if (current_magic || (i >= SHARED_STATE_WAIT_MILLISECONDS)) {
+                PyErr_SetString(PyExc_ValueError,
+                                current_magic ? "The shared memory segment holds a different type of object" :
+                                                "The shared memory segment was never initialized");
+                goto error_return;
+            }
+            usleep(1000);
+        }
+    }
+
+    *p_name = the_name;
+
+    return address;
+
+    error_return:
+    if (address)
+        munmap(address, size);
+    if (-1 != fd) {
+        close(fd);
+        if (*p_created)
+            shm_unlink(the_name);
+    }
+    PyMem_Free(the_name);
+    *p_created = 0;
+
+    return NULL;
+}
+
+
+static void
+publish_shared_state(void *address, uint32_t magic) {
+    // Tells processes waiting in open_shared_state() that the state is ready.
+    __atomic_store_n((uint32_t *)address, magic, __ATOMIC_RELEASE);
+}
+
+
+static PyObject *
+SharedMemory_new(PyTypeObject *type, PyObject *args, PyObject *kwlist) {
+    SharedMemory *self;
+
+    self = (SharedMemory *)type->tp_alloc(type, 0);
+
+    return (PyObject *)self;
+}
+
+
+static int
+SharedMemory_init(SharedMemory *self, PyObject *args, PyObject *keywords) {
+    NoneableName name;
+    char temp_name[MAX_SAFE_NAME_LENGTH + 1];
+    unsigned int flags = 0;
+    unsigned long size = 0;
+    int read_only = 0;
+    static char *keyword_list[ ] = {"name", "flags", "mode", "size", "read_only", NULL};
+
+    // First things first -- initialize the self struct.
+    self->name = NULL;
+    self->fd = POSIX_IPC_SHM_NO_VALUE;
+    self->mode = 0600;
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "O&|Iiki", keyword_list,
+                                    &convert_name_param, &name, &flags,
+                                    &(self->mode), &size, &read_only))
+        goto error_return;
+
+    // Remembered so that a pickled SharedMemory reopens the same way.
+    self->read_only = read_only ? 1 : 0;
+
+    if ( !(flags & O_CREAT) && (flags & O_EXCL) ) {
+        PyErr_SetString(PyExc_ValueError,
+                "O_EXCL must be combined with O_CREAT");
+        goto error_return;
+    }
+
+    if (name.is_none && ((flags & O_EXCL) != O_EXCL)) {
+        PyErr_SetString(PyExc_ValueError,
+                "Name can only be None if O_EXCL is set");
+        goto error_return;
+    }
+
+    flags |= (read_only ? O_RDONLY : O_RDWR);
+
     if (name.is_none) {
         // (name == None) ==> generate a name for the caller
         do {
@@ -945,48 +1661,7 @@ SharedMemory_init(SharedMemory *self, PyObject *args, PyObject *keywords) {
     DPRINTF("shm fd = %d\n", self->fd);
 
     if (-1 == self->fd) {
-        switch (errno) {
-            case EACCES:
-                PyErr_Format(pPermissionsException,
-                                "No permission to %s this segment",
-                                (flags & O_TRUNC) ? "truncate" : "access"
-                                );
-            break;
-
-            case EEXIST:
-                PyErr_SetString(pExistentialException,
-                                "Shared memory with the specified name already exists");
-            break;
-
-            case ENOENT:
-                PyErr_SetString(pExistentialException,
-                                "No shared memory exists with the specified name");
-            break;
-
-            case EINVAL:
-                PyErr_SetString(PyExc_ValueError, "Invalid parameter(s)");
-            break;
-
-            case EMFILE:
-                PyErr_SetString(PyExc_OSError,
-                                 "This process already has the maximum number of files open");
-            break;
-
-            case ENFILE:
-                PyErr_SetString(PyExc_OSError,
-                                 "The system limit on the total number of open files has been reached");
-            break;
-
-            case ENAMETOOLONG:
-                PyErr_SetString(PyExc_ValueError,
-                                 "The name is too long");
-            break;
-
-            default:
-                PyErr_SetFromErrno(PyExc_OSError);
-            break;
-        }
-
+        set_shm_open_error(flags);
         goto error_return;
     }
     else {
@@ -1113,798 +1788,1108 @@ SharedMemory_close_fd(SharedMemory *self) {
 }
 
 
+static PyObject *
+SharedMemory_reduce(SharedMemory *self) {
+    return reduce_handle("SharedMemory", self->name,
+                         Py_BuildValue("{sO}", "read_only",
+                                       self->read_only ? Py_True : Py_False));
+}
+
+
 PyObject *
 SharedMemory_unlink(SharedMemory *self) {
     return my_shm_unlink(self->name);
 }
 
 
-/*   =====  End Shared Memory functions =====           */
+// SharedMemory.load_from() and dump_to() copy between a file and a segment.
+// The copy is divided into contiguous pieces, one per thread. Each thread
+// asks the kernel to do its copy with copy_file_range() (so the data never
+// enters user space) and if the kernel can't do that between these two
+// files (e.g. because they're on different file systems), it falls back to
+// pread()/pwrite() directly between the file and a mapping of the segment.
 
+// Linux won't read or write more than about 2GB in one call.
+#define MAX_FILE_COPY_CHUNK         (1024 * 1024 * 1024)
+// It's not worth starting a thread to copy less than this.
+#define MIN_FILE_COPY_PER_THREAD    (1024 * 1024)
 
-/*   =====  Begin Message Queue implementation functions ===== */
+typedef struct {
+    int file_fd;
+    off_t file_offset;
+    int segment_fd;
+    off_t segment_offset;
+    char *address;      // segment_offset's address in the mapping
+    size_t size;
+    int to_file;        // 1 for dump_to(), 0 for load_from()
+    int error;          // errno, or -1 if the file ended early
+} FileCopyTask;
+
+
+static void *
+file_copy_task(void *arg) {
+    FileCopyTask *task = (FileCopyTask *)arg;
+    size_t done = 0;
+    size_t chunk;
+    ssize_t n;
+#ifdef COPY_FILE_RANGE_EXISTS
+    off_t file_offset;
+    off_t segment_offset;
+    int use_copy_file_range = 1;
+#endif
 
-#ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
+    while (done < task->size) {
+        chunk = task->size - done;
+        if (chunk > MAX_FILE_COPY_CHUNK)
+            chunk = MAX_FILE_COPY_CHUNK;
+
+#ifdef COPY_FILE_RANGE_EXISTS
+        if (use_copy_file_range) {
+            // copy_file_range() advances these copies of the offsets rather
+            // than the files' positions.
+            file_offset = task->file_offset + done;
+            segment_offset = task->segment_offset + done;
+            if (task->to_file)
+                n = copy_file_range(task->segment_fd, &segment_offset,
+                                    task->file_fd, &file_offset, chunk, 0);
+            else
+                n = copy_file_range(task->file_fd, &file_offset,
+                                    task->segment_fd, &segment_offset, chunk, 0);
+
+            if (-1 == n) {
+                switch (errno) {
+                    case EXDEV:
+                    case EINVAL:
+                    case ENOSYS:
+                    case EOPNOTSUPP:
+                    case ETXTBSY:
+                        // The kernel can't copy between these files. Carry
+                        // on the old-fashioned way.
+                        DPRINTF("copy_file_range() failed, errno = %d\n", errno);
+                        use_copy_file_range = 0;
+                        continue;
+                }
+            }
+        }
+        else
+#endif
+        if (task->to_file)
+            n = pwrite(task->file_fd, task->address + done, chunk,
+                       task->file_offset + done);
+        else
+            n = pread(task->file_fd, task->address + done, chunk,
+                      task->file_offset + done);
 
-static PyObject *
-mq_str(MessageQueue *self) {
-    return generic_str(self->name);
-}
+        if (-1 == n) {
+            if (EINTR == errno)
+                continue;
+            task->error = errno;
+            break;
+        }
 
-static PyObject *
-mq_repr(MessageQueue *self) {
-    char mode[32];
-    char read[32];
-    char write[32];
+        if (!n) {
+            task->error = -1;
+            break;
+        }
 
-    strcpy(read, self->receive_permitted ? "True" : "False");
-    strcpy(write, self->send_permitted ? "True" : "False");
-    mode_to_str(self->mode, mode);
+        done += n;
+    }
 
-    return PyUnicode_FromFormat("posix_ipc.MessageQueue(\"%s\", mode=%s, max_message_size=%ld, max_messages=%ld, read=%s, write=%s)",
-                self->name, mode, self->max_message_size, self->max_messages,
-                read, write);
+    return NULL;
 }
 
 
-void
-mq_cancel_notification(MessageQueue *self) {
-    // Based on the documentation, mq_notify() can only fail in this context
-    // if mqd is invalid. That will only occur if the queue has been
-    // destroyed, in which case notifications are effectively cancelled
-    // anyway. Therefore I don't care about the return code from mq_notify()
-    // and this function is always successful.
-
-    // I hope this doesn't come back to bite me...
-    #pragma GCC diagnostic push
-    #pragma GCC diagnostic ignored "-Wunused-but-set-variable"
-    int rc;
+static int
+copy_file_and_segment(int file_fd, off_t file_offset, int segment_fd, off_t segment_offset,
+                      size_t size, int to_file, int threads) {
+    // Copies size bytes between the file and the segment, dividing the work
+    // among up to threads threads. Returns 0 on success, an errno on failure,
+    // or -1 if the file ended early. The caller must not hold the GIL.
+    FileCopyTask *tasks = NULL;
+    pthread_t *thread_ids = NULL;
+    int *started = NULL;
+    off_t map_offset;
+    size_t map_size;
+    char *mapping = MAP_FAILED;
+    size_t per_thread;
+    size_t assigned = 0;
+    int n_tasks;
+    int error = 0;
+    int i;
 
-    rc = mq_notify(self->mqd, NULL);
-    DPRINTF("Notification cancelled, rc=%d\n", rc);
-    #pragma GCC diagnostic pop
+    if (!size)
+        return 0;
+
+    if ((size_t)threads > (size / MIN_FILE_COPY_PER_THREAD) + 1)
+        threads = (int)(size / MIN_FILE_COPY_PER_THREAD) + 1;
+
+    // The mapping is only touched if copy_file_range() isn't usable. It
+    // costs little until it's touched.
+    map_offset = segment_offset - (segment_offset % (off_t)page_size());
+    map_size = (size_t)(segment_offset - map_offset) + size;
+    mapping = mmap(NULL, map_size, to_file ? PROT_READ : PROT_WRITE, MAP_SHARED,
+                   segment_fd, map_offset);
+    if (MAP_FAILED == mapping) {
+        error = errno;
+        goto cleanup;
+    }
 
-    Py_XDECREF(self->notification_callback);
-    self->notification_callback = NULL;
-    Py_XDECREF(self->notification_callback_param);
-    self->notification_callback_param = NULL;
-}
+    tasks = (FileCopyTask *)malloc(threads * sizeof(FileCopyTask));
+    thread_ids = (pthread_t *)malloc(threads * sizeof(pthread_t));
+    started = (int *)calloc(threads, sizeof(int));
+    if (!(tasks && thread_ids && started)) {
+        error = ENOMEM;
+        goto cleanup;
+    }
 
+    // Each thread gets a whole number of pages (except the last) so that
+    // no two threads write to the same page.
+    per_thread = (size + threads - 1) / threads;
+    per_thread += (page_size() - (per_thread % page_size())) % page_size();
+
+    for (n_tasks = 0; assigned < size; n_tasks++) {
+        tasks[n_tasks].file_fd = file_fd;
+        tasks[n_tasks].file_offset = file_offset + assigned;
+        tasks[n_tasks].segment_fd = segment_fd;
+        tasks[n_tasks].segment_offset = segment_offset + assigned;
+        tasks[n_tasks].address = mapping + (segment_offset - map_offset) + assigned;
+        tasks[n_tasks].size = ((size - assigned) < per_thread) ? (size - assigned) : per_thread;
+        tasks[n_tasks].to_file = to_file;
+        tasks[n_tasks].error = 0;
+        assigned += tasks[n_tasks].size;
+    }
 
-static PyObject *
-my_mq_unlink(const char *name) {
-    DPRINTF("unlinking mq name %s\n", name);
-    if (-1 == mq_unlink(name)) {
-        switch (errno) {
-            case EACCES:
-                PyErr_SetString(pPermissionsException,
-                                "Permission denied");
-            break;
+    // This thread does the first piece itself. If a thread can't be
+    // started, this thread does that piece too.
+    for (i = 1; i < n_tasks; i++)
+        started[i] = !pthread_create(&thread_ids[i], NULL, file_copy_task, &tasks[i]);
 
-            case ENOENT:
-            case EINVAL:
-                PyErr_SetString(pExistentialException,
-                                "No queue exists with the specified name");
-            break;
+    file_copy_task(&tasks[0]);
 
-            case ENAMETOOLONG:
-                PyErr_SetString(PyExc_ValueError, "The name is too long");
-            break;
+    for (i = 1; i < n_tasks; i++) {
+        if (started[i])
+            pthread_join(thread_ids[i], NULL);
+        else
+            file_copy_task(&tasks[i]);
+    }
 
-            default:
-                PyErr_SetFromErrno(PyExc_OSError);
+    for (i = 0; i < n_tasks; i++) {
+        if (tasks[i].error) {
+            error = tasks[i].error;
             break;
         }
-        goto error_return;
     }
 
-    Py_RETURN_NONE;
+    cleanup:
+    if (MAP_FAILED != mapping)
+        munmap(mapping, map_size);
+    free(tasks);
+    free(thread_ids);
+    free(started);
 
-    error_return:
-    return NULL;
+    return error;
 }
 
 
-static int
-mq_get_attrs(mqd_t mqd, struct mq_attr *attr) {
-    attr->mq_flags = 0;
-    attr->mq_maxmsg = 0;
-    attr->mq_msgsize = 0;
-    attr->mq_curmsgs = 0;
+static PyObject *
+shared_memory_file_copy(SharedMemory *self, PyObject *args, PyObject *keywords,
+                        int to_file) {
+    // Implements load_from() (to_file == 0) and dump_to() (to_file == 1).
+    PyObject *py_file = NULL;
+    PyObject *py_size = Py_None;
+    PyObject *py_path = NULL;
+    Py_ssize_t offset = 0;
+    Py_ssize_t file_offset = 0;
+    Py_ssize_t size;
+    int threads = 1;
+    int file_fd = -1;
+    int opened = 0;
+    int rc = 0;
+    struct stat file_info;
+    struct stat segment_info;
+    static char *load_keyword_list[] = {"source", "offset", "size", "source_offset",
+                                        "threads", NULL};
+    static char *dump_keyword_list[] = {"destination", "offset", "size",
+                                        "destination_offset", "threads", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "O|nOni",
+                                     to_file ? dump_keyword_list : load_keyword_list,
+                                     &py_file, &offset, &py_size, &file_offset, &threads))
+        goto error_return;
 
-    if (-1 == mq_getattr(mqd, attr)) {
-        switch (errno) {
-            case EBADF:
-            case EINVAL:
-                PyErr_SetString(pExistentialException,
-                                "The queue does not exist");
-            break;
+    if ((offset < 0) || (file_offset < 0)) {
+        PyErr_SetString(PyExc_ValueError, "The offsets must be non-negative");
+        goto error_return;
+    }
 
-            default:
-                PyErr_SetFromErrno(PyExc_OSError);
-            break;
+    if (threads < 1) {
+        PyErr_SetString(PyExc_ValueError, "threads must be at least 1");
+        goto error_return;
+    }
+
+    if (Py_None == py_size)
+        size = -1;
+    else {
+        size = PyLong_AsSsize_t(py_size);
+        if ((-1 == size) && PyErr_Occurred())
+            goto error_return;
+        if (size < 0) {
+            PyErr_SetString(PyExc_ValueError, "The size must be None or non-negative");
+            goto error_return;
         }
+    }
 
+    if (-1 == fstat(self->fd, &segment_info)) {
+        if ((EBADF == errno) || (EINVAL == errno))
+            PyErr_SetString(pExistentialException, "The segment does not exist");
+        else
+            PyErr_SetFromErrno(PyExc_OSError);
         goto error_return;
     }
 
-    return 0;
-
-    error_return:
-    return -1;
-}
-
-
-static PyObject *
-MessageQueue_new(PyTypeObject *type, PyObject *args, PyObject *kwlist) {
-    MessageQueue *self;
+    // This is checked before the file is opened (and maybe truncated).
+    if (to_file) {
+        // By default, everything from offset to the end of the segment is
+        // copied.
+        if (offset > segment_info.st_size) {
+            PyErr_SetString(PyExc_ValueError, "The offset is beyond the end of the segment");
+            goto error_return;
+        }
+        if (-1 == size)
+            size = segment_info.st_size - offset;
+        else if (size > segment_info.st_size - offset) {
+            PyErr_SetString(PyExc_ValueError, "size extends beyond the end of the segment");
+            goto error_return;
+        }
+    }
 
-    self = (MessageQueue *)type->tp_alloc(type, 0);
+    // The file can be a file descriptor or a path.
+    if (PyLong_Check(py_file)) {
+        long fd = PyLong_AsLong(py_file);
 
-    return (PyObject *)self;
-}
+        if ((-1 == fd) && PyErr_Occurred())
+            goto error_return;
+        if ((fd < 0) || (fd > INT_MAX)) {
+            PyErr_SetString(PyExc_ValueError, "The file descriptor is invalid");
+            goto error_return;
+        }
+        file_fd = (int)fd;
+    }
+    else {
+        if (!PyUnicode_FSConverter(py_file, &py_path))
+            goto error_return;
 
+        Py_BEGIN_ALLOW_THREADS
+        if (to_file)
+            file_fd = open(PyBytes_AS_STRING(py_path), O_WRONLY | O_CREAT | O_TRUNC, 0666);
+        else
+            file_fd = open(PyBytes_AS_STRING(py_path), O_RDONLY);
+        Py_END_ALLOW_THREADS
 
-static int
-MessageQueue_init(MessageQueue *self, PyObject *args, PyObject *keywords) {
-    NoneableName name;
-    char temp_name[MAX_SAFE_NAME_LENGTH + 1];
-    unsigned int flags = 0;
-    long max_messages = QUEUE_MESSAGES_MAX_DEFAULT;
-    long max_message_size = QUEUE_MESSAGE_SIZE_MAX_DEFAULT;
-    PyObject *py_read = NULL;
-    PyObject *py_write = NULL;
-    struct mq_attr attr;
-    static char *keyword_list[ ] = {"name", "flags", "mode", "max_messages",
-                                    "max_message_size", "read", "write", NULL};
+        if (-1 == file_fd) {
+            PyErr_SetFromErrnoWithFilenameObject(PyExc_OSError, py_file);
+            goto error_return;
+        }
+        opened = 1;
+    }
 
-    // First things first -- initialize the self struct.
-    self->mqd = POSIX_IPC_MQ_NO_VALUE;
-    self->name = NULL;
-    self->mode = 0600;
-    self->notification_callback = NULL;
-    self->notification_callback_param = NULL;
+    if (!to_file) {
+        // By default, everything from source_offset to the end of the file
+        // is copied.
+        if (-1 == size) {
+            if (-1 == fstat(file_fd, &file_info)) {
+                PyErr_SetFromErrno(PyExc_OSError);
+                goto error_return;
+            }
+            if (file_offset > file_info.st_size) {
+                PyErr_SetString(PyExc_ValueError, "source_offset is beyond the end of the file");
+                goto error_return;
+            }
+            size = file_info.st_size - file_offset;
+        }
 
-    // MessageQueue(name, flags = 0, mode=0600,
-    //              max_messages=QUEUE_MESSAGES_MAX_DEFAULT,
-    //              max_message_size=QUEUE_MESSAGE_SIZE_MAX_DEFAULT,
-    //              read = True, write = True)
+        // The segment grows if necessary to hold what's copied into it.
+        if (offset + size > segment_info.st_size) {
+            if (-1 == ftruncate(self->fd, (off_t)(offset + size))) {
+                PyErr_SetFromErrno(PyExc_OSError);
+                goto error_return;
+            }
+        }
+    }
 
-    if (!PyArg_ParseTupleAndKeywords(args, keywords, "O&|IillOO", keyword_list,
-                                    &convert_name_param, &name, &flags,
-                                    &(self->mode), &max_messages,
-                                    &max_message_size, &py_read, &py_write))
-        goto error_return;
+    Py_BEGIN_ALLOW_THREADS
+    rc = copy_file_and_segment(file_fd, (off_t)file_offset, self->fd, (off_t)offset,
+                               (size_t)size, to_file, threads);
+    Py_END_ALLOW_THREADS
 
-    if ( !(flags & O_CREAT) && (flags & O_EXCL) ) {
-        PyErr_SetString(PyExc_ValueError,
-                "O_EXCL must be combined with O_CREAT");
+    if (-1 == rc) {
+        PyErr_SetString(PyExc_ValueError, "The file ended before size bytes were copied");
         goto error_return;
     }
-
-    if (name.is_none && ((flags & O_EXCL) != O_EXCL)) {
-        PyErr_SetString(PyExc_ValueError,
-                "Name can only be None if O_EXCL is set");
+    else if (rc) {
+        errno = rc;
+        PyErr_SetFromErrno(PyExc_OSError);
         goto error_return;
     }
 
-    // read & write flags default to True, so if the user passed True I
-    // set the object pointers to their default values of NULL. So here
-    // NULL means True and any other value means False. Sorry for being
-    // backwards.
-    if (py_read && PyObject_IsTrue(py_read)) py_read = NULL;
+    if (opened)
+        close(file_fd);
+    Py_XDECREF(py_path);
 
-    if (py_write && PyObject_IsTrue(py_write)) py_write = NULL;
+    return PyLong_FromSsize_t(size);
 
-    if ((!py_read) && (!py_write)) {
-        flags |= O_RDWR;
-        self->send_permitted = 1;
-        self->receive_permitted = 1;
-    }
+    error_return:
+    if (opened)
+        close(file_fd);
+    Py_XDECREF(py_path);
 
-    if ((!py_read) && (py_write)) {
-        flags |= O_RDONLY;
-        self->send_permitted = 0;
-        self->receive_permitted = 1;
-    }
+    return NULL;
+}
 
-    if ((py_read) && (!py_write)) {
-        flags |= O_WRONLY;
-        self->send_permitted = 1;
-        self->receive_permitted = 0;
-    }
 
-    if ((py_read) && (py_write)) {
-        PyErr_SetString(PyExc_ValueError, "At least one of read or write must be True");
-        goto error_return;
-    }
+static PyObject *
+SharedMemory_checkpoint(SharedMemory *self, PyObject *args, PyObject *keywords) {
+    return call_python_implementation("posix_ipc._checkpoint", "checkpoint",
+                                      (PyObject *)self, args, keywords);
+}
 
-    // Params look OK, let's try to open/create the queue
-    if (flags & O_CREAT) {
-        // Set up the attr struct which is only needed when creating.
-        attr.mq_flags = (flags & O_NONBLOCK) ? O_NONBLOCK : 0;
-        attr.mq_maxmsg = max_messages;
-        attr.mq_msgsize = max_message_size;
-        attr.mq_curmsgs = 0;
-    }
 
-    if (name.is_none) {
-        // (name == None) ==> generate a name for the caller
-        do {
-            errno = 0;
-            create_random_name(temp_name);
+static PyObject *
+SharedMemory_restore(SharedMemory *self, PyObject *args, PyObject *keywords) {
+    return call_python_implementation("posix_ipc._checkpoint", "restore",
+                                      (PyObject *)self, args, keywords);
+}
 
-            DPRINTF("calling mq_open, name=%s, flags=0x%x, mode=0%o, maxmsg=%ld, msgsize=%ld\n",
-                    temp_name, flags, (int)self->mode, attr.mq_maxmsg, attr.mq_msgsize);
-            self->mqd = mq_open(temp_name, flags, (mode_t)self->mode, &attr);
 
-        } while ( ((mqd_t)-1 == self->mqd) && (EEXIST == errno) );
+static PyObject *
+SharedMemory_records(SharedMemory *self, PyObject *args, PyObject *keywords) {
+    return call_python_implementation("posix_ipc._records", "records",
+                                      (PyObject *)self, args, keywords);
+}
 
-        // PyMalloc memory and copy the randomly-generated name to it.
-        self->name = (char *)PyMem_Malloc(strlen(temp_name) + 1);
-        if (self->name)
-            strcpy(self->name, temp_name);
-        else {
-            PyErr_SetString(PyExc_MemoryError, "Out of memory");
-            goto error_return;
-        }
-    }
-    else {
-        // (name != None) ==> use name supplied by the caller. It was
-        // already converted to C by convert_name_param().
-        self->name = name.name;
 
-        if (flags & O_CREAT) {
-            DPRINTF("calling mq_open, name=%s, flags=0x%x, mode=0%o, maxmsg=%ld, msgsize=%ld\n",
-                    self->name, flags, (int)self->mode, attr.mq_maxmsg, attr.mq_msgsize);
-            self->mqd = mq_open(self->name, flags, (mode_t)self->mode, &attr);
-        }
-        else {
-            DPRINTF("calling mq_open, name=%s, flags=0x%x\n", self->name, flags);
-            self->mqd = mq_open(self->name, flags);
-        }
-    }
+static PyObject *
+SharedMemory_load_from(SharedMemory *self, PyObject *args, PyObject *keywords) {
+    return shared_memory_file_copy(self, args, keywords, 0);
+}
 
-    DPRINTF("mqd = %ld\n", (long)self->mqd);
 
-    if ((mqd_t)-1 == self->mqd) {
-        switch (errno) {
-            case EINVAL:
-                PyErr_SetString(PyExc_ValueError, "Invalid parameter(s)");
-            break;
+static PyObject *
+SharedMemory_dump_to(SharedMemory *self, PyObject *args, PyObject *keywords) {
+    return shared_memory_file_copy(self, args, keywords, 1);
+}
 
-            case ENOSPC:
-                PyErr_SetString(PyExc_OSError,
-                                "Insufficient space for a new queue");
-            break;
 
-            case EACCES:
-                PyErr_SetString(pPermissionsException, "Permission denied");
-            break;
+/*   =====  End Shared Memory functions =====           */
 
-            case EEXIST:
-                PyErr_SetString(pExistentialException,
-                        "A queue with the specified name already exists");
-            break;
 
-            case ENOENT:
-                PyErr_SetString(pExistentialException,
-                                "No queue exists with the specified name");
-            break;
+/*   =====  Begin Atomic Array implementation functions ===== */
 
-            case EMFILE:
-                PyErr_SetString(PyExc_OSError,
-                    "This process already has the maximum number of files open");
-            break;
+// SharedMemory.atomic_array() creates AtomicArrays, so it needs this before
+// the type's meta stuff is defined.
+static PyTypeObject AtomicArrayType;
 
-            case ENFILE:
-                PyErr_SetString(PyExc_OSError,
-                    "The system limit on the total number of open files has been reached");
-            break;
+static const AtomicDtype atomic_dtypes[] = {
+    {"i32", "i", 4, 1},
+    {"u32", "I", 4, 0},
+    {"i64", "q", 8, 1},
+    {"u64", "Q", 8, 0},
+    {NULL, NULL, 0, 0} /* Sentinel */
+};
 
-            case ENAMETOOLONG:
-                PyErr_SetString(PyExc_ValueError, "The name is too long");
-            break;
 
-            case ENOMEM:
-                PyErr_SetString(PyExc_MemoryError, "Not enough memory");
-            break;
+static PyObject *
+SharedMemory_atomic_array(SharedMemory *self, PyObject *args, PyObject *keywords) {
+    char *dtype_name = "i64";
+    Py_ssize_t length = -1;
+    Py_ssize_t offset = 0;
+    const AtomicDtype *dtype = NULL;
+    AtomicArray *array = NULL;
+    struct stat file_info;
+    off_t map_offset;
+    size_t map_size;
+    void *mapping;
+    int read_only = 0;
+    int i;
+    static char *keyword_list[ ] = {"dtype", "length", "offset", NULL};
 
-            default:
-                PyErr_SetFromErrno(PyExc_OSError);
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "|snn", keyword_list,
+                                     &dtype_name, &length, &offset))
+        goto error_return;
+
+    for (i = 0; atomic_dtypes[i].name; i++) {
+        if (!strcmp(dtype_name, atomic_dtypes[i].name)) {
+            dtype = &atomic_dtypes[i];
             break;
         }
+    }
 
+    if (!dtype) {
+        PyErr_SetString(PyExc_ValueError,
+                        "The dtype must be \"i32\", \"u32\", \"i64\" or \"u64\"");
         goto error_return;
     }
 
-    // self->mqd and self->name are already populated. Here's where I get
-    // the other two values.
-    if (0 == mq_get_attrs(self->mqd, &attr)) {
-        self->max_messages = attr.mq_maxmsg;
-        self->max_message_size = attr.mq_msgsize;
+    // Atomic instructions require naturally aligned operands. The mapping
+    // starts at a page boundary, so aligning the offset aligns the elements.
+    if ((offset < 0) || (offset % dtype->itemsize)) {
+        PyErr_Format(PyExc_ValueError,
+                     "The offset must be a non-negative multiple of %d", dtype->itemsize);
+        goto error_return;
     }
-    else {
-        // Oy vey, something has gone very wrong. The call to mq_open()
-        // succeeded but mq_getattr() failed?!?
-        PyErr_Clear();
-        PyErr_SetString(pBaseException, "Unable to initialize object");
+
+    if (-1 == fstat(self->fd, &file_info)) {
+        if ((EBADF == errno) || (EINVAL == errno))
+            PyErr_SetString(pExistentialException, "The segment does not exist");
+        else
+            PyErr_SetFromErrno(PyExc_OSError);
         goto error_return;
     }
 
-    // Last but not least, get a reference to the interpreter state. I only
-    // need this if the caller requests queue notifications that occur in
-    // a new thread, so much of the time this goes unused.
-    // It's my understanding that there's only one interpreter state to go
-    // around, so no matter which thread I get the interpreter state from,
-    // it will be the same interpreter state.
-    self->interpreter = PyThreadState_Get()->interp;
+    if (offset > file_info.st_size) {
+        PyErr_SetString(PyExc_ValueError, "The offset is beyond the end of the segment");
+        goto error_return;
+    }
 
-    return 0;
+    // By default the array extends to the end of the segment.
+    if (-1 == length)
+        length = (file_info.st_size - offset) / dtype->itemsize;
+
+    if ((length < 0) || (length > (file_info.st_size - offset) / dtype->itemsize)) {
+        PyErr_SetString(PyExc_ValueError, "The array doesn't fit in the segment");
+        goto error_return;
+    }
+
+    map_offset = (off_t)(offset - (offset % (Py_ssize_t)page_size()));
+    map_size = (size_t)(offset - map_offset) + (size_t)(length * dtype->itemsize);
+    // mmap() doesn't accept a size of 0.
+    if (!map_size)
+        map_size = 1;
+
+    mapping = mmap(NULL, map_size, PROT_READ | PROT_WRITE, MAP_SHARED, self->fd, map_offset);
+    if ((MAP_FAILED == mapping) && (EACCES == errno)) {
+        // The segment was opened read-only.
+        read_only = 1;
+        mapping = mmap(NULL, map_size, PROT_READ, MAP_SHARED, self->fd, map_offset);
+    }
+
+    if (MAP_FAILED == mapping) {
+        PyErr_SetFromErrno(PyExc_OSError);
+        goto error_return;
+    }
+
+    array = (AtomicArray *)AtomicArrayType.tp_alloc(&AtomicArrayType, 0);
+    if (!array) {
+        munmap(mapping, map_size);
+        goto error_return;
+    }
+
+    array->dtype = dtype;
+    array->mapping = mapping;
+    array->mapping_size = map_size;
+    array->data = (char *)mapping + (offset - map_offset);
+    array->length = length;
+    array->read_only = read_only;
+
+    return (PyObject *)array;
 
     error_return:
-    return -1;
+    return NULL;
 }
 
 
 static void
-MessageQueue_dealloc(MessageQueue *self) {
+AtomicArray_dealloc(AtomicArray *self) {
     DPRINTF("dealloc\n");
-    PyMem_Free(self->name);
-    self->name = NULL;
-
-    Py_XDECREF(self->notification_callback);
-    self->notification_callback = NULL;
-    Py_XDECREF(self->notification_callback_param);
-    self->notification_callback_param = NULL;
+    if (self->mapping)
+        munmap(self->mapping, self->mapping_size);
 
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
 
-static PyObject *
-MessageQueue_send(MessageQueue *self, PyObject *args, PyObject *keywords) {
-    NoneableTimeout timeout;
-    long priority = 0;
-    int rc = 0;
-    static char *keyword_list[ ] = {"message", "timeout", "priority", NULL};
-    static char args_format[] = "s*|O&l";
-    Py_buffer msg;
+static int
+test_atomic_array_validity(AtomicArray *self, int write) {
+    // Returns 1 if the array is open (and writable, if write is true),
+    // otherwise sets an exception and returns 0.
+    if (!self->mapping) {
+        PyErr_SetString(pExistentialException, "The array has been closed");
+        return 0;
+    }
 
-    // Initialize this to the default of None.
-    timeout.is_none = 1;
+    if (write && self->read_only) {
+        PyErr_SetString(pPermissionsException, "The array is read-only");
+        return 0;
+    }
 
-    /* In Python >= 2.5, the Python argument specifier 's#' expects a
-       py_ssize_t for its second parameter (msg.len). A ulong is long
-       enough to fit a py_ssize_t.
-       It might be too big, though, on platforms where a ulong is larger than
-       py_ssize_t. Therefore I *must* initialize it to 0 so that whatever
-       Python doesn't write to is zeroed out.
-    */
-    msg.len = 0;
+    return 1;
+}
 
-    if (!PyArg_ParseTupleAndKeywords(args, keywords, args_format, keyword_list,
-                                     &msg,
-                                     convert_timeout, &timeout,
-                                     &priority))
-        goto error_return;
 
-    if (!self->send_permitted) {
-        PyErr_SetString(pPermissionsException, "The queue is not open for writing");
-        goto error_return;
-    }
+static void *
+atomic_array_element(AtomicArray *self, Py_ssize_t index) {
+    // Returns the address of the element at index (which may be negative)
+    // or sets an IndexError and returns NULL.
+    if (index < 0)
+        index += self->length;
 
-    if (msg.len > self->max_message_size) {
-        PyErr_Format(PyExc_ValueError,
-                     "The message must be no longer than %ld bytes",
-                     self->max_message_size);
+    if ((index < 0) || (index >= self->length)) {
+        PyErr_SetString(PyExc_IndexError, "The index is out of range");
+        return NULL;
     }
 
-    if ((priority < 0) || (priority > QUEUE_PRIORITY_MAX)) {
-        PyErr_Format(PyExc_ValueError,
-                     "The priority must be a positive number no greater than QUEUE_PRIORITY_MAX (%u)",
-                     QUEUE_PRIORITY_MAX);
-        goto error_return;
+    return self->data + (index * self->dtype->itemsize);
+}
+
+
+static int
+atomic_array_from_python(AtomicArray *self, PyObject *py_value, int wrap, uint64_t *p_bits) {
+    // Converts a Python int to the bits of an element. Unless wrap is true
+    // (as it is for fetch_add()'s delta), the value must be in range for the
+    // array's type. Returns 1 on success, 0 with an exception set on failure.
+    long long signed_value;
+    unsigned long long unsigned_value;
+    int itemsize = self->dtype->itemsize;
+
+    if (!PyLong_Check(py_value)) {
+        PyErr_SetString(PyExc_TypeError, "The value must be an integer");
+        return 0;
     }
 
-    Py_BEGIN_ALLOW_THREADS
-    // timeout == None: no timeout, i.e. wait forever.
-    // timeout >= 0: wait no longer than t seconds before raising an error.
-    if (timeout.is_none) {
-        DPRINTF("calling mq_send(), mqd=%ld, msg len=%ld, priority=%ld\n",
-                (long)self->mqd, (long)msg.len, priority);
-        rc = mq_send(self->mqd, msg.buf, msg.len, (unsigned int)priority);
+    if (self->dtype->is_signed || wrap) {
+        signed_value = PyLong_AsLongLong(py_value);
+        if ((-1 == signed_value) && PyErr_Occurred())
+            return 0;
+        if ((!wrap) && (4 == itemsize) &&
+            ((signed_value < INT32_MIN) || (signed_value > INT32_MAX)))
+            goto overflow;
+        *p_bits = (uint64_t)signed_value;
     }
     else {
-        // Timeout is not None (i.e. is numeric)
-        DPRINTF("calling mq_timedsend(), mqd=%ld, msg len=%ld, priority=%ld\n",
-                (long)self->mqd, (long)msg.len, priority);
-        DPRINTF("timeout tv_sec = %ld; timeout tv_nsec = %ld\n",
-                timeout.timestamp.tv_sec, timeout.timestamp.tv_nsec);
+        unsigned_value = PyLong_AsUnsignedLongLong(py_value);
+        if (((unsigned long long)-1 == unsigned_value) && PyErr_Occurred())
+            return 0;
+        if ((4 == itemsize) && (unsigned_value > UINT32_MAX))
+            goto overflow;
+        *p_bits = (uint64_t)unsigned_value;
+    }
 
-        rc = mq_timedsend(self->mqd, msg.buf, msg.len, (unsigned int)priority,
-                          &(timeout.timestamp));
+    return 1;
+
+    overflow:
+    PyErr_Format(PyExc_OverflowError, "The value is out of range for %s", self->dtype->name);
+    return 0;
+}
+
+
+static PyObject *
+atomic_array_to_python(AtomicArray *self, uint64_t bits) {
+    if (4 == self->dtype->itemsize) {
+        if (self->dtype->is_signed)
+            return PyLong_FromLong((long)(int32_t)bits);
+        else
+            return PyLong_FromUnsignedLong((unsigned long)(uint32_t)bits);
     }
-    Py_END_ALLOW_THREADS
+    else {
+        if (self->dtype->is_signed)
+            return PyLong_FromLongLong((long long)(int64_t)bits);
+        else
+            return PyLong_FromUnsignedLongLong((unsigned long long)bits);
+    }
+}
 
-    if (-1 == rc) {
-        switch (errno) {
-            case EBADF:
-            case EINVAL:
-                // The POSIX spec & Linux doc say that EINVAL can mean --
-                // 1) self->mqd is not valid for writing
-                // 2) timeout is < 0 or > one billion.
-                // Since my code above guards against out-of-range
-                // params, I expect only the first condition.
-                PyErr_SetString(pExistentialException,
-                    "The message queue does not exist or is not open for writing");
-            break;
 
-            case EINTR:
-                /* If the signal was generated by Ctrl-C, calling
-                PyErr_CheckSignals() here has the side effect of setting
-                Python's error indicator. Otherwise there's a good chance
-                it won't be set.
-                http://groups.google.com/group/comp.lang.python/browse_thread/thread/ada39e984dfc3da6/fd6becbdce91a6be?#fd6becbdce91a6be
-                */
-                PyErr_CheckSignals();
+static PyObject *
+AtomicArray_load(AtomicArray *self, PyObject *args) {
+    Py_ssize_t index;
+    void *element;
+    uint64_t bits;
 
-                if (!(PyErr_Occurred() &&
-                      PyErr_ExceptionMatches(PyExc_KeyboardInterrupt))
-                   ) {
-                    PyErr_Clear();
-                    PyErr_SetString(pSignalException,
-                                    "The wait was interrupted by a signal");
-                }
-                // else
-                    // If KeyboardInterrupt error is set, I propogate that
-                    // up to the caller.
-            break;
+    if (!PyArg_ParseTuple(args, "n", &index))
+        goto error_return;
 
-            case EAGAIN:
-            case ETIMEDOUT:
-                PyErr_SetString(pBusyException, "The queue is full");
-            break;
+    if (!test_atomic_array_validity(self, 0))
+        goto error_return;
 
-            case EMSGSIZE:
-                // This should never happen since I checked message length
-                // above, but who knows...
-                PyErr_SetString(PyExc_ValueError, "The message is too long");
-            break;
+    if (!(element = atomic_array_element(self, index)))
+        goto error_return;
+
+    if (4 == self->dtype->itemsize)
+        bits = __atomic_load_n((uint32_t *)element, __ATOMIC_SEQ_CST);
+    else
+        bits = __atomic_load_n((uint64_t *)element, __ATOMIC_SEQ_CST);
+
+    return atomic_array_to_python(self, bits);
+
+    error_return:
+    return NULL;
+}
 
-            default:
-                PyErr_SetFromErrno(PyExc_OSError);
-            break;
-        }
 
+static PyObject *
+AtomicArray_store(AtomicArray *self, PyObject *args) {
+    Py_ssize_t index;
+    PyObject *py_value;
+    void *element;
+    uint64_t bits;
+
+    if (!PyArg_ParseTuple(args, "nO", &index, &py_value))
         goto error_return;
-    }
 
-    PyBuffer_Release(&msg);
+    if (!test_atomic_array_validity(self, 1))
+        goto error_return;
+
+    if (!(element = atomic_array_element(self, index)))
+        goto error_return;
+
+    if (!atomic_array_from_python(self, py_value, 0, &bits))
+        goto error_return;
+
+    if (4 == self->dtype->itemsize)
+        __atomic_store_n((uint32_t *)element, (uint32_t)bits, __ATOMIC_SEQ_CST);
+    else
+        __atomic_store_n((uint64_t *)element, bits, __ATOMIC_SEQ_CST);
 
     Py_RETURN_NONE;
 
     error_return:
-    PyBuffer_Release(&msg);
     return NULL;
 }
 
 
 static PyObject *
-MessageQueue_receive(MessageQueue *self, PyObject *args, PyObject *keywords) {
-    NoneableTimeout timeout;
-    char *msg = NULL;
-    unsigned int priority = 0;
-    ssize_t size = 0;
-    PyObject *py_return_tuple = NULL;
-    static char *keyword_list[ ] = {"timeout", NULL};
+AtomicArray_fetch_add(AtomicArray *self, PyObject *args) {
+    Py_ssize_t index;
+    PyObject *py_delta = NULL;
+    void *element;
+    uint64_t delta = 1;
+    uint64_t bits;
+
+    if (!PyArg_ParseTuple(args, "n|O", &index, &py_delta))
+        goto error_return;
 
-    // Initialize this to the default of None.
-    timeout.is_none = 1;
+    if (!test_atomic_array_validity(self, 1))
+        goto error_return;
 
-    if (!PyArg_ParseTupleAndKeywords(args, keywords, "|O&", keyword_list,
-                                     convert_timeout, &timeout))
+    if (!(element = atomic_array_element(self, index)))
         goto error_return;
 
-    if (!self->receive_permitted) {
-        PyErr_SetString(pPermissionsException, "The queue is not open for reading");
+    if (py_delta && !atomic_array_from_python(self, py_delta, 1, &delta))
         goto error_return;
-    }
 
-    msg = (char *)malloc(self->max_message_size);
+    if (4 == self->dtype->itemsize)
+        bits = __atomic_fetch_add((uint32_t *)element, (uint32_t)delta, __ATOMIC_SEQ_CST);
+    else
+        bits = __atomic_fetch_add((uint64_t *)element, delta, __ATOMIC_SEQ_CST);
 
-    if (!msg) {
-        PyErr_SetString(PyExc_MemoryError, "Out of memory");
+    return atomic_array_to_python(self, bits);
+
+    error_return:
+    return NULL;
+}
+
+
+static PyObject *
+AtomicArray_compare_exchange(AtomicArray *self, PyObject *args) {
+    Py_ssize_t index;
+    PyObject *py_expected;
+    PyObject *py_desired;
+    void *element;
+    uint64_t expected;
+    uint64_t desired;
+    uint32_t expected32;
+
+    if (!PyArg_ParseTuple(args, "nOO", &index, &py_expected, &py_desired))
+        goto error_return;
+
+    if (!test_atomic_array_validity(self, 1))
         goto error_return;
+
+    if (!(element = atomic_array_element(self, index)))
+        goto error_return;
+
+    if (!atomic_array_from_python(self, py_expected, 0, &expected))
+        goto error_return;
+
+    if (!atomic_array_from_python(self, py_desired, 0, &desired))
+        goto error_return;
+
+    // On failure, the builtin writes the current value into expected. On
+    // success, expected already holds the value that was there. Either way
+    // the caller gets the value that was there before the call.
+    if (4 == self->dtype->itemsize) {
+        expected32 = (uint32_t)expected;
+        __atomic_compare_exchange_n((uint32_t *)element, &expected32, (uint32_t)desired, 0,
+                                    __ATOMIC_SEQ_CST, __ATOMIC_SEQ_CST);
+        expected = expected32;
     }
+    else
+        __atomic_compare_exchange_n((uint64_t *)element, &expected, desired, 0,
+                                    __ATOMIC_SEQ_CST, __ATOMIC_SEQ_CST);
 
-    Py_BEGIN_ALLOW_THREADS
-    // timeout == None: no timeout, i.e. wait forever.
-    // timeout >= 0: wait no longer than t seconds before raising an error.
-    if (timeout.is_none) {
-        DPRINTF("Calling mq_receive(), mqd=%ld; msg buffer length = %ld\n",
-                (long)self->mqd, self->max_message_size);
-        size = mq_receive(self->mqd, msg, self->max_message_size, &priority);
+    return atomic_array_to_python(self, expected);
+
+    error_return:
+    return NULL;
+}
+
+
+static void
+atomic_array_copy_out(AtomicArray *self, char *destination) {
+    // Copies every element to destination with relaxed atomic loads, so each
+    // element is intact, although the elements might not all have been
+    // read at the same instant.
+    Py_ssize_t i;
+
+    if (4 == self->dtype->itemsize) {
+        uint32_t *source = (uint32_t *)self->data;
+        uint32_t *target = (uint32_t *)destination;
+        for (i = 0; i < self->length; i++)
+            target[i] = __atomic_load_n(&source[i], __ATOMIC_RELAXED);
     }
     else {
-        // Timeout is not None (i.e. is numeric)
-        DPRINTF("Calling mq_timedreceive(), mqd=%ld; msg buffer length = %ld\n",
-                (long)self->mqd, self->max_message_size);
-        DPRINTF("timeout tv_sec = %ld; timeout tv_nsec = %ld\n",
-                timeout.timestamp.tv_sec,
-                timeout.timestamp.tv_nsec);
-
-        size = mq_timedreceive(self->mqd, msg, self->max_message_size,
-                               &priority, &(timeout.timestamp));
+        uint64_t *source = (uint64_t *)self->data;
+        uint64_t *target = (uint64_t *)destination;
+        for (i = 0; i < self->length; i++)
+            target[i] = __atomic_load_n(&source[i], __ATOMIC_RELAXED);
     }
-    Py_END_ALLOW_THREADS
+}
 
-    if (-1 == size) {
-        switch (errno) {
-            case EBADF:
-            case EINVAL:
-                // The POSIX spec & Linux doc say that EINVAL has three
-                // meanings --
-                // 1) self->mqd is not open for reading
-                // 2) timeout is < 0 or > one billion.
-                // 3) msg len is out of range.
-                // Since my code above guards against out-of-range
-                // params, I expect only the first condition.
-                PyErr_SetString(pExistentialException,
-                                "The message queue does not exist or is not open for reading");
-            break;
 
-            case EINTR:
-                /* If the signal was generated by Ctrl-C, calling
-                PyErr_CheckSignals() here has the side effect of setting
-                Python's error indicator. Otherwise there's a good chance
-                it won't be set.
-                http://groups.google.com/group/comp.lang.python/browse_thread/thread/ada39e984dfc3da6/fd6becbdce91a6be?#fd6becbdce91a6be
-                */
-                PyErr_CheckSignals();
+static PyObject *
+AtomicArray_snapshot(AtomicArray *self, PyObject *args, PyObject *keywords) {
+    PyObject *out = Py_None;
+    PyObject *py_bytes = NULL;
+    PyObject *py_view = NULL;
+    PyObject *retval = NULL;
+    Py_buffer buffer;
+    Py_ssize_t size;
+    static char *keyword_list[ ] = {"out", NULL};
 
-                if (!(PyErr_Occurred() &&
-                      PyErr_ExceptionMatches(PyExc_KeyboardInterrupt))
-                   ) {
-                    PyErr_Clear();
-                    PyErr_SetString(pSignalException,
-                                    "The wait was interrupted by a signal");
-                }
-                // else
-                    // If KeyboardInterrupt error is set, I propogate that
-                    // up to the caller.
-            break;
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "|O", keyword_list, &out))
+        goto error_return;
 
-            case EAGAIN:
-            case ETIMEDOUT:
-                PyErr_SetString(pBusyException, "The queue is empty");
-            break;
+    if (!test_atomic_array_validity(self, 0))
+        goto error_return;
 
-            default:
-                PyErr_SetFromErrno(PyExc_OSError);
-            break;
-        }
+    size = self->length * self->dtype->itemsize;
 
-        goto error_return;
+    if (Py_None == out) {
+        // Return a typed memoryview of a new bytearray. NumPy can wrap it
+        // without copying via numpy.frombuffer() or numpy.asarray().
+        if (!(py_bytes = PyByteArray_FromStringAndSize(NULL, size)))
+            goto error_return;
+
+        atomic_array_copy_out(self, PyByteArray_AS_STRING(py_bytes));
+
+        if (!(py_view = PyMemoryView_FromObject(py_bytes)))
+            goto error_return;
+
+        retval = PyObject_CallMethod(py_view, "cast", "s", self->dtype->format);
     }
+    else {
+        if (-1 == PyObject_GetBuffer(out, &buffer, PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS))
+            goto error_return;
 
-    py_return_tuple = Py_BuildValue("NN",
-                                    PyBytes_FromStringAndSize(msg, size),
-                                    PyLong_FromLong((long)priority)
-                                   );
+        if ((buffer.len < size) || ((uintptr_t)buffer.buf % self->dtype->itemsize)) {
+            PyBuffer_Release(&buffer);
+            PyErr_Format(PyExc_ValueError,
+                         "out must be an aligned buffer of at least %zd bytes", size);
+            goto error_return;
+        }
 
-    free(msg);
+        atomic_array_copy_out(self, (char *)buffer.buf);
+        PyBuffer_Release(&buffer);
 
-    return py_return_tuple;
+        Py_INCREF(out);
+        retval = out;
+    }
 
     error_return:
-    free(msg);
+    Py_XDECREF(py_bytes);
+    Py_XDECREF(py_view);
 
-    return NULL;
+    return retval;
 }
 
 
 static PyObject *
-MessageQueue_unlink(MessageQueue *self) {
-    return my_mq_unlink(self->name);
+AtomicArray_close(AtomicArray *self) {
+    if (!test_atomic_array_validity(self, 0))
+        goto error_return;
+
+    if (-1 == munmap(self->mapping, self->mapping_size)) {
+        PyErr_SetFromErrno(PyExc_OSError);
+        goto error_return;
+    }
+
+    self->mapping = NULL;
+    self->data = NULL;
+
+    Py_RETURN_NONE;
+
+    error_return:
+    return NULL;
 }
 
 
-void dprint_current_thread_id(void) {
-    // Debug print only. Note that calling PyThreadState_Get() when there's
-    // no current thread is a fatal error, so calling this can crash your
-    // app.
-    DPRINTF("Current thread has id %lx\n", PyThreadState_Get()->thread_id);
+static Py_ssize_t
+AtomicArray_length(AtomicArray *self) {
+    return self->length;
 }
 
 
-void process_notification(union sigval notification_data) {
-    /* Invoked by the system in a new thread as notification of a message
-       arriving in the queue. */
-    PyObject *py_args;
-    PyObject *py_result;
-    MessageQueue *self = notification_data.sival_ptr;
-    PyObject *callback_function = NULL;
-    PyObject *callback_param = NULL;
-    PyGILState_STATE gstate;
+static PyObject *
+AtomicArray_get_dtype(AtomicArray *self) {
+    return PyUnicode_FromString(self->dtype->name);
+}
 
-    DPRINTF("C thread %lx invoked, calling PyGILState_Ensure()\n", (unsigned long)pthread_self());
 
-    gstate = PyGILState_Ensure();
+static PyObject *
+atomic_array_repr(AtomicArray *self) {
+    return PyUnicode_FromFormat("<posix_ipc.AtomicArray dtype=%s length=%zd>",
+                                self->dtype->name, self->length);
+}
 
-    /* Notifications are one-offs; the caller must re-register if he wants
-       more. Therefore I must discard my pointers to the callback function
-       and param after the callback is complete.
+/*   =====  End Atomic Array implementation functions ===== */
 
-       But the caller may want to re-request notification during the callback.
-       If he does so, MessageQueue_request_notification() will be invoked
-       and self->notification_callback and ->notification_callback_param
-       will get overwritten. Therefore I need to make copies of them here
-       under the assumption that my self-> pointers won't survive the
-       callback and DECREF them after the callback is complete.
-    */
-    callback_function = self->notification_callback;
-    callback_param = self->notification_callback_param;
-    self->notification_callback = NULL;
-    self->notification_callback_param = NULL;
 
-    // Perform the callback.
-    DPRINTF("Performing the callback...\n");
-    py_args = Py_BuildValue("(O)", callback_param);
-    py_result = PyObject_CallObject(callback_function, py_args);
-    Py_DECREF(py_args);
+/*   =====  Begin Semaphore Array implementation functions ===== */
 
-    // If py_result is NULL, the call failed. However, I want to return
-    // control to the main thread before I raise an error, so I deal with
-    // py_result later.
+#ifdef UNNAMED_SEMAPHORE_EXISTS
 
-    DPRINTF("Done calling\n");
+// SemaphoreArray's constructor checks the type of its shared_memory
+// argument, so it needs this before the type's meta stuff is defined.
+static PyTypeObject SharedMemoryType;
 
-    // Now I can clean these up safely.
-    Py_XDECREF(callback_function);
-    Py_XDECREF(callback_param);
+static size_t
+semaphore_array_size(Py_ssize_t count) {
+    return SEMAPHORE_ARRAY_HEADER_SIZE + ((size_t)count * sizeof(sem_t));
+}
 
-    if (!py_result) {
-        DPRINTF("Invoking the callback failed\n");
-        // FIXME - setting the error indicator here doesn't seem to
-        // propogate up to the main thread, so I can't figure out how to
-        // squawk if the callback fails.
-        //PyErr_SetString(pBaseException, "Invoking the callback failed");
+
+static int
+semaphore_array_initialize(SemaphoreArrayHeader *header, sem_t *semaphores,
+                           Py_ssize_t count, unsigned int initial_value) {
+    // Initializes the semaphores (if no other process has done so or is
+    // doing so) and then waits briefly for them to be ready. Returns 0 on
+    // success, otherwise sets an exception and returns -1.
+    uint32_t magic = 0;
+    Py_ssize_t i;
+    int j;
+
+    if (__atomic_compare_exchange_n(&(header->magic), &magic, SEMAPHORE_ARRAY_INITIALIZING,
+                                    0, __ATOMIC_ACQ_REL, __ATOMIC_ACQUIRE)) {
+        // This process is the initializer.
+        for (i = 0; i < count; i++) {
+            if (-1 == sem_init(&(semaphores[i]), 1, initial_value)) {
+                PyErr_SetFromErrno(PyExc_OSError);
+                // Let another process try.
+                __atomic_store_n(&(header->magic), 0, __ATOMIC_RELEASE);
+                return -1;
+            }
+        }
+        header->count = (uint32_t)count;
+        // Tells processes waiting below that the semaphores are ready.
+        __atomic_store_n(&(header->magic), SEMAPHORE_ARRAY_MAGIC, __ATOMIC_RELEASE);
+        return 0;
     }
 
-    Py_XDECREF(py_result);
+    // Another process initialized them, or is initializing them.
+    for (j = 0; ; j++) {
+        magic = __atomic_load_n(&(header->magic), __ATOMIC_ACQUIRE);
+        if (SEMAPHORE_ARRAY_MAGIC == magic)
+            break;
+        if ((SEMAPHORE_ARRAY_INITIALIZING != magic) || (j >= SHARED_STATE_WAIT_MILLISECONDS)) {
+            PyErr_SetString(PyExc_ValueError,
+                            (SEMAPHORE_ARRAY_INITIALIZING == magic) ?
+                                "The semaphore array was never initialized" :
+                                "The shared memory holds something other than a semaphore array");
+            return -1;
+        }
+        usleep(1000);
+    }
 
-    /* Release the thread. No Python API allowed beyond this point. */
-    DPRINTF("Calling PyGILState_Release()\n");
-    PyGILState_Release(gstate);
+    if (header->count != (uint32_t)count) {
+        PyErr_Format(PyExc_ValueError, "The semaphore array was created with %u semaphores",
+                     header->count);
+        return -1;
+    }
+
+    return 0;
+}
 
-    DPRINTF("exiting thread\n");
-};
 
 static PyObject *
-MessageQueue_request_notification(MessageQueue *self, PyObject *args,
-                                  PyObject *keywords) {
-    struct sigevent notification;
-    PyObject *py_callback = NULL;
-    PyObject *py_callback_param = NULL;
-    PyObject *py_notification = Py_None;
-    int param_is_ok = 1;
-    static char *keyword_list[ ] = {"notification", NULL};
+SemaphoreArray_new(PyTypeObject *type, PyObject *args, PyObject *kwlist) {
+    SemaphoreArray *self;
 
-    // request_notification(notification = None)
+    self = (SemaphoreArray *)type->tp_alloc(type, 0);
 
-    if (!PyArg_ParseTupleAndKeywords(args, keywords, "|O", keyword_list,
-                                     &py_notification))
+    return (PyObject *)self;
+}
+
+
+static int
+SemaphoreArray_init(SemaphoreArray *self, PyObject *args, PyObject *keywords) {
+    SharedMemory *shm = NULL;
+    Py_ssize_t count = 0;
+    Py_ssize_t offset = 0;
+    unsigned int initial_value = 0;
+    struct stat file_info;
+    off_t map_offset;
+    size_t map_size;
+    void *mapping;
+    static char *keyword_list[ ] = {"shared_memory", "count", "offset", "initial_value", NULL};
+
+    // First things first -- initialize the self struct.
+    self->mapping = NULL;
+    self->mapping_size = 0;
+    self->semaphores = NULL;
+    self->count = 0;
+    self->offset = 0;
+
+    // SemaphoreArray(shared_memory, count, [offset = 0, [initial_value = 0]])
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "O!n|nI", keyword_list,
+                                     &SharedMemoryType, &shm, &count, &offset,
+                                     &initial_value))
         goto error_return;
 
-    // py_notification can be None ==> cancel, an int ==> signal,
-    // or a tuple of (callback function, param)
-    if (py_notification == Py_None) {
-        notification.sigev_notify = SIGEV_NONE;
+    if ((count <= 0) || (count > UINT32_MAX)) {
+        PyErr_SetString(PyExc_ValueError, "The count must be greater than 0");
+        goto error_return;
     }
-    else if (PyLong_Check(py_notification))
-    {
-        notification.sigev_notify = SIGEV_SIGNAL;
-        notification.sigev_signo = (int)PyLong_AsLong(py_notification);
+
+    if ((offset < 0) || (offset % SEMAPHORE_ARRAY_HEADER_SIZE)) {
+        PyErr_Format(PyExc_ValueError,
+                     "The offset must be a non-negative multiple of %d",
+                     SEMAPHORE_ARRAY_HEADER_SIZE);
+        goto error_return;
     }
-    else if (PyTuple_Check(py_notification)) {
-        notification.sigev_notify = SIGEV_THREAD;
 
-        if (2 == PyTuple_Size(py_notification)) {
-            py_callback = PyTuple_GetItem(py_notification, 0);
-            py_callback_param = PyTuple_GetItem(py_notification, 1);
+    if (initial_value > SEM_VALUE_MAX) {
+        PyErr_SetString(PyExc_ValueError, "The initial value must be <= SEMAPHORE_VALUE_MAX");
+        goto error_return;
+    }
 
-            if (!PyCallable_Check(py_callback))
-                param_is_ok = 0;
-        }
+    if (-1 == fstat(shm->fd, &file_info)) {
+        if ((EBADF == errno) || (EINVAL == errno))
+            PyErr_SetString(pExistentialException, "The segment does not exist");
         else
-            param_is_ok = 0;
+            PyErr_SetFromErrno(PyExc_OSError);
+        goto error_return;
     }
-    else
-        param_is_ok = 0;
 
-    if (!param_is_ok) {
-        PyErr_SetString(PyExc_ValueError,
-                        "The notification must be None, an integer, or a tuple of (function, parameter)");
+    if ((offset > file_info.st_size) ||
+        (semaphore_array_size(count) > (size_t)(file_info.st_size - offset))) {
+        PyErr_SetString(PyExc_ValueError, "The array doesn't fit in the segment");
         goto error_return;
     }
 
-    // At this point the param is either None, in which case I want to
-    // cancel any existing notification request, or it is requesting
-    // signal or thread notification, in which case I also want to cancel
-    // any existing notification request.
-    mq_cancel_notification(self);
+    map_offset = (off_t)(offset - (offset % (Py_ssize_t)page_size()));
+    map_size = (size_t)(offset - map_offset) + semaphore_array_size(count);
 
-    if (SIGEV_THREAD == notification.sigev_notify) {
-        // I have to do a bit more work before calling mq_notify().
+    mapping = mmap(NULL, map_size, PROT_READ | PROT_WRITE, MAP_SHARED, shm->fd, map_offset);
 
-        // Store the new callback & param in self
-        Py_INCREF(py_callback);
-        Py_INCREF(py_callback_param);
-        self->notification_callback = py_callback;
-        self->notification_callback_param = py_callback_param;
+    if (MAP_FAILED == mapping) {
+        if (EACCES == errno)
+            PyErr_SetString(pPermissionsException,
+                            "A semaphore array needs a segment that's open for writing");
+        else
+            PyErr_SetFromErrno(PyExc_OSError);
+        goto error_return;
+    }
 
-        // Set up notification struct for passing to mq_notify()
-        notification.sigev_value.sival_ptr = self;
-        notification.sigev_notify_function = process_notification;
-        notification.sigev_notify_attributes = NULL;
+    self->mapping = mapping;
+    self->mapping_size = map_size;
+    self->semaphores = (sem_t *)((char *)mapping + (offset - map_offset) +
+                                 SEMAPHORE_ARRAY_HEADER_SIZE);
+    self->count = count;
+    self->offset = offset;
 
-        dprint_current_thread_id();
-    }
+    if (-1 == semaphore_array_initialize((SemaphoreArrayHeader *)((char *)mapping +
+                                                                  (offset - map_offset)),
+                                         self->semaphores, count, initial_value))
+        goto error_return;
 
-    if (SIGEV_NONE != notification.sigev_notify) {
-        // request notification
-        if (-1 == mq_notify(self->mqd, &notification)) {
-            switch (errno) {
-                case EBUSY:
-                    PyErr_SetString(pBusyException,
-                        "The queue is already delivering notifications elsewhere");
-                break;
+    return 0;
 
-                default:
-                    PyErr_SetFromErrno(PyExc_OSError);
-                break;
-            }
+    error_return:
+    return -1;
+}
 
-            // If setting up the notification failed, there's no reason to
-            // hang on to these references.
-            Py_XDECREF(self->notification_callback);
-            self->notification_callback = NULL;
-            Py_XDECREF(self->notification_callback_param);
-            self->notification_callback_param = NULL;
 
-            goto error_return;
-        }
+static void
+SemaphoreArray_dealloc(SemaphoreArray *self) {
+    DPRINTF("dealloc\n");
+    // The semaphores aren't destroyed because other processes may still be
+    // using them. A thread blocked in acquire() holds a reference to the
+    // array, so there can't be any waiters here.
+    if (self->mapping)
+        munmap(self->mapping, self->mapping_size);
+
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+
+static sem_t *
+semaphore_array_element(SemaphoreArray *self, Py_ssize_t index) {
+    // Returns the address of the semaphore at index (which may be negative)
+    // or sets an exception and returns NULL.
+    if (!self->mapping) {
+        PyErr_SetString(pExistentialException, "The array has been closed");
+        return NULL;
     }
 
-    DPRINTF("exiting MessageQueue_request_notification()\n");
+    if (index < 0)
+        index += self->count;
 
-    Py_RETURN_NONE;
+    if ((index < 0) || (index >= self->count)) {
+        PyErr_SetString(PyExc_IndexError, "The index is out of range");
+        return NULL;
+    }
 
-    error_return:
-    return NULL;
+    return &(self->semaphores[index]);
 }
 
 
 static PyObject *
-MessageQueue_close(MessageQueue *self) {
-    if (-1 == mq_close(self->mqd)) {
-        switch (errno) {
-            case EINVAL:
-            case EBADF:
-                PyErr_SetString(pExistentialException,
-                                "The queue does not exist");
-            break;
+SemaphoreArray_acquire(SemaphoreArray *self, PyObject *args, PyObject *keywords) {
+    Py_ssize_t index;
+    NoneableTimeout timeout;
+    sem_t *semaphore;
+    int rc;
+    static char *keyword_list[] = {"index", "timeout", NULL};
 
-            default:
-                PyErr_SetFromErrno(PyExc_OSError);
-            break;
-        }
+    // Initialize this to the default of None.
+    timeout.is_none = 1;
+
+    // acquire(index, [timeout=None])
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "n|O&", keyword_list,
+                                     &index, convert_timeout, &timeout))
+        goto error_return;
+
+    if (!(semaphore = semaphore_array_element(self, index)))
         goto error_return;
+
+    // Skip the GIL dance when the semaphore is available, which is the
+    // common case for per-slot signaling.
+    rc = sem_trywait(semaphore);
+    if ((-1 == rc) && (EAGAIN == errno) && (timeout.is_none || !timeout.is_zero)) {
+        // The count is only touched with the GIL held.
+        self->waiters++;
+        Py_BEGIN_ALLOW_THREADS
+        rc = semaphore_wait(semaphore, &timeout);
+        Py_END_ALLOW_THREADS
+        self->waiters--;
     }
-    else {
-        // Close was successful so the handle is no longer valid.
-        self->mqd = POSIX_IPC_MQ_NO_VALUE;
+
+    if (-1 == rc) {
+        DPRINTF("sem_wait() rc = %d, errno = %d\n", rc, errno);
+        set_semaphore_wait_error();
+        goto error_return;
     }
 
     Py_RETURN_NONE;
@@ -1914,214 +2899,2542 @@ MessageQueue_close(MessageQueue *self) {
 }
 
 
-PyObject *
-MessageQueue_get_mqd(MessageQueue *self) {
-    // This is a little awkward because an mqd is a void * under Solaris
-    // and an int under Linux. I cast it and hope for the best.    :-/
-    return PyLong_FromLong((long)self->mqd);
-}
-
-
-PyObject *
-MessageQueue_fileno(MessageQueue *self) {
-    return MessageQueue_get_mqd(self);
-}
+static PyObject *
+SemaphoreArray_release(SemaphoreArray *self, PyObject *args) {
+    Py_ssize_t index;
+    sem_t *semaphore;
 
+    if (!PyArg_ParseTuple(args, "n", &index))
+        goto error_return;
 
-PyObject *
-MessageQueue_get_block(MessageQueue *self) {
-    struct mq_attr attr;
+    if (!(semaphore = semaphore_array_element(self, index)))
+        goto error_return;
 
-    if (-1 == mq_get_attrs(self->mqd, &attr))
-        return NULL;
-    else {
-        if (attr.mq_flags & O_NONBLOCK)
-            Py_RETURN_FALSE;
+    if (-1 == sem_post(semaphore)) {
+        if (EOVERFLOW == errno)
+            PyErr_SetString(PyExc_ValueError,
+                            "The semaphore's value would exceed SEMAPHORE_VALUE_MAX");
         else
-            Py_RETURN_TRUE;
+            PyErr_SetFromErrno(PyExc_OSError);
+        goto error_return;
     }
-}
 
+    Py_RETURN_NONE;
 
-static int
-MessageQueue_set_block(MessageQueue *self, PyObject *value) {
-    struct mq_attr attr;
+    error_return:
+    return NULL;
+}
 
-    attr.mq_flags = PyObject_IsTrue(value) ? 0 : O_NONBLOCK;
 
-    if (-1 == mq_setattr(self->mqd, &attr, NULL)) {
-        switch (errno) {
-            case EBADF:
-                PyErr_SetString(pExistentialException,
-                                "The queue does not exist");
-            break;
+#ifdef SEM_GETVALUE_EXISTS
+static PyObject *
+SemaphoreArray_value(SemaphoreArray *self, PyObject *args) {
+    Py_ssize_t index;
+    sem_t *semaphore;
+    int value;
 
-            default:
-                PyErr_SetFromErrno(PyExc_OSError);
-            break;
-        }
+    if (!PyArg_ParseTuple(args, "n", &index))
+        goto error_return;
 
+    if (!(semaphore = semaphore_array_element(self, index)))
+        goto error_return;
+
+    if (-1 == sem_getvalue(semaphore, &value)) {
+        PyErr_SetFromErrno(PyExc_OSError);
         goto error_return;
     }
 
-    return 0;
+    return PyLong_FromLong((long)value);
 
     error_return:
-    return -1;
+    return NULL;
+}
+#endif
+
+
+static PyObject *
+SemaphoreArray_close(SemaphoreArray *self) {
+    if (!self->mapping) {
+        PyErr_SetString(pExistentialException, "The array has been closed");
+        goto error_return;
+    }
+
+    if (self->waiters) {
+        PyErr_SetString(pBusyException, "Another thread is waiting on the array");
+        goto error_return;
+    }
+
+    if (-1 == munmap(self->mapping, self->mapping_size)) {
+        PyErr_SetFromErrno(PyExc_OSError);
+        goto error_return;
+    }
+
+    self->mapping = NULL;
+    self->semaphores = NULL;
+
+    Py_RETURN_NONE;
+
+    error_return:
+    return NULL;
+}
+
+
+static PyObject *
+SemaphoreArray_size_of(PyObject *unused, PyObject *args) {
+    Py_ssize_t count;
+
+    if (!PyArg_ParseTuple(args, "n", &count))
+        return NULL;
+
+    if (count < 0) {
+        PyErr_SetString(PyExc_ValueError, "The count must not be negative");
+        return NULL;
+    }
+
+    return PyLong_FromSize_t(semaphore_array_size(count));
+}
+
+
+static Py_ssize_t
+SemaphoreArray_length(SemaphoreArray *self) {
+    return self->count;
+}
+
+
+static PyObject *
+semaphore_array_repr(SemaphoreArray *self) {
+    return PyUnicode_FromFormat("<posix_ipc.SemaphoreArray count=%zd offset=%zd>",
+                                self->count, self->offset);
+}
+
+#endif
+
+/*   =====  End Semaphore Array implementation functions ===== */
+
+
+/*   =====  Begin Message Queue implementation functions ===== */
+
+#ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
+
+static PyObject *
+mq_str(MessageQueue *self) {
+    return generic_str(self->name);
+}
+
+static PyObject *
+mq_repr(MessageQueue *self) {
+    char mode[32];
+    char read[32];
+    char write[32];
+
+    strcpy(read, self->receive_permitted ? "True" : "False");
+    strcpy(write, self->send_permitted ? "True" : "False");
+    mode_to_str(self->mode, mode);
+
+    if (self->codec)
+        return PyUnicode_FromFormat("posix_ipc.MessageQueue(\"%s\", mode=%s, max_message_size=%ld, max_messages=%ld, read=%s, write=%s, codec=%R)",
+                    self->name, mode, self->max_message_size, self->max_messages,
+                    read, write, self->codec);
+
+    return PyUnicode_FromFormat("posix_ipc.MessageQueue(\"%s\", mode=%s, max_message_size=%ld, max_messages=%ld, read=%s, write=%s)",
+                self->name, mode, self->max_message_size, self->max_messages,
+                read, write);
+}
+
+
+void
+mq_cancel_notification(MessageQueue *self) {
+    // Based on the documentation, mq_notify() can only fail in this context
+    // if mqd is invalid. That will only occur if the queue has been
+    // destroyed, in which case notifications are effectively cancelled
+    // anyway. Therefore I don't care about the return code from mq_notify()
+    // and this function is always successful.
+
+    // I hope this doesn't come back to bite me...
+    #pragma GCC diagnostic push
+    #pragma GCC diagnostic ignored "-Wunused-but-set-variable"
+    int rc;
+
+    rc = mq_notify(self->mqd, NULL);
+    DPRINTF("Notification cancelled, rc=%d\n", rc);
+    #pragma GCC diagnostic pop
+
+    Py_XDECREF(self->notification_callback);
+    self->notification_callback = NULL;
+    Py_XDECREF(self->notification_callback_param);
+    self->notification_callback_param = NULL;
+}
+
+
+static PyObject *
+my_mq_unlink(const char *name) {
+    DPRINTF("unlinking mq name %s\n", name);
+    if (-1 == mq_unlink(name)) {
+        switch (errno) {
+            case EACCES:
+                PyErr_SetString(pPermissionsException,
+                                "Permission denied");
+            break;
+
+            case ENOENT:
+            case EINVAL:
+                PyErr_SetString(pExistentialException,
+                                "No queue exists with the specified name");
+            break;
+
+            case ENAMETOOLONG:
+                PyErr_SetString(PyExc_ValueError, "The name is too long");
+            break;
+
+            default:
+                PyErr_SetFromErrno(PyExc_OSError);
+            break;
+        }
+        goto error_return;
+    }
+
+    Py_RETURN_NONE;
+
+    error_return:
+    return NULL;
+}
+
+
+static int
+mq_get_attrs(mqd_t mqd, struct mq_attr *attr) {
+    attr->mq_flags = 0;
+    attr->mq_maxmsg = 0;
+    attr->mq_msgsize = 0;
+    attr->mq_curmsgs = 0;
+
+    if (-1 == mq_getattr(mqd, attr)) {
+        switch (errno) {
+            case EBADF:
+            case EINVAL:
+                PyErr_SetString(pExistentialException,
+                                "The queue does not exist");
+            break;
+
+            default:
+                PyErr_SetFromErrno(PyExc_OSError);
+            break;
+        }
+
+        goto error_return;
+    }
+
+    return 0;
+
+    error_return:
+    return -1;
+}
+
+
+static long
+read_long_from_file(const char *filename) {
+    // Returns the integer value in the file (e.g. one of the files in
+    // /proc/sys/fs/mqueue), or -1 if it can't be read.
+    FILE *fp;
+    long value = -1;
+
+    fp = fopen(filename, "r");
+    if (fp) {
+        if (1 != fscanf(fp, "%ld", &value))
+            value = -1;
+        fclose(fp);
+    }
+
+    return value;
+}
+
+
+static void
+mq_get_limits(MessageQueueLimits *limits) {
+    // Populates limits with the values in effect right now, as opposed to
+    // the QUEUE_xxx_DEFAULT constants which were sniffed when the module was
+    // built (possibly on a different machine).
+    // ref: http://man7.org/linux/man-pages/man7/mq_overview.7.html
+#ifdef RLIMIT_MSGQUEUE
+    struct rlimit rlimit;
+#endif
+
+    limits->max_messages = read_long_from_file("/proc/sys/fs/mqueue/msg_max");
+    limits->max_message_size = read_long_from_file("/proc/sys/fs/mqueue/msgsize_max");
+    limits->max_queues = read_long_from_file("/proc/sys/fs/mqueue/queues_max");
+    // These two only exist under Linux >= 3.5.
+    limits->default_max_messages = read_long_from_file("/proc/sys/fs/mqueue/msg_default");
+    limits->default_max_message_size = read_long_from_file("/proc/sys/fs/mqueue/msgsize_default");
+
+    limits->rlimit_msgqueue = -1;
+#ifdef RLIMIT_MSGQUEUE
+    if ((0 == getrlimit(RLIMIT_MSGQUEUE, &rlimit)) &&
+        (RLIM_INFINITY != rlimit.rlim_cur) && (rlimit.rlim_cur <= LONG_MAX))
+        limits->rlimit_msgqueue = (long)rlimit.rlim_cur;
+#endif
+}
+
+
+static void
+mq_choose_auto_geometry(AutoableLong *max_messages, AutoableLong *max_message_size) {
+    // Replaces "auto" values with the largest values the system permits.
+    // If RLIMIT_MSGQUEUE wouldn't accommodate a queue that large, I shrink
+    // max_messages (if it's auto) and then max_message_size (if it's auto)
+    // until the queue fits. I'd rather give the caller a shallower queue
+    // than one that can't hold the messages they want to send.
+    // Note that RLIMIT_MSGQUEUE applies to all of the user's queues
+    // combined, and there's no way to know how much of it is already used,
+    // so this assumes none of it is.
+    MessageQueueLimits limits;
+    long per_message_cost;
+
+    mq_get_limits(&limits);
+
+    if (max_messages->is_auto)
+        max_messages->value = (limits.max_messages > 0) ? limits.max_messages :
+                                                          QUEUE_MESSAGES_MAX_DEFAULT;
+
+    if (max_message_size->is_auto)
+        max_message_size->value = (limits.max_message_size > 0) ? limits.max_message_size :
+                                                                  QUEUE_MESSAGE_SIZE_MAX_DEFAULT;
+
+    if ((limits.rlimit_msgqueue > 0) && (max_message_size->value > 0) &&
+        (max_messages->value > 0)) {
+        per_message_cost = max_message_size->value + QUEUE_MESSAGE_OVERHEAD_ESTIMATE;
+
+        if (max_messages->is_auto &&
+            (max_messages->value > limits.rlimit_msgqueue / per_message_cost)) {
+            max_messages->value = limits.rlimit_msgqueue / per_message_cost;
+            if (max_messages->value < 1)
+                max_messages->value = 1;
+        }
+
+        if (max_message_size->is_auto &&
+            (max_message_size->value >
+             (limits.rlimit_msgqueue / max_messages->value) - QUEUE_MESSAGE_OVERHEAD_ESTIMATE)) {
+            max_message_size->value =
+                (limits.rlimit_msgqueue / max_messages->value) - QUEUE_MESSAGE_OVERHEAD_ESTIMATE;
+            if (max_message_size->value < 1)
+                max_message_size->value = 1;
+        }
+    }
+
+    max_messages->is_auto = 0;
+    max_message_size->is_auto = 0;
+
+    DPRINTF("auto geometry: max_messages=%ld, max_message_size=%ld\n",
+            max_messages->value, max_message_size->value);
+}
+
+
+static PyObject *
+MessageQueue_new(PyTypeObject *type, PyObject *args, PyObject *kwlist) {
+    MessageQueue *self;
+
+    self = (MessageQueue *)type->tp_alloc(type, 0);
+
+    return (PyObject *)self;
+}
+
+
+static int
+MessageQueue_init(MessageQueue *self, PyObject *args, PyObject *keywords) {
+    NoneableName name;
+    char temp_name[MAX_SAFE_NAME_LENGTH + 1];
+    unsigned int flags = 0;
+    AutoableLong max_messages = {0, QUEUE_MESSAGES_MAX_DEFAULT};
+    AutoableLong max_message_size = {0, QUEUE_MESSAGE_SIZE_MAX_DEFAULT};
+    PyObject *py_read = NULL;
+    PyObject *py_write = NULL;
+    PyObject *py_codec = Py_None;
+    PyObject *py_args = NULL;
+    struct mq_attr attr;
+    static char *keyword_list[ ] = {"name", "flags", "mode", "max_messages",
+                                    "max_message_size", "read", "write", "codec", NULL};
+
+    // First things first -- initialize the self struct.
+    self->mqd = POSIX_IPC_MQ_NO_VALUE;
+    self->name = NULL;
+    self->mode = 0600;
+    self->notification_callback = NULL;
+    self->notification_callback_param = NULL;
+    self->codec = NULL;
+
+    // MessageQueue(name, flags = 0, mode=0600,
+    //              max_messages=QUEUE_MESSAGES_MAX_DEFAULT,
+    //              max_message_size=QUEUE_MESSAGE_SIZE_MAX_DEFAULT,
+    //              read = True, write = True, codec = None)
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "O&|IiO&O&OOO", keyword_list,
+                                    &convert_name_param, &name, &flags,
+                                    &(self->mode),
+                                    &convert_autoable_long, &max_messages,
+                                    &convert_autoable_long, &max_message_size,
+                                    &py_read, &py_write, &py_codec))
+        goto error_return;
+
+    if (py_codec != Py_None) {
+        // Turn a codec name into a codec object before creating anything.
+        if (!(py_args = Py_BuildValue("(O)", py_codec)))
+            goto error_return;
+        self->codec = call_python_implementation("posix_ipc._codecs", "get_codec",
+                                                 (PyObject *)self, py_args, NULL);
+        Py_DECREF(py_args);
+        if (!self->codec)
+            goto error_return;
+    }
+
+    if ( !(flags & O_CREAT) && (flags & O_EXCL) ) {
+        PyErr_SetString(PyExc_ValueError,
+                "O_EXCL must be combined with O_CREAT");
+        goto error_return;
+    }
+
+    if (name.is_none && ((flags & O_EXCL) != O_EXCL)) {
+        PyErr_SetString(PyExc_ValueError,
+                "Name can only be None if O_EXCL is set");
+        goto error_return;
+    }
+
+    // read & write flags default to True, so if the user passed True I
+    // set the object pointers to their default values of NULL. So here
+    // NULL means True and any other value means False. Sorry for being
+    // backwards.
+    if (py_read && PyObject_IsTrue(py_read)) py_read = NULL;
+
+    if (py_write && PyObject_IsTrue(py_write)) py_write = NULL;
+
+    if ((!py_read) && (!py_write)) {
+        flags |= O_RDWR;
+        self->send_permitted = 1;
+        self->receive_permitted = 1;
+    }
+
+    if ((!py_read) && (py_write)) {
+        flags |= O_RDONLY;
+        self->send_permitted = 0;
+        self->receive_permitted = 1;
+    }
+
+    if ((py_read) && (!py_write)) {
+        flags |= O_WRONLY;
+        self->send_permitted = 1;
+        self->receive_permitted = 0;
+    }
+
+    if ((py_read) && (py_write)) {
+        PyErr_SetString(PyExc_ValueError, "At least one of read or write must be True");
+        goto error_return;
+    }
+
+    // Params look OK, let's try to open/create the queue
+    if (flags & O_CREAT) {
+        // "auto" means as large as the system's current limits permit.
+        if (max_messages.is_auto || max_message_size.is_auto)
+            mq_choose_auto_geometry(&max_messages, &max_message_size);
+
+        // Set up the attr struct which is only needed when creating.
+        attr.mq_flags = (flags & O_NONBLOCK) ? O_NONBLOCK : 0;
+        attr.mq_maxmsg = max_messages.value;
+        attr.mq_msgsize = max_message_size.value;
+        attr.mq_curmsgs = 0;
+    }
+
+    if (name.is_none) {
+        // (name == None) ==> generate a name for the caller
+        do {
+            errno = 0;
+            create_random_name(temp_name);
+
+            DPRINTF("calling mq_open, name=%s, flags=0x%x, mode=0%o, maxmsg=%ld, msgsize=%ld\n",
+                    temp_name, flags, (int)self->mode, attr.mq_maxmsg, attr.mq_msgsize);
+            self->mqd = mq_open(temp_name, flags, (mode_t)self->mode, &attr);
+
+        } while ( ((mqd_t)-1 == self->mqd) && (EEXIST == errno) );
+
+        // PyMalloc memory and copy the randomly-generated name to it.
+        self->name = (char *)PyMem_Malloc(strlen(temp_name) + 1);
+        if (self->name)
+            strcpy(self->name, temp_name);
+        else {
+            PyErr_SetString(PyExc_MemoryError, "Out of memory");
+            goto error_return;
+        }
+    }
+    else {
+        // (name != None) ==> use name supplied by the caller. It was
+        // already converted to C by convert_name_param().
+        self->name = name.name;
+
+        if (flags & O_CREAT) {
+            DPRINTF("calling mq_open, name=%s, flags=0x%x, mode=0%o, maxmsg=%ld, msgsize=%ld\n",
+                    self->name, flags, (int)self->mode, attr.mq_maxmsg, attr.mq_msgsize);
+            self->mqd = mq_open(self->name, flags, (mode_t)self->mode, &attr);
+        }
+        else {
+            DPRINTF("calling mq_open, name=%s, flags=0x%x\n", self->name, flags);
+            self->mqd = mq_open(self->name, flags);
+        }
+    }
+
+    DPRINTF("mqd = %ld\n", (long)self->mqd);
+
+    if ((mqd_t)-1 == self->mqd) {
+        switch (errno) {
+            case EINVAL:
+                PyErr_SetString(PyExc_ValueError, "Invalid parameter(s)");
+            break;
+
+            case ENOSPC:
+                PyErr_SetString(PyExc_OSError,
+                                "Insufficient space for a new queue");
+            break;
+
+            case EACCES:
+                PyErr_SetString(pPermissionsException, "Permission denied");
+            break;
+
+            case EEXIST:
+                PyErr_SetString(pExistentialException,
+                        "A queue with the specified name already exists");
+            break;
+
+            case ENOENT:
+                PyErr_SetString(pExistentialException,
+                                "No queue exists with the specified name");
+            break;
+
+            case EMFILE:
+                PyErr_SetString(PyExc_OSError,
+                    "This process already has the maximum number of files open");
+            break;
+
+            case ENFILE:
+                PyErr_SetString(PyExc_OSError,
+                    "The system limit on the total number of open files has been reached");
+            break;
+
+            case ENAMETOOLONG:
+                PyErr_SetString(PyExc_ValueError, "The name is too long");
+            break;
+
+            case ENOMEM:
+                PyErr_SetString(PyExc_MemoryError, "Not enough memory");
+            break;
+
+            default:
+                PyErr_SetFromErrno(PyExc_OSError);
+            break;
+        }
+
+        goto error_return;
+    }
+
+    // self->mqd and self->name are already populated. Here's where I get
+    // the other two values.
+    if (0 == mq_get_attrs(self->mqd, &attr)) {
+        self->max_messages = attr.mq_maxmsg;
+        self->max_message_size = attr.mq_msgsize;
+    }
+    else {
+        // Oy vey, something has gone very wrong. The call to mq_open()
+        // succeeded but mq_getattr() failed?!?
+        PyErr_Clear();
+        PyErr_SetString(pBaseException, "Unable to initialize object");
+        goto error_return;
+    }
+
+    // Last but not least, get a reference to the interpreter state. I only
+    // need this if the caller requests queue notifications that occur in
+    // a new thread, so much of the time this goes unused.
+    // It's my understanding that there's only one interpreter state to go
+    // around, so no matter which thread I get the interpreter state from,
+    // it will be the same interpreter state.
+    self->interpreter = PyThreadState_Get()->interp;
+
+    return 0;
+
+    error_return:
+    return -1;
+}
+
+
+static void
+MessageQueue_dealloc(MessageQueue *self) {
+    DPRINTF("dealloc\n");
+    PyMem_Free(self->name);
+    self->name = NULL;
+
+    Py_XDECREF(self->notification_callback);
+    self->notification_callback = NULL;
+    Py_XDECREF(self->notification_callback_param);
+    self->notification_callback_param = NULL;
+    Py_CLEAR(self->codec);
+
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+
+static PyObject *
+MessageQueue_send(MessageQueue *self, PyObject *args, PyObject *keywords) {
+    NoneableTimeout timeout;
+    long priority = 0;
+    int rc = 0;
+    unsigned long long started = 0;
+    PyObject *py_view = NULL;
+    PyObject *py_args = NULL;
+    PyObject *py_encoded = NULL;
+    static char *keyword_list[ ] = {"message", "timeout", "priority", NULL};
+    static char args_format[] = "s*|O&l";
+    Py_buffer msg;
+
+    // Initialize this to the default of None.
+    timeout.is_none = 1;
+
+    /* In Python >= 2.5, the Python argument specifier 's#' expects a
+       py_ssize_t for its second parameter (msg.len). A ulong is long
+       enough to fit a py_ssize_t.
+       It might be too big, though, on platforms where a ulong is larger than
+       py_ssize_t. Therefore I *must* initialize it to 0 so that whatever
+       Python doesn't write to is zeroed out.
+    */
+    msg.len = 0;
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, args_format, keyword_list,
+                                     &msg,
+                                     convert_timeout, &timeout,
+                                     &priority))
+        goto error_return;
+
+    if (!self->send_permitted) {
+        PyErr_SetString(pPermissionsException, "The queue is not open for writing");
+        goto error_return;
+    }
+
+    if (self->codec) {
+        // Compress the message (with the GIL released, if the codec allows) and send the
+        // result instead. A str has already been encoded into msg, anything else is passed
+        // to the codec as is.
+        if (PyUnicode_Check(msg.obj))
+            py_view = PyBytes_FromStringAndSize(msg.buf, msg.len);
+        else
+            py_view = PyMemoryView_FromObject(msg.obj);
+        if (!py_view)
+            goto error_return;
+        py_args = Py_BuildValue("(N)", py_view);
+        py_encoded = py_args ? call_python_implementation("posix_ipc._codecs", "encode",
+                                                          (PyObject *)self, py_args, NULL)
+                             : NULL;
+        Py_XDECREF(py_args);
+        if (!py_encoded)
+            goto error_return;
+        PyBuffer_Release(&msg);
+        if (-1 == PyObject_GetBuffer(py_encoded, &msg, PyBUF_SIMPLE)) {
+            msg.obj = NULL;
+            goto error_return;
+        }
+    }
+
+    if (msg.len > self->max_message_size) {
+        PyErr_Format(PyExc_ValueError,
+                     "The message must be no longer than %ld bytes",
+                     self->max_message_size);
+    }
+
+    if ((priority < 0) || (priority > QUEUE_PRIORITY_MAX)) {
+        PyErr_Format(PyExc_ValueError,
+                     "The priority must be a positive number no greater than QUEUE_PRIORITY_MAX (%u)",
+                     QUEUE_PRIORITY_MAX);
+        goto error_return;
+    }
+
+    USDT_PROBE3(message_queue__send__entry, self->name, (long)msg.len, priority);
+    USDT_START_TIMER(message_queue__send__return, started);
+
+    Py_BEGIN_ALLOW_THREADS
+    // timeout == None: no timeout, i.e. wait forever.
+    // timeout >= 0: wait no longer than t seconds before raising an error.
+    if (timeout.is_none) {
+        DPRINTF("calling mq_send(), mqd=%ld, msg len=%ld, priority=%ld\n",
+                (long)self->mqd, (long)msg.len, priority);
+        rc = mq_send(self->mqd, msg.buf, msg.len, (unsigned int)priority);
+    }
+    else {
+        // Timeout is not None (i.e. is numeric)
+        DPRINTF("calling mq_timedsend(), mqd=%ld, msg len=%ld, priority=%ld\n",
+                (long)self->mqd, (long)msg.len, priority);
+        DPRINTF("timeout tv_sec = %ld; timeout tv_nsec = %ld\n",
+                timeout.timestamp.tv_sec, timeout.timestamp.tv_nsec);
+
+        rc = mq_timedsend(self->mqd, msg.buf, msg.len, (unsigned int)priority,
+                          &(timeout.timestamp));
+    }
+
+    USDT_PROBE5(message_queue__send__return, self->name, (long)msg.len, priority,
+                (-1 == rc) ? errno : 0, USDT_ELAPSED_NS(started));
+    Py_END_ALLOW_THREADS
+
+    if (-1 == rc) {
+        switch (errno) {
+            case EBADF:
+            case EINVAL:
+                // The POSIX spec & Linux doc say that EINVAL can mean --
+                // 1) self->mqd is not valid for writing
+                // 2) timeout is < 0 or > one billion.
+                // Since my code above guards against out-of-range
+                // params, I expect only the first condition.
+                PyErr_SetString(pExistentialException,
+                    "The message queue does not exist or is not open for writing");
+            break;
+
+            case EINTR:
+                /* If the signal was generated by Ctrl-C, calling
+                PyErr_CheckSignals() here has the side effect of setting
+                Python's error indicator. Otherwise there's a good chance
+                it won't be set.
+                http://groups.google.com/group/comp.lang.python/browse_thread/thread/ada39e984dfc3da6/fd6becbdce91a6be?#fd6becbdce91a6be
+                */
+                PyErr_CheckSignals();
+
+                if (!(PyErr_Occurred() &&
+                      PyErr_ExceptionMatches(PyExc_KeyboardInterrupt))
+                   ) {
+                    PyErr_Clear();
+                    PyErr_SetString(pSignalException,
+                                    "The wait was interrupted by a signal");
+                }
+                // else
+                    // If KeyboardInterrupt error is set, I propogate that
+                    // up to the caller.
+            break;
+
+            case EAGAIN:
+            case ETIMEDOUT:
+                PyErr_SetString(pBusyException, "The queue is full");
+            break;
+
+            case EMSGSIZE:
+                // This should never happen since I checked message length
+                // above, but who knows...
+                PyErr_SetString(PyExc_ValueError, "The message is too long");
+            break;
+
+            default:
+                PyErr_SetFromErrno(PyExc_OSError);
+            break;
+        }
+
+        goto error_return;
+    }
+
+    PyBuffer_Release(&msg);
+    Py_XDECREF(py_encoded);
+
+    Py_RETURN_NONE;
+
+    error_return:
+    PyBuffer_Release(&msg);
+    Py_XDECREF(py_encoded);
+    return NULL;
+}
+
+
+static PyObject *
+decode_message(MessageQueue *self, PyObject *py_message) {
+    // Returns the message (a new reference) as the sender sent it, decompressing it if the
+    // queue has a codec. Steals the reference to py_message, which may be NULL.
+    PyObject *py_args;
+
+    if (py_message && self->codec) {
+        // Decompress the message (with the GIL released, if the codec allows).
+        py_args = Py_BuildValue("(N)", py_message);
+        py_message = py_args ? call_python_implementation("posix_ipc._codecs", "decode",
+                                                          (PyObject *)self, py_args, NULL)
+                             : NULL;
+        Py_XDECREF(py_args);
+    }
+
+    return py_message;
+}
+
+
+static PyObject *
+MessageQueue_receive(MessageQueue *self, PyObject *args, PyObject *keywords) {
+    NoneableTimeout timeout;
+    char *msg = NULL;
+    unsigned int priority = 0;
+    ssize_t size = 0;
+    PyObject *py_return_tuple = NULL;
+    PyObject *py_message = NULL;
+    unsigned long long started = 0;
+    static char *keyword_list[ ] = {"timeout", NULL};
+
+    // Initialize this to the default of None.
+    timeout.is_none = 1;
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "|O&", keyword_list,
+                                     convert_timeout, &timeout))
+        goto error_return;
+
+    if (!self->receive_permitted) {
+        PyErr_SetString(pPermissionsException, "The queue is not open for reading");
+        goto error_return;
+    }
+
+    // PyMem_Malloc() rather than malloc() so that this allocation is visible
+    // to tracemalloc (see memory_leak_tests.py). The GIL is held here and
+    // when the buffer is freed, which is all that PyMem_Malloc() requires.
+    msg = (char *)PyMem_Malloc(self->max_message_size);
+
+    if (!msg) {
+        PyErr_SetString(PyExc_MemoryError, "Out of memory");
+        goto error_return;
+    }
+
+    USDT_PROBE2(message_queue__receive__entry, self->name, self->max_message_size);
+    USDT_START_TIMER(message_queue__receive__return, started);
+
+    Py_BEGIN_ALLOW_THREADS
+    // timeout == None: no timeout, i.e. wait forever.
+    // timeout >= 0: wait no longer than t seconds before raising an error.
+    if (timeout.is_none) {
+        DPRINTF("Calling mq_receive(), mqd=%ld; msg buffer length = %ld\n",
+                (long)self->mqd, self->max_message_size);
+        size = mq_receive(self->mqd, msg, self->max_message_size, &priority);
+    }
+    else {
+        // Timeout is not None (i.e. is numeric)
+        DPRINTF("Calling mq_timedreceive(), mqd=%ld; msg buffer length = %ld\n",
+                (long)self->mqd, self->max_message_size);
+        DPRINTF("timeout tv_sec = %ld; timeout tv_nsec = %ld\n",
+                timeout.timestamp.tv_sec,
+                timeout.timestamp.tv_nsec);
+
+        size = mq_timedreceive(self->mqd, msg, self->max_message_size,
+                               &priority, &(timeout.timestamp));
+    }
+
+    USDT_PROBE5(message_queue__receive__return, self->name, (long)size,
+                (long)priority, (-1 == size) ? errno : 0, USDT_ELAPSED_NS(started));
+    Py_END_ALLOW_THREADS
+
+    if (-1 == size) {
+        switch (errno) {
+            case EBADF:
+            case EINVAL:
+                // The POSIX spec & Linux doc say that EINVAL has three
+                // meanings --
+                // 1) self->mqd is not open for reading
+                // 2) timeout is < 0 or > one billion.
+                // 3) msg len is out of range.
+                // Since my code above guards against out-of-range
+                // params, I expect only the first condition.
+                PyErr_SetString(pExistentialException,
+                                "The message queue does not exist or is not open for reading");
+            break;
+
+            case EINTR:
+                /* If the signal was generated by Ctrl-C, calling
+                PyErr_CheckSignals() here has the side effect of setting
+                Python's error indicator. Otherwise there's a good chance
+                it won't be set.
+                http://groups.google.com/group/comp.lang.python/browse_thread/thread/ada39e984dfc3da6/fd6becbdce91a6be?#fd6becbdce91a6be
+                */
+                PyErr_CheckSignals();
+
+                if (!(PyErr_Occurred() &&
+                      PyErr_ExceptionMatches(PyExc_KeyboardInterrupt))
+                   ) {
+                    PyErr_Clear();
+                    PyErr_SetString(pSignalException,
+                                    "The wait was interrupted by a signal");
+                }
+                // else
+                    // If KeyboardInterrupt error is set, I propogate that
+                    // up to the caller.
+            break;
+
+            case EAGAIN:
+            case ETIMEDOUT:
+                PyErr_SetString(pBusyException, "The queue is empty");
+            break;
+
+            default:
+                PyErr_SetFromErrno(PyExc_OSError);
+            break;
+        }
+
+        goto error_return;
+    }
+
+    py_message = decode_message(self, PyBytes_FromStringAndSize(msg, size));
+    PyMem_Free(msg);
+    msg = NULL;
+
+    if (!py_message)
+        goto error_return;
+
+    py_return_tuple = Py_BuildValue("NN",
+                                    py_message,
+                                    PyLong_FromLong((long)priority)
+                                   );
+
+    return py_return_tuple;
+
+    error_return:
+    PyMem_Free(msg);
+
+    return NULL;
+}
+
+
+static PyObject *
+MessageQueue_reduce(MessageQueue *self) {
+    return reduce_handle("MessageQueue", self->name,
+                         Py_BuildValue("{sOsOsO}",
+                                       "read", self->receive_permitted ? Py_True : Py_False,
+                                       "write", self->send_permitted ? Py_True : Py_False,
+                                       "codec", self->codec ? self->codec : Py_None));
+}
+
+
+static PyObject *
+MessageQueue_unlink(MessageQueue *self) {
+    return my_mq_unlink(self->name);
+}
+
+
+static PyObject *
+MessageQueue_send_large(MessageQueue *self, PyObject *args, PyObject *keywords) {
+    return call_python_implementation("posix_ipc._large", "send_large",
+                                      (PyObject *)self, args, keywords);
+}
+
+
+static PyObject *
+MessageQueue_receive_large(MessageQueue *self, PyObject *args, PyObject *keywords) {
+    return call_python_implementation("posix_ipc._large", "receive_large",
+                                      (PyObject *)self, args, keywords);
+}
+
+
+static PyObject *
+MessageQueue_send_obj(MessageQueue *self, PyObject *args, PyObject *keywords) {
+    return call_python_implementation("posix_ipc._objects", "send_obj",
+                                      (PyObject *)self, args, keywords);
+}
+
+
+static PyObject *
+MessageQueue_receive_obj(MessageQueue *self, PyObject *args, PyObject *keywords) {
+    return call_python_implementation("posix_ipc._objects", "receive_obj",
+                                      (PyObject *)self, args, keywords);
+}
+
+
+void dprint_current_thread_id(void) {
+    // Debug print only. Note that calling PyThreadState_Get() when there's
+    // no current thread is a fatal error, so calling this can crash your
+    // app.
+    DPRINTF("Current thread has id %lx\n", PyThreadState_Get()->thread_id);
+}
+
+
+void process_notification(union sigval notification_data) {
+    /* Invoked by the system in a new thread as notification of a message
+       arriving in the queue. */
+    PyObject *py_args;
+    PyObject *py_result;
+    MessageQueue *self = notification_data.sival_ptr;
+    PyObject *callback_function = NULL;
+    PyObject *callback_param = NULL;
+    PyGILState_STATE gstate;
+    unsigned long long started = 0;
+
+    DPRINTF("C thread %lx invoked, calling PyGILState_Ensure()\n", (unsigned long)pthread_self());
+
+    // The elapsed time reported by the return probe includes the wait for
+    // the GIL.
+    USDT_PROBE1(message_queue__notification__entry, self->name);
+    USDT_START_TIMER(message_queue__notification__return, started);
+
+    gstate = PyGILState_Ensure();
+
+    /* Notifications are one-offs; the caller must re-register if he wants
+       more. Therefore I must discard my pointers to the callback function
+       and param after the callback is complete.
+
+       But the caller may want to re-request notification during the callback.
+       If he does so, MessageQueue_request_notification() will be invoked
+       and self->notification_callback and ->notification_callback_param
+       will get overwritten. Therefore I need to make copies of them here
+       under the assumption that my self-> pointers won't survive the
+       callback and DECREF them after the callback is complete.
+    */
+    callback_function = self->notification_callback;
+    callback_param = self->notification_callback_param;
+    self->notification_callback = NULL;
+    self->notification_callback_param = NULL;
+
+    // Perform the callback.
+    DPRINTF("Performing the callback...\n");
+    py_args = Py_BuildValue("(O)", callback_param);
+    py_result = PyObject_CallObject(callback_function, py_args);
+    Py_DECREF(py_args);
+
+    // If py_result is NULL, the call failed. However, I want to return
+    // control to the main thread before I raise an error, so I deal with
+    // py_result later.
+
+    DPRINTF("Done calling\n");
+
+    // Now I can clean these up safely.
+    Py_XDECREF(callback_function);
+    Py_XDECREF(callback_param);
+
+    if (!py_result) {
+        DPRINTF("Invoking the callback failed\n");
+        // FIXME - setting the error indicator here doesn't seem to
+        // propogate up to the main thread, so I can't figure out how to
+        // squawk if the callback fails.
+        //PyErr_SetString(pBaseException, "Invoking the callback failed");
+    }
+
+    USDT_PROBE3(message_queue__notification__return, self->name, py_result ? 1 : 0,
+                USDT_ELAPSED_NS(started));
+
+    Py_XDECREF(py_result);
+
+    /* Release the thread. No Python API allowed beyond this point. */
+    DPRINTF("Calling PyGILState_Release()\n");
+    PyGILState_Release(gstate);
+
+    DPRINTF("exiting thread\n");
+};
+
+static PyObject *
+MessageQueue_request_notification(MessageQueue *self, PyObject *args,
+                                  PyObject *keywords) {
+    struct sigevent notification;
+    PyObject *py_callback = NULL;
+    PyObject *py_callback_param = NULL;
+    PyObject *py_notification = Py_None;
+    int param_is_ok = 1;
+    static char *keyword_list[ ] = {"notification", NULL};
+
+    // request_notification(notification = None)
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "|O", keyword_list,
+                                     &py_notification))
+        goto error_return;
+
+    // py_notification can be None ==> cancel, an int ==> signal,
+    // or a tuple of (callback function, param)
+    if (py_notification == Py_None) {
+        notification.sigev_notify = SIGEV_NONE;
+    }
+    else if (PyLong_Check(py_notification))
+    {
+        notification.sigev_notify = SIGEV_SIGNAL;
+        notification.sigev_signo = (int)PyLong_AsLong(py_notification);
+    }
+    else if (PyTuple_Check(py_notification)) {
+        notification.sigev_notify = SIGEV_THREAD;
+
+        if (2 == PyTuple_Size(py_notification)) {
+            py_callback = PyTuple_GetItem(py_notification, 0);
+            py_callback_param = PyTuple_GetItem(py_notification, 1);
+
+            if (!PyCallable_Check(py_callback))
+                param_is_ok = 0;
+        }
+        else
+            param_is_ok = 0;
+    }
+    else
+        param_is_ok = 0;
+
+    if (!param_is_ok) {
+        PyErr_SetString(PyExc_ValueError,
+                        "The notification must be None, an integer, or a tuple of (function, parameter)");
+        goto error_return;
+    }
+
+    // At this point the param is either None, in which case I want to
+    // cancel any existing notification request, or it is requesting
+    // signal or thread notification, in which case I also want to cancel
+    // any existing notification request.
+    mq_cancel_notification(self);
+
+    if (SIGEV_THREAD == notification.sigev_notify) {
+        // I have to do a bit more work before calling mq_notify().
+
+        // Store the new callback & param in self
+        Py_INCREF(py_callback);
+        Py_INCREF(py_callback_param);
+        self->notification_callback = py_callback;
+        self->notification_callback_param = py_callback_param;
+
+        // Set up notification struct for passing to mq_notify()
+        notification.sigev_value.sival_ptr = self;
+        notification.sigev_notify_function = process_notification;
+        notification.sigev_notify_attributes = NULL;
+
+        dprint_current_thread_id();
+    }
+
+    if (SIGEV_NONE != notification.sigev_notify) {
+        // request notification
+        if (-1 == mq_notify(self->mqd, &notification)) {
+            switch (errno) {
+                case EBUSY:
+                    PyErr_SetString(pBusyException,
+                        "The queue is already delivering notifications elsewhere");
+                break;
+
+                default:
+                    PyErr_SetFromErrno(PyExc_OSError);
+                break;
+            }
+
+            // If setting up the notification failed, there's no reason to
+            // hang on to these references.
+            Py_XDECREF(self->notification_callback);
+            self->notification_callback = NULL;
+            Py_XDECREF(self->notification_callback_param);
+            self->notification_callback_param = NULL;
+
+            goto error_return;
+        }
+    }
+
+    DPRINTF("exiting MessageQueue_request_notification()\n");
+
+    Py_RETURN_NONE;
+
+    error_return:
+    return NULL;
+}
+
+
+static PyObject *
+MessageQueue_close(MessageQueue *self) {
+    if (-1 == mq_close(self->mqd)) {
+        switch (errno) {
+            case EINVAL:
+            case EBADF:
+                PyErr_SetString(pExistentialException,
+                                "The queue does not exist");
+            break;
+
+            default:
+                PyErr_SetFromErrno(PyExc_OSError);
+            break;
+        }
+        goto error_return;
+    }
+    else {
+        // Close was successful so the handle is no longer valid.
+        self->mqd = POSIX_IPC_MQ_NO_VALUE;
+    }
+
+    Py_RETURN_NONE;
+
+    error_return:
+    return NULL;
+}
+
+
+PyObject *
+MessageQueue_get_mqd(MessageQueue *self) {
+    // This is a little awkward because an mqd is a void * under Solaris
+    // and an int under Linux. I cast it and hope for the best.    :-/
+    return PyLong_FromLong((long)self->mqd);
+}
+
+
+PyObject *
+MessageQueue_fileno(MessageQueue *self) {
+    return MessageQueue_get_mqd(self);
+}
+
+
+PyObject *
+MessageQueue_get_block(MessageQueue *self) {
+    struct mq_attr attr;
+
+    if (-1 == mq_get_attrs(self->mqd, &attr))
+        return NULL;
+    else {
+        if (attr.mq_flags & O_NONBLOCK)
+            Py_RETURN_FALSE;
+        else
+            Py_RETURN_TRUE;
+    }
+}
+
+
+static int
+MessageQueue_set_block(MessageQueue *self, PyObject *value) {
+    struct mq_attr attr;
+
+    attr.mq_flags = PyObject_IsTrue(value) ? 0 : O_NONBLOCK;
+
+    if (-1 == mq_setattr(self->mqd, &attr, NULL)) {
+        switch (errno) {
+            case EBADF:
+                PyErr_SetString(pExistentialException,
+                                "The queue does not exist");
+            break;
+
+            default:
+                PyErr_SetFromErrno(PyExc_OSError);
+            break;
+        }
+
+        goto error_return;
+    }
+
+    return 0;
+
+    error_return:
+    return -1;
+}
+
+PyObject *
+MessageQueue_get_current_messages(MessageQueue *self) {
+    struct mq_attr attr;
+
+    if (-1 == mq_get_attrs(self->mqd, &attr))
+        return NULL;
+    else
+        return Py_BuildValue("k", (unsigned long)attr.mq_curmsgs);
+}
+
+// end of #ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
+#endif
+
+
+/*   =====  End Message Queue implementation functions ===== */
+
+
+/*   =====  Begin Robust Lock implementation functions ===== */
+
+#ifdef ROBUST_MUTEX_EXISTS
+
+static PyObject *
+robust_lock_str(RobustLock *self) {
+    return generic_str(self->name);
+}
+
+
+static PyObject *
+robust_lock_repr(RobustLock *self) {
+    char mode[32];
+
+    mode_to_str(self->mode, mode);
+
+    return PyUnicode_FromFormat("posix_ipc.RobustLock(\"%s\", mode=%s)",
+                                self->name, mode);
+}
+
+
+static PyObject *
+RobustLock_new(PyTypeObject *type, PyObject *args, PyObject *kwlist) {
+    RobustLock *self;
+
+    self = (RobustLock *)type->tp_alloc(type, 0);
+
+    return (PyObject *)self;
+}
+
+
+static int
+RobustLock_init(RobustLock *self, PyObject *args, PyObject *keywords) {
+    NoneableName name;
+    unsigned int flags = 0;
+    int created = 0;
+    pthread_mutexattr_t attr;
+    int rc;
+    static char *keyword_list[ ] = {"name", "flags", "mode", NULL};
+
+    // First things first -- initialize the self struct.
+    self->name = NULL;
+    self->state = NULL;
+    self->mode = 0600;
+    self->owner_died = 0;
+    self->waiters = 0;
+    self->held = 0;
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "O&|Ii", keyword_list,
+                                     &convert_name_param, &name, &flags,
+                                     &(self->mode)))
+        goto error_return;
+
+    self->state = (RobustLockState *)open_shared_state(&name, flags, self->mode,
+                                                       sizeof(RobustLockState),
+                                                       ROBUST_LOCK_MAGIC,
+                                                       &(self->name), &created);
+    if (!self->state)
+        goto error_return;
+
+    if (created) {
+        // The mutex is robust so that it's released if its owner dies, and
+        // error-checking so that a thread that tries to acquire it twice or
+        // release it without owning it gets an error rather than a hang.
+        pthread_mutexattr_init(&attr);
+        pthread_mutexattr_setpshared(&attr, PTHREAD_PROCESS_SHARED);
+        pthread_mutexattr_setrobust(&attr, PTHREAD_MUTEX_ROBUST);
+        pthread_mutexattr_settype(&attr, PTHREAD_MUTEX_ERRORCHECK);
+        rc = pthread_mutex_init(&(self->state->mutex), &attr);
+        pthread_mutexattr_destroy(&attr);
+
+        if (rc) {
+            shm_unlink(self->name);
+            errno = rc;
+            PyErr_SetFromErrno(PyExc_OSError);
+            goto error_return;
+        }
+
+        publish_shared_state(self->state, ROBUST_LOCK_MAGIC);
+    }
+
+    return 0;
+
+    error_return:
+    return -1;
+}
+
+
+static void
+RobustLock_dealloc(RobustLock *self) {
+    DPRINTF("dealloc\n");
+    // A thread blocked in acquire() holds a reference to the lock, so there
+    // can't be any waiters here. If the lock is held, it's released first.
+    // If that fails (because another thread holds it), the mapping is leaked
+    // rather than pulled out from under that thread's robust list.
+    if (self->state && self->held) {
+        if (0 == pthread_mutex_unlock(&(self->state->mutex)))
+            self->held = 0;
+    }
+    if (self->state && !self->held)
+        munmap(self->state, sizeof(RobustLockState));
+    PyMem_Free(self->name);
+    self->name = NULL;
+
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+
+static int
+test_robust_lock_validity(RobustLock *self) {
+    // Returns 1 if the lock is open, otherwise sets an exception and returns 0.
+    if (!self->state) {
+        PyErr_SetString(pExistentialException, "The lock has been closed");
+        return 0;
+    }
+
+    return 1;
+}
+
+
+static PyObject *
+RobustLock_acquire(RobustLock *self, PyObject *args, PyObject *keywords) {
+    NoneableTimeout timeout;
+    int rc = 0;
+    static char *keyword_list[ ] = {"timeout", NULL};
+
+    // Initialize this to the default of None.
+    timeout.is_none = 1;
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "|O&", keyword_list,
+                                     convert_timeout, &timeout))
+        goto error_return;
+
+    if (!test_robust_lock_validity(self))
+        goto error_return;
+
+    // The count is only touched with the GIL held.
+    self->waiters++;
+    Py_BEGIN_ALLOW_THREADS
+    // timeout == None: no timeout, i.e. wait forever.
+    // timeout == 0: don't wait at all.
+    // timeout > 0: wait no longer than t seconds before raising an error.
+    if (timeout.is_none)
+        rc = pthread_mutex_lock(&(self->state->mutex));
+    else if (timeout.is_zero)
+        rc = pthread_mutex_trylock(&(self->state->mutex));
+    else
+        rc = pthread_mutex_timedlock(&(self->state->mutex), &(timeout.timestamp));
+
+    if (EOWNERDEAD == rc) {
+        // The previous owner died while holding the lock. The lock is now
+        // mine, and marking it consistent keeps it usable. The caller gets
+        // the opportunity to repair whatever the dead owner left behind via
+        // the owner_died attribute.
+        pthread_mutex_consistent(&(self->state->mutex));
+    }
+    Py_END_ALLOW_THREADS
+    self->waiters--;
+
+    self->owner_died = (EOWNERDEAD == rc);
+    if ((0 == rc) || (EOWNERDEAD == rc))
+        self->held = 1;
+
+    switch (rc) {
+        case 0:
+        case EOWNERDEAD:
+        break;
+
+        case EBUSY:
+        case ETIMEDOUT:
+            PyErr_SetString(pBusyException, "The lock is held by another owner");
+            goto error_return;
+
+        case EDEADLK:
+            PyErr_SetString(pBusyException, "This thread already holds the lock");
+            goto error_return;
+
+        case ENOTRECOVERABLE:
+            PyErr_SetString(pExistentialException, "The lock is not recoverable");
+            goto error_return;
+
+        default:
+            errno = rc;
+            PyErr_SetFromErrno(PyExc_OSError);
+            goto error_return;
+    }
+
+    Py_RETURN_NONE;
+
+    error_return:
+    return NULL;
+}
+
+
+static PyObject *
+RobustLock_release(RobustLock *self) {
+    int rc;
+
+    if (!test_robust_lock_validity(self))
+        goto error_return;
+
+    rc = pthread_mutex_unlock(&(self->state->mutex));
+
+    if (rc) {
+        if (EPERM == rc)
+            PyErr_SetString(pPermissionsException, "This thread doesn't hold the lock");
+        else {
+            errno = rc;
+            PyErr_SetFromErrno(PyExc_OSError);
+        }
+        goto error_return;
+    }
+
+    self->held = 0;
+
+    Py_RETURN_NONE;
+
+    error_return:
+    return NULL;
+}
+
+
+static PyObject *
+RobustLock_close(RobustLock *self) {
+    if (!test_robust_lock_validity(self))
+        goto error_return;
+
+    if (self->held) {
+        PyErr_SetString(pBusyException, "The lock is held; release it before closing");
+        goto error_return;
+    }
+
+    if (self->waiters) {
+        PyErr_SetString(pBusyException, "Another thread is waiting on the lock");
+        goto error_return;
+    }
+
+    if (-1 == munmap(self->state, sizeof(RobustLockState))) {
+        PyErr_SetFromErrno(PyExc_OSError);
+        goto error_return;
+    }
+
+    self->state = NULL;
+
+    Py_RETURN_NONE;
+
+    error_return:
+    return NULL;
+}
+
+
+static PyObject *
+RobustLock_unlink(RobustLock *self) {
+    return my_shm_unlink(self->name);
+}
+
+
+static PyObject *
+RobustLock_get_owner_died(RobustLock *self) {
+    return PyBool_FromLong(self->owner_died);
+}
+
+
+static PyObject *
+RobustLock_enter(RobustLock *self) {
+    PyObject *args = PyTuple_New(0);
+    PyObject *retval = NULL;
+
+    if (RobustLock_acquire(self, args, NULL)) {
+        retval = (PyObject *)self;
+        Py_INCREF(self);
+    }
+
+    Py_DECREF(args);
+
+    return retval;
+}
+
+
+static PyObject *
+RobustLock_exit(RobustLock *self, PyObject *args) {
+    return RobustLock_release(self);
+}
+
+// end of #ifdef ROBUST_MUTEX_EXISTS
+#endif
+
+/*   =====  End Robust Lock implementation functions ===== */
+
+
+/*   =====  Begin Barrier implementation functions ===== */
+
+#ifdef FUTEX_EXISTS
+
+static int
+futex_wait(uint32_t *address, uint32_t expected, struct timespec *deadline) {
+    // Sleeps as long as *address == expected, until woken, or until the
+    // deadline (an absolute CLOCK_REALTIME time, or NULL to wait forever)
+    // passes. Returns 0 or an errno value. EAGAIN means that *address
+    // didn't hold the expected value.
+    // The futex isn't FUTEX_PRIVATE_FLAG because it's shared between
+    // processes.
+    if (-1 == syscall(SYS_futex, address, FUTEX_WAIT_BITSET | FUTEX_CLOCK_REALTIME,
+                      expected, deadline, NULL, FUTEX_BITSET_MATCH_ANY))
+        return errno;
+
+    return 0;
+}
+
+
+static void
+futex_wake_all(uint32_t *address) {
+    syscall(SYS_futex, address, FUTEX_WAKE, INT_MAX, NULL, NULL, 0);
+}
+
+
+static void
+break_barrier(BarrierState *state) {
+    __atomic_or_fetch(&(state->phase), BARRIER_BROKEN, __ATOMIC_RELEASE);
+    futex_wake_all(&(state->phase));
+}
+
+
+static int
+break_phase(BarrierState *state, uint32_t phase) {
+    // Breaks the barrier if it's still in the given phase, for a process
+    // that gives up waiting. Returns 1 if the barrier tripped first (so the
+    // process got through after all), otherwise 0.
+    uint32_t expected = phase;
+
+    if (__atomic_compare_exchange_n(&(state->phase), &expected, phase | BARRIER_BROKEN, 0,
+                                    __ATOMIC_ACQ_REL, __ATOMIC_ACQUIRE)) {
+        futex_wake_all(&(state->phase));
+        return 0;
+    }
+
+    // Either the phase moved on or another process broke the barrier.
+    return (expected & ~BARRIER_BROKEN) != phase;
+}
+
+
+static int
+wait_for_next_phase(BarrierState *state, uint32_t phase, NoneableTimeout *timeout) {
+    // Waits for the barrier to leave the given phase. Returns 0 if it did,
+    // EPIPE if the barrier was broken, or ETIMEDOUT or EINTR.
+    // This doesn't touch Python objects so it's safe to call without the GIL.
+    uint32_t current;
+    int rc;
+
+    while (1) {
+        current = __atomic_load_n(&(state->phase), __ATOMIC_ACQUIRE);
+
+        // The phase might have moved on and then the barrier might have
+        // been broken, but this process got through.
+        if ((current & ~BARRIER_BROKEN) != phase)
+            return 0;
+        if (current & BARRIER_BROKEN)
+            return EPIPE;
+        if ((!timeout->is_none) && timeout->is_zero)
+            return ETIMEDOUT;
+
+        rc = futex_wait(&(state->phase), current,
+                        timeout->is_none ? NULL : &(timeout->timestamp));
+
+        if ((ETIMEDOUT == rc) || (EINTR == rc))
+            return rc;
+        // Otherwise the process was woken or the phase had already changed,
+        // so it's time to look again.
+    }
+}
+
+
+static PyObject *
+barrier_str(Barrier *self) {
+    return generic_str(self->name);
+}
+
+
+static PyObject *
+barrier_repr(Barrier *self) {
+    char mode[32];
+
+    mode_to_str(self->mode, mode);
+
+    return PyUnicode_FromFormat("posix_ipc.Barrier(\"%s\", mode=%s)",
+                                self->name, mode);
+}
+
+
+static PyObject *
+Barrier_new(PyTypeObject *type, PyObject *args, PyObject *kwlist) {
+    Barrier *self;
+
+    self = (Barrier *)type->tp_alloc(type, 0);
+
+    return (PyObject *)self;
+}
+
+
+static int
+Barrier_init(Barrier *self, PyObject *args, PyObject *keywords) {
+    NoneableName name;
+    unsigned int parties = 0;
+    unsigned int flags = 0;
+    int created = 0;
+    static char *keyword_list[ ] = {"name", "parties", "flags", "mode", NULL};
+
+    // First things first -- initialize the self struct.
+    self->name = NULL;
+    self->state = NULL;
+    self->mode = 0600;
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "O&|IIi", keyword_list,
+                                     &convert_name_param, &name, &parties,
+                                     &flags, &(self->mode)))
+        goto error_return;
+
+    if ((flags & O_CREAT) && !parties) {
+        PyErr_SetString(PyExc_ValueError,
+                        "The number of parties must be specified when creating a barrier");
+        if (!name.is_none)
+            PyMem_Free(name.name);
+        goto error_return;
+    }
+
+    self->state = (BarrierState *)open_shared_state(&name, flags, self->mode,
+                                                    sizeof(BarrierState),
+                                                    BARRIER_MAGIC,
+                                                    &(self->name), &created);
+    if (!self->state)
+        goto error_return;
+
+    if (created) {
+        // The segment is zero-filled, so the count and phase start at 0.
+        self->state->parties = parties;
+        publish_shared_state(self->state, BARRIER_MAGIC);
+    }
+    else if (parties && (parties != self->state->parties)) {
+        PyErr_Format(PyExc_ValueError, "The barrier was created for %u parties",
+                     self->state->parties);
+        goto error_return;
+    }
+
+    return 0;
+
+    error_return:
+    return -1;
+}
+
+
+static void
+Barrier_dealloc(Barrier *self) {
+    DPRINTF("dealloc\n");
+    // A thread blocked in wait() holds a reference to the barrier, so there
+    // can't be any waiters here.
+    if (self->state)
+        munmap(self->state, sizeof(BarrierState));
+    PyMem_Free(self->name);
+    self->name = NULL;
+
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+
+static int
+test_barrier_validity(Barrier *self) {
+    // Returns 1 if the barrier is open, otherwise sets an exception and
+    // returns 0.
+    if (!self->state) {
+        PyErr_SetString(pExistentialException, "The barrier has been closed");
+        return 0;
+    }
+
+    return 1;
+}
+
+
+static PyObject *
+Barrier_wait(Barrier *self, PyObject *args, PyObject *keywords) {
+    NoneableTimeout timeout;
+    BarrierState *state;
+    uint32_t phase;
+    uint32_t arrival;
+    int rc = 0;
+    static char *keyword_list[ ] = {"timeout", NULL};
+
+    // Initialize this to the default of None.
+    timeout.is_none = 1;
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "|O&", keyword_list,
+                                     convert_timeout, &timeout))
+        goto error_return;
+
+    if (!test_barrier_validity(self))
+        goto error_return;
+
+    state = self->state;
+
+    phase = __atomic_load_n(&(state->phase), __ATOMIC_ACQUIRE);
+    if (phase & BARRIER_BROKEN) {
+        PyErr_SetString(pBrokenBarrierException, "The barrier is broken");
+        goto error_return;
+    }
+
+    // This is the only write to shared memory for all but the last process
+    // to arrive.
+    arrival = __atomic_add_fetch(&(state->count), 1, __ATOMIC_ACQ_REL);
+
+    if (arrival == state->parties) {
+        // This process is the last to arrive. The count must be reset before
+        // the phase changes because processes that are released by the phase
+        // change might arrive again right away.
+        __atomic_store_n(&(state->count), 0, __ATOMIC_RELAXED);
+        __atomic_add_fetch(&(state->phase), BARRIER_PHASE_STEP, __ATOMIC_RELEASE);
+        futex_wake_all(&(state->phase));
+    }
+    else {
+        // The count is only touched with the GIL held.
+        self->waiters++;
+        while (1) {
+            Py_BEGIN_ALLOW_THREADS
+            rc = wait_for_next_phase(state, phase, &timeout);
+            Py_END_ALLOW_THREADS
+
+            if (EINTR != rc)
+                break;
+
+            // A signal interrupted the wait. If a Python signal handler
+            // raised an exception (e.g. KeyboardInterrupt), this process
+            // won't arrive after all, and the barrier can't trip without it.
+            if (PyErr_CheckSignals()) {
+                self->waiters--;
+                break_phase(state, phase);
+                goto error_return;
+            }
+        }
+        self->waiters--;
+
+        // The last process might have arrived just as this one timed out.
+        // If so, the barrier tripped and this process got through.
+        if ((ETIMEDOUT == rc) && break_phase(state, phase))
+            rc = 0;
+
+        switch (rc) {
+            case 0:
+            break;
+
+            case EPIPE:
+                PyErr_SetString(pBrokenBarrierException, "The barrier is broken");
+                goto error_return;
+
+            case ETIMEDOUT:
+                // This process has been counted but won't be waiting when the
+                // barrier trips, so break_phase() has broken the barrier.
+                PyErr_SetString(pBusyException, "The barrier timed out");
+                goto error_return;
+
+            default:
+                errno = rc;
+                PyErr_SetFromErrno(PyExc_OSError);
+                goto error_return;
+        }
+    }
+
+    // The last process to arrive gets parties - 1.
+    return PyLong_FromUnsignedLong(arrival - 1);
+
+    error_return:
+    return NULL;
+}
+
+
+static PyObject *
+Barrier_abort(Barrier *self) {
+    if (!test_barrier_validity(self))
+        goto error_return;
+
+    break_barrier(self->state);
+
+    Py_RETURN_NONE;
+
+    error_return:
+    return NULL;
+}
+
+
+static PyObject *
+Barrier_close(Barrier *self) {
+    if (!test_barrier_validity(self))
+        goto error_return;
+
+    if (self->waiters) {
+        PyErr_SetString(pBusyException, "Another thread is waiting on the barrier");
+        goto error_return;
+    }
+
+    if (-1 == munmap(self->state, sizeof(BarrierState))) {
+        PyErr_SetFromErrno(PyExc_OSError);
+        goto error_return;
+    }
+
+    self->state = NULL;
+
+    Py_RETURN_NONE;
+
+    error_return:
+    return NULL;
+}
+
+
+static PyObject *
+Barrier_unlink(Barrier *self) {
+    return my_shm_unlink(self->name);
 }
 
-PyObject *
-MessageQueue_get_current_messages(MessageQueue *self) {
-    struct mq_attr attr;
 
-    if (-1 == mq_get_attrs(self->mqd, &attr))
-        return NULL;
-    else
-        return Py_BuildValue("k", (unsigned long)attr.mq_curmsgs);
-}
+static PyObject *
+Barrier_get_parties(Barrier *self) {
+    if (!test_barrier_validity(self))
+        return NULL;
+
+    return PyLong_FromUnsignedLong(self->state->parties);
+}
+
+
+static PyObject *
+Barrier_get_n_waiting(Barrier *self) {
+    if (!test_barrier_validity(self))
+        return NULL;
+
+    return PyLong_FromUnsignedLong(__atomic_load_n(&(self->state->count), __ATOMIC_RELAXED));
+}
+
+
+static PyObject *
+Barrier_get_broken(Barrier *self) {
+    if (!test_barrier_validity(self))
+        return NULL;
+
+    return PyBool_FromLong(__atomic_load_n(&(self->state->phase), __ATOMIC_ACQUIRE) & BARRIER_BROKEN);
+}
+
+// end of #ifdef FUTEX_EXISTS
+#endif
+
+/*   =====  End Barrier implementation functions ===== */
+
+
+
+
+/*
+ *
+ * Semaphore meta stuff for describing myself to Python
+ *
+ */
+
+static PyMemberDef Semaphore_members[] = {
+    {   "name",
+        T_STRING,
+        offsetof(Semaphore, name),
+        READONLY,
+        "The name specified in the constructor"
+    },
+    {   "mode",
+        T_LONG,
+        offsetof(Semaphore, mode),
+        READONLY,
+        "The mode specified in the constructor"
+    },
+    {NULL} /* Sentinel */
+};
+
+
+static PyMethodDef Semaphore_methods[] = {
+    {   "__enter__",
+        (PyCFunction)Semaphore_enter,
+        METH_NOARGS,
+    },
+    {   "__exit__",
+        (PyCFunction)Semaphore_exit,
+        METH_VARARGS,
+    },
+    {   "acquire",
+        (PyCFunction)Semaphore_acquire,
+        METH_VARARGS | METH_KEYWORDS,
+        "Acquire (grab) the semaphore, waiting if necessary"
+    },
+    {   "release",
+        (PyCFunction)Semaphore_release,
+        METH_NOARGS,
+        "Release the semaphore"
+    },
+    {   "close",
+        (PyCFunction)Semaphore_close,
+        METH_NOARGS,
+        "Close the semaphore for this process."
+    },
+    {   "unlink",
+        (PyCFunction)Semaphore_unlink,
+        METH_NOARGS,
+        "Unlink (remove) the semaphore."
+    },
+    {   "__reduce__",
+        (PyCFunction)Semaphore_reduce,
+        METH_NOARGS,
+        "Pickles the semaphore as its name"
+    },
+    {NULL, NULL, 0, NULL} /* Sentinel */
+};
+
+
+static PyGetSetDef Semaphore_getseters[] = {
+    {"spin", (getter)Semaphore_get_spin, (setter)Semaphore_set_spin,
+        "The maximum number of times acquire() polls before blocking", NULL},
+#ifdef SEM_GETVALUE_EXISTS
+    {"value", (getter)Semaphore_getvalue, (setter)NULL, "value", NULL},
+#endif
+    {NULL} /* Sentinel */
+};
+
+
+static PyTypeObject SemaphoreType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "posix_ipc.Semaphore",              // tp_name
+    sizeof(Semaphore),                  // tp_basicsize
+    0,                                  // tp_itemsize
+    (destructor) Semaphore_dealloc,     // tp_dealloc
+    0,                                  // tp_print
+    0,                                  // tp_getattr
+    0,                                  // tp_setattr
+    0,                                  // tp_compare
+    (reprfunc) sem_repr,                // tp_repr
+    0,                                  // tp_as_number
+    0,                                  // tp_as_sequence
+    0,                                  // tp_as_mapping
+    0,                                  // tp_hash
+    0,                                  // tp_call
+    (reprfunc) sem_str,                 // tp_str
+    0,                                  // tp_getattro
+    0,                                  // tp_setattro
+    0,                                  // tp_as_buffer
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+                                        // tp_flags
+    "POSIX semaphore object",           // tp_doc
+    0,                                  // tp_traverse
+    0,                                  // tp_clear
+    0,                                  // tp_richcompare
+    0,                                  // tp_weaklistoffset
+    0,                                  // tp_iter
+    0,                                  // tp_iternext
+    Semaphore_methods,                  // tp_methods
+    Semaphore_members,                  // tp_members
+    Semaphore_getseters,                // tp_getset
+    0,                                  // tp_base
+    0,                                  // tp_dict
+    0,                                  // tp_descr_get
+    0,                                  // tp_descr_set
+    0,                                  // tp_dictoffset
+    (initproc) Semaphore_init,          // tp_init
+    0,                                  // tp_alloc
+    (newfunc) Semaphore_new,            // tp_new
+    0,                                  // tp_free
+    0,                                  // tp_is_gc
+    0                                   // tp_bases
+};
+
+
+/*
+ *
+ * Shared memory meta stuff for describing myself to Python
+ *
+ */
+
+
+static PyMemberDef SharedMemory_members[] = {
+    {   "name",
+        T_STRING,
+        offsetof(SharedMemory, name),
+        READONLY,
+        "The name specified in the constructor"
+    },
+    {   "fd",
+        T_INT,
+        offsetof(SharedMemory, fd),
+        READONLY,
+        "Shared memory segment file descriptor"
+    },
+    {   "read_only",
+        T_BOOL,
+        offsetof(SharedMemory, read_only),
+        READONLY,
+        "True if the segment was opened read-only"
+    },
+    {   "mode",
+        T_LONG,
+        offsetof(SharedMemory, mode),
+        READONLY,
+        "The mode specified in the constructor"
+    },
+    {NULL} /* Sentinel */
+};
+
+
+static PyMethodDef SharedMemory_methods[] = {
+    {   "__reduce__",
+        (PyCFunction)SharedMemory_reduce,
+        METH_NOARGS,
+        "Pickles the segment as its name"
+    },
+    {   "close_fd",
+        (PyCFunction)SharedMemory_close_fd,
+        METH_NOARGS,
+        "Closes the file descriptor associated with the shared memory."
+    },
+    {   "fileno",
+        (PyCFunction)SharedMemory_fileno,
+        METH_NOARGS,
+        "Returns the shared memory's file descriptor (same as the fd property)."
+    },
+    {   "unlink",
+        (PyCFunction)SharedMemory_unlink,
+        METH_NOARGS,
+        "Unlink (remove) the shared memory."
+    },
+    {   "load_from",
+        (PyCFunction)SharedMemory_load_from,
+        METH_VARARGS | METH_KEYWORDS,
+        "Copies a file (or part of one) into the shared memory."
+    },
+    {   "dump_to",
+        (PyCFunction)SharedMemory_dump_to,
+        METH_VARARGS | METH_KEYWORDS,
+        "Copies the shared memory (or part of it) into a file."
+    },
+    {   "checkpoint",
+        (PyCFunction)SharedMemory_checkpoint,
+        METH_VARARGS | METH_KEYWORDS,
+        "Writes the pages that have changed since the last checkpoint to a file."
+    },
+    {   "restore",
+        (PyCFunction)SharedMemory_restore,
+        METH_VARARGS | METH_KEYWORDS,
+        "Restores the shared memory from a checkpoint file."
+    },
+    {   "records",
+        (PyCFunction)SharedMemory_records,
+        METH_VARARGS | METH_KEYWORDS,
+        "Returns a RecordArray of fixed-layout records in the shared memory."
+    },
+    {   "atomic_array",
+        (PyCFunction)SharedMemory_atomic_array,
+        METH_VARARGS | METH_KEYWORDS,
+        "Returns an AtomicArray of integers in the shared memory."
+    },
+    {NULL, NULL, 0, NULL} /* Sentinel */
+};
+
+
+static PyGetSetDef SharedMemory_getseters[] = {
+    // size is read-only
+    {   "size",
+        (getter)SharedMemory_getsize,
+        (setter)NULL,
+        "size",
+        NULL
+    },
+    {NULL} /* Sentinel */
+};
+
+
+static PyTypeObject SharedMemoryType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "posix_ipc.SharedMemory",           // tp_name
+    sizeof(SharedMemory),               // tp_basicsize
+    0,                                  // tp_itemsize
+    (destructor) SharedMemory_dealloc,  // tp_dealloc
+    0,                                  // tp_print
+    0,                                  // tp_getattr
+    0,                                  // tp_setattr
+    0,                                  // tp_compare
+    (reprfunc) shm_repr,                // tp_repr
+    0,                                  // tp_as_number
+    0,                                  // tp_as_sequence
+    0,                                  // tp_as_mapping
+    0,                                  // tp_hash
+    0,                                  // tp_call
+    (reprfunc) shm_str,                 // tp_str
+    0,                                  // tp_getattro
+    0,                                  // tp_setattro
+    0,                                  // tp_as_buffer
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+                                        // tp_flags
+    "POSIX shared memory object",       // tp_doc
+    0,                                  // tp_traverse
+    0,                                  // tp_clear
+    0,                                  // tp_richcompare
+    0,                                  // tp_weaklistoffset
+    0,                                  // tp_iter
+    0,                                  // tp_iternext
+    SharedMemory_methods,               // tp_methods
+    SharedMemory_members,               // tp_members
+    SharedMemory_getseters,             // tp_getset
+    0,                                  // tp_base
+    0,                                  // tp_dict
+    0,                                  // tp_descr_get
+    0,                                  // tp_descr_set
+    0,                                  // tp_dictoffset
+    (initproc) SharedMemory_init,       // tp_init
+    0,                                  // tp_alloc
+    (newfunc) SharedMemory_new,         // tp_new
+    0,                                  // tp_free
+    0,                                  // tp_is_gc
+    0                                   // tp_bases
+};
+
+
+/*
+ *
+ * Atomic array meta stuff for describing myself to Python
+ *
+ */
 
-// end of #ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
+static PyMethodDef AtomicArray_methods[] = {
+    {   "load",
+        (PyCFunction)AtomicArray_load,
+        METH_VARARGS,
+        "Returns the value at an index"
+    },
+    {   "store",
+        (PyCFunction)AtomicArray_store,
+        METH_VARARGS,
+        "Sets the value at an index"
+    },
+    {   "fetch_add",
+        (PyCFunction)AtomicArray_fetch_add,
+        METH_VARARGS,
+        "Adds to the value at an index and returns the previous value"
+    },
+    {   "compare_exchange",
+        (PyCFunction)AtomicArray_compare_exchange,
+        METH_VARARGS,
+        "Replaces the value at an index if it's the expected value; returns the previous value"
+    },
+    {   "snapshot",
+        (PyCFunction)AtomicArray_snapshot,
+        METH_VARARGS | METH_KEYWORDS,
+        "Copies all of the values into a buffer"
+    },
+    {   "close",
+        (PyCFunction)AtomicArray_close,
+        METH_NOARGS,
+        "Unmaps the array"
+    },
+    {NULL, NULL, 0, NULL} /* Sentinel */
+};
+
+
+static PyGetSetDef AtomicArray_getseters[] = {
+    {   "dtype",
+        (getter)AtomicArray_get_dtype,
+        (setter)NULL,
+        "The type of the array's elements",
+        NULL
+    },
+    {NULL} /* Sentinel */
+};
+
+
+static PySequenceMethods AtomicArray_as_sequence = {
+    (lenfunc)AtomicArray_length,        // sq_length
+};
+
+
+static PyTypeObject AtomicArrayType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "posix_ipc.AtomicArray",            // tp_name
+    sizeof(AtomicArray),                // tp_basicsize
+    0,                                  // tp_itemsize
+    (destructor) AtomicArray_dealloc,   // tp_dealloc
+    0,                                  // tp_print
+    0,                                  // tp_getattr
+    0,                                  // tp_setattr
+    0,                                  // tp_compare
+    (reprfunc) atomic_array_repr,       // tp_repr
+    0,                                  // tp_as_number
+    &AtomicArray_as_sequence,           // tp_as_sequence
+    0,                                  // tp_as_mapping
+    0,                                  // tp_hash
+    0,                                  // tp_call
+    0,                                  // tp_str
+    0,                                  // tp_getattro
+    0,                                  // tp_setattro
+    0,                                  // tp_as_buffer
+    Py_TPFLAGS_DEFAULT,                 // tp_flags
+    "Integers in shared memory that are accessed atomically",
+                                        // tp_doc
+    0,                                  // tp_traverse
+    0,                                  // tp_clear
+    0,                                  // tp_richcompare
+    0,                                  // tp_weaklistoffset
+    0,                                  // tp_iter
+    0,                                  // tp_iternext
+    AtomicArray_methods,                // tp_methods
+    0,                                  // tp_members
+    AtomicArray_getseters,              // tp_getset
+    0,                                  // tp_base
+    0,                                  // tp_dict
+    0,                                  // tp_descr_get
+    0,                                  // tp_descr_set
+    0,                                  // tp_dictoffset
+    0,                                  // tp_init
+    0,                                  // tp_alloc
+    // AtomicArrays are created by SharedMemory.atomic_array(), not directly.
+    0,                                  // tp_new
+    0,                                  // tp_free
+    0,                                  // tp_is_gc
+    0                                   // tp_bases
+};
+
+
+/*
+ *
+ * Semaphore array meta stuff for describing myself to Python
+ *
+ */
+
+#ifdef UNNAMED_SEMAPHORE_EXISTS
+
+static PyMethodDef SemaphoreArray_methods[] = {
+    {   "acquire",
+        (PyCFunction)SemaphoreArray_acquire,
+        METH_VARARGS | METH_KEYWORDS,
+        "Acquire (grab) the semaphore at the index, waiting if necessary"
+    },
+    {   "release",
+        (PyCFunction)SemaphoreArray_release,
+        METH_VARARGS,
+        "Release the semaphore at the index"
+    },
+#ifdef SEM_GETVALUE_EXISTS
+    {   "value",
+        (PyCFunction)SemaphoreArray_value,
+        METH_VARARGS,
+        "Returns the value of the semaphore at the index"
+    },
 #endif
+    {   "close",
+        (PyCFunction)SemaphoreArray_close,
+        METH_NOARGS,
+        "Unmaps the array (without destroying the semaphores)"
+    },
+    {   "size_of",
+        (PyCFunction)SemaphoreArray_size_of,
+        METH_VARARGS | METH_STATIC,
+        "Returns the number of bytes that a SemaphoreArray of count semaphores occupies"
+    },
+    {NULL, NULL, 0, NULL}  /* Sentinel */
+};
 
 
-/*   =====  End Message Queue implementation functions ===== */
+static PyMemberDef SemaphoreArray_members[] = {
+    {   "offset",
+        T_PYSSIZET,
+        offsetof(SemaphoreArray, offset),
+        READONLY,
+        "The offset of the array in the shared memory segment"
+    },
+    {NULL} /* Sentinel */
+};
+
 
+static PySequenceMethods SemaphoreArray_as_sequence = {
+    (lenfunc)SemaphoreArray_length,     // sq_length
+};
+
+
+static PyTypeObject SemaphoreArrayType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "posix_ipc.SemaphoreArray",         // tp_name
+    sizeof(SemaphoreArray),             // tp_basicsize
+    0,                                  // tp_itemsize
+    (destructor) SemaphoreArray_dealloc,
+                                        // tp_dealloc
+    0,                                  // tp_print
+    0,                                  // tp_getattr
+    0,                                  // tp_setattr
+    0,                                  // tp_compare
+    (reprfunc) semaphore_array_repr,    // tp_repr
+    0,                                  // tp_as_number
+    &SemaphoreArray_as_sequence,        // tp_as_sequence
+    0,                                  // tp_as_mapping
+    0,                                  // tp_hash
+    0,                                  // tp_call
+    0,                                  // tp_str
+    0,                                  // tp_getattro
+    0,                                  // tp_setattro
+    0,                                  // tp_as_buffer
+    Py_TPFLAGS_DEFAULT,                 // tp_flags
+    "Process-shared semaphores packed in a shared memory segment",
+                                        // tp_doc
+    0,                                  // tp_traverse
+    0,                                  // tp_clear
+    0,                                  // tp_richcompare
+    0,                                  // tp_weaklistoffset
+    0,                                  // tp_iter
+    0,                                  // tp_iternext
+    SemaphoreArray_methods,             // tp_methods
+    SemaphoreArray_members,             // tp_members
+    0,                                  // tp_getset
+    0,                                  // tp_base
+    0,                                  // tp_dict
+    0,                                  // tp_descr_get
+    0,                                  // tp_descr_set
+    0,                                  // tp_dictoffset
+    (initproc) SemaphoreArray_init,     // tp_init
+    0,                                  // tp_alloc
+    (newfunc) SemaphoreArray_new,       // tp_new
+    0,                                  // tp_free
+    0,                                  // tp_is_gc
+    0                                   // tp_bases
+};
 
+#endif
 
 
 /*
  *
- * Semaphore meta stuff for describing myself to Python
+ * Message queue meta stuff for describing myself to Python
  *
  */
 
-static PyMemberDef Semaphore_members[] = {
+#ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
+
+static PyMemberDef MessageQueue_members[] = {
     {   "name",
         T_STRING,
-        offsetof(Semaphore, name),
+        offsetof(MessageQueue, name),
         READONLY,
         "The name specified in the constructor"
     },
+    {   "max_messages",
+        T_LONG,
+        offsetof(MessageQueue, max_messages),
+        READONLY,
+        "Queue slots"
+    },
+    {   "max_message_size",
+        T_LONG,
+        offsetof(MessageQueue, max_message_size),
+        READONLY,
+        "Maximum number of bytes per message"
+    },
     {   "mode",
         T_LONG,
-        offsetof(Semaphore, mode),
+        offsetof(MessageQueue, mode),
         READONLY,
         "The mode specified in the constructor"
     },
+    {   "codec",
+        T_OBJECT,
+        offsetof(MessageQueue, codec),
+        READONLY,
+        "The codec that compresses messages, or None"
+    },
     {NULL} /* Sentinel */
 };
 
 
-static PyMethodDef Semaphore_methods[] = {
-    {   "__enter__",
-        (PyCFunction)Semaphore_enter,
-        METH_NOARGS,
+static PyMethodDef MessageQueue_methods[] = {
+    {   "send",
+        (PyCFunction)MessageQueue_send,
+        METH_VARARGS | METH_KEYWORDS,
+        "Send a message via the queue"
     },
-    {   "__exit__",
-        (PyCFunction)Semaphore_exit,
-        METH_VARARGS,
+    {   "receive",
+        (PyCFunction)MessageQueue_receive,
+        METH_VARARGS | METH_KEYWORDS,
+        "Receive a message from the queue"
     },
-    {   "acquire",
-        (PyCFunction)Semaphore_acquire,
+    {   "send_large",
+        (PyCFunction)MessageQueue_send_large,
         METH_VARARGS | METH_KEYWORDS,
-        "Acquire (grab) the semaphore, waiting if necessary"
+        "Send a message of any size, spilling large ones to shared memory"
     },
-    {   "release",
-        (PyCFunction)Semaphore_release,
-        METH_NOARGS,
-        "Release the semaphore"
+    {   "receive_large",
+        (PyCFunction)MessageQueue_receive_large,
+        METH_VARARGS | METH_KEYWORDS,
+        "Receive a message sent with send_large()"
+    },
+    {   "send_obj",
+        (PyCFunction)MessageQueue_send_obj,
+        METH_VARARGS | METH_KEYWORDS,
+        "Send a Python object, passing large buffers through shared memory"
+    },
+    {   "receive_obj",
+        (PyCFunction)MessageQueue_receive_obj,
+        METH_VARARGS | METH_KEYWORDS,
+        "Receive a Python object sent with send_obj()"
     },
     {   "close",
-        (PyCFunction)Semaphore_close,
+        (PyCFunction)MessageQueue_close,
         METH_NOARGS,
-        "Close the semaphore for this process."
+        "Close the queue's descriptor"
     },
     {   "unlink",
-        (PyCFunction)Semaphore_unlink,
+        (PyCFunction)MessageQueue_unlink,
         METH_NOARGS,
-        "Unlink (remove) the semaphore."
+        "Unlink the queue"
+    },
+    {   "request_notification",
+        (PyCFunction)MessageQueue_request_notification,
+        METH_VARARGS | METH_KEYWORDS,
+        "Request notification of the queue becoming non-empty"
+    },
+    {   "fileno",
+        (PyCFunction)MessageQueue_fileno,
+        METH_NOARGS,
+        "Returns the queue's descriptor (same as the mqd property)."
+    },
+    {   "__reduce__",
+        (PyCFunction)MessageQueue_reduce,
+        METH_NOARGS,
+        "Pickles the queue as its name"
     },
+
     {NULL, NULL, 0, NULL} /* Sentinel */
 };
 
 
-static PyGetSetDef Semaphore_getseters[] = {
-#ifdef SEM_GETVALUE_EXISTS
-    {"value", (getter)Semaphore_getvalue, (setter)NULL, "value", NULL},
-#endif
+static PyGetSetDef MessageQueue_getseters[] = {
+    {   "block",
+        (getter)MessageQueue_get_block,
+        (setter)MessageQueue_set_block,
+        "block",
+        NULL
+    },
+    {   "mqd",
+        (getter)MessageQueue_get_mqd,
+        (setter)NULL,
+        "Message queue descriptor",
+        NULL
+    },
+    {   "current_messages",
+        (getter)MessageQueue_get_current_messages,
+        (setter)NULL,
+        "current_message_count",
+        NULL
+    },
     {NULL} /* Sentinel */
 };
 
-
-static PyTypeObject SemaphoreType = {
+static PyTypeObject MessageQueueType = {
     PyVarObject_HEAD_INIT(NULL, 0)
-    "posix_ipc.Semaphore",              // tp_name
-    sizeof(Semaphore),                  // tp_basicsize
+    "posix_ipc.MessageQueue",           // tp_name
+    sizeof(MessageQueue),               // tp_basicsize
     0,                                  // tp_itemsize
-    (destructor) Semaphore_dealloc,     // tp_dealloc
+    (destructor) MessageQueue_dealloc,  // tp_dealloc
     0,                                  // tp_print
     0,                                  // tp_getattr
     0,                                  // tp_setattr
     0,                                  // tp_compare
-    (reprfunc) sem_repr,                // tp_repr
+    (reprfunc) mq_repr,                 // tp_repr
     0,                                  // tp_as_number
     0,                                  // tp_as_sequence
     0,                                  // tp_as_mapping
     0,                                  // tp_hash
     0,                                  // tp_call
-    (reprfunc) sem_str,                 // tp_str
+    (reprfunc) mq_str,                  // tp_str
     0,                                  // tp_getattro
     0,                                  // tp_setattro
     0,                                  // tp_as_buffer
     Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
                                         // tp_flags
-    "POSIX semaphore object",           // tp_doc
+    "POSIX message queue object",       // tp_doc
     0,                                  // tp_traverse
     0,                                  // tp_clear
     0,                                  // tp_richcompare
     0,                                  // tp_weaklistoffset
     0,                                  // tp_iter
     0,                                  // tp_iternext
-    Semaphore_methods,                  // tp_methods
-    Semaphore_members,                  // tp_members
-    Semaphore_getseters,                // tp_getset
+    MessageQueue_methods,               // tp_methods
+    MessageQueue_members,               // tp_members
+    MessageQueue_getseters,             // tp_getset
     0,                                  // tp_base
     0,                                  // tp_dict
     0,                                  // tp_descr_get
     0,                                  // tp_descr_set
     0,                                  // tp_dictoffset
-    (initproc) Semaphore_init,          // tp_init
+    (initproc) MessageQueue_init,       // tp_init
     0,                                  // tp_alloc
-    (newfunc) Semaphore_new,            // tp_new
+    (newfunc) MessageQueue_new,         // tp_new
     0,                                  // tp_free
     0,                                  // tp_is_gc
     0                                   // tp_bases
 };
 
+// end of #ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
+#endif
+
 
 /*
  *
- * Shared memory meta stuff for describing myself to Python
+ * Robust lock meta stuff for describing myself to Python
  *
  */
 
+#ifdef ROBUST_MUTEX_EXISTS
 
-static PyMemberDef SharedMemory_members[] = {
+static PyMemberDef RobustLock_members[] = {
     {   "name",
         T_STRING,
-        offsetof(SharedMemory, name),
+        offsetof(RobustLock, name),
         READONLY,
         "The name specified in the constructor"
     },
-    {   "fd",
-        T_INT,
-        offsetof(SharedMemory, fd),
-        READONLY,
-        "Shared memory segment file descriptor"
-    },
     {   "mode",
         T_LONG,
-        offsetof(SharedMemory, mode),
+        offsetof(RobustLock, mode),
         READONLY,
         "The mode specified in the constructor"
     },
@@ -2129,114 +5442,118 @@ static PyMemberDef SharedMemory_members[] = {
 };
 
 
-static PyMethodDef SharedMemory_methods[] = {
-    {   "close_fd",
-        (PyCFunction)SharedMemory_close_fd,
+static PyMethodDef RobustLock_methods[] = {
+    {   "__enter__",
+        (PyCFunction)RobustLock_enter,
         METH_NOARGS,
-        "Closes the file descriptor associated with the shared memory."
     },
-    {   "fileno",
-        (PyCFunction)SharedMemory_fileno,
+    {   "__exit__",
+        (PyCFunction)RobustLock_exit,
+        METH_VARARGS,
+    },
+    {   "acquire",
+        (PyCFunction)RobustLock_acquire,
+        METH_VARARGS | METH_KEYWORDS,
+        "Acquire the lock, waiting if necessary"
+    },
+    {   "release",
+        (PyCFunction)RobustLock_release,
         METH_NOARGS,
-        "Returns the shared memory's file descriptor (same as the fd property)."
+        "Release the lock"
+    },
+    {   "close",
+        (PyCFunction)RobustLock_close,
+        METH_NOARGS,
+        "Unmap the lock from this process"
     },
     {   "unlink",
-        (PyCFunction)SharedMemory_unlink,
+        (PyCFunction)RobustLock_unlink,
         METH_NOARGS,
-        "Unlink (remove) the shared memory."
+        "Unlink (remove) the lock"
     },
     {NULL, NULL, 0, NULL} /* Sentinel */
 };
 
 
-static PyGetSetDef SharedMemory_getseters[] = {
-    // size is read-only
-    {   "size",
-        (getter)SharedMemory_getsize,
+static PyGetSetDef RobustLock_getseters[] = {
+    {   "owner_died",
+        (getter)RobustLock_get_owner_died,
         (setter)NULL,
-        "size",
+        "True if the most recent acquire() recovered the lock from a dead owner",
         NULL
     },
     {NULL} /* Sentinel */
 };
 
 
-static PyTypeObject SharedMemoryType = {
+static PyTypeObject RobustLockType = {
     PyVarObject_HEAD_INIT(NULL, 0)
-    "posix_ipc.SharedMemory",           // tp_name
-    sizeof(SharedMemory),               // tp_basicsize
+    "posix_ipc.RobustLock",             // tp_name
+    sizeof(RobustLock),                 // tp_basicsize
     0,                                  // tp_itemsize
-    (destructor) SharedMemory_dealloc,  // tp_dealloc
+    (destructor) RobustLock_dealloc,    // tp_dealloc
     0,                                  // tp_print
     0,                                  // tp_getattr
     0,                                  // tp_setattr
     0,                                  // tp_compare
-    (reprfunc) shm_repr,                // tp_repr
+    (reprfunc) robust_lock_repr,        // tp_repr
     0,                                  // tp_as_number
     0,                                  // tp_as_sequence
     0,                                  // tp_as_mapping
     0,                                  // tp_hash
     0,                                  // tp_call
-    (reprfunc) shm_str,                 // tp_str
+    (reprfunc) robust_lock_str,         // tp_str
     0,                                  // tp_getattro
     0,                                  // tp_setattro
     0,                                  // tp_as_buffer
     Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
                                         // tp_flags
-    "POSIX shared memory object",       // tp_doc
+    "Process-shared lock that survives the death of its owner",
+                                        // tp_doc
     0,                                  // tp_traverse
     0,                                  // tp_clear
     0,                                  // tp_richcompare
     0,                                  // tp_weaklistoffset
     0,                                  // tp_iter
     0,                                  // tp_iternext
-    SharedMemory_methods,               // tp_methods
-    SharedMemory_members,               // tp_members
-    SharedMemory_getseters,             // tp_getset
+    RobustLock_methods,                 // tp_methods
+    RobustLock_members,                 // tp_members
+    RobustLock_getseters,               // tp_getset
     0,                                  // tp_base
     0,                                  // tp_dict
     0,                                  // tp_descr_get
     0,                                  // tp_descr_set
     0,                                  // tp_dictoffset
-    (initproc) SharedMemory_init,       // tp_init
+    (initproc) RobustLock_init,         // tp_init
     0,                                  // tp_alloc
-    (newfunc) SharedMemory_new,         // tp_new
+    (newfunc) RobustLock_new,           // tp_new
     0,                                  // tp_free
     0,                                  // tp_is_gc
     0                                   // tp_bases
 };
 
+// end of #ifdef ROBUST_MUTEX_EXISTS
+#endif
+
 
 /*
  *
- * Message queue meta stuff for describing myself to Python
+ * Barrier meta stuff for describing myself to Python
  *
  */
 
-#ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
+#ifdef FUTEX_EXISTS
 
-static PyMemberDef MessageQueue_members[] = {
+static PyMemberDef Barrier_members[] = {
     {   "name",
         T_STRING,
-        offsetof(MessageQueue, name),
+        offsetof(Barrier, name),
         READONLY,
         "The name specified in the constructor"
     },
-    {   "max_messages",
-        T_LONG,
-        offsetof(MessageQueue, max_messages),
-        READONLY,
-        "Queue slots"
-    },
-    {   "max_message_size",
-        T_LONG,
-        offsetof(MessageQueue, max_message_size),
-        READONLY,
-        "Maximum number of bytes per message"
-    },
     {   "mode",
         T_LONG,
-        offsetof(MessageQueue, mode),
+        offsetof(Barrier, mode),
         READONLY,
         "The mode specified in the constructor"
     },
@@ -2244,152 +5561,901 @@ static PyMemberDef MessageQueue_members[] = {
 };
 
 
-static PyMethodDef MessageQueue_methods[] = {
-    {   "send",
-        (PyCFunction)MessageQueue_send,
+static PyMethodDef Barrier_methods[] = {
+    {   "wait",
+        (PyCFunction)Barrier_wait,
         METH_VARARGS | METH_KEYWORDS,
-        "Send a message via the queue"
+        "Wait until all parties have called wait()"
     },
-    {   "receive",
-        (PyCFunction)MessageQueue_receive,
-        METH_VARARGS | METH_KEYWORDS,
-        "Receive a message from the queue"
+    {   "abort",
+        (PyCFunction)Barrier_abort,
+        METH_NOARGS,
+        "Put the barrier into the broken state"
     },
     {   "close",
-        (PyCFunction)MessageQueue_close,
+        (PyCFunction)Barrier_close,
         METH_NOARGS,
-        "Close the queue's descriptor"
+        "Unmap the barrier from this process"
     },
     {   "unlink",
-        (PyCFunction)MessageQueue_unlink,
-        METH_NOARGS,
-        "Unlink the queue"
-    },
-    {   "request_notification",
-        (PyCFunction)MessageQueue_request_notification,
-        METH_VARARGS | METH_KEYWORDS,
-        "Request notification of the queue becoming non-empty"
-    },
-    {   "fileno",
-        (PyCFunction)MessageQueue_fileno,
+        (PyCFunction)Barrier_unlink,
         METH_NOARGS,
-        "Returns the queue's descriptor (same as the mqd property)."
+        "Unlink (remove) the barrier"
     },
-
     {NULL, NULL, 0, NULL} /* Sentinel */
 };
 
 
-static PyGetSetDef MessageQueue_getseters[] = {
-    {   "block",
-        (getter)MessageQueue_get_block,
-        (setter)MessageQueue_set_block,
-        "block",
+static PyGetSetDef Barrier_getseters[] = {
+    {   "parties",
+        (getter)Barrier_get_parties,
+        (setter)NULL,
+        "The number of parties required to trip the barrier",
         NULL
     },
-    {   "mqd",
-        (getter)MessageQueue_get_mqd,
+    {   "n_waiting",
+        (getter)Barrier_get_n_waiting,
         (setter)NULL,
-        "Message queue descriptor",
+        "The number of parties currently waiting",
         NULL
     },
-    {   "current_messages",
-        (getter)MessageQueue_get_current_messages,
+    {   "broken",
+        (getter)Barrier_get_broken,
         (setter)NULL,
-        "current_message_count",
+        "True if the barrier is broken",
         NULL
     },
     {NULL} /* Sentinel */
 };
 
-static PyTypeObject MessageQueueType = {
+
+static PyTypeObject BarrierType = {
     PyVarObject_HEAD_INIT(NULL, 0)
-    "posix_ipc.MessageQueue",           // tp_name
-    sizeof(MessageQueue),               // tp_basicsize
+    "posix_ipc.Barrier",                // tp_name
+    sizeof(Barrier),                    // tp_basicsize
     0,                                  // tp_itemsize
-    (destructor) MessageQueue_dealloc,  // tp_dealloc
+    (destructor) Barrier_dealloc,       // tp_dealloc
     0,                                  // tp_print
     0,                                  // tp_getattr
     0,                                  // tp_setattr
     0,                                  // tp_compare
-    (reprfunc) mq_repr,                 // tp_repr
+    (reprfunc) barrier_repr,            // tp_repr
     0,                                  // tp_as_number
     0,                                  // tp_as_sequence
     0,                                  // tp_as_mapping
     0,                                  // tp_hash
     0,                                  // tp_call
-    (reprfunc) mq_str,                  // tp_str
+    (reprfunc) barrier_str,             // tp_str
     0,                                  // tp_getattro
     0,                                  // tp_setattro
     0,                                  // tp_as_buffer
     Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
                                         // tp_flags
-    "POSIX message queue object",       // tp_doc
+    "Barrier shared between processes",
+                                        // tp_doc
     0,                                  // tp_traverse
     0,                                  // tp_clear
     0,                                  // tp_richcompare
     0,                                  // tp_weaklistoffset
     0,                                  // tp_iter
     0,                                  // tp_iternext
-    MessageQueue_methods,               // tp_methods
-    MessageQueue_members,               // tp_members
-    MessageQueue_getseters,             // tp_getset
+    Barrier_methods,                    // tp_methods
+    Barrier_members,                    // tp_members
+    Barrier_getseters,                  // tp_getset
     0,                                  // tp_base
     0,                                  // tp_dict
     0,                                  // tp_descr_get
     0,                                  // tp_descr_set
     0,                                  // tp_dictoffset
-    (initproc) MessageQueue_init,       // tp_init
+    (initproc) Barrier_init,            // tp_init
     0,                                  // tp_alloc
-    (newfunc) MessageQueue_new,         // tp_new
+    (newfunc) Barrier_new,              // tp_new
     0,                                  // tp_free
     0,                                  // tp_is_gc
     0                                   // tp_bases
 };
 
-// end of #ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
-#endif
+// end of #ifdef FUTEX_EXISTS
+#endif
+
+
+/*
+ *
+ * Module-level functions & meta stuff
+ *
+ */
+
+static PyObject *
+posix_ipc_unlink_semaphore(PyObject *self, PyObject *args) {
+    const char *name;
+
+    if (!PyArg_ParseTuple(args, "s", &name))
+        return NULL;
+    else
+        return my_sem_unlink(name);
+}
+
+
+static PyObject *
+posix_ipc_unlink_shared_memory(PyObject *self, PyObject *args) {
+    const char *name;
+
+    if (!PyArg_ParseTuple(args, "s", &name))
+        return NULL;
+    else
+        return my_shm_unlink(name);
+}
+
+
+static uint64_t
+hash_page(const unsigned char *p, size_t size) {
+    // A fast non-cryptographic 64-bit hash for detecting changed pages.
+    // Four independent multiply-xorshift lanes let the CPU overlap the
+    // multiplications.
+    const uint64_t k = 0x9E3779B97F4A7C15ULL;
+    uint64_t lanes[4] = {1, 2, 3, 4};
+    uint64_t word;
+    uint64_t h;
+    size_t i = 0;
+    int j;
+
+    for (; i + 32 <= size; i += 32) {
+        for (j = 0; j < 4; j++) {
+            memcpy(&word, p + i + (j * 8), 8);
+            lanes[j] = (lanes[j] ^ word) * k;
+            lanes[j] ^= lanes[j] >> 29;
+        }
+    }
+
+    // Any remainder is zero padded.
+    for (j = 0; i < size; i += 8, j++) {
+        word = 0;
+        memcpy(&word, p + i, ((size - i) < 8) ? (size - i) : 8);
+        lanes[j] = (lanes[j] ^ word) * k;
+        lanes[j] ^= lanes[j] >> 29;
+    }
+
+    h = size;
+    for (j = 0; j < 4; j++) {
+        h = (h ^ lanes[j]) * k;
+        h ^= h >> 32;
+    }
+
+    return h;
+}
+
+
+static PyObject *
+posix_ipc_is_open(PyObject *self, PyObject *py_handle) {
+    // Returns True if a Semaphore, SharedMemory or MessageQueue hasn't been
+    // closed (for a SharedMemory, if it still has its file descriptor). The
+    // handle cache in posix_ipc._handles uses this.
+    int is_open;
+
+    if (PyObject_TypeCheck(py_handle, &SemaphoreType))
+        is_open = (NULL != ((Semaphore *)py_handle)->pSemaphore) &&
+                  (SEM_FAILED != ((Semaphore *)py_handle)->pSemaphore);
+    else if (PyObject_TypeCheck(py_handle, &SharedMemoryType))
+        is_open = (POSIX_IPC_SHM_NO_VALUE != ((SharedMemory *)py_handle)->fd);
+#ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
+    else if (PyObject_TypeCheck(py_handle, &MessageQueueType))
+        is_open = (POSIX_IPC_MQ_NO_VALUE != ((MessageQueue *)py_handle)->mqd);
+#endif
+    else {
+        PyErr_SetString(PyExc_TypeError,
+                        "Expected a Semaphore, SharedMemory or MessageQueue");
+        return NULL;
+    }
+
+    return PyBool_FromLong(is_open);
+}
+
+
+static PyObject *
+posix_ipc_hash_pages(PyObject *self, PyObject *args, PyObject *keywords) {
+    // _hash_pages(buffer, page_size, [previous = None]) returns a tuple of
+    // (hashes, changed) where hashes is a bytes object containing a uint64
+    // hash of each page of the buffer (the last page may be partial), and
+    // changed is a list of the indices of the pages whose hashes differ from
+    // those in previous (which has the same form as hashes). If previous is
+    // None, every page is changed. SharedMemory.checkpoint() uses this.
+    Py_buffer buffer = {0};
+    Py_buffer previous = {0};
+    PyObject *py_previous = Py_None;
+    PyObject *py_hashes = NULL;
+    PyObject *py_changed = NULL;
+    PyObject *py_index;
+    PyObject *py_result = NULL;
+    uint64_t *hashes;
+    const uint64_t *previous_hashes = NULL;
+    Py_ssize_t page_size;
+    Py_ssize_t n_pages;
+    Py_ssize_t i;
+    static char *keyword_list[] = {"buffer", "page_size", "previous", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "y*n|O", keyword_list,
+                                     &buffer, &page_size, &py_previous))
+        goto error_return;
+
+    if (page_size <= 0) {
+        PyErr_SetString(PyExc_ValueError, "page_size must be positive");
+        goto error_return;
+    }
+
+    n_pages = (buffer.len + page_size - 1) / page_size;
+
+    if (Py_None != py_previous) {
+        if (-1 == PyObject_GetBuffer(py_previous, &previous, PyBUF_SIMPLE))
+            goto error_return;
+        if (previous.len != (Py_ssize_t)(n_pages * sizeof(uint64_t))) {
+            PyErr_SetString(PyExc_ValueError, "previous must hold one hash per page");
+            goto error_return;
+        }
+        previous_hashes = (const uint64_t *)previous.buf;
+    }
+
+    if (!(py_hashes = PyBytes_FromStringAndSize(NULL, n_pages * sizeof(uint64_t))))
+        goto error_return;
+    hashes = (uint64_t *)PyBytes_AS_STRING(py_hashes);
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < n_pages; i++)
+        hashes[i] = hash_page((const unsigned char *)buffer.buf + (i * page_size),
+                              ((buffer.len - (i * page_size)) < page_size) ?
+                                (size_t)(buffer.len - (i * page_size)) : (size_t)page_size);
+    Py_END_ALLOW_THREADS
+
+    if (!(py_changed = PyList_New(0)))
+        goto error_return;
+
+    for (i = 0; i < n_pages; i++) {
+        if ((!previous_hashes) || (hashes[i] != previous_hashes[i])) {
+            if (!(py_index = PyLong_FromSsize_t(i)))
+                goto error_return;
+            if (-1 == PyList_Append(py_changed, py_index)) {
+                Py_DECREF(py_index);
+                goto error_return;
+            }
+            Py_DECREF(py_index);
+        }
+    }
+
+    py_result = Py_BuildValue("(OO)", py_hashes, py_changed);
+
+    error_return:
+    Py_XDECREF(py_hashes);
+    Py_XDECREF(py_changed);
+    if (previous.obj)
+        PyBuffer_Release(&previous);
+    if (buffer.obj)
+        PyBuffer_Release(&buffer);
+
+    return py_result;
+}
+
+
+static int
+test_strided_bounds(Py_ssize_t buffer_size, Py_ssize_t offset, Py_ssize_t stride,
+                    Py_ssize_t itemsize, Py_ssize_t count) {
+    // Returns 1 if count items of itemsize bytes, the first at offset and
+    // each subsequent one stride bytes after the previous one, fit in the
+    // buffer. Otherwise sets an exception and returns 0.
+    if ((offset < 0) || (stride < 0) || (itemsize < 0) || (count < 0)) {
+        PyErr_SetString(PyExc_ValueError, "The offset, stride, itemsize and count must be "
+                                          "non-negative");
+        return 0;
+    }
+
+    if (count && ((offset > buffer_size) ||
+                  (itemsize > buffer_size - offset) ||
+                  (stride && ((count - 1) > (buffer_size - offset - itemsize) / stride)))) {
+        PyErr_SetString(PyExc_ValueError, "The items don't fit in the buffer");
+        return 0;
+    }
+
+    return 1;
+}
+
+
+static PyObject *
+posix_ipc_gather(PyObject *self, PyObject *args) {
+    // _gather(buffer, offset, stride, itemsize, count) returns a bytearray of
+    // count items of itemsize bytes copied from the buffer, the first at
+    // offset and each subsequent one stride bytes after the previous one.
+    // SharedMemory.records() uses this to extract a field from every record.
+    Py_buffer buffer = {0};
+    Py_ssize_t offset;
+    Py_ssize_t stride;
+    Py_ssize_t itemsize;
+    Py_ssize_t count;
+    Py_ssize_t i;
+    PyObject *py_result = NULL;
+    char *destination;
+    const char *source;
+
+    if (!PyArg_ParseTuple(args, "y*nnnn", &buffer, &offset, &stride, &itemsize, &count))
+        goto error_return;
+
+    if (!test_strided_bounds(buffer.len, offset, stride, itemsize, count))
+        goto error_return;
+
+    if (!(py_result = PyByteArray_FromStringAndSize(NULL, count * itemsize)))
+        goto error_return;
+
+    destination = PyByteArray_AS_STRING(py_result);
+    source = (const char *)buffer.buf + offset;
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < count; i++)
+        memcpy(destination + (i * itemsize), source + (i * stride), itemsize);
+    Py_END_ALLOW_THREADS
+
+    error_return:
+    if (buffer.obj)
+        PyBuffer_Release(&buffer);
+
+    return py_result;
+}
+
+
+static PyObject *
+posix_ipc_scatter(PyObject *self, PyObject *args) {
+    // _scatter(buffer, offset, stride, itemsize, count, values) is the
+    // reverse of _gather(). It copies count items of itemsize bytes from
+    // values (which must contain exactly that many bytes) into the buffer.
+    Py_buffer buffer = {0};
+    Py_buffer values = {0};
+    Py_ssize_t offset;
+    Py_ssize_t stride;
+    Py_ssize_t itemsize;
+    Py_ssize_t count;
+    Py_ssize_t i;
+    PyObject *py_result = NULL;
+    char *destination;
+    const char *source;
+
+    if (!PyArg_ParseTuple(args, "w*nnnny*", &buffer, &offset, &stride, &itemsize, &count,
+                          &values))
+        goto error_return;
+
+    if (!test_strided_bounds(buffer.len, offset, stride, itemsize, count))
+        goto error_return;
 
+    if (values.len != count * itemsize) {
+        PyErr_SetString(PyExc_ValueError, "values must contain count * itemsize bytes");
+        goto error_return;
+    }
+
+    destination = (char *)buffer.buf + offset;
+    source = (const char *)values.buf;
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < count; i++)
+        memcpy(destination + (i * stride), source + (i * itemsize), itemsize);
+    Py_END_ALLOW_THREADS
+
+    py_result = Py_None;
+    Py_INCREF(py_result);
+
+    error_return:
+    if (values.obj)
+        PyBuffer_Release(&values);
+    if (buffer.obj)
+        PyBuffer_Release(&buffer);
+
+    return py_result;
+}
 
-/*
- *
- * Module-level functions & meta stuff
- *
- */
 
+#ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
 static PyObject *
-posix_ipc_unlink_semaphore(PyObject *self, PyObject *args) {
+posix_ipc_unlink_message_queue(PyObject *self, PyObject *args) {
     const char *name;
 
     if (!PyArg_ParseTuple(args, "s", &name))
         return NULL;
     else
-        return my_sem_unlink(name);
+        return my_mq_unlink(name);
 }
 
 
 static PyObject *
-posix_ipc_unlink_shared_memory(PyObject *self, PyObject *args) {
-    const char *name;
-
-    if (!PyArg_ParseTuple(args, "s", &name))
-        return NULL;
+limit_or_none(long value) {
+    // Limits that can't be determined are represented as -1 in C and
+    // None in Python.
+    if (value < 0)
+        Py_RETURN_NONE;
     else
-        return my_shm_unlink(name);
+        return PyLong_FromLong(value);
 }
 
 
-#ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
 static PyObject *
-posix_ipc_unlink_message_queue(PyObject *self, PyObject *args) {
-    const char *name;
+posix_ipc_limits(PyObject *self) {
+    MessageQueueLimits limits;
+
+    mq_get_limits(&limits);
+
+    return Py_BuildValue("{sNsNsNsNsNsN}",
+                         "max_messages", limit_or_none(limits.max_messages),
+                         "max_message_size", limit_or_none(limits.max_message_size),
+                         "max_queues", limit_or_none(limits.max_queues),
+                         "default_max_messages", limit_or_none(limits.default_max_messages),
+                         "default_max_message_size", limit_or_none(limits.default_max_message_size),
+                         "rlimit_msgqueue", limit_or_none(limits.rlimit_msgqueue)
+                        );
+}
 
-    if (!PyArg_ParseTuple(args, "s", &name))
-        return NULL;
+
+#ifdef MESSAGE_QUEUE_POLL_EXISTS
+/* Struct to contain one message received by receive_any(). The message's
+   content lives in a buffer shared by all of the messages received in the
+   same call. */
+typedef struct {
+    Py_ssize_t queue_index;
+    unsigned int priority;
+    size_t offset;
+    size_t size;
+} ReceivedMessage;
+
+
+static int
+poll_timeout(NoneableTimeout *timeout) {
+    // Converts the timeout (an absolute time) to the relative number of
+    // milliseconds that poll() wants, rounding up so that poll() never
+    // returns early. This doesn't call any Python API functions so it's
+    // safe to call when the GIL is released.
+    struct timeval current_time;
+    double remaining;
+
+    if (timeout->is_none)
+        return -1;
+
+    gettimeofday(&current_time, NULL);
+
+    remaining = (double)(timeout->timestamp.tv_sec - current_time.tv_sec) * 1000;
+    remaining += ((double)timeout->timestamp.tv_nsec / 1e6) - ((double)current_time.tv_usec / 1e3);
+
+    if (remaining <= 0)
+        return 0;
+    else if (remaining >= INT_MAX)
+        return INT_MAX;
     else
-        return my_mq_unlink(name);
+        return (int)ceil(remaining);
+}
+
+
+static PyObject *
+queues_to_pollfds(PyObject *py_queues, int for_receiving, struct pollfd **p_pollfds) {
+    // Given a sequence of MessageQueue objects, returns them as a new
+    // reference to a tuple and populates *p_pollfds with a pollfd for each
+    // one. The caller must PyMem_Free() the pollfds. The tuple is a snapshot
+    // that owns references to the queues, so another thread can't change
+    // what the caller reads once it has released the GIL (as it could if
+    // this returned the caller's list).
+    // Returns NULL (with an exception set) if py_queues isn't a non-empty
+    // sequence of open MessageQueues.
+    PyObject *py_queues_tuple = NULL;
+    PyObject *py_item;
+    MessageQueue *mq;
+    struct pollfd *pollfds = NULL;
+    Py_ssize_t i;
+    Py_ssize_t count;
+
+    if (!PySequence_Check(py_queues)) {
+        PyErr_SetString(PyExc_TypeError, "queues must be a sequence of MessageQueue objects");
+        goto error_return;
+    }
+
+    py_queues_tuple = PySequence_Tuple(py_queues);
+    if (!py_queues_tuple)
+        goto error_return;
+
+    count = PyTuple_GET_SIZE(py_queues_tuple);
+
+    if (!count) {
+        PyErr_SetString(PyExc_ValueError, "queues must not be empty");
+        goto error_return;
+    }
+
+    pollfds = PyMem_New(struct pollfd, count);
+    if (!pollfds) {
+        PyErr_NoMemory();
+        goto error_return;
+    }
+
+    for (i = 0; i < count; i++) {
+        py_item = PyTuple_GET_ITEM(py_queues_tuple, i);
+
+        if (!PyObject_TypeCheck(py_item, &MessageQueueType)) {
+            PyErr_SetString(PyExc_TypeError,
+                            "queues must be a sequence of MessageQueue objects");
+            goto error_return;
+        }
+
+        mq = (MessageQueue *)py_item;
+
+        if (POSIX_IPC_MQ_NO_VALUE == mq->mqd) {
+            PyErr_SetString(pExistentialException, "The message queue is closed");
+            goto error_return;
+        }
+
+        if (for_receiving && !mq->receive_permitted) {
+            PyErr_SetString(pPermissionsException, "The queue is not open for reading");
+            goto error_return;
+        }
+
+        pollfds[i].fd = (int)(long)mq->mqd;
+        pollfds[i].events = POLLIN;
+        pollfds[i].revents = 0;
+    }
+
+    *p_pollfds = pollfds;
+
+    return py_queues_tuple;
+
+    error_return:
+    PyMem_Free(pollfds);
+    Py_XDECREF(py_queues_tuple);
+
+    return NULL;
+}
+
+
+static void
+set_wait_any_error(int error) {
+    // Translates the errno from poll() or mq_timedreceive() into a Python
+    // exception in the same manner as MessageQueue.receive().
+    switch (error) {
+        case EBADF:
+        case EINVAL:
+            PyErr_SetString(pExistentialException,
+                            "The message queue does not exist or is not open for reading");
+        break;
+
+        case EINTR:
+            // See the comment in MessageQueue_receive() about this.
+            PyErr_CheckSignals();
+
+            if (!(PyErr_Occurred() &&
+                  PyErr_ExceptionMatches(PyExc_KeyboardInterrupt))
+               ) {
+                PyErr_Clear();
+                PyErr_SetString(pSignalException,
+                                "The wait was interrupted by a signal");
+            }
+        break;
+
+        case ETIMEDOUT:
+            PyErr_SetString(pBusyException, "All of the queues are empty");
+        break;
+
+        case ENOMEM:
+            PyErr_NoMemory();
+        break;
+
+        default:
+            errno = error;
+            PyErr_SetFromErrno(PyExc_OSError);
+        break;
+    }
+}
+
+
+static int
+poll_queues(struct pollfd *pollfds, Py_ssize_t count, NoneableTimeout *timeout) {
+    // Waits until at least one of the queues has a message or the timeout
+    // expires. Returns 0 on success or an errno value on failure. A timeout
+    // is reported as ETIMEDOUT. This doesn't
+    // call any Python API functions so it's safe to call when the GIL is
+    // released.
+    Py_ssize_t i;
+    int rc;
+
+    rc = poll(pollfds, (nfds_t)count, poll_timeout(timeout));
+
+    if (-1 == rc)
+        return errno;
+
+    if (!rc)
+        return ETIMEDOUT;
+
+    for (i = 0; i < count; i++)
+        if (pollfds[i].revents & POLLNVAL)
+            return EBADF;
+
+    return 0;
+}
+
+
+static PyObject *
+posix_ipc_wait_any(PyObject *self, PyObject *args, PyObject *keywords) {
+    PyObject *py_queues = NULL;
+    PyObject *py_queues_tuple = NULL;
+    PyObject *py_ready = NULL;
+    PyObject *py_item;
+    struct pollfd *pollfds = NULL;
+    NoneableTimeout timeout;
+    Py_ssize_t i;
+    Py_ssize_t count;
+    int error;
+    static char *keyword_list[ ] = {"queues", "timeout", NULL};
+
+    // Initialize this to the default of None.
+    timeout.is_none = 1;
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "O|O&", keyword_list,
+                                     &py_queues, convert_timeout, &timeout))
+        goto error_return;
+
+    if (!(py_queues_tuple = queues_to_pollfds(py_queues, 0, &pollfds)))
+        goto error_return;
+
+    count = PyTuple_GET_SIZE(py_queues_tuple);
+
+    Py_BEGIN_ALLOW_THREADS
+    error = poll_queues(pollfds, count, &timeout);
+    Py_END_ALLOW_THREADS
+
+    if (error) {
+        set_wait_any_error(error);
+        goto error_return;
+    }
+
+    if (!(py_ready = PyList_New(0)))
+        goto error_return;
+
+    for (i = 0; i < count; i++) {
+        if (pollfds[i].revents & POLLIN) {
+            py_item = PyTuple_GET_ITEM(py_queues_tuple, i);
+            if (-1 == PyList_Append(py_ready, py_item))
+                goto error_return;
+        }
+    }
+
+    PyMem_Free(pollfds);
+    Py_DECREF(py_queues_tuple);
+
+    return py_ready;
+
+    error_return:
+    PyMem_Free(pollfds);
+    Py_XDECREF(py_queues_tuple);
+    Py_XDECREF(py_ready);
+
+    return NULL;
+}
+
+
+static PyObject *
+posix_ipc_receive_any(PyObject *self, PyObject *args, PyObject *keywords) {
+    PyObject *py_queues = NULL;
+    PyObject *py_weights = Py_None;
+    PyObject *py_queues_tuple = NULL;
+    PyObject *py_weights_tuple = NULL;
+    PyObject *py_messages = NULL;
+    PyObject *py_message;
+    PyObject *py_decoded;
+    PyObject *py_error_type;
+    PyObject *py_error_traceback;
+    MessageQueue *mq;
+    struct pollfd *pollfds = NULL;
+    long *weights = NULL;
+    long *credits = NULL;
+    long *sizes = NULL;
+    char *buffer = NULL;
+    char *new_buffer;
+    size_t buffer_size = 0;
+    size_t buffer_used = 0;
+    ReceivedMessage *received = NULL;
+    ReceivedMessage *new_received;
+    Py_ssize_t received_size = 0;
+    Py_ssize_t received_count = 0;
+    Py_ssize_t received_this_round;
+    NoneableTimeout timeout;
+    // A timestamp that has already passed makes mq_timedreceive() return
+    // immediately rather than wait, regardless of the queue's block flag.
+    struct timespec expired = {0, 0};
+    Py_ssize_t i;
+    Py_ssize_t count;
+    ssize_t size;
+    unsigned int priority;
+    int error = 0;
+    static char *keyword_list[ ] = {"queues", "timeout", "weights", NULL};
+
+    // Initialize this to the default of None.
+    timeout.is_none = 1;
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywords, "O|O&O", keyword_list,
+                                     &py_queues, convert_timeout, &timeout,
+                                     &py_weights))
+        goto error_return;
+
+    if (!(py_queues_tuple = queues_to_pollfds(py_queues, 1, &pollfds)))
+        goto error_return;
+
+    count = PyTuple_GET_SIZE(py_queues_tuple);
+
+    weights = PyMem_New(long, count);
+    credits = PyMem_New(long, count);
+    sizes = PyMem_New(long, count);
+    if ((!weights) || (!credits) || (!sizes)) {
+        PyErr_NoMemory();
+        goto error_return;
+    }
+
+    for (i = 0; i < count; i++) {
+        weights[i] = 1;
+        sizes[i] = ((MessageQueue *)PyTuple_GET_ITEM(py_queues_tuple, i))->max_message_size;
+    }
+
+    if (py_weights != Py_None) {
+        // A tuple, for the same reason as the queues. Converting a weight can
+        // run Python code, which could change a list.
+        if (!PySequence_Check(py_weights)) {
+            PyErr_SetString(PyExc_TypeError, "weights must be a sequence of integers");
+            goto error_return;
+        }
+
+        py_weights_tuple = PySequence_Tuple(py_weights);
+        if (!py_weights_tuple)
+            goto error_return;
+
+        if (PyTuple_GET_SIZE(py_weights_tuple) != count) {
+            PyErr_SetString(PyExc_ValueError,
+                            "weights must be the same length as queues");
+            goto error_return;
+        }
+
+        for (i = 0; i < count; i++) {
+            weights[i] = PyLong_AsLong(PyTuple_GET_ITEM(py_weights_tuple, i));
+            if ((-1 == weights[i]) && PyErr_Occurred())
+                goto error_return;
+
+            if (weights[i] < 1) {
+                PyErr_SetString(PyExc_ValueError, "weights must be positive");
+                goto error_return;
+            }
+        }
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    // Everything in here is plain C so that the whole wait-and-receive
+    // cycle happens without the GIL. Memory is allocated with the PyMem_Raw
+    // functions which (unlike PyMem_Malloc()) don't require the GIL.
+    // The loop repeats if another process empties a queue between poll()
+    // and mq_timedreceive().
+    while ((!received_count) && (!error)) {
+        error = poll_queues(pollfds, count, &timeout);
+        if (error)
+            break;
+
+        // Interleaved weighted round robin -- each round receives at most
+        // one message from each readable queue that still has credit, so a
+        // busy queue can't starve the others no matter what its weight.
+        for (i = 0; i < count; i++)
+            credits[i] = (pollfds[i].revents & POLLIN) ? weights[i] : 0;
+
+        do {
+            received_this_round = 0;
+
+            for (i = 0; (i < count) && (!error); i++) {
+                if (!credits[i])
+                    continue;
+
+                if (buffer_size - buffer_used < (size_t)sizes[i]) {
+                    new_buffer = PyMem_RawRealloc(buffer, (buffer_used + sizes[i]) * 2);
+                    if (!new_buffer) {
+                        error = ENOMEM;
+                        break;
+                    }
+                    buffer = new_buffer;
+                    buffer_size = (buffer_used + sizes[i]) * 2;
+                }
+
+                if (received_count == received_size) {
+                    new_received = PyMem_RawRealloc(received,
+                                        (received_size + count) * 2 * sizeof(ReceivedMessage));
+                    if (!new_received) {
+                        error = ENOMEM;
+                        break;
+                    }
+                    received = new_received;
+                    received_size = (received_size + count) * 2;
+                }
+
+                size = mq_timedreceive((mqd_t)(long)pollfds[i].fd,
+                                       buffer + buffer_used, sizes[i],
+                                       &priority, &expired);
+
+                if (-1 == size) {
+                    if ((EAGAIN == errno) || (ETIMEDOUT == errno))
+                        // This queue is empty (for now)
+                        credits[i] = 0;
+                    else
+                        error = errno;
+                }
+                else {
+                    received[received_count].queue_index = i;
+                    received[received_count].priority = priority;
+                    received[received_count].offset = buffer_used;
+                    received[received_count].size = (size_t)size;
+                    received_count++;
+                    buffer_used += size;
+                    credits[i]--;
+                    received_this_round++;
+                }
+            }
+        } while (received_this_round && (!error));
+    }
+    Py_END_ALLOW_THREADS
+
+    // If something went wrong after some messages were received, I return
+    // those rather than discard them. A persistent error will be raised
+    // on the next call.
+    if (error && (!received_count)) {
+        set_wait_any_error(error);
+        goto error_return;
+    }
+
+    if (!(py_messages = PyList_New(received_count)))
+        goto error_return;
+
+    for (i = 0; i < received_count; i++) {
+        mq = (MessageQueue *)PyTuple_GET_ITEM(py_queues_tuple, received[i].queue_index);
+        py_decoded = decode_message(mq, PyBytes_FromStringAndSize(buffer + received[i].offset,
+                                                                  received[i].size));
+        if ((!py_decoded) && PyErr_ExceptionMatches(PyExc_Exception)) {
+            // Every message has already been taken off its queue, so raising
+            // here would lose the others too. Instead this message's tuple
+            // carries the exception in place of the message.
+            PyErr_Fetch(&py_error_type, &py_decoded, &py_error_traceback);
+            PyErr_NormalizeException(&py_error_type, &py_decoded, &py_error_traceback);
+            if (py_error_traceback)
+                PyException_SetTraceback(py_decoded, py_error_traceback);
+            Py_XDECREF(py_error_type);
+            Py_XDECREF(py_error_traceback);
+        }
+        if (!py_decoded)
+            goto error_return;
+
+        py_message = Py_BuildValue("ONN",
+                        (PyObject *)mq,
+                        py_decoded,
+                        PyLong_FromLong((long)received[i].priority)
+                    );
+        if (!py_message)
+            goto error_return;
+
+        PyList_SET_ITEM(py_messages, i, py_message);
+    }
+
+    PyMem_RawFree(buffer);
+    PyMem_RawFree(received);
+    PyMem_Free(sizes);
+    PyMem_Free(credits);
+    PyMem_Free(weights);
+    PyMem_Free(pollfds);
+    Py_XDECREF(py_weights_tuple);
+    Py_DECREF(py_queues_tuple);
+
+    return py_messages;
+
+    error_return:
+    PyMem_RawFree(buffer);
+    PyMem_RawFree(received);
+    PyMem_Free(sizes);
+    PyMem_Free(credits);
+    PyMem_Free(weights);
+    PyMem_Free(pollfds);
+    Py_XDECREF(py_weights_tuple);
+    Py_XDECREF(py_queues_tuple);
+    Py_XDECREF(py_messages);
+
+    return NULL;
 }
 #endif
+#endif
 
 
 static PyMethodDef module_methods[ ] = {
@@ -2403,12 +6469,49 @@ static PyMethodDef module_methods[ ] = {
         METH_VARARGS,
         "Unlink shared memory"
     },
+    {   "_is_open",
+        (PyCFunction)posix_ipc_is_open,
+        METH_O,
+        "Returns True if a handle hasn't been closed (for the handle cache)"
+    },
+    {   "_hash_pages",
+        (PyCFunction)posix_ipc_hash_pages,
+        METH_VARARGS | METH_KEYWORDS,
+        "Hashes each page of a buffer (for SharedMemory.checkpoint())"
+    },
+    {   "_gather",
+        (PyCFunction)posix_ipc_gather,
+        METH_VARARGS,
+        "Copies equally spaced items out of a buffer (for SharedMemory.records())"
+    },
+    {   "_scatter",
+        (PyCFunction)posix_ipc_scatter,
+        METH_VARARGS,
+        "Copies items into equally spaced places in a buffer (for SharedMemory.records())"
+    },
 #ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
     {   "unlink_message_queue",
         (PyCFunction)posix_ipc_unlink_message_queue,
         METH_VARARGS,
         "Unlink a message queue"
     },
+    {   "limits",
+        (PyCFunction)posix_ipc_limits,
+        METH_NOARGS,
+        "Returns the system's current message queue limits"
+    },
+#ifdef MESSAGE_QUEUE_POLL_EXISTS
+    {   "wait_any",
+        (PyCFunction)posix_ipc_wait_any,
+        METH_VARARGS | METH_KEYWORDS,
+        "Wait until at least one of the message queues has a message"
+    },
+    {   "receive_any",
+        (PyCFunction)posix_ipc_receive_any,
+        METH_VARARGS | METH_KEYWORDS,
+        "Receive messages from whichever of the message queues have them"
+    },
+#endif
 #endif
     {NULL} /* Sentinel */
 };
@@ -2416,7 +6519,7 @@ static PyMethodDef module_methods[ ] = {
 
 static struct PyModuleDef this_module = {
     PyModuleDef_HEAD_INIT,  // m_base
-    "posix_ipc",            // m_name
+    "posix_ipc._posix_ipc", // m_name
     "POSIX IPC module",     // m_doc
     -1,                     // m_size (space allocated for module globals)
     module_methods,         // m_methods
@@ -2427,7 +6530,7 @@ static struct PyModuleDef this_module = {
 };
 
 /* Module init function */
-#define POSIX_IPC_INIT_FUNCTION_NAME PyInit_posix_ipc
+#define POSIX_IPC_INIT_FUNCTION_NAME PyInit__posix_ipc
 
 /* Module init function */
 PyMODINIT_FUNC
@@ -2449,22 +6552,81 @@ POSIX_IPC_INIT_FUNCTION_NAME(void) {
     if (PyType_Ready(&SharedMemoryType) < 0)
         goto error_return;
 
+    if (PyType_Ready(&AtomicArrayType) < 0)
+        goto error_return;
+
+#ifdef UNNAMED_SEMAPHORE_EXISTS
+    if (PyType_Ready(&SemaphoreArrayType) < 0)
+        goto error_return;
+#endif
+
 #ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
     if (PyType_Ready(&MessageQueueType) < 0)
         goto error_return;
 #endif
 
+#ifdef ROBUST_MUTEX_EXISTS
+    if (PyType_Ready(&RobustLockType) < 0)
+        goto error_return;
+#endif
+
+#ifdef FUTEX_EXISTS
+    if (PyType_Ready(&BarrierType) < 0)
+        goto error_return;
+#endif
+
     Py_INCREF(&SemaphoreType);
     PyModule_AddObject(module, "Semaphore", (PyObject *)&SemaphoreType);
 
     Py_INCREF(&SharedMemoryType);
     PyModule_AddObject(module, "SharedMemory", (PyObject *)&SharedMemoryType);
 
+    Py_INCREF(&AtomicArrayType);
+    PyModule_AddObject(module, "AtomicArray", (PyObject *)&AtomicArrayType);
+
+#ifdef UNNAMED_SEMAPHORE_EXISTS
+    Py_INCREF(&SemaphoreArrayType);
+    PyModule_AddObject(module, "SemaphoreArray", (PyObject *)&SemaphoreArrayType);
+    Py_INCREF(Py_True);
+    PyModule_AddObject(module, "SEMAPHORE_ARRAY_SUPPORTED", Py_True);
+#else
+    Py_INCREF(Py_False);
+    PyModule_AddObject(module, "SEMAPHORE_ARRAY_SUPPORTED", Py_False);
+#endif
+
 #ifdef MESSAGE_QUEUE_SUPPORT_EXISTS
     Py_INCREF(&MessageQueueType);
     PyModule_AddObject(module, "MessageQueue", (PyObject *)&MessageQueueType);
 #endif
 
+#ifdef ROBUST_MUTEX_EXISTS
+    Py_INCREF(&RobustLockType);
+    PyModule_AddObject(module, "RobustLock", (PyObject *)&RobustLockType);
+    Py_INCREF(Py_True);
+    PyModule_AddObject(module, "ROBUST_LOCK_SUPPORTED", Py_True);
+#else
+    Py_INCREF(Py_False);
+    PyModule_AddObject(module, "ROBUST_LOCK_SUPPORTED", Py_False);
+#endif
+
+#ifdef FUTEX_EXISTS
+    Py_INCREF(&BarrierType);
+    PyModule_AddObject(module, "Barrier", (PyObject *)&BarrierType);
+    Py_INCREF(Py_True);
+    PyModule_AddObject(module, "BARRIER_SUPPORTED", Py_True);
+#else
+    Py_INCREF(Py_False);
+    PyModule_AddObject(module, "BARRIER_SUPPORTED", Py_False);
+#endif
+
+#ifdef USDT_PROBES_EXIST
+    Py_INCREF(Py_True);
+    PyModule_AddObject(module, "USDT_PROBES_SUPPORTED", Py_True);
+#else
+    Py_INCREF(Py_False);
+    PyModule_AddObject(module, "USDT_PROBES_SUPPORTED", Py_False);
+#endif
+
 
     PyModule_AddStringConstant(module, "VERSION", POSIX_IPC_VERSION);
     PyModule_AddStringConstant(module, "__version__", POSIX_IPC_VERSION);
@@ -2486,6 +6648,13 @@ POSIX_IPC_INIT_FUNCTION_NAME(void) {
     PyModule_AddIntConstant(module, "QUEUE_MESSAGES_MAX_DEFAULT", QUEUE_MESSAGES_MAX_DEFAULT);
     PyModule_AddIntConstant(module, "QUEUE_MESSAGE_SIZE_MAX_DEFAULT", QUEUE_MESSAGE_SIZE_MAX_DEFAULT);
     PyModule_AddIntConstant(module, "QUEUE_PRIORITY_MAX", QUEUE_PRIORITY_MAX);
+#ifdef MESSAGE_QUEUE_POLL_EXISTS
+    Py_INCREF(Py_True);
+    PyModule_AddObject(module, "MESSAGE_QUEUE_WAIT_SUPPORTED", Py_True);
+#else
+    Py_INCREF(Py_False);
+    PyModule_AddObject(module, "MESSAGE_QUEUE_WAIT_SUPPORTED", Py_False);
+#endif
 #ifdef SIGRTMAX
     // SIGRTMIN and SIGRTMAX are only defined on platforms that support
     // the Realtime Signals Extension (RTS). NetBSD prior to 6.0 is an
@@ -2496,6 +6665,8 @@ POSIX_IPC_INIT_FUNCTION_NAME(void) {
 #else
     Py_INCREF(Py_False);
     PyModule_AddObject(module, "MESSAGE_QUEUES_SUPPORTED", Py_False);
+    Py_INCREF(Py_False);
+    PyModule_AddObject(module, "MESSAGE_QUEUE_WAIT_SUPPORTED", Py_False);
 #endif
 
     PyModule_AddIntConstant(module, "PAGE_SIZE", PAGE_SIZE);
@@ -2547,6 +6718,11 @@ POSIX_IPC_INIT_FUNCTION_NAME(void) {
     else
         PyDict_SetItemString(module_dict, "BusyError", pBusyException);
 
+    if (!(pBrokenBarrierException = PyErr_NewException("posix_ipc.BrokenBarrierError", pBaseException, NULL)))
+        goto error_return;
+    else
+        PyDict_SetItemString(module_dict, "BrokenBarrierError", pBrokenBarrierException);
+
     return module;
 
     error_return:
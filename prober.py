@@ -175,10 +175,43 @@ def sniff_page_size():
     return page_size
 
 
+def sniff_robust_mutex(linker_options):
+    return does_build_succeed("sniff_robust_mutex.c", linker_options)
+
+
+def sniff_futex(linker_options):
+    return does_build_succeed("sniff_futex.c", linker_options)
+
+
+def sniff_copy_file_range(linker_options):
+    return does_build_succeed("sniff_copy_file_range.c", linker_options)
+
+
+def sniff_unnamed_semaphore(linker_options):
+    # SemaphoreArray needs sem_init() with pshared = 1, which OS X declares
+    # but doesn't implement, so I test it rather than assume it.
+    return compile_and_run("sniff_unnamed_semaphore.c", linker_options) == "1"
+
+
+def sniff_usdt(linker_options):
+    # USDT probes are compiled in if sys/sdt.h is available, unless the
+    # environment variable POSIX_IPC_NO_USDT is set.
+    if os.environ.get("POSIX_IPC_NO_USDT"):
+        return False
+    return does_build_succeed("sniff_usdt.c", linker_options)
+
+
 def sniff_mq_existence(linker_options):
     return does_build_succeed("sniff_mq_existence.c", linker_options)
 
 
+def sniff_mq_pollable(linker_options):
+    # Message queue descriptors are file descriptors under Linux, so they
+    # work with poll(). That's not true everywhere (e.g. FreeBSD), so I
+    # test it rather than assume it.
+    return compile_and_run("sniff_mq_pollable.c", linker_options) == "1"
+
+
 def sniff_mq_prio_max():
     # MQ_PRIO_MAX is #defined in limits.h on all of the systems that I
     # checked that support message queues at all. (I checked 2 Linux boxes,
@@ -374,6 +407,21 @@ def probe():
     if sniff_sem_timedwait(linker_options):
         d["SEM_TIMEDWAIT_EXISTS"] = ""
 
+    if sniff_unnamed_semaphore(linker_options):
+        d["UNNAMED_SEMAPHORE_EXISTS"] = ""
+
+    if sniff_robust_mutex(linker_options):
+        d["ROBUST_MUTEX_EXISTS"] = ""
+
+    if sniff_futex(linker_options):
+        d["FUTEX_EXISTS"] = ""
+
+    if sniff_copy_file_range(linker_options):
+        d["COPY_FILE_RANGE_EXISTS"] = ""
+
+    if sniff_usdt(linker_options):
+        d["USDT_PROBES_EXIST"] = ""
+
     d["SEM_VALUE_MAX"] = sniff_sem_value_max()
     # A return of None means that I don't need to #define this myself.
     if d["SEM_VALUE_MAX"] is None:
@@ -382,6 +430,9 @@ def probe():
     if sniff_mq_existence(linker_options):
         d["MESSAGE_QUEUE_SUPPORT_EXISTS"] = ""
 
+        if sniff_mq_pollable(linker_options):
+            d["MESSAGE_QUEUE_POLL_EXISTS"] = ""
+
     d["QUEUE_MESSAGES_MAX_DEFAULT"] = sniff_mq_max_messages()
     d["QUEUE_MESSAGE_SIZE_MAX_DEFAULT"] = sniff_mq_max_message_size_default()
     d["QUEUE_PRIORITY_MAX"] = sniff_mq_prio_max()
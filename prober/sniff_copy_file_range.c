@@ -0,0 +1,14 @@
+// copy_file_range() is Linux-specific (and glibc >= 2.27) but FreeBSD has it
+// too.
+#define _GNU_SOURCE
+#include <sys/types.h>
+#include <unistd.h>
+
+int main(void) {
+    off_t offset_in = 0;
+    off_t offset_out = 0;
+
+    copy_file_range(0, &offset_in, 1, &offset_out, 1, 0);
+
+    return 0;
+}
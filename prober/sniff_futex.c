@@ -0,0 +1,17 @@
+// Futexes are Linux-specific. This only checks that the headers and the
+// syscall number are available.
+#include <stdint.h>
+#include <limits.h>
+#include <unistd.h>
+#include <sys/syscall.h>
+#include <linux/futex.h>
+
+int main(void) {
+    uint32_t word = 0;
+
+    syscall(SYS_futex, &word, FUTEX_WAIT_BITSET | FUTEX_CLOCK_REALTIME, 1,
+            NULL, NULL, FUTEX_BITSET_MATCH_ANY);
+    syscall(SYS_futex, &word, FUTEX_WAKE, INT_MAX, NULL, NULL, 0);
+
+    return 0;
+}
@@ -0,0 +1,44 @@
+// Prints 1 if message queue descriptors can be passed to poll() (as they
+// can under Linux), 0 otherwise. Under some systems (e.g. FreeBSD), mqd_t
+// is a pointer rather than a file descriptor.
+#include <stdio.h>
+#include <fcntl.h>
+#include <poll.h>
+#include <unistd.h>
+#include <mqueue.h>
+
+int main(void) {
+    char name[32];
+    struct mq_attr attr;
+    struct pollfd pollfd;
+    mqd_t mqd;
+    int pollable = 0;
+
+    attr.mq_flags = 0;
+    attr.mq_maxmsg = 1;
+    attr.mq_msgsize = 1;
+    attr.mq_curmsgs = 0;
+
+    sprintf(name, "/posix_ipc_%d", (int)getpid());
+
+    mqd = mq_open(name, O_CREAT | O_EXCL | O_RDWR, 0600, &attr);
+
+    if ((mqd_t)-1 != mqd) {
+        mq_unlink(name);
+
+        if (0 == mq_send(mqd, "x", 1, 0)) {
+            pollfd.fd = (int)(long)mqd;
+            pollfd.events = POLLIN;
+            pollfd.revents = 0;
+
+            if ((1 == poll(&pollfd, 1, 0)) && (pollfd.revents & POLLIN))
+                pollable = 1;
+        }
+
+        mq_close(mqd);
+    }
+
+    printf("%d\n", pollable);
+
+    return 0;
+}
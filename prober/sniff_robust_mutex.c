@@ -0,0 +1,19 @@
+// Robust mutexes are part of POSIX.1-2008 but not every platform (e.g. macOS)
+// implements them.
+#include <pthread.h>
+#include <time.h>
+
+int main(void) {
+    pthread_mutexattr_t attr;
+    pthread_mutex_t mutex;
+    struct timespec timeout = {0, 0};
+
+    pthread_mutexattr_init(&attr);
+    pthread_mutexattr_setpshared(&attr, PTHREAD_PROCESS_SHARED);
+    pthread_mutexattr_setrobust(&attr, PTHREAD_MUTEX_ROBUST);
+    pthread_mutex_init(&mutex, &attr);
+    pthread_mutex_timedlock(&mutex, &timeout);
+    pthread_mutex_consistent(&mutex);
+
+    return 0;
+}
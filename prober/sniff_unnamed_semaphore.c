@@ -0,0 +1,27 @@
+// Prints 1 if unnamed semaphores can be shared between processes (i.e.
+// sem_init() with pshared = 1 works), 0 otherwise. OS X has sem_init() but
+// it always fails with ENOSYS, so building this isn't enough.
+#include <stdio.h>
+#include <sys/mman.h>
+#include <semaphore.h>
+
+int main(void) {
+    sem_t *semaphore;
+    int works = 0;
+
+    semaphore = (sem_t *)mmap(NULL, sizeof(sem_t), PROT_READ | PROT_WRITE,
+                              MAP_SHARED | MAP_ANON, -1, 0);
+
+    if (MAP_FAILED != semaphore) {
+        if (0 == sem_init(semaphore, 1, 0)) {
+            if ((0 == sem_post(semaphore)) && (0 == sem_trywait(semaphore)))
+                works = 1;
+            sem_destroy(semaphore);
+        }
+        munmap(semaphore, sizeof(sem_t));
+    }
+
+    printf("%d\n", works);
+
+    return 0;
+}
@@ -0,0 +1,36 @@
+// USDT probes need sys/sdt.h, which comes from SystemTap (e.g. the
+// systemtap-sdt-dev or systemtap-sdt-devel package).
+//
+// This uses the header the way posix_ipc_module.c does -- semaphores in the
+// .probes section that are tested with __builtin_expect(), and probes with
+// up to 5 arguments of the types that the module passes (C strings, errno
+// expressions, longs and unsigned long longs) -- so that a header which can't
+// handle them leaves the probes out rather than breaking the module's build.
+#include <errno.h>
+#include <stddef.h>
+
+#define _SDT_HAS_SEMAPHORES 1
+#include <sys/sdt.h>
+
+unsigned short posix_ipc_sniff__entry_semaphore __attribute__((unused))
+                                                __attribute__((section(".probes")));
+unsigned short posix_ipc_sniff__return_semaphore __attribute__((unused))
+                                                 __attribute__((section(".probes")));
+
+static const char *name = "/sniff";
+
+int main(void) {
+    unsigned long long started = 0;
+    long size = 42;
+    unsigned int priority = 0;
+    int rc = 0;
+
+    if (__builtin_expect(posix_ipc_sniff__entry_semaphore, 0))
+        started = 1;
+
+    DTRACE_PROBE3(posix_ipc, sniff__entry, name, size, priority);
+    DTRACE_PROBE5(posix_ipc, sniff__return, name, size, priority,
+                  (-1 == rc) ? errno : 0, started);
+
+    return 0;
+}
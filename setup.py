@@ -49,7 +49,13 @@ d = prober.probe()
 if "REALTIME_LIB_IS_NEEDED" in d:
     libraries.append("rt")
 
-ext_modules = [distutools.Extension("posix_ipc",
+# Older glibcs keep the robust mutex functions in libpthread
+if "ROBUST_MUTEX_EXISTS" in d:
+    libraries.append("pthread")
+
+# The C code is the extension module posix_ipc._posix_ipc. The posix_ipc package re-exports
+# everything in it and adds the few features that are written in Python.
+ext_modules = [distutools.Extension("posix_ipc._posix_ipc",
                                     source_files,
                                     libraries=libraries,
                                     depends=["posix_ipc_module.c",
@@ -71,5 +77,6 @@ distutools.setup(name=name,
                  classifiers=classifiers,
                  license=license,
                  keywords=keywords,
+                 packages=["posix_ipc"],
                  ext_modules=ext_modules
                  )
@@ -0,0 +1,203 @@
+"""Tests and task functions shared by the tests of IPCExecutor and WorkStealingPool"""
+# Python imports
+import multiprocessing
+import os
+import pickle
+import subprocess
+import sys
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+# Project imports
+import posix_ipc
+
+
+def add_one(x):
+    return x + 1
+
+
+def raise_key_error():
+    raise KeyError('foo')
+
+
+def get_pid(ignored):
+    return os.getpid()
+
+
+def return_unpicklable():
+    return lambda: None
+
+
+class UnpicklableError(Exception):
+    """An exception that pickles but can't be unpickled, because __init__() needs 2 arguments"""
+    def __init__(self, a, b):
+        super().__init__(a)
+
+
+def raise_unpicklable_error():
+    raise UnpicklableError(1, 2)
+
+
+initialized_value = None
+
+
+def initialize(value):
+    global initialized_value
+    initialized_value = value
+
+
+def get_initialized_value():
+    return initialized_value
+
+
+# Run in a child process to check that a process that exits right after shutdown(wait=False)
+# doesn't leave the IPC objects behind. It prints the kind and name of each one.
+SHUTDOWN_WITHOUT_WAITING = """
+import sys
+import time
+sys.path.insert(0, %r)
+import %s as test_module
+
+test_class = test_module.%s
+executor = test_class.executor_class(max_workers=1)
+executor.submit(time.sleep, 0.5)
+for kind, name in test_class.ipc_objects(executor):
+    print(kind.__name__, name)
+executor.shutdown(wait=False)
+"""
+
+
+class ExecutorTests:
+    """Tests that every executor must pass
+
+    A subclass (which must also subclass unittest.TestCase) sets executor_class and
+    small_options (the options that make an executor hold as few tasks as possible) and
+    implements ipc_objects(executor), which returns (kind, name) for each of the executor's IPC
+    objects.
+    """
+    executor_class = None
+    small_options = {}
+
+    def setUp(self):
+        self.executor = self.executor_class(max_workers=2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def assertDestroyed(self, ipc_objects):
+        """Asserts that each of the (kind, name) pairs no longer exists"""
+        for kind, name in ipc_objects:
+            self.assertRaises(posix_ipc.ExistentialError, kind, name)
+
+    def test_submit(self):
+        """tests that submit() returns a future with the result"""
+        self.assertEqual(self.executor.submit(add_one, 41).result(), 42)
+
+    def test_map(self):
+        """tests that map() returns results in order"""
+        self.assertEqual(list(self.executor.map(add_one, range(500))), list(range(1, 501)))
+
+    def test_workers(self):
+        """tests that tasks run in other processes"""
+        pids = set(self.executor.map(get_pid, [None] * 20))
+        self.assertNotIn(os.getpid(), pids)
+        self.assertLessEqual(len(pids), 2)
+
+    def test_exception(self):
+        """tests that an exception raised by a task is raised by result() with its traceback"""
+        future = self.executor.submit(raise_key_error)
+        self.assertRaises(KeyError, future.result)
+        self.assertIn('raise_key_error', str(future.exception().__cause__))
+
+    def test_unpicklable_result(self):
+        """tests that a result that can't be pickled is reported as an exception"""
+        self.assertRaises(Exception, self.executor.submit(return_unpicklable).result)
+
+    def test_unpicklable_argument(self):
+        """tests that an argument that can't be pickled is reported through the future"""
+        future = self.executor.submit(add_one, lambda: None)
+        self.assertRaises(Exception, future.result, 10)
+        self.assertEqual(self.executor.submit(add_one, 1).result(), 2)
+
+    def test_result_not_unpicklable(self):
+        """tests that a result that can't be unpickled breaks the executor rather than hanging"""
+        future = self.executor.submit(raise_unpicklable_error)
+        self.assertRaises(BrokenProcessPool, future.result, 10)
+
+    def test_large_arguments(self):
+        """tests that arguments and results too large to pass inline work"""
+        payload = bytearray(range(256)) * 10000
+        result = self.executor.submit(bytearray, pickle.PickleBuffer(payload)).result()
+        self.assertEqual(result, payload)
+
+    def test_shutdown(self):
+        """tests that shutdown() rejects new tasks and destroys the IPC objects"""
+        ipc_objects = self.ipc_objects(self.executor)
+        self.executor.shutdown()
+        self.assertRaises(RuntimeError, self.executor.submit, add_one, 1)
+        self.assertDestroyed(ipc_objects)
+
+    def test_shutdown_without_waiting(self):
+        """tests that the IPC objects are destroyed at exit after shutdown(wait=False)"""
+        script = SHUTDOWN_WITHOUT_WAITING % (os.path.dirname(os.path.abspath(__file__)),
+                                             type(self).__module__, type(self).__name__)
+        output = subprocess.check_output([sys.executable, '-c', script], timeout=60)
+        ipc_objects = [line.split() for line in output.decode().splitlines()]
+        self.assertTrue(ipc_objects)
+        self.assertDestroyed([(getattr(posix_ipc, kind), name) for kind, name in ipc_objects])
+
+    def test_submit_from_callback(self):
+        """tests that a done-callback can submit more tasks than the executor holds"""
+        futures = []
+        submitted = threading.Event()
+
+        with self.executor_class(max_workers=1, **self.small_options) as executor:
+            def submit_more(future):
+                for i in range(50):
+                    futures.append(executor.submit(add_one, i))
+                submitted.set()
+
+            executor.submit(add_one, 0).add_done_callback(submit_more)
+            self.assertTrue(submitted.wait(10))
+            self.assertEqual([future.result(10) for future in futures], list(range(1, 51)))
+
+    def test_shutdown_from_callback(self):
+        """tests that tasks submitted by a done-callback run even if it then shuts down"""
+        futures = []
+
+        executor = self.executor_class(max_workers=1, **self.small_options)
+
+        def submit_more(future):
+            for i in range(50):
+                futures.append(executor.submit(add_one, i))
+            executor.shutdown(wait=False)
+
+        executor.submit(add_one, 0).add_done_callback(submit_more)
+        executor._result_thread.join(10)
+        self.assertFalse(executor._result_thread.is_alive())
+        self.assertEqual([future.result(0) for future in futures], list(range(1, 51)))
+
+    def test_broken(self):
+        """tests that a worker dying breaks the executor"""
+        future = self.executor.submit(os._exit, 1)
+        self.assertRaises(BrokenProcessPool, future.result, 10)
+        self.assertRaises(BrokenProcessPool, self.executor.submit, add_one, 1)
+
+    def test_initializer(self):
+        """tests that the initializer runs in each worker"""
+        executor = self.executor_class(max_workers=1, initializer=initialize,
+                                       initargs=('foo', ))
+        with executor:
+            self.assertEqual(executor.submit(get_initialized_value).result(), 'foo')
+
+    def test_spawn(self):
+        """tests that workers started with spawn work"""
+        executor = self.executor_class(max_workers=1,
+                                       mp_context=multiprocessing.get_context('spawn'))
+        with executor:
+            self.assertEqual(executor.submit(add_one, 1).result(), 2)
+
+    def test_bad_max_workers(self):
+        """tests that max_workers must be positive"""
+        self.assertRaises(ValueError, self.executor_class, max_workers=0)
+
@@ -0,0 +1,87 @@
+# Python imports
+import unittest
+from unittest import skipUnless
+import os
+
+# Project imports
+import posix_ipc
+try:
+    import pyarrow
+    import posix_ipc.arrow
+except ImportError:
+    pyarrow = None
+# Hack -- add tests directory to sys.path so Python 3 can find base.py.
+import sys
+sys.path.insert(0, os.path.join(os.getcwd(), 'tests'))
+import base as tests_base  # noqa
+
+
+@skipUnless(pyarrow, "Requires pyarrow")
+class TestArrow(tests_base.Base):
+    """Exercise posix_ipc.arrow"""
+    def setUp(self):
+        self.table = pyarrow.table({"id": pyarrow.array(range(1000), pyarrow.int64()),
+                                    "name": ["row %d" % i for i in range(1000)],
+                                    "value": [i / 4 for i in range(1000)],
+                                    })
+        self.name = posix_ipc.arrow.write_table(None, self.table)
+
+    def tearDown(self):
+        posix_ipc.unlink_shared_memory(self.name)
+
+    def test_round_trip(self):
+        """tests that read_table() returns the table passed to write_table()"""
+        table = posix_ipc.arrow.read_table(self.name)
+        self.assertTrue(table.equals(self.table))
+
+    def test_segment_size(self):
+        """tests that the segment is exactly the size of the stream"""
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, self.table.schema) as writer:
+            writer.write(self.table)
+        memory = posix_ipc.SharedMemory(self.name)
+        self.assertEqual(memory.size, sink.getvalue().size)
+        memory.close_fd()
+
+    def test_zero_copy(self):
+        """tests that the table refers to the segment rather than to a copy"""
+        table = posix_ipc.arrow.read_table(self.name)
+        values = table.column("id").chunk(0).buffers()[1]
+        self.assertEqual(values.to_pybytes()[8:16], (1).to_bytes(8, "little"))
+
+        # A change to the segment is visible in the table.
+        memory = posix_ipc.SharedMemory(self.name)
+        data = memory.records("=q", count=memory.size // 8)
+        raw = bytes(data.field(0))
+        offset = raw.find(values.to_pybytes())
+        self.assertGreaterEqual(offset, 0)
+        data[(offset // 8) + 1] = (42, )
+        self.assertEqual(table.column("id")[1].as_py(), 42)
+        data.close()
+        memory.close_fd()
+
+    def test_outlives_unlink(self):
+        """tests that a table remains usable after its segment is unlinked"""
+        table = posix_ipc.arrow.read_table(self.name)
+        posix_ipc.unlink_shared_memory(self.name)
+        self.assertEqual(table.column("name")[999].as_py(), "row 999")
+        # Recreate it so that tearDown() has something to unlink.
+        posix_ipc.arrow.write_table(self.name, self.table)
+
+    def test_existing_name(self):
+        """tests that write_table() won't overwrite an existing segment by default"""
+        self.assertRaises(posix_ipc.ExistentialError, posix_ipc.arrow.write_table,
+                          self.name, self.table)
+
+    def test_record_batch(self):
+        """tests that write_table() accepts a RecordBatch"""
+        batch = self.table.to_batches()[0]
+        name = posix_ipc.arrow.write_table(None, batch)
+        try:
+            self.assertTrue(posix_ipc.arrow.read_table(name).equals(self.table))
+        finally:
+            posix_ipc.unlink_shared_memory(name)
+
+
+if __name__ == '__main__':
+    unittest.main()
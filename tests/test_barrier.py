@@ -0,0 +1,160 @@
+# Python imports
+import unittest
+from unittest import skipUnless
+import os
+import threading
+import time
+
+# Project imports
+import posix_ipc
+# Hack -- add tests directory to sys.path so Python 3 can find base.py.
+import sys
+sys.path.insert(0, os.path.join(os.getcwd(), 'tests'))
+import base as tests_base  # noqa
+
+PARTIES = 4
+
+
+@skipUnless(posix_ipc.BARRIER_SUPPORTED, "Requires Barrier support")
+class TestBarrier(tests_base.Base):
+    """Exercise the Barrier class"""
+    def setUp(self):
+        self.barrier = posix_ipc.Barrier(None, PARTIES, posix_ipc.O_CREX)
+
+    def tearDown(self):
+        if self.barrier:
+            self.barrier.unlink()
+            self.barrier.close()
+
+    def fork_parties(self, n, target):
+        """Forks n children that call target(barrier) and returns their pids"""
+        pids = []
+        for i in range(n):
+            pid = os.fork()
+            if not pid:
+                barrier = posix_ipc.Barrier(self.barrier.name)
+                try:
+                    target(barrier)
+                except BaseException:
+                    os._exit(1)
+                os._exit(0)
+            pids.append(pid)
+        return pids
+
+    def wait_for_children(self, pids):
+        """Asserts that all of the children exited successfully"""
+        for pid in pids:
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+    def test_attributes(self):
+        """tests the barrier's attributes"""
+        self.assertEqual(self.barrier.parties, PARTIES)
+        self.assertEqual(self.barrier.n_waiting, 0)
+        self.assertFalse(self.barrier.broken)
+        self.assertEqual(self.barrier.mode, 0o600)
+
+    def test_wait(self):
+        """tests that wait() returns a different index to each party, phase after phase"""
+        phases = 50
+
+        def target(barrier):
+            for i in range(phases):
+                barrier.wait(10)
+
+        pids = self.fork_parties(PARTIES - 1, target)
+        indices = [self.barrier.wait(10) for i in range(phases)]
+        self.wait_for_children(pids)
+
+        for index in indices:
+            self.assertIn(index, range(PARTIES))
+        self.assertEqual(self.barrier.n_waiting, 0)
+        self.assertFalse(self.barrier.broken)
+
+    def test_waits_for_all_parties(self):
+        """tests that wait() doesn't return until the last party arrives"""
+        def target(barrier):
+            time.sleep(0.2)
+            barrier.wait()
+
+        start = time.time()
+        pids = self.fork_parties(PARTIES - 1, target)
+        self.barrier.wait(10)
+        self.assertGreaterEqual(time.time() - start, 0.15)
+        self.wait_for_children(pids)
+
+    def test_single_party(self):
+        """tests that a barrier for one party never waits"""
+        barrier = posix_ipc.Barrier(None, 1, posix_ipc.O_CREX)
+        self.assertEqual(barrier.wait(0), 0)
+        self.assertEqual(barrier.wait(0), 0)
+        barrier.unlink()
+        barrier.close()
+
+    def test_timeout(self):
+        """tests that a timed out wait() raises BusyError and breaks the barrier"""
+        start = time.time()
+        self.assertRaises(posix_ipc.BusyError, self.barrier.wait, 0.2)
+        self.assertGreaterEqual(time.time() - start, 0.15)
+        self.assertTrue(self.barrier.broken)
+        self.assertRaises(posix_ipc.BrokenBarrierError, self.barrier.wait)
+
+    def test_abort(self):
+        """tests that abort() releases the waiting parties with BrokenBarrierError"""
+        def target(barrier):
+            try:
+                barrier.wait(10)
+            except posix_ipc.BrokenBarrierError:
+                pass
+            else:
+                raise AssertionError("wait() should have raised BrokenBarrierError")
+
+        pids = self.fork_parties(PARTIES - 2, target)
+        time.sleep(0.2)
+        self.assertEqual(self.barrier.n_waiting, PARTIES - 2)
+        self.barrier.abort()
+        self.wait_for_children(pids)
+        self.assertTrue(self.barrier.broken)
+
+    def test_parties_mismatch(self):
+        """tests that opening a barrier with the wrong number of parties fails"""
+        barrier = posix_ipc.Barrier(self.barrier.name, PARTIES)
+        barrier.close()
+        self.assertRaises(ValueError, posix_ipc.Barrier, self.barrier.name, PARTIES + 1)
+
+    def test_parties_required(self):
+        """tests that creating a barrier requires the number of parties"""
+        self.assertRaises(ValueError, posix_ipc.Barrier, None, flags=posix_ipc.O_CREX)
+        self.assertRaises(ValueError, posix_ipc.Barrier, None, 0, posix_ipc.O_CREX)
+
+    def test_o_excl_existing(self):
+        """tests that O_CREX fails if the barrier already exists"""
+        self.assertRaises(posix_ipc.ExistentialError, posix_ipc.Barrier,
+                          self.barrier.name, PARTIES, posix_ipc.O_CREX)
+
+    def test_closed(self):
+        """tests that a closed barrier raises ExistentialError"""
+        barrier = posix_ipc.Barrier(self.barrier.name)
+        barrier.close()
+        self.assertRaises(posix_ipc.ExistentialError, barrier.wait)
+        self.assertRaises(posix_ipc.ExistentialError, getattr, barrier, "parties")
+
+    def test_close_while_waiting(self):
+        """tests that close() raises BusyError while another thread is blocked in wait()"""
+        thread = threading.Thread(target=self.assertRaises,
+                                  args=(posix_ipc.BusyError, self.barrier.wait, .5))
+        thread.start()
+        time.sleep(.1)
+        self.assertRaises(posix_ipc.BusyError, self.barrier.close)
+        thread.join()
+
+    def test_wrong_type(self):
+        """tests that a shared memory segment that isn't a barrier is rejected"""
+        mem = posix_ipc.SharedMemory(None, posix_ipc.O_CREX, size=4096)
+        os.write(mem.fd, b'\xff' * 4)
+        self.assertRaises(ValueError, posix_ipc.Barrier, mem.name)
+        mem.close_fd()
+        mem.unlink()
+
+
+if __name__ == '__main__':
+    unittest.main()
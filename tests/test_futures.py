@@ -0,0 +1,45 @@
+# Python imports
+import unittest
+from unittest import skipUnless
+import os
+
+# Project imports
+import posix_ipc
+import posix_ipc.futures
+# Hack -- add tests directory to sys.path so Python 3 can find base.py.
+import sys
+sys.path.insert(0, os.path.join(os.getcwd(), 'tests'))
+import base as tests_base  # noqa
+import executor_base  # noqa
+
+
+@skipUnless(posix_ipc.MESSAGE_QUEUES_SUPPORTED, "Requires MessageQueue support")
+class TestIPCExecutor(executor_base.ExecutorTests, tests_base.Base):
+    """Exercise posix_ipc.futures.IPCExecutor"""
+    executor_class = posix_ipc.futures.IPCExecutor
+
+    @staticmethod
+    def ipc_objects(executor):
+        return [(posix_ipc.MessageQueue, executor._tasks.name),
+                (posix_ipc.MessageQueue, executor._results.name)]
+
+    def test_queue_creation_fails(self):
+        """tests that the task queue is destroyed if the result queue can't be created"""
+        created = []
+
+        def create_once(*args, **kwargs):
+            if created:
+                raise posix_ipc.Error("No more queues")
+            created.append(posix_ipc.MessageQueue(*args, **kwargs))
+            return created[-1]
+
+        posix_ipc.futures.MessageQueue = create_once
+        try:
+            self.assertRaises(posix_ipc.Error, posix_ipc.futures.IPCExecutor, max_workers=1)
+        finally:
+            posix_ipc.futures.MessageQueue = posix_ipc.MessageQueue
+        self.assertRaises(posix_ipc.ExistentialError, posix_ipc.MessageQueue, created[0].name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+# Python imports
+import unittest
+from unittest import skipUnless
+import concurrent.futures
+import multiprocessing
+import os
+import pickle
+
+# Project imports
+import posix_ipc
+import posix_ipc._handles
+# Hack -- add tests directory to sys.path so Python 3 can find base.py.
+import sys
+sys.path.insert(0, os.path.join(os.getcwd(), 'tests'))
+import base as tests_base  # noqa
+
+
+def round_trip(handle):
+    return pickle.loads(pickle.dumps(handle))
+
+
+def use_handles(semaphore, memory, mq):
+    # Runs in a worker process that received the handles by pickle.
+    semaphore.release()
+    os.write(memory.fd, b'worker')
+    mq.send('hello from %d' % os.getpid())
+    return semaphore.name, memory.name, mq.name
+
+
+class TestSemaphorePickling(tests_base.Base):
+    """Exercise pickling of Semaphore"""
+    def setUp(self):
+        self.sem = posix_ipc.Semaphore(None, posix_ipc.O_CREX)
+
+    def tearDown(self):
+        self.sem.unlink()
+        self.sem.close()
+
+    def test_round_trip(self):
+        """tests that an unpickled Semaphore refers to the same semaphore"""
+        sem = round_trip(self.sem)
+        self.assertIsInstance(sem, posix_ipc.Semaphore)
+        self.assertIsNot(sem, self.sem)
+        self.assertEqual(sem.name, self.sem.name)
+        sem.release()
+        self.assertEqual(self.sem.value, 1)
+
+    def test_cached(self):
+        """tests that unpickling the same Semaphore twice returns the same object"""
+        self.assertIs(round_trip(self.sem), round_trip(self.sem))
+
+    def test_reopen_after_close(self):
+        """tests that unpickling opens a new Semaphore after the cached one is closed"""
+        sem = round_trip(self.sem)
+        sem.close()
+        other = round_trip(self.sem)
+        self.assertIsNot(other, sem)
+        other.release()
+        self.assertEqual(self.sem.value, 1)
+
+    def test_unlinked(self):
+        """tests that unpickling an unlinked Semaphore raises ExistentialError"""
+        sem = posix_ipc.Semaphore(None, posix_ipc.O_CREX)
+        data = pickle.dumps(sem)
+        sem.unlink()
+        sem.close()
+        self.assertRaises(posix_ipc.ExistentialError, pickle.loads, data)
+
+    @skipUnless(os.path.isdir('/dev/shm'), "Requires semaphores to be visible in /dev/shm")
+    def test_recreated(self):
+        """tests that unpickling opens the new semaphore after the name is unlinked and reused"""
+        sem = posix_ipc.Semaphore(None, posix_ipc.O_CREX)
+        data = pickle.dumps(sem)
+        stale = pickle.loads(data)
+        sem.unlink()
+        sem.close()
+        sem = posix_ipc.Semaphore(sem.name, posix_ipc.O_CREX, initial_value=3)
+        try:
+            self.assertEqual(pickle.loads(data).value, 3)
+            self.assertRaises(posix_ipc.ExistentialError, stale.release)
+        finally:
+            sem.unlink()
+            sem.close()
+
+    def test_cache_is_bounded(self):
+        """tests that the least recently unpickled handle is closed when the cache is full"""
+        old_max = posix_ipc._handles.MAX_HANDLES
+        posix_ipc._handles.MAX_HANDLES = 2
+        sems = [posix_ipc.Semaphore(None, posix_ipc.O_CREX) for i in range(3)]
+        try:
+            handles = [round_trip(sem) for sem in sems]
+            self.assertRaises(posix_ipc.ExistentialError, handles[0].release)
+            handles[2].release()
+            self.assertLessEqual(len(posix_ipc._handles._cache), 2)
+        finally:
+            posix_ipc._handles.MAX_HANDLES = old_max
+            for sem in sems:
+                sem.unlink()
+                sem.close()
+
+
+class TestSharedMemoryPickling(tests_base.Base):
+    """Exercise pickling of SharedMemory"""
+    def setUp(self):
+        self.mem = posix_ipc.SharedMemory(None, posix_ipc.O_CREX, size=4096)
+
+    def tearDown(self):
+        self.mem.unlink()
+        self.mem.close_fd()
+
+    def test_round_trip(self):
+        """tests that an unpickled SharedMemory refers to the same segment"""
+        mem = round_trip(self.mem)
+        self.assertIsInstance(mem, posix_ipc.SharedMemory)
+        self.assertEqual(mem.name, self.mem.name)
+        self.assertEqual(mem.size, 4096)
+
+    def test_read_only(self):
+        """tests that read_only is preserved and is part of the cache key"""
+        read_only = posix_ipc.SharedMemory(self.mem.name, read_only=True)
+        try:
+            unpickled = round_trip(read_only)
+            self.assertTrue(unpickled.read_only)
+            self.assertFalse(round_trip(self.mem).read_only)
+            self.assertIsNot(unpickled, round_trip(self.mem))
+        finally:
+            read_only.close_fd()
+
+    def test_reopen_after_close_fd(self):
+        """tests that unpickling opens a new SharedMemory after the cached one's fd is closed"""
+        mem = round_trip(self.mem)
+        mem.close_fd()
+        other = round_trip(self.mem)
+        self.assertIsNot(other, mem)
+        self.assertNotEqual(other.fd, -1)
+
+    @skipUnless(os.path.isdir('/dev/shm'), "Requires shared memory to be visible in /dev/shm")
+    def test_recreated(self):
+        """tests that unpickling opens the new segment after the name is unlinked and reused"""
+        os.write(self.mem.fd, b'first')
+        data = pickle.dumps(self.mem)
+        stale = pickle.loads(data)
+        self.mem.unlink()
+        self.mem.close_fd()
+        self.mem = posix_ipc.SharedMemory(self.mem.name, posix_ipc.O_CREX, size=4096)
+        os.write(self.mem.fd, b'secnd')
+        mem = pickle.loads(data)
+        self.assertIsNot(mem, stale)
+        self.assertEqual(os.pread(mem.fd, 5, 0), b'secnd')
+        # The stale handle was closed so that it doesn't keep the old segment alive.
+        self.assertEqual(stale.fd, -1)
+
+
+@skipUnless(posix_ipc.MESSAGE_QUEUES_SUPPORTED, "Requires MessageQueue support")
+class TestMessageQueuePickling(tests_base.Base):
+    """Exercise pickling of MessageQueue"""
+    def setUp(self):
+        self.mq = posix_ipc.MessageQueue(None, posix_ipc.O_CREX)
+
+    def tearDown(self):
+        self.mq.unlink()
+        self.mq.close()
+
+    def test_round_trip(self):
+        """tests that an unpickled MessageQueue refers to the same queue"""
+        mq = round_trip(self.mq)
+        self.assertIsInstance(mq, posix_ipc.MessageQueue)
+        self.assertEqual(mq.name, self.mq.name)
+        mq.send(b'hello')
+        self.assertEqual(self.mq.receive()[0], b'hello')
+
+    def test_read_write(self):
+        """tests that read and write are preserved"""
+        writer = posix_ipc.MessageQueue(self.mq.name, read=False)
+        try:
+            mq = round_trip(writer)
+            self.assertRaises(posix_ipc.PermissionsError, mq.receive, 0)
+            self.assertIsNot(mq, round_trip(self.mq))
+        finally:
+            writer.close()
+
+    def test_codec(self):
+        """tests that the codec is preserved"""
+        mq = posix_ipc.MessageQueue(self.mq.name, codec='zlib')
+        try:
+            unpickled = round_trip(mq)
+            self.assertEqual(unpickled.codec, mq.codec)
+            unpickled.send(b'x' * 1000)
+            self.assertEqual(mq.receive()[0], b'x' * 1000)
+            # The queue without a codec is cached separately.
+            self.assertIsNone(round_trip(self.mq).codec)
+        finally:
+            mq.close()
+
+
+@skipUnless(posix_ipc.MESSAGE_QUEUES_SUPPORTED, "Requires MessageQueue support")
+class TestPicklingToWorkers(tests_base.Base):
+    """Exercise sending handles to worker processes"""
+    def test_spawn_pool(self):
+        """tests that workers started with spawn can use handles passed to them"""
+        sem = posix_ipc.Semaphore(None, posix_ipc.O_CREX)
+        mem = posix_ipc.SharedMemory(None, posix_ipc.O_CREX, size=4096)
+        mq = posix_ipc.MessageQueue(None, posix_ipc.O_CREX)
+        try:
+            context = multiprocessing.get_context('spawn')
+            with concurrent.futures.ProcessPoolExecutor(2, mp_context=context) as executor:
+                names = list(executor.map(use_handles, [sem] * 4, [mem] * 4, [mq] * 4))
+
+            self.assertEqual(names, [(sem.name, mem.name, mq.name)] * 4)
+            self.assertEqual(sem.value, 4)
+            self.assertEqual(mq.current_messages, 4)
+            self.assertEqual(os.pread(mem.fd, 6, 0), b'worker')
+        finally:
+            for handle in (sem, mem, mq):
+                handle.unlink()
+            sem.close()
+            mem.close_fd()
+            mq.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
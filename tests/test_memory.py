@@ -3,11 +3,16 @@ import numbers
 import platform
 import unittest
 import mmap
+import array
+import ctypes
 import os
+import struct
 import sys
+import tempfile
 
 # Project imports
 import posix_ipc
+import posix_ipc._checkpoint
 # Hack -- add tests directory to sys.path so Python 3 can find base.py.
 sys.path.insert(0, os.path.join(os.getcwd(), 'tests'))
 import base as tests_base  # noqa
@@ -278,5 +283,510 @@ class TestMemoryResize(tests_base.Base):
         self.assertEqual(mem.size, new_size)
 
 
+class TestMemoryAtomicArray(tests_base.Base):
+    """Exercise SharedMemory.atomic_array()"""
+    def setUp(self):
+        self.mem = posix_ipc.SharedMemory(None, posix_ipc.O_CREX, size=4096)
+
+    def tearDown(self):
+        self.mem.close_fd()
+        self.mem.unlink()
+
+    def test_defaults(self):
+        """tests that the default array is i64 and covers the whole segment"""
+        a = self.mem.atomic_array()
+        self.assertEqual(a.dtype, "i64")
+        self.assertEqual(len(a), 4096 // 8)
+        self.assertEqual(a.load(0), 0)
+        a.close()
+
+    def test_length_and_offset(self):
+        """tests that length and offset select part of the segment"""
+        a = self.mem.atomic_array("i32", 4, 8)
+        a.store(0, 42)
+        self.assertEqual(len(a), 4)
+        self.assertEqual(os.pread(self.mem.fd, 4, 8), array.array('i', [42]).tobytes())
+        self.assertRaises(ValueError, self.mem.atomic_array, "i32", 4, 6)
+        self.assertRaises(ValueError, self.mem.atomic_array, "i32", 1025)
+        self.assertRaises(ValueError, self.mem.atomic_array, "i32", 1, 4096)
+        self.assertRaises(ValueError, self.mem.atomic_array, "f64")
+
+    def test_offset_beyond_first_page(self):
+        """tests an offset that isn't within the first page"""
+        os.ftruncate(self.mem.fd, 3 * posix_ipc.PAGE_SIZE)
+        a = self.mem.atomic_array("u64", 2, posix_ipc.PAGE_SIZE + 16)
+        a.store(1, 7)
+        self.assertEqual(os.pread(self.mem.fd, 8, posix_ipc.PAGE_SIZE + 24),
+                         array.array('Q', [7]).tobytes())
+
+    def test_load_store(self):
+        """tests load() and store(), including negative indices and range checks"""
+        a = self.mem.atomic_array("i64", 4)
+        a.store(-1, -2 ** 63)
+        self.assertEqual(a.load(3), -2 ** 63)
+        self.assertRaises(IndexError, a.load, 4)
+        self.assertRaises(OverflowError, a.store, 0, 2 ** 63)
+        self.assertRaises(TypeError, a.store, 0, 1.5)
+
+        a = self.mem.atomic_array("u32", 4)
+        a.store(0, 2 ** 32 - 1)
+        self.assertEqual(a.load(0), 2 ** 32 - 1)
+        self.assertRaises(OverflowError, a.store, 0, 2 ** 32)
+        self.assertRaises(OverflowError, a.store, 0, -1)
+
+    def test_fetch_add(self):
+        """tests that fetch_add() returns the previous value and wraps around"""
+        a = self.mem.atomic_array("i32", 4)
+        self.assertEqual(a.fetch_add(0), 0)
+        self.assertEqual(a.fetch_add(0, 10), 1)
+        self.assertEqual(a.fetch_add(0, -11), 11)
+        self.assertEqual(a.load(0), 0)
+        a.store(1, 2 ** 31 - 1)
+        a.fetch_add(1)
+        self.assertEqual(a.load(1), -2 ** 31)
+
+    def test_fetch_add_concurrent(self):
+        """tests that increments from several processes aren't lost"""
+        a = self.mem.atomic_array("u64", 1)
+        pids = []
+        for i in range(4):
+            pid = os.fork()
+            if not pid:
+                child_array = posix_ipc.SharedMemory(self.mem.name).atomic_array("u64", 1)
+                for j in range(10000):
+                    child_array.fetch_add(0)
+                os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        self.assertEqual(a.load(0), 40000)
+
+    def test_compare_exchange(self):
+        """tests that compare_exchange() only replaces the expected value"""
+        a = self.mem.atomic_array("u64", 1)
+        a.store(0, 5)
+        self.assertEqual(a.compare_exchange(0, 5, 6), 5)
+        self.assertEqual(a.load(0), 6)
+        self.assertEqual(a.compare_exchange(0, 5, 7), 6)
+        self.assertEqual(a.load(0), 6)
+
+    def test_snapshot(self):
+        """tests snapshot() with and without an output buffer"""
+        a = self.mem.atomic_array("i64", 3)
+        for i in range(3):
+            a.store(i, i - 1)
+        self.assertEqual(a.snapshot().tolist(), [-1, 0, 1])
+        self.assertEqual(a.snapshot().format, 'q')
+        out = array.array('q', [9] * 4)
+        self.assertIs(a.snapshot(out), out)
+        self.assertEqual(out.tolist(), [-1, 0, 1, 9])
+        self.assertRaises(ValueError, a.snapshot, array.array('q', [0]))
+        self.assertRaises(BufferError, a.snapshot, b'123456789012345678901234')
+
+    def test_read_only(self):
+        """tests that an array in a read-only segment can be read but not changed"""
+        self.mem.atomic_array("i32", 1).store(0, 3)
+        mem = posix_ipc.SharedMemory(self.mem.name, read_only=True)
+        a = mem.atomic_array("i32", 1)
+        mem.close_fd()
+        self.assertEqual(a.load(0), 3)
+        self.assertRaises(posix_ipc.PermissionsError, a.store, 0, 4)
+        self.assertRaises(posix_ipc.PermissionsError, a.fetch_add, 0)
+
+    def test_close(self):
+        """tests that a closed array raises ExistentialError"""
+        a = self.mem.atomic_array()
+        a.close()
+        self.assertRaises(posix_ipc.ExistentialError, a.load, 0)
+        self.assertRaises(posix_ipc.ExistentialError, a.close)
+
+
+class TestMemoryFileCopy(tests_base.Base):
+    """Exercise SharedMemory.load_from() and SharedMemory.dump_to()"""
+    # Big enough to be divided among several threads, and not a multiple
+    # of the page size.
+    SIZE = (3 * 1024 * 1024) + 1234
+
+    def setUp(self):
+        self.mem = posix_ipc.SharedMemory(None, posix_ipc.O_CREX)
+        self.data = os.urandom(self.SIZE)
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, self.data)
+        os.close(fd)
+
+    def tearDown(self):
+        self.mem.close_fd()
+        self.mem.unlink()
+        os.unlink(self.path)
+
+    def read_segment(self):
+        with mmap.mmap(self.mem.fd, self.mem.size) as f:
+            return f[:]
+
+    def test_load_from_path(self):
+        """tests that load_from() copies a whole file and grows the segment to fit"""
+        for threads in (1, 4):
+            self.assertEqual(self.mem.load_from(self.path, threads=threads), self.SIZE)
+            self.assertEqual(self.mem.size, self.SIZE)
+            self.assertEqual(self.read_segment(), self.data)
+
+    def test_load_from_fd(self):
+        """tests that load_from() accepts a file descriptor and leaves it open"""
+        with open(self.path, 'rb') as f:
+            self.assertEqual(self.mem.load_from(f.fileno(), offset=10, size=100,
+                                                source_offset=20), 100)
+            # The file position isn't affected.
+            self.assertEqual(f.tell(), 0)
+        data = self.read_segment()
+        self.assertEqual(len(data), 110)
+        self.assertEqual(data[:10], b'\0' * 10)
+        self.assertEqual(data[10:], self.data[20:120])
+
+    def test_load_from_short_file(self):
+        """tests that load_from() complains if the file ends early"""
+        self.assertRaises(ValueError, self.mem.load_from, self.path,
+                          size=self.SIZE + 1)
+
+    def test_load_from_bad_params(self):
+        """tests that load_from() rejects bad parameters"""
+        self.assertRaises(ValueError, self.mem.load_from, self.path, offset=-1)
+        self.assertRaises(ValueError, self.mem.load_from, self.path, size=-1)
+        self.assertRaises(ValueError, self.mem.load_from, self.path, threads=0)
+        self.assertRaises(ValueError, self.mem.load_from, self.path,
+                          source_offset=self.SIZE + 1)
+        self.assertRaises(FileNotFoundError, self.mem.load_from, self.path + 'x')
+
+    def test_dump_to(self):
+        """tests that dump_to() copies the segment into a file"""
+        self.mem.load_from(self.path)
+        for threads in (1, 4):
+            os.unlink(self.path)
+            self.assertEqual(self.mem.dump_to(self.path, threads=threads), self.SIZE)
+            with open(self.path, 'rb') as f:
+                self.assertEqual(f.read(), self.data)
+
+    def test_dump_to_fd(self):
+        """tests that dump_to() can copy part of the segment into an open file"""
+        self.mem.load_from(self.path)
+        with open(self.path, 'r+b') as f:
+            self.assertEqual(self.mem.dump_to(f.fileno(), offset=100, size=50,
+                                              destination_offset=5), 50)
+            self.assertEqual(f.read(), self.data[:5] + self.data[100:150] + self.data[55:])
+
+    def test_dump_to_beyond_segment(self):
+        """tests that dump_to() won't read beyond the end of the segment"""
+        self.mem.load_from(self.path, size=100)
+        self.assertRaises(ValueError, self.mem.dump_to, self.path, size=101)
+        self.assertRaises(ValueError, self.mem.dump_to, self.path, offset=101)
+        # The file wasn't touched.
+        self.assertEqual(os.path.getsize(self.path), self.SIZE)
+
+
+class TestMemoryCheckpoint(tests_base.Base):
+    """Exercise SharedMemory.checkpoint() and SharedMemory.restore()"""
+    # Not a whole number of pages
+    SIZE = (10 * posix_ipc.PAGE_SIZE) + 100
+
+    def setUp(self):
+        self.mem = posix_ipc.SharedMemory(None, posix_ipc.O_CREX, size=self.SIZE)
+        self.mapfile = mmap.mmap(self.mem.fd, self.SIZE)
+        self.mapfile[:] = os.urandom(self.SIZE)
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        self.mapfile.close()
+        self.mem.close_fd()
+        self.mem.unlink()
+        for path in (self.path, self.path + posix_ipc._checkpoint.JOURNAL_SUFFIX):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def restored(self):
+        mem = posix_ipc.SharedMemory(None, posix_ipc.O_CREX)
+        try:
+            self.assertEqual(mem.restore(self.path), mem.size)
+            with mmap.mmap(mem.fd, mem.size) as f:
+                return f[:]
+        finally:
+            mem.close_fd()
+            mem.unlink()
+
+    def test_round_trip(self):
+        """tests that restore() reproduces the checkpointed segment"""
+        self.assertEqual(self.mem.checkpoint(self.path), self.SIZE)
+        self.assertEqual(self.restored(), self.mapfile[:])
+
+    def test_incremental(self):
+        """tests that checkpoint() only writes the pages that have changed"""
+        self.mem.checkpoint(self.path)
+        self.assertEqual(self.mem.checkpoint(self.path), 0)
+
+        # Change one byte in the second page and one in the partial last page.
+        self.mapfile[posix_ipc.PAGE_SIZE + 1] ^= 0xff
+        self.mapfile[-1] ^= 0xff
+        self.assertEqual(self.mem.checkpoint(self.path), posix_ipc.PAGE_SIZE + 100)
+        self.assertEqual(self.restored(), self.mapfile[:])
+        self.assertEqual(self.mem.checkpoint(self.path), 0)
+
+    def test_zero_pages_not_written(self):
+        """tests that the first checkpoint skips pages that are all zeros"""
+        self.mapfile[:] = bytes(self.SIZE)
+        self.mapfile[0] = 1
+        self.assertEqual(self.mem.checkpoint(self.path), posix_ipc.PAGE_SIZE)
+        self.assertEqual(self.restored(), self.mapfile[:])
+
+    def test_resized(self):
+        """tests that a checkpoint of a resized segment only writes the pages that changed"""
+        self.mem.checkpoint(self.path)
+        os.ftruncate(self.mem.fd, self.SIZE // 2)
+        # Only the new partial last page is written.
+        self.assertLess(self.mem.checkpoint(self.path), posix_ipc.PAGE_SIZE)
+        self.assertEqual(self.restored(), self.mapfile[:self.SIZE // 2])
+
+        # Growing the segment adds zeros, which don't need to be written.
+        os.ftruncate(self.mem.fd, self.SIZE * 2)
+        with mmap.mmap(self.mem.fd, self.SIZE * 2) as mapfile:
+            self.assertLessEqual(self.mem.checkpoint(self.path), posix_ipc.PAGE_SIZE)
+            self.assertEqual(self.restored(), mapfile[:])
+
+    def crash_during_checkpoint(self, name, replacement):
+        # Checkpoints with one of posix_ipc._checkpoint's functions replaced by one that
+        # raises, as if the process had crashed there.
+        original = getattr(posix_ipc._checkpoint, name)
+        setattr(posix_ipc._checkpoint, name, replacement)
+        try:
+            self.assertRaises(RuntimeError, self.mem.checkpoint, self.path)
+        finally:
+            setattr(posix_ipc._checkpoint, name, original)
+
+    def test_crash(self):
+        """tests that a checkpoint interrupted by a crash leaves a usable checkpoint"""
+        journal_path = self.path + posix_ipc._checkpoint.JOURNAL_SUFFIX
+        write_header = posix_ipc._checkpoint._write_header
+
+        def crash(*args):
+            raise RuntimeError("crash")
+
+        def crash_before_complete(fd, state, size):
+            if state == posix_ipc._checkpoint.STATE_COMPLETE:
+                raise RuntimeError("crash")
+            write_header(fd, state, size)
+
+        self.mem.checkpoint(self.path)
+        old = self.mapfile[:]
+
+        # A crash before the journal is committed leaves the old checkpoint.
+        self.mapfile[posix_ipc.PAGE_SIZE + 1] ^= 0xff
+        self.crash_during_checkpoint("_pwrite_all", crash)
+        self.assertEqual(self.restored(), old)
+
+        # A crash after the journal is committed, before the pages are copied into the image
+        # or while they are, leaves the new one.
+        for name, replacement in (("_apply_journal", crash),
+                                  ("_write_header", crash_before_complete)):
+            self.mapfile[-1] ^= 0xff
+            new = self.mapfile[:]
+            self.crash_during_checkpoint(name, replacement)
+            self.assertTrue(os.path.exists(journal_path))
+            self.assertEqual(self.restored(), new)
+
+            # The next checkpoint finishes the job.
+            self.assertEqual(self.mem.checkpoint(self.path), 0)
+            self.assertFalse(os.path.exists(journal_path))
+            self.assertEqual(self.restored(), new)
+
+    def test_restore_resizes(self):
+        """tests that restore() makes the segment the checkpoint's size"""
+        self.mem.checkpoint(self.path)
+        mem = posix_ipc.SharedMemory(None, posix_ipc.O_CREX, size=self.SIZE * 2)
+        mem.restore(self.path)
+        self.assertEqual(mem.size, self.SIZE)
+        mem.close_fd()
+        mem.unlink()
+
+    def test_restore_not_a_checkpoint(self):
+        """tests that restore() rejects a file that isn't a complete checkpoint"""
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 100)
+        self.assertRaises(ValueError, self.mem.restore, self.path)
+
+        # A checkpoint is incomplete while pages are being written.
+        os.unlink(self.path)
+        self.mem.checkpoint(self.path)
+        with open(self.path, 'r+b') as f:
+            f.seek(12)
+            f.write(b'\1')
+        self.assertRaises(ValueError, self.mem.restore, self.path)
+        # The next checkpoint starts over.
+        self.assertEqual(self.mem.checkpoint(self.path), self.SIZE)
+        self.assertEqual(self.restored(), self.mapfile[:])
+
+
+
+class Quote(ctypes.Structure):
+    _fields_ = [("timestamp", ctypes.c_uint64),
+                ("price", ctypes.c_double),
+                ("quantity", ctypes.c_int32),
+                ("symbol", ctypes.c_char * 4),
+                ]
+
+
+class TestMemoryRecords(tests_base.Base):
+    """Exercise SharedMemory.records()"""
+    def setUp(self):
+        self.mem = posix_ipc.SharedMemory(None, posix_ipc.O_CREX, size=4096)
+
+    def tearDown(self):
+        self.mem.close_fd()
+        self.mem.unlink()
+
+    def test_ctypes_layout(self):
+        """tests records described by a ctypes Structure"""
+        records = self.mem.records(Quote)
+        self.assertEqual(len(records), 4096 // ctypes.sizeof(Quote))
+        self.assertEqual(records.itemsize, ctypes.sizeof(Quote))
+        self.assertEqual([field.name for field in records.fields],
+                         ["timestamp", "price", "quantity", "symbol"])
+
+        records[1] = (10, 2.5, 7, b'ABCD')
+        self.assertEqual(records[1], (10, 2.5, 7, b'ABCD'))
+        self.assertEqual(records[-1], (0, 0.0, 0, b'\0' * 4))
+
+        # The records are laid out the way ctypes lays them out.
+        quote = Quote.from_buffer_copy(os.pread(self.mem.fd, ctypes.sizeof(Quote),
+                                                ctypes.sizeof(Quote)))
+        self.assertEqual((quote.timestamp, quote.price, quote.quantity, quote.symbol),
+                         (10, 2.5, 7, b'ABCD'))
+        records.close()
+
+    def test_format_layout(self):
+        """tests records described by a struct format, with and without names"""
+        records = self.mem.records("<iH", count=10, offset=100, names=("a", "b"))
+        self.assertEqual(len(records), 10)
+        self.assertEqual(records.itemsize, 6)
+        records[2] = (-5, 6)
+        self.assertEqual(os.pread(self.mem.fd, 6, 112), struct.pack("<iH", -5, 6))
+        self.assertEqual(records.field("a")[2], -5)
+        records.close()
+
+        records = self.mem.records("=q3sxd", count=2)
+        self.assertEqual(len(records.fields), 3)
+        self.assertEqual(records.itemsize, 20)
+        records[1] = (1, b'abc', 0.5)
+        self.assertEqual(records.field(2).tolist(), [0.0, 0.5])
+        records.close()
+
+    def test_iteration_and_slicing(self):
+        """tests that iteration, tolist() and slices see the same records"""
+        records = self.mem.records("=Id", count=20)
+        for i in range(20):
+            records[i] = (i, i / 2)
+        self.assertEqual(records.tolist(), [(i, i / 2) for i in range(20)])
+        part = records[5:8]
+        self.assertEqual(len(part), 3)
+        self.assertEqual(list(part), [(5, 2.5), (6, 3.0), (7, 3.5)])
+        self.assertEqual(part[-1], (7, 3.5))
+        self.assertEqual(part.field(0).tolist(), [5, 6, 7])
+        self.assertRaises(IndexError, part.__getitem__, 3)
+        self.assertRaises(ValueError, records.__getitem__, slice(0, 10, 2))
+        records.close()
+
+    def test_field_and_set_field(self):
+        """tests reading and writing one field of every record"""
+        records = self.mem.records(Quote, count=50)
+        records.set_field("price", array.array('d', range(50)))
+        records.set_field("symbol", b'WXYZ' * 50)
+        price = records.field("price")
+        self.assertEqual(price.format, 'd')
+        self.assertEqual(price.tolist(), [float(i) for i in range(50)])
+        self.assertEqual(records[3], (0, 3.0, 0, b'WXYZ'))
+        self.assertEqual(records.field("symbol").shape, (50, 4))
+        self.assertRaises(ValueError, records.set_field, "price", array.array('d', range(49)))
+        self.assertRaises(KeyError, records.field, "volume")
+        del price
+        records.close()
+
+    def test_set_field_format(self):
+        """tests that set_field() checks the format and accepts what field() returns"""
+        records = self.mem.records(">eqd", count=4)
+        records.set_field(0, array.array('f', [0.5, 1.5, -2.0, 65504.0]))
+        half = records.field(0)
+        self.assertEqual(half.format, 'f')
+        records.set_field(0, half)
+        self.assertEqual(records.field(0).tolist(), [0.5, 1.5, -2.0, 65504.0])
+        self.assertEqual(os.pread(self.mem.fd, 2, 18), struct.pack(">e", 1.5))
+        self.assertRaises(ValueError, records.set_field, 0, array.array('d', range(4)))
+
+        records.set_field(1, array.array('l' if struct.calcsize('l') == 8 else 'q', range(4)))
+        self.assertEqual(records.field(1).tolist(), [0, 1, 2, 3])
+        self.assertRaises(ValueError, records.set_field, 1, array.array('d', range(4)))
+        self.assertRaises(ValueError, records.set_field, 2, array.array('q', range(4)))
+        self.assertRaises(ValueError, records.set_field, 2, bytes(32))
+        del half
+        records.close()
+
+    def test_columnar(self):
+        """tests columnar records, whose fields are zero-copy views of the segment"""
+        records = self.mem.records("=qd", count=100, names=("id", "value"), columnar=True)
+        records[3] = (3, 1.5)
+        ids = records.field("id")
+        self.assertEqual(ids[3], 3)
+        records.set_field("id", array.array('q', range(100)))
+        # ids refers to the segment, so it sees the change.
+        self.assertEqual(ids[99], 99)
+        self.assertEqual(os.pread(self.mem.fd, 8, 800 + (3 * 8)), struct.pack("=d", 1.5))
+        self.assertEqual(records[1:3].tolist(), [(1, 0.0), (2, 0.0)])
+        del ids
+        records.close()
+
+    def test_columnar_iteration(self):
+        """tests that iterating over columnar records gives the same records as indexing"""
+        records = self.mem.records("=i4s?", count=5, columnar=True)
+        records[0] = (1, b'abcd', True)
+        records[4] = (5, b'wxyz', False)
+        expected = [records[i] for i in range(len(records))]
+        self.assertEqual(expected[0], (1, b'abcd', True))
+        self.assertEqual(list(records), expected)
+        self.assertEqual(records.tolist(), expected)
+        self.assertEqual(list(records[3:]), expected[3:])
+        records.close()
+
+    def test_byte_order(self):
+        """tests that non-native byte orders are converted"""
+        records = self.mem.records(">I", count=3)
+        records.set_field(0, array.array('I', [1, 2, 3]))
+        self.assertEqual(os.pread(self.mem.fd, 12, 0), struct.pack(">3I", 1, 2, 3))
+        self.assertEqual(records.field(0).tolist(), [1, 2, 3])
+        self.assertEqual(records[2], (3, ))
+        records.close()
+
+    def test_bad_params(self):
+        """tests that bad layouts and sizes are rejected"""
+        self.assertRaises(TypeError, self.mem.records, 42)
+        self.assertRaises(ValueError, self.mem.records, "=i", count=1025)
+        self.assertRaises(ValueError, self.mem.records, "=i", offset=-1)
+        self.assertRaises(ValueError, self.mem.records, "=i", names=("a", "b"))
+        self.assertRaises(ValueError, self.mem.records, "=i!")
+
+    def test_read_only(self):
+        """tests that records in a read-only segment can't be written"""
+        mem = posix_ipc.SharedMemory(self.mem.name, read_only=True)
+        records = mem.records("=i")
+        self.assertTrue(records.read_only)
+        self.assertEqual(records[0], (0, ))
+        self.assertRaises(posix_ipc.PermissionsError, records.__setitem__, 0, (1, ))
+        self.assertRaises(posix_ipc.PermissionsError, records.set_field, 0, bytes(4096))
+        records.close()
+        mem.close_fd()
+
+    def test_close(self):
+        """tests that a closed RecordArray can't be used"""
+        records = self.mem.records("=i")
+        records.close()
+        self.assertRaises(ValueError, records.__getitem__, 0)
+        records.close()
+
+
 if __name__ == '__main__':
     unittest.main()
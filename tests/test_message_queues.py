@@ -4,6 +4,8 @@ from unittest import skipUnless
 import time
 import signal
 import threading
+import pickle
+import bz2
 
 # Project imports
 import posix_ipc
@@ -151,6 +153,55 @@ class TestMessageQueueCreation(MessageQueueTestBase):
         mq.close()
         mq.unlink()
 
+    def test_max_messages_auto(self):
+        """test that max_messages='auto' creates a queue as deep as the system permits"""
+        mq = posix_ipc.MessageQueue(None, posix_ipc.O_CREX, max_messages='auto',
+                                    max_message_size=10)
+        self.assertGreaterEqual(mq.max_messages, 1)
+        limit = posix_ipc.limits()['max_messages']
+        if limit is not None:
+            self.assertLessEqual(mq.max_messages, limit)
+        mq.close()
+        mq.unlink()
+
+    def test_max_message_size_auto(self):
+        """test that max_message_size='auto' creates a queue with messages as large as
+        the system permits"""
+        mq = posix_ipc.MessageQueue(None, posix_ipc.O_CREX, max_messages=1,
+                                    max_message_size='auto')
+        self.assertGreaterEqual(mq.max_message_size, 1)
+        limit = posix_ipc.limits()['max_message_size']
+        if limit is not None:
+            self.assertLessEqual(mq.max_message_size, limit)
+        mq.send(' ' * mq.max_message_size)
+        mq.close()
+        mq.unlink()
+
+    def test_geometry_param_types(self):
+        """test that max_messages and max_message_size reject strings other than
+        'auto' and non-integers"""
+        for name in ('max_messages', 'max_message_size'):
+            self.assertRaises(ValueError, posix_ipc.MessageQueue, None, posix_ipc.O_CREX,
+                              **{name: 'big'})
+            self.assertRaises(TypeError, posix_ipc.MessageQueue, None, posix_ipc.O_CREX,
+                              **{name: 1.5})
+
+    def test_geometry_param_index(self):
+        """test that max_messages and max_message_size accept objects with __index__"""
+        class Index:
+            def __init__(self, value):
+                self.value = value
+
+            def __index__(self):
+                return self.value
+
+        mq = posix_ipc.MessageQueue(None, posix_ipc.O_CREX, max_messages=Index(2),
+                                    max_message_size=Index(100))
+        self.assertEqual(mq.max_messages, 2)
+        self.assertEqual(mq.max_message_size, 100)
+        mq.close()
+        mq.unlink()
+
     def test_read_flag_new_queue(self):
         """test that the read flag is respected on a new queue"""
         mq = posix_ipc.MessageQueue(None, posix_ipc.O_CREX, read=False)
@@ -567,5 +618,390 @@ class TestMessageQueuePropertiesAndAttributes(MessageQueueTestBase):
         mq.unlink()
 
 
+
+@skipUnless(posix_ipc.MESSAGE_QUEUE_WAIT_SUPPORTED, "Requires wait_any() support")
+class TestMessageQueueWaitAny(tests_base.Base):
+    """Exercise wait_any() and receive_any()"""
+    def setUp(self):
+        # Small queues for the same reason as MessageQueueTestBase
+        self.queues = [posix_ipc.MessageQueue(None, posix_ipc.O_CREX, max_messages=10,
+                                              max_message_size=10)
+                       for i in range(3)]
+
+    def tearDown(self):
+        for mq in self.queues:
+            mq.close()
+            mq.unlink()
+
+    def test_wait_any_timeout(self):
+        """tests that wait_any() raises BusyError when the timeout expires"""
+        start = time.time()
+        self.assertRaises(posix_ipc.BusyError, posix_ipc.wait_any, self.queues, 0.1)
+        self.assertGreaterEqual(time.time() - start, 0.1)
+
+    def test_wait_any_returns_ready_queues(self):
+        """tests that wait_any() returns only the queues that have messages, in order"""
+        self.queues[2].send('a')
+        self.queues[0].send('b')
+        self.assertEqual(posix_ipc.wait_any(self.queues, timeout=0),
+                         [self.queues[0], self.queues[2]])
+        # Waiting doesn't consume the messages
+        self.assertEqual(self.queues[0].current_messages, 1)
+
+    def test_wait_any_wakes_up(self):
+        """tests that wait_any() returns when a message arrives while it waits"""
+        threading.Timer(0.1, self.queues[1].send, ['a']).start()
+        self.assertEqual(posix_ipc.wait_any(self.queues, timeout=5), [self.queues[1]])
+
+    def test_wait_any_list_changes(self):
+        """tests that changing the list of queues while wait_any() waits doesn't affect it"""
+        queues = list(self.queues)
+        mq = queues[2]
+
+        def change_list():
+            queues.clear()
+            mq.send('a')
+
+        threading.Timer(0.1, change_list).start()
+        self.assertEqual(posix_ipc.wait_any(queues, timeout=5), [mq])
+        mq.receive()
+
+        queues = list(self.queues)
+        threading.Timer(0.1, change_list).start()
+        self.assertEqual(posix_ipc.receive_any(queues, timeout=5), [(mq, b'a', 0)])
+
+    def test_receive_any(self):
+        """tests that receive_any() returns (queue, message, priority) for each ready queue"""
+        self.queues[0].send('a', priority=2)
+        self.queues[2].send('b')
+        self.assertEqual(posix_ipc.receive_any(self.queues),
+                         [(self.queues[0], b'a', 2), (self.queues[2], b'b', 0)])
+        self.assertRaises(posix_ipc.BusyError, posix_ipc.receive_any, self.queues, 0)
+
+    def test_receive_any_weights(self):
+        """tests that receive_any() interleaves queues according to their weights"""
+        for i in range(5):
+            self.queues[0].send('a%d' % i)
+            self.queues[1].send('b%d' % i)
+        messages = posix_ipc.receive_any(self.queues, weights=[3, 1, 1])
+        self.assertEqual([message for mq, message, priority in messages],
+                         [b'a0', b'b0', b'a1', b'a2'])
+
+    def test_receive_any_nonblocking_queue(self):
+        """tests that receive_any() works with queues whose block flag is False"""
+        for mq in self.queues:
+            mq.block = False
+        self.queues[1].send('a')
+        self.assertEqual(posix_ipc.receive_any(self.queues, 1),
+                         [(self.queues[1], b'a', 0)])
+
+    def test_bad_params(self):
+        """tests that wait_any() and receive_any() reject bad params"""
+        for function in (posix_ipc.wait_any, posix_ipc.receive_any):
+            self.assertRaises(ValueError, function, [])
+            self.assertRaises(TypeError, function, [self.queues[0], 42])
+            self.assertRaises(TypeError, function, self.queues, -1)
+        self.assertRaises(ValueError, posix_ipc.receive_any, self.queues, weights=[1])
+        self.assertRaises(ValueError, posix_ipc.receive_any, self.queues, weights=[1, 0, 1])
+
+    def test_receive_any_write_only_queue(self):
+        """tests that receive_any() refuses queues that aren't open for reading"""
+        mq = posix_ipc.MessageQueue(self.queues[0].name, read=False)
+        self.assertRaises(posix_ipc.PermissionsError, posix_ipc.receive_any, [mq])
+        mq.close()
+
+    def test_closed_queue(self):
+        """tests that wait_any() refuses closed queues"""
+        mq = posix_ipc.MessageQueue(self.queues[0].name)
+        mq.close()
+        self.assertRaises(posix_ipc.ExistentialError, posix_ipc.wait_any, [mq])
+
+
+
+@skipUnless(posix_ipc.MESSAGE_QUEUES_SUPPORTED, "Requires MessageQueue support")
+class TestMessageQueueLargeMessages(MessageQueueTestBase):
+    """Exercise send_large() and receive_large()"""
+    def setUp(self):
+        # The queue must be large enough for the descriptor of a spilled message.
+        self.mq = posix_ipc.MessageQueue(None, posix_ipc.O_CREX,
+                                         max_messages=10,
+                                         max_message_size=64)
+
+    def test_small_message(self):
+        """tests that a message that fits in the queue round trips"""
+        self.mq.send_large(b'foo', priority=3)
+        message = self.mq.receive_large()
+        self.assertIsInstance(message, posix_ipc.LargeMessage)
+        self.assertEqual(bytes(message), b'foo')
+        self.assertEqual(message.priority, 3)
+        message.release()
+
+    def test_str_message(self):
+        """tests that send_large() encodes str as UTF-8 like send() does"""
+        self.mq.send_large('fo\u00f6')
+        with self.mq.receive_large() as message:
+            self.assertEqual(bytes(message), 'fo\u00f6'.encode())
+
+    def test_large_message(self):
+        """tests that a message much larger than max_message_size round trips"""
+        payload = bytes(range(256)) * 1024
+        self.mq.send_large(payload, priority=1)
+        # Only the descriptor occupies space in the queue
+        self.assertEqual(self.mq.current_messages, 1)
+        with self.mq.receive_large() as message:
+            self.assertEqual(len(message), len(payload))
+            self.assertEqual(message.data, payload)
+            self.assertEqual(message.priority, 1)
+
+    def test_threshold(self):
+        """tests that messages larger than the threshold are spilled even if they'd fit"""
+        self.mq.send_large(b'foo', threshold=3)
+        message, priority = self.mq.receive()
+        self.assertEqual(message, bytes((posix_ipc._large.INLINE, )) + b'foo')
+
+        self.mq.send_large(b'foo', threshold=2)
+        message, priority = self.mq.receive()
+        self.assertEqual(message[0], posix_ipc._large.SPILLED)
+        name = message[posix_ipc._large.DESCRIPTOR_SIZE:].decode()
+        segment, = [segment for segment in posix_ipc._large._pool if segment.name == name]
+        self.assertFalse(segment.is_free)
+        # receive() doesn't release the segment, so this test must.
+        segment.set_state(posix_ipc._large.STATE_FREE)
+
+    def test_segment_reuse(self):
+        """tests that a released segment is reused for the next large message"""
+        self.mq.send_large(b'x' * 1000, threshold=0)
+        self.mq.receive_large().release()
+        pool_size = len(posix_ipc._large._pool)
+        for i in range(3):
+            self.mq.send_large(b'x' * 1000, threshold=0)
+            self.mq.receive_large().release()
+        self.assertEqual(len(posix_ipc._large._pool), pool_size)
+
+    def test_pool_is_capped(self):
+        """tests that surplus segments are unlinked once they're free"""
+        cap = posix_ipc._large.MAX_POOL_SEGMENTS
+        messages = []
+        for i in range(cap + 2):
+            self.mq.send_large(b'x' * 1000, threshold=0)
+            messages.append(self.mq.receive_large())
+        self.assertGreaterEqual(len(posix_ipc._large._pool), cap + 2)
+        names = [segment.name for segment in posix_ipc._large._pool]
+        for message in messages:
+            message.release()
+
+        self.mq.send_large(b'x' * 1000, threshold=0)
+        self.mq.receive_large().release()
+        self.assertEqual(len(posix_ipc._large._pool), cap)
+        unlinked = set(names) - {segment.name for segment in posix_ipc._large._pool}
+        self.assertEqual(len(unlinked), len(names) - cap)
+        for name in unlinked:
+            self.assertRaises(posix_ipc.ExistentialError, posix_ipc.SharedMemory, name)
+
+    def test_release_is_idempotent(self):
+        """tests that release() can be called more than once"""
+        self.mq.send_large(b'x' * 100)
+        message = self.mq.receive_large()
+        message.release()
+        message.release()
+        self.assertRaises(ValueError, bytes, message)
+
+    def test_dropped_message(self):
+        """tests that a message that's garbage collected without being released is released"""
+        self.mq.send_large(b'x' * 1000, threshold=0)
+        message = self.mq.receive_large()
+        segment, = [segment for segment in posix_ipc._large._pool if not segment.is_free]
+        del message
+        self.assertTrue(segment.is_free)
+
+    def test_not_a_large_message(self):
+        """tests that receive_large() rejects messages that weren't sent with send_large()"""
+        self.mq.send(b'\x07foo')
+        self.assertRaises(ValueError, self.mq.receive_large)
+        self.mq.send(b'')
+        self.assertRaises(ValueError, self.mq.receive_large)
+
+    def test_queue_too_small(self):
+        """tests that send_large() raises ValueError if a descriptor won't fit in the queue"""
+        mq = posix_ipc.MessageQueue(None, posix_ipc.O_CREX, max_message_size=10)
+        self.assertRaises(ValueError, mq.send_large, b'x' * 100)
+        mq.close()
+        mq.unlink()
+
+    def test_timeout(self):
+        """tests that receive_large() honors the timeout like receive()"""
+        self.assertRaises(posix_ipc.BusyError, self.mq.receive_large, 0)
+
+
+
+@skipUnless(posix_ipc.MESSAGE_QUEUES_SUPPORTED, "Requires MessageQueue support")
+class TestMessageQueueObjects(MessageQueueTestBase):
+    """Exercise send_obj() and receive_obj()"""
+    def setUp(self):
+        # The queue must be large enough for the descriptor of a spilled object.
+        self.mq = posix_ipc.MessageQueue(None, posix_ipc.O_CREX,
+                                         max_messages=10,
+                                         max_message_size=64)
+
+    def test_small_object(self):
+        """tests that a small object round trips through the queue"""
+        self.mq.send_obj((1, 'two'), priority=2)
+        self.assertEqual(self.mq.receive_obj(), (1, 'two'))
+
+    def test_large_stream(self):
+        """tests that an object whose pickle is larger than the queue round trips"""
+        obj = {'key%d' % i: i for i in range(1000)}
+        self.mq.send_obj(obj)
+        self.assertEqual(self.mq.receive_obj(), obj)
+
+    def test_out_of_band_buffers(self):
+        """tests that large buffers are passed out-of-band and arrive intact and writable"""
+        payloads = [bytearray(range(256)) * 64, bytearray(b'x' * 100000)]
+        self.mq.send_obj(['header', pickle.PickleBuffer(payloads[0]),
+                          pickle.PickleBuffer(payloads[1])])
+        # Only the descriptor went through the queue.
+        message, priority = self.mq.receive()
+        self.assertLess(len(message), 64)
+        # Put it back and receive it properly.
+        self.mq.send(message)
+        obj = self.mq.receive_obj()
+        self.assertEqual(obj[0], 'header')
+        self.assertEqual(bytes(obj[1]), payloads[0])
+        self.assertEqual(bytes(obj[2]), payloads[1])
+        obj[1][0] = 42
+
+    def test_segment_released(self):
+        """tests that receive_obj() hands the segment back to the sender's pool"""
+        obj = pickle.PickleBuffer(bytearray(50000))
+        self.mq.send_obj(obj)
+        self.mq.receive_obj()
+        pool_size = len(posix_ipc._large._pool)
+        for i in range(3):
+            self.mq.send_obj(obj)
+            self.mq.receive_obj()
+        self.assertEqual(len(posix_ipc._large._pool), pool_size)
+
+    def test_not_an_object(self):
+        """tests that receive_obj() rejects messages that weren't sent with send_obj()"""
+        self.mq.send_large(b'foo')
+        self.assertRaises(ValueError, self.mq.receive_obj)
+
+
+@skipUnless(posix_ipc.MESSAGE_QUEUES_SUPPORTED, "Requires MessageQueue support")
+class TestMessageQueueCodec(MessageQueueTestBase):
+    """Exercise MessageQueue's codec parameter"""
+    def setUp(self):
+        self.mq = posix_ipc.MessageQueue(None, posix_ipc.O_CREX,
+                                         max_messages=10,
+                                         max_message_size=1024,
+                                         codec="zlib")
+
+    def test_no_codec(self):
+        """tests that a queue has no codec by default"""
+        mq = posix_ipc.MessageQueue(None, posix_ipc.O_CREX)
+        self.assertIsNone(mq.codec)
+        mq.unlink()
+        mq.close()
+        self.assertIsNotNone(self.mq.codec)
+
+    def test_compressible_message(self):
+        """tests that a message larger than the queue round trips if it compresses to fit"""
+        message = b'{"name": "spam", "count": 42}, ' * 200
+        self.assertGreater(len(message), self.mq.max_message_size)
+        self.mq.send(message, priority=3)
+        self.assertEqual(self.mq.receive(), (message, 3))
+
+    def test_small_message(self):
+        """tests that short messages and str round trip"""
+        for message in (b'', b'x', 'hello'):
+            self.mq.send(message)
+            self.assertEqual(self.mq.receive()[0],
+                             message.encode() if isinstance(message, str) else message)
+
+    @skipUnless(posix_ipc.MESSAGE_QUEUE_WAIT_SUPPORTED, "Requires receive_any() support")
+    def test_receive_any(self):
+        """tests that receive_any() decompresses messages from a queue with a codec"""
+        plain = posix_ipc.MessageQueue(None, posix_ipc.O_CREX)
+        try:
+            message = b'x' * 1000
+            self.mq.send(message)
+            self.mq.send(b'short')
+            plain.send(b'plain')
+            received = posix_ipc.receive_any([self.mq, plain], 0)
+            self.assertEqual([(mq, data) for mq, data, priority in received],
+                             [(self.mq, message), (plain, b'plain')])
+            self.assertEqual(posix_ipc.receive_any([self.mq, plain], 0)[0][1], b'short')
+        finally:
+            plain.unlink()
+            plain.close()
+
+    def test_receive_any_undecodable(self):
+        """tests that receive_any() returns the other messages when one can't be decoded"""
+        plain = posix_ipc.MessageQueue(None, posix_ipc.O_CREX)
+        # The same queue without the codec, which can send messages that the codec can't read
+        raw = posix_ipc.MessageQueue(self.mq.name)
+        try:
+            raw.send(b'\x07 not from a codec')
+            plain.send(b'plain')
+            (mq, error, priority), received = posix_ipc.receive_any([self.mq, plain], 0)
+            self.assertIs(mq, self.mq)
+            self.assertIsInstance(error, ValueError)
+            self.assertIsNotNone(error.__traceback__)
+            self.assertEqual(received, (plain, b'plain', 0))
+        finally:
+            raw.close()
+            plain.unlink()
+            plain.close()
+
+    def test_incompressible_message(self):
+        """tests that a message that neither compresses nor fits raises ValueError"""
+        message = os.urandom(self.mq.max_message_size - 1)
+        self.mq.send(message)
+        self.assertEqual(self.mq.receive()[0], message)
+        self.assertRaises(ValueError, self.mq.send, os.urandom(self.mq.max_message_size))
+
+    def test_other_process(self):
+        """tests that a queue opened with the same codec decompresses messages"""
+        other = posix_ipc.MessageQueue(self.mq.name, codec="zlib")
+        message = b'abc' * 1000
+        self.mq.send(message)
+        self.assertEqual(other.receive()[0], message)
+        other.close()
+
+    def test_custom_codec(self):
+        """tests that any object with compress() and decompress() can be a codec"""
+        class Bz2Codec:
+            def compress(self, data):
+                return bz2.compress(data)
+
+            def decompress(self, data, size):
+                return bz2.decompress(data)
+
+        mq = posix_ipc.MessageQueue(None, posix_ipc.O_CREX, max_message_size=200,
+                                    codec=Bz2Codec())
+        try:
+            mq.send(b'123456789' * 100)
+            self.assertEqual(mq.receive()[0], b'123456789' * 100)
+        finally:
+            mq.unlink()
+            mq.close()
+
+    def test_bad_codec(self):
+        """tests that unknown codecs are rejected"""
+        self.assertRaises(ValueError, posix_ipc.MessageQueue, None, posix_ipc.O_CREX,
+                          codec="no such codec")
+        self.assertRaises(TypeError, posix_ipc.MessageQueue, None, posix_ipc.O_CREX,
+                          codec=42)
+
+    def test_large_and_objects(self):
+        """tests that send_large() and send_obj() work on a queue with a codec"""
+        payload = os.urandom(self.mq.max_message_size - 1)
+        self.mq.send_large(payload)
+        self.assertEqual(bytes(self.mq.receive_large()), payload)
+        obj = {'key%d' % i: i for i in range(1000)}
+        self.mq.send_obj(obj)
+        self.assertEqual(self.mq.receive_obj(), obj)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,153 @@
+# Python imports
+import unittest
+import math
+import os
+import signal
+
+# Project imports
+import posix_ipc
+import posix_ipc.metrics
+# Hack -- add tests directory to sys.path so Python 3 can find base.py.
+import sys
+sys.path.insert(0, os.path.join(os.getcwd(), 'tests'))
+import base as tests_base  # noqa
+
+METRICS = {"requests": "counter", "in_flight": "gauge", "latency": "histogram"}
+
+
+class TestMetrics(tests_base.Base):
+    """Exercise posix_ipc.metrics"""
+    def setUp(self):
+        self.registry = posix_ipc.metrics.Registry(None, METRICS, slots=4,
+                                                   flags=posix_ipc.O_CREX)
+
+    def tearDown(self):
+        self.registry.unlink()
+        self.registry.close()
+
+    def run_in_child(self, target):
+        """Runs target(registry) in a child process that opens the registry by name"""
+        pid = os.fork()
+        if not pid:
+            try:
+                target(posix_ipc.metrics.Registry(self.registry.name))
+            except BaseException:
+                os._exit(1)
+            os._exit(0)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+    def test_initial_values(self):
+        """tests that a new registry is all zeroes"""
+        values = self.registry.collect()
+        self.assertEqual(values["requests"], 0)
+        self.assertEqual(values["in_flight"], 0.0)
+        self.assertEqual(values["latency"], posix_ipc.metrics.HistogramSnapshot(0, 0.0, []))
+        self.assertEqual(self.registry.metrics, METRICS)
+
+    def test_counter(self):
+        """tests that counters are summed over processes, including ones that have exited"""
+        self.registry.counter("requests").inc()
+        self.run_in_child(lambda registry: registry.counter("requests").inc(10))
+        self.assertEqual(self.registry.collect()["requests"], 11)
+        self.assertRaises(ValueError, self.registry.counter("requests").inc, -1)
+
+    def test_gauge(self):
+        """tests that gauges are summed over live processes only"""
+        gauge = self.registry.gauge("in_flight")
+        gauge.set(2.5)
+        gauge.inc()
+        gauge.dec(0.5)
+        self.run_in_child(lambda registry: registry.gauge("in_flight").set(100))
+        self.assertEqual(self.registry.collect()["in_flight"], 3.0)
+
+    def test_histogram(self):
+        """tests that histogram observations land in power of 2 buckets"""
+        histogram = self.registry.histogram("latency")
+        histogram.observe(0)
+        histogram.observe(0.75)
+        histogram.observe(1.5)
+        self.run_in_child(lambda registry: registry.histogram("latency").observe(1.25))
+        snapshot = self.registry.collect()["latency"]
+        self.assertEqual(snapshot.count, 4)
+        self.assertEqual(snapshot.sum, 3.5)
+        self.assertEqual(snapshot.buckets,
+                         [(2.0 ** -32, 1), (1.0, 1), (2.0, 2)])
+        histogram.observe(1e100)
+        self.assertEqual(self.registry.collect()["latency"].buckets[-1], (math.inf, 1))
+
+    def test_slots_exhausted(self):
+        """tests that a process that can't get a slot gets BusyError, and that slots of
+        exited processes are reused"""
+        self.registry.counter("requests").inc()
+        children = []
+        for i in range(3):
+            pid = os.fork()
+            if not pid:
+                registry = posix_ipc.metrics.Registry(self.registry.name)
+                registry.counter("requests").inc()
+                signal.pause()
+                os._exit(0)
+            children.append(pid)
+
+        # Wait until the children have claimed the remaining slots.
+        while self.registry.collect()["requests"] < 4:
+            pass
+
+        def target(registry):
+            try:
+                registry.counter("requests").inc()
+            except posix_ipc.BusyError:
+                pass
+            else:
+                raise AssertionError("BusyError wasn't raised")
+        self.run_in_child(target)
+
+        os.kill(children[0], signal.SIGKILL)
+        for pid in children:
+            if pid != children[0]:
+                os.kill(pid, signal.SIGTERM)
+        for pid in children:
+            os.waitpid(pid, 0)
+
+        # The counts from the dead processes survive.
+        self.run_in_child(lambda registry: registry.counter("requests").inc())
+        self.assertEqual(self.registry.collect()["requests"], 5)
+
+    def test_open_existing(self):
+        """tests opening an existing registry"""
+        registry = posix_ipc.metrics.Registry(self.registry.name, METRICS,
+                                              flags=posix_ipc.O_CREAT)
+        self.assertEqual(registry.slots, 4)
+        registry.close()
+        self.assertRaises(ValueError, posix_ipc.metrics.Registry, self.registry.name,
+                          {"requests": "gauge"})
+        self.assertRaises(posix_ipc.ExistentialError, posix_ipc.metrics.Registry,
+                          self.registry.name, METRICS, flags=posix_ipc.O_CREX)
+
+    def test_wrong_kind(self):
+        """tests that asking for a metric of the wrong kind or name fails"""
+        self.assertRaises(TypeError, self.registry.gauge, "requests")
+        self.assertRaises(KeyError, self.registry.counter, "nope")
+
+    def test_bad_schema(self):
+        """tests that invalid metric definitions are rejected"""
+        self.assertRaises(ValueError, posix_ipc.metrics.Registry, None, {},
+                          flags=posix_ipc.O_CREX)
+        self.assertRaises(ValueError, posix_ipc.metrics.Registry, None, {"x": "summary"},
+                          flags=posix_ipc.O_CREX)
+        self.assertRaises(ValueError, posix_ipc.metrics.Registry, None,
+                          [("x", "counter"), ("x", "gauge")], flags=posix_ipc.O_CREX)
+        self.assertRaises(ValueError, posix_ipc.metrics.Registry, None,
+                          flags=posix_ipc.O_CREX)
+
+    def test_not_a_registry(self):
+        """tests that opening a segment that isn't a registry fails"""
+        mem = posix_ipc.SharedMemory(None, posix_ipc.O_CREX, size=4096)
+        os.write(mem.fd, b'\xff' * 8)
+        self.assertRaises(ValueError, posix_ipc.metrics.Registry, mem.name)
+        mem.close_fd()
+        mem.unlink()
+
+
+if __name__ == '__main__':
+    unittest.main()
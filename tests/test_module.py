@@ -2,6 +2,10 @@
 import unittest
 import os
 import resource
+import datetime
+import re
+import shutil
+import subprocess
 
 # Project imports
 import posix_ipc
@@ -30,6 +34,7 @@ class TestModule(tests_base.Base):
         self.assertGreaterEqual(posix_ipc.SEMAPHORE_VALUE_MAX, 1)
 
         self.assertIn(posix_ipc.MESSAGE_QUEUES_SUPPORTED, (True, False))
+        self.assertIn(posix_ipc.USDT_PROBES_SUPPORTED, (True, False))
 
         if posix_ipc.MESSAGE_QUEUES_SUPPORTED:
             self.assertGreaterEqual(posix_ipc.QUEUE_MESSAGES_MAX_DEFAULT, 1)
@@ -43,6 +48,32 @@ class TestModule(tests_base.Base):
 
         self.assertTrue(isinstance(posix_ipc.VERSION, str))
 
+    @unittest.skipUnless(posix_ipc.USDT_PROBES_SUPPORTED and shutil.which('readelf'),
+                         "requires USDT probes and readelf")
+    def test_usdt_probes(self):
+        """tests that the extension's stapsdt notes describe each probe and its semaphore"""
+        notes = subprocess.check_output(['readelf', '--notes', '--wide',
+                                         posix_ipc._posix_ipc.__file__]).decode()
+        probes = {}
+        for note in notes.split('NT_STAPSDT')[1:]:
+            fields = dict(re.findall(r'(\w+): ([^,\t\n]+)', note))
+            if fields.get('Provider') == 'posix_ipc':
+                probes[fields['Name']] = fields
+
+        expected = {'semaphore__acquire__entry': 1, 'semaphore__acquire__return': 3,
+                    'semaphore__release__entry': 1, 'semaphore__release__return': 2}
+        if posix_ipc.MESSAGE_QUEUES_SUPPORTED:
+            expected.update({'message_queue__send__entry': 3,
+                             'message_queue__send__return': 5,
+                             'message_queue__receive__entry': 2,
+                             'message_queue__receive__return': 5,
+                             'message_queue__notification__entry': 1,
+                             'message_queue__notification__return': 3})
+        for name, arguments in expected.items():
+            self.assertIn(name, probes)
+            self.assertEqual(len(probes[name]['Arguments'].split()), arguments)
+            self.assertNotEqual(int(probes[name]['Semaphore'], 16), 0)
+
     def test_unlink_semaphore(self):
         """Exercise unlink_semaphore"""
         sem = posix_ipc.Semaphore(None, posix_ipc.O_CREX)
@@ -87,6 +118,86 @@ class TestModule(tests_base.Base):
             mq.unlink()
             mq.close()
 
+        def test_limits(self):
+            """Exercise limits()"""
+            limits = posix_ipc.limits()
+            self.assertEqual(set(limits.keys()),
+                             {'max_messages', 'max_message_size', 'max_queues',
+                              'default_max_messages', 'default_max_message_size',
+                              'rlimit_msgqueue'})
+            for value in limits.values():
+                self.assertTrue((value is None) or (isinstance(value, int) and value >= 0))
+
+    @unittest.skipUnless(os.path.isdir(posix_ipc._inventory.SHARED_MEMORY_DIRECTORY),
+                         "Requires /dev/shm")
+    def test_list_objects(self):
+        """Exercise list_objects()"""
+        prefix = tests_base.make_name() + '_'
+        sem = posix_ipc.Semaphore(prefix + 's', posix_ipc.O_CREX)
+        mem = posix_ipc.SharedMemory(prefix + 'm', posix_ipc.O_CREX, size=1024)
+
+        objects = posix_ipc.list_objects(prefix)
+        self.assertEqual(sorted((o.kind, o.name) for o in objects),
+                         [('semaphore', prefix + 's'), ('shared_memory', prefix + 'm')])
+        memory_object = [o for o in objects if o.kind == 'shared_memory'][0]
+        self.assertEqual(memory_object.size, 1024)
+        self.assertEqual(memory_object.uid, os.geteuid())
+        self.assertIsNone(memory_object.queued_bytes)
+        self.assertIsNone(memory_object.queued_messages)
+
+        # The leading slash is optional and kind restricts the results
+        self.assertEqual([o.name for o in posix_ipc.list_objects(prefix[1:], 'semaphore')],
+                         [prefix + 's'])
+        self.assertRaises(ValueError, posix_ipc.list_objects, prefix, 'foo')
+
+        sem.unlink()
+        sem.close()
+        mem.unlink()
+        mem.close_fd()
+
+    @unittest.skipUnless(posix_ipc.MESSAGE_QUEUES_SUPPORTED and
+                         os.path.isdir(posix_ipc._inventory.MESSAGE_QUEUE_DIRECTORY),
+                         "Requires message queues mounted on /dev/mqueue")
+    def test_list_objects_message_queue(self):
+        """Exercise list_objects() with message queues"""
+        mq = posix_ipc.MessageQueue(None, posix_ipc.O_CREX, max_messages=10,
+                                    max_message_size=10)
+        mq.send('foo')
+        mq.send('bar')
+        objects = posix_ipc.list_objects(mq.name, 'message_queue')
+        self.assertEqual([(o.name, o.queued_bytes, o.queued_messages) for o in objects],
+                         [(mq.name, 6, None)])
+        objects = posix_ipc.list_objects(mq.name, 'message_queue', count_messages=True)
+        self.assertEqual([(o.name, o.queued_bytes, o.queued_messages) for o in objects],
+                         [(mq.name, 6, 2)])
+        mq.close()
+        mq.unlink()
+
+    @unittest.skipUnless(os.path.isdir(posix_ipc._inventory.SHARED_MEMORY_DIRECTORY),
+                         "Requires /dev/shm")
+    def test_reap(self):
+        """Exercise reap()"""
+        prefix = tests_base.make_name() + '_'
+        sem = posix_ipc.Semaphore(prefix + 's', posix_ipc.O_CREX)
+        mem = posix_ipc.SharedMemory(prefix + 'm', posix_ipc.O_CREX, size=1024)
+        sem.close()
+        mem.close_fd()
+
+        # Nothing is old enough to reap
+        self.assertEqual(posix_ipc.reap(prefix, older_than=3600), [])
+        self.assertEqual(len(posix_ipc.list_objects(prefix)), 2)
+
+        reaped = posix_ipc.reap(prefix, kind='shared_memory')
+        self.assertEqual([o.name for o in reaped], [prefix + 'm'])
+        self.assertRaises(posix_ipc.ExistentialError, posix_ipc.SharedMemory, prefix + 'm')
+
+        reaped = posix_ipc.reap(prefix, older_than=datetime.timedelta(0))
+        self.assertEqual([o.name for o in reaped], [prefix + 's'])
+        self.assertEqual(posix_ipc.list_objects(prefix), [])
+
+        self.assertRaises(ValueError, posix_ipc.reap, '')
+        self.assertRaises(ValueError, posix_ipc.reap, '/')
+
     def test_errors(self):
         self.assertTrue(issubclass(posix_ipc.Error, Exception))
         self.assertTrue(issubclass(posix_ipc.SignalError, posix_ipc.Error))
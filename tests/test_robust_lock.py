@@ -0,0 +1,178 @@
+# Python imports
+import unittest
+from unittest import skipUnless
+import os
+import signal
+import threading
+import time
+
+# Project imports
+import posix_ipc
+# Hack -- add tests directory to sys.path so Python 3 can find base.py.
+import sys
+sys.path.insert(0, os.path.join(os.getcwd(), 'tests'))
+import base as tests_base  # noqa
+
+
+@skipUnless(posix_ipc.ROBUST_LOCK_SUPPORTED, "Requires RobustLock support")
+class TestRobustLock(tests_base.Base):
+    """Exercise the RobustLock class"""
+    def setUp(self):
+        self.lock = posix_ipc.RobustLock(None, posix_ipc.O_CREX)
+
+    def tearDown(self):
+        if self.lock:
+            self.lock.unlink()
+            self.lock.close()
+
+    def test_acquire_release(self):
+        """tests that the lock can be acquired and released repeatedly"""
+        for i in range(3):
+            self.lock.acquire()
+            self.assertFalse(self.lock.owner_died)
+            self.lock.release()
+
+    def test_context_manager(self):
+        """tests that the lock works as a context manager"""
+        with self.lock:
+            self.assertRaises(posix_ipc.BusyError, self.lock.acquire, 0)
+        self.lock.acquire(0)
+        self.lock.release()
+
+    def test_open_existing(self):
+        """tests that a second handle refers to the same lock"""
+        lock = posix_ipc.RobustLock(self.lock.name)
+        self.assertEqual(lock.name, self.lock.name)
+        pid = os.fork()
+        if not pid:
+            lock.acquire()
+            time.sleep(0.5)
+            lock.release()
+            os._exit(0)
+        time.sleep(0.1)
+        self.assertRaises(posix_ipc.BusyError, lock.acquire, 0)
+        lock.acquire(5)
+        self.assertFalse(lock.owner_died)
+        lock.release()
+        os.waitpid(pid, 0)
+        lock.close()
+
+    def test_o_creat_existing(self):
+        """tests that O_CREAT opens an existing lock rather than reinitializing it"""
+        self.lock.acquire()
+        lock = posix_ipc.RobustLock(self.lock.name, posix_ipc.O_CREAT)
+        pid = os.fork()
+        if not pid:
+            # The lock is still held by the parent.
+            try:
+                lock.acquire(0)
+                os._exit(1)
+            except posix_ipc.BusyError:
+                os._exit(0)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.lock.release()
+        lock.close()
+
+    def test_timeout(self):
+        """tests that acquire() raises BusyError when the timeout expires"""
+        pid = os.fork()
+        if not pid:
+            self.lock.acquire()
+            time.sleep(2)
+            os._exit(0)
+        time.sleep(0.2)
+        start = time.time()
+        self.assertRaises(posix_ipc.BusyError, self.lock.acquire, 0.2)
+        self.assertGreaterEqual(time.time() - start, 0.15)
+        os.waitpid(pid, 0)
+
+    def test_owner_died(self):
+        """tests that a lock held by a process that's killed is recovered"""
+        pid = os.fork()
+        if not pid:
+            self.lock.acquire()
+            time.sleep(10)
+            os._exit(0)
+        time.sleep(0.2)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        self.lock.acquire(5)
+        self.assertTrue(self.lock.owner_died)
+        self.lock.release()
+        # The lock is consistent again.
+        self.lock.acquire(0)
+        self.assertFalse(self.lock.owner_died)
+        self.lock.release()
+
+    def test_release_unowned(self):
+        """tests that releasing a lock this thread doesn't hold raises PermissionsError"""
+        self.assertRaises(posix_ipc.PermissionsError, self.lock.release)
+
+    def test_acquire_twice(self):
+        """tests that acquiring the lock twice in the same thread raises BusyError"""
+        self.lock.acquire()
+        self.assertRaises(posix_ipc.BusyError, self.lock.acquire)
+        self.lock.release()
+
+    def test_wrong_type(self):
+        """tests that a shared memory segment that isn't a lock is rejected"""
+        mem = posix_ipc.SharedMemory(None, posix_ipc.O_CREX, size=4096)
+        os.write(mem.fd, b'\xff' * 4)
+        self.assertRaises(ValueError, posix_ipc.RobustLock, mem.name)
+        mem.close_fd()
+        mem.unlink()
+
+    def test_o_excl_existing(self):
+        """tests that O_CREX fails if the lock already exists"""
+        self.assertRaises(posix_ipc.ExistentialError, posix_ipc.RobustLock,
+                          self.lock.name, posix_ipc.O_CREX)
+
+    def test_closed(self):
+        """tests that a closed lock raises ExistentialError"""
+        lock = posix_ipc.RobustLock(self.lock.name)
+        lock.close()
+        self.assertRaises(posix_ipc.ExistentialError, lock.acquire)
+        self.assertRaises(posix_ipc.ExistentialError, lock.close)
+
+    def test_close_held(self):
+        """tests that a held lock can't be closed and is released when it's deallocated"""
+        lock = posix_ipc.RobustLock(self.lock.name)
+        lock.acquire()
+        self.assertRaises(posix_ipc.BusyError, lock.close)
+        del lock
+        self.lock.acquire(0)
+        self.assertFalse(self.lock.owner_died)
+        self.lock.release()
+
+        lock = posix_ipc.RobustLock(self.lock.name)
+        lock.acquire()
+        lock.release()
+        lock.close()
+
+    def test_close_while_waiting(self):
+        """tests that close() refuses while another thread is blocked in acquire()"""
+        self.lock.acquire()
+        lock = posix_ipc.RobustLock(self.lock.name)
+
+        def acquire_and_release():
+            lock.acquire(10)
+            lock.release()
+
+        thread = threading.Thread(target=acquire_and_release)
+        thread.start()
+        time.sleep(0.2)
+        self.assertRaises(posix_ipc.BusyError, lock.close)
+        self.lock.release()
+        thread.join()
+        lock.close()
+
+    def test_unlink(self):
+        """tests that unlink() removes the lock"""
+        self.lock.unlink()
+        self.assertRaises(posix_ipc.ExistentialError, posix_ipc.RobustLock, self.lock.name)
+        self.lock.close()
+        self.lock = None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+# Python imports
+import concurrent.futures
+import unittest
+from unittest import skipUnless
+import os
+import threading
+import time
+
+# Project imports
+import posix_ipc
+if posix_ipc.MESSAGE_QUEUES_SUPPORTED:
+    import posix_ipc.rpc
+# Hack -- add tests directory to sys.path so Python 3 can find base.py.
+import sys
+sys.path.insert(0, os.path.join(os.getcwd(), 'tests'))
+import base as tests_base  # noqa
+
+
+class Handlers:
+    def add(self, a, b=0):
+        return a + b
+
+    def fail(self):
+        raise KeyError('foo')
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+        return seconds
+
+    def echo(self, data):
+        return data
+
+    def unpicklable(self):
+        return lambda: None
+
+    def _private(self):
+        return 'secret'
+
+
+class Undecodable:
+    def __reduce__(self):
+        return (divmod, (1, 0))
+
+
+@skipUnless(posix_ipc.MESSAGE_QUEUES_SUPPORTED, "Requires MessageQueue support")
+class TestRPC(tests_base.Base):
+    """Exercise posix_ipc.rpc"""
+    def setUp(self):
+        self.server = posix_ipc.rpc.Server(None, Handlers(), posix_ipc.O_CREX)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05, ))
+        self.thread.start()
+        self.client = posix_ipc.rpc.Client(self.server.name)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.unlink()
+        self.server.close()
+
+    def test_call(self):
+        """tests that call() returns the handler's result"""
+        self.assertEqual(self.client.call('add', 40, b=2), 42)
+
+    def test_mapping_handlers(self):
+        """tests that handlers can be a mapping of names to callables"""
+        self.server.handlers = {'double': lambda x: x * 2}
+        self.assertEqual(self.client.call('double', 21), 42)
+
+    def test_exception(self):
+        """tests that the handler's exception is raised in the client with its traceback"""
+        with self.assertRaises(KeyError) as context:
+            self.client.call('fail')
+        self.assertIn('KeyError', str(context.exception.__cause__))
+
+    def test_no_such_method(self):
+        """tests that unknown and private methods raise AttributeError"""
+        self.assertRaises(AttributeError, self.client.call, 'no_such_method')
+        self.assertRaises(AttributeError, self.client.call, '_private')
+
+    def test_unpicklable_result(self):
+        """tests that a result that can't be sent back raises RemoteError"""
+        self.assertRaises(posix_ipc.rpc.RemoteError, self.client.call, 'unpicklable')
+        # The server is still working.
+        self.assertEqual(self.client.call('add', 1), 1)
+
+    def test_pipelining(self):
+        """tests that many calls can be outstanding and their results collected in any order"""
+        calls = [self.client.submit('add', i, 1) for i in range(50)]
+        self.assertEqual([call.result() for call in reversed(calls)],
+                         list(range(50, 0, -1)))
+        self.assertTrue(all(call.done() for call in calls))
+
+    def test_timeout(self):
+        """tests that a call that times out raises BusyError and can be waited for again"""
+        call = self.client.submit('sleep', 0.2)
+        self.assertRaises(posix_ipc.BusyError, call.result, 0.01)
+        self.assertFalse(call.done())
+        self.assertEqual(call.result(), 0.2)
+
+        self.client.timeout = 0.01
+        self.assertRaises(posix_ipc.BusyError, self.client.call, 'sleep', 0.2)
+
+    def test_cancel(self):
+        """tests that cancelled calls don't count as outstanding and their replies are dropped"""
+        self.client.timeout = 10
+        calls = [self.client.submit('sleep', 0.01) for i in range(3)]
+        self.assertTrue(calls[0].cancel())
+        self.assertTrue(calls[0].cancelled())
+        self.assertTrue(calls[0].done())
+        self.assertRaises(concurrent.futures.CancelledError, calls[0].result)
+        self.assertEqual(calls[2].result(), 0.01)
+        # The first call's reply arrived and was dropped.
+        self.assertFalse(calls[1].cancel())
+        self.assertEqual(calls[1].result(), 0.01)
+        self.assertEqual(self.client._pending, {})
+
+    def test_lost_replies(self):
+        """tests that calls whose replies never arrive don't block submit() once cancelled"""
+        self.server.shutdown()
+        self.thread.join()
+        self.client.timeout = 0.05
+        for i in range(posix_ipc.rpc.QUEUE_MAX_MESSAGES * 2):
+            call = self.client.submit('add', i)
+            # Take the request so that the server never replies to it.
+            self.server._requests.receive_obj(10)
+            self.assertRaises(posix_ipc.BusyError, call.result, 0)
+            call.cancel()
+
+        # call() cancels a call that times out.
+        self.assertRaises(posix_ipc.BusyError, self.client.call, 'add', 1)
+        self.assertEqual(self.client._pending, {})
+
+        self.server.handle_request(10)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05, ))
+        self.thread.start()
+        self.client.timeout = 10
+        self.assertEqual(self.client.call('add', 41, 1), 42)
+
+    def test_large_arguments(self):
+        """tests that arguments and results larger than the queues round trip"""
+        data = bytearray(os.urandom(1024 * 1024))
+        self.assertEqual(self.client.call('echo', data), data)
+        self.assertEqual(self.client.call('echo', bytes(data)), bytes(data))
+
+    def test_bad_requests(self):
+        """tests that requests that can't be decoded are dropped without stopping the server"""
+        requests = posix_ipc.MessageQueue(self.server.name, read=False)
+        replies = posix_ipc.MessageQueue(None, posix_ipc.O_CREX)
+        try:
+            with self.assertLogs('posix_ipc.rpc', 'WARNING') as logs:
+                # Unpickling this raises ZeroDivisionError.
+                requests.send_obj(Undecodable())
+                requests.send_obj('not a tuple')
+                # This one says where to send the error.
+                requests.send_obj((7, replies.name, 'add'))
+                call_id, succeeded, (exception, tb) = replies.receive_obj(10)
+            self.assertEqual(len(logs.records), 3)
+            self.assertEqual((call_id, succeeded), (7, False))
+            self.assertIsInstance(exception, posix_ipc.rpc.RemoteError)
+            self.assertEqual(self.client.call('add', 1), 1)
+        finally:
+            replies.unlink()
+            replies.close()
+            requests.close()
+
+    def test_several_clients(self):
+        """tests that replies go to the client that made the call"""
+        with posix_ipc.rpc.Client(self.server.name) as other:
+            call = other.submit('add', 1, 2)
+            self.assertEqual(self.client.call('add', 3, 4), 7)
+            self.assertEqual(call.result(), 3)
+
+
+@skipUnless(posix_ipc.MESSAGE_QUEUES_SUPPORTED, "Requires MessageQueue support")
+class TestRPCBenchmark(tests_base.Base):
+    """Exercise posix_ipc.rpc.benchmark()"""
+    def test_benchmark(self):
+        """tests that benchmark() makes the calls and reports their latency"""
+        results = posix_ipc.rpc.benchmark(calls=50, size=10000, pipeline=4)
+        self.assertEqual(results['calls'], 50)
+        self.assertGreater(results['calls_per_second'], 0)
+        self.assertLessEqual(results['median_us'], results['p99_us'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,8 @@
 import unittest
 from unittest import skipUnless
 import datetime
+import threading
+import time
 
 # Project imports
 import posix_ipc
@@ -220,6 +222,55 @@ class TestSemaphoreAquisitionAndRelease(SemaphoreTestBase):
         sem.acquire(0)
 
 
+class TestSemaphoreSpin(SemaphoreTestBase):
+    """Exercise acquire() with spinning"""
+    def test_spin_default(self):
+        """tests that spinning is off by default"""
+        self.assertEqual(self.sem.spin, 0)
+
+    def test_spin_attribute(self):
+        """tests that Semaphore.spin is writable and rejects bad values"""
+        self.sem.spin = 1000
+        self.assertEqual(self.sem.spin, 1000)
+        self.sem.acquire()
+        with self.assertRaises(posix_ipc.BusyError):
+            self.sem.acquire(0)
+
+        with self.assertRaises(ValueError):
+            self.sem.spin = -1
+        with self.assertRaises(TypeError):
+            self.sem.spin = 'fast'
+        self.assertEqual(self.sem.spin, 1000)
+
+    def test_spin_param(self):
+        """tests that acquire(spin=n) works and validates n"""
+        self.sem.acquire(spin=1000)
+        with self.assertRaises(posix_ipc.BusyError):
+            self.sem.acquire(0, spin=1000)
+        with self.assertRaises(ValueError):
+            self.sem.acquire(spin=-1)
+        with self.assertRaises(TypeError):
+            self.sem.acquire(spin=1.5)
+
+    @skipUnless(posix_ipc.SEMAPHORE_TIMEOUT_SUPPORTED, "Requires Semaphore timeout support")
+    def test_spin_then_timeout(self):
+        """tests that the timeout still applies after a fruitless spin"""
+        self.sem.acquire()
+        with self.assertRaises(posix_ipc.BusyError):
+            self.sem.acquire(0.1, spin=100000)
+
+    def test_spin_handoff(self):
+        """tests that a spinning acquire() sees a release() from another process"""
+        self.sem.acquire()
+        pid = os.fork()
+        if not pid:
+            time.sleep(0.1)
+            self.sem.release()
+            os._exit(0)
+        self.sem.acquire(spin=1000000)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+
 class TestSemaphoreDestruction(SemaphoreTestBase):
     def test_close_and_unlink(self):
         """tests that sem.close() and sem.unlink() work"""
@@ -254,5 +305,116 @@ class TestSemaphorePropertiesAndAttributes(SemaphoreTestBase):
         self.assertWriteToReadOnlyPropertyFails('value', 42)
 
 
+@skipUnless(posix_ipc.SEMAPHORE_ARRAY_SUPPORTED, "Requires SemaphoreArray support")
+class TestSemaphoreArray(tests_base.Base):
+    """Exercise posix_ipc.SemaphoreArray"""
+    COUNT = 100
+
+    def setUp(self):
+        # Leave room for something else at the start of the segment.
+        self.offset = 128
+        size = self.offset + posix_ipc.SemaphoreArray.size_of(self.COUNT)
+        self.memory = posix_ipc.SharedMemory(None, posix_ipc.O_CREX, size=size)
+        self.array = posix_ipc.SemaphoreArray(self.memory, self.COUNT, self.offset,
+                                              initial_value=1)
+
+    def tearDown(self):
+        self.memory.close_fd()
+        self.memory.unlink()
+
+    def test_attributes(self):
+        """tests len(), offset and size_of()"""
+        self.assertEqual(len(self.array), self.COUNT)
+        self.assertEqual(self.array.offset, self.offset)
+        self.assertGreater(posix_ipc.SemaphoreArray.size_of(2),
+                           posix_ipc.SemaphoreArray.size_of(1))
+
+    def test_acquire_release(self):
+        """tests that each semaphore is independent"""
+        self.array.acquire(3)
+        self.assertRaises(posix_ipc.BusyError, self.array.acquire, 3, 0)
+        self.array.acquire(4, 0)
+        self.array.acquire(-1)
+        self.array.release(3)
+        self.array.acquire(3, timeout=0)
+
+    @skipUnless(posix_ipc.SEMAPHORE_VALUE_SUPPORTED, "Requires Semaphore.value support")
+    def test_value(self):
+        """tests that value() reports each semaphore's value"""
+        self.array.release(7)
+        self.assertEqual(self.array.value(7), 2)
+        self.assertEqual(self.array.value(8), 1)
+
+    @skipUnless(posix_ipc.SEMAPHORE_TIMEOUT_SUPPORTED, "Requires sem_timedwait()")
+    def test_timeout(self):
+        """tests that acquire() with a positive timeout waits and then raises BusyError"""
+        self.array.acquire(0)
+        start = time.time()
+        self.assertRaises(posix_ipc.BusyError, self.array.acquire, 0, .2)
+        self.assertGreaterEqual(time.time() - start, .19)
+
+    def test_index_out_of_range(self):
+        """tests that bad indices raise IndexError"""
+        self.assertRaises(IndexError, self.array.acquire, self.COUNT)
+        self.assertRaises(IndexError, self.array.release, -self.COUNT - 1)
+
+    def test_attach_existing(self):
+        """tests that a second SemaphoreArray shares the semaphores without reinitializing them"""
+        self.array.acquire(9)
+        other = posix_ipc.SemaphoreArray(self.memory, self.COUNT, self.offset, initial_value=5)
+        self.assertRaises(posix_ipc.BusyError, other.acquire, 9, 0)
+        other.release(9)
+        self.array.acquire(9, 0)
+        other.close()
+
+    def test_other_process(self):
+        """tests that the semaphores work between processes"""
+        self.array.acquire(10)
+        pid = os.fork()
+        if not pid:
+            try:
+                memory = posix_ipc.SharedMemory(self.memory.name)
+                array = posix_ipc.SemaphoreArray(memory, self.COUNT, self.offset)
+                array.acquire(10)
+                array.release(11)
+                os._exit(0)
+            except BaseException:
+                os._exit(1)
+        self.array.acquire(11)
+        self.array.release(10)
+        self.array.acquire(11, 5)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+    def test_wrong_count(self):
+        """tests that attaching with a different count raises ValueError"""
+        self.assertRaises(ValueError, posix_ipc.SemaphoreArray, self.memory, self.COUNT - 1,
+                          self.offset)
+
+    def test_bad_parameters(self):
+        """tests that bad offsets, counts and segments are rejected"""
+        self.assertRaises(ValueError, posix_ipc.SemaphoreArray, self.memory, 0)
+        self.assertRaises(ValueError, posix_ipc.SemaphoreArray, self.memory, 1, 8)
+        self.assertRaises(ValueError, posix_ipc.SemaphoreArray, self.memory, self.COUNT * 2)
+        self.assertRaises(TypeError, posix_ipc.SemaphoreArray, 'not memory', 1)
+
+    def test_close(self):
+        """tests that using a closed array raises ExistentialError"""
+        self.array.close()
+        self.assertRaises(posix_ipc.ExistentialError, self.array.acquire, 0)
+        self.assertRaises(posix_ipc.ExistentialError, self.array.close)
+
+    @skipUnless(posix_ipc.SEMAPHORE_TIMEOUT_SUPPORTED, "Requires sem_timedwait()")
+    def test_close_while_waiting(self):
+        """tests that close() raises BusyError while another thread is blocked in acquire()"""
+        self.array.acquire(0)
+        thread = threading.Thread(target=self.assertRaises,
+                                  args=(posix_ipc.BusyError, self.array.acquire, 0, .5))
+        thread.start()
+        time.sleep(.1)
+        self.assertRaises(posix_ipc.BusyError, self.array.close)
+        thread.join()
+        self.array.close()
+
+
 if __name__ == '__main__':
     unittest.main()
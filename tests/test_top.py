@@ -0,0 +1,116 @@
+# Python imports
+import unittest
+from unittest import skipUnless
+import io
+import json
+import os
+
+# Project imports
+import posix_ipc
+from posix_ipc import _top
+from posix_ipc.__main__ import main
+# Hack -- add tests directory to sys.path so Python 3 can find base.py.
+import sys
+sys.path.insert(0, os.path.join(os.getcwd(), 'tests'))
+import base as tests_base  # noqa
+
+INVENTORY_SUPPORTED = os.path.isdir(posix_ipc._inventory.SHARED_MEMORY_DIRECTORY)
+
+
+@skipUnless(INVENTORY_SUPPORTED, "Requires /dev/shm")
+class TestTop(tests_base.Base):
+    """Exercise python -m posix_ipc top"""
+    def setUp(self):
+        self.prefix = tests_base.make_name()
+        self.mem = posix_ipc.SharedMemory(self.prefix + "_mem", posix_ipc.O_CREX, size=1234)
+
+    def tearDown(self):
+        self.mem.close_fd()
+        posix_ipc.reap(self.prefix)
+
+    @skipUnless(posix_ipc.MESSAGE_QUEUES_SUPPORTED, "Requires MessageQueue support")
+    @skipUnless(os.path.isdir(posix_ipc._inventory.MESSAGE_QUEUE_DIRECTORY),
+                "Requires the mqueue filesystem")
+    def test_queue_depth_and_rates(self):
+        """tests that the monitor tracks a queue's depth, high-water mark and rates"""
+        mq = posix_ipc.MessageQueue(self.prefix + "_mq", posix_ipc.O_CREX, max_messages=10,
+                                    max_message_size=10)
+        monitor = _top.Monitor(self.prefix)
+        monitor.poll()
+        for i in range(4):
+            mq.send(b'x')
+        monitor.poll()
+        mq.receive()
+        monitor.poll()
+        report = monitor.report()
+        monitor.close()
+        mq.close()
+
+        queue, = [o for o in report["objects"] if o["kind"] == "message_queue"]
+        self.assertEqual(queue["depth"], 3)
+        self.assertEqual(queue["high_water"], 4)
+        self.assertEqual(queue["queued_bytes"], 3)
+        self.assertGreater(queue["in_per_second"], 0)
+        self.assertGreater(queue["out_per_second"], 0)
+
+    @skipUnless(posix_ipc.SEMAPHORE_VALUE_SUPPORTED, "Requires Semaphore.value support")
+    def test_semaphore_value(self):
+        """tests that the monitor reports a semaphore's value"""
+        sem = posix_ipc.Semaphore(self.prefix + "_sem", posix_ipc.O_CREX, initial_value=2)
+        monitor = _top.Monitor(self.prefix)
+        monitor.poll()
+        sem.release()
+        monitor.poll()
+        report = monitor.report()
+        monitor.close()
+        sem.close()
+
+        semaphore, = [o for o in report["objects"] if o["kind"] == "semaphore"]
+        self.assertEqual(semaphore["name"], self.prefix + "_sem")
+        self.assertEqual(semaphore["depth"], 3)
+        self.assertEqual(semaphore["high_water"], 3)
+
+    def test_unlinked_objects_are_dropped(self):
+        """tests that objects disappear from the report once they're unlinked"""
+        monitor = _top.Monitor(self.prefix)
+        monitor.poll()
+        self.assertEqual(len(monitor.report()["objects"]), 1)
+        self.mem.unlink()
+        monitor.poll()
+        self.assertEqual(monitor.report()["objects"], [])
+        monitor.close()
+
+    def test_json_output(self):
+        """tests that run() writes one JSON report per line"""
+        output = io.StringIO()
+        _top.run(self.prefix, interval=0.01, count=2, as_json=True, output=output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        report = json.loads(lines[0])
+        self.assertEqual(report["prefix"], self.prefix)
+        memory, = report["objects"]
+        self.assertEqual(memory["kind"], "shared_memory")
+        self.assertEqual(memory["size"], 1234)
+        self.assertIsNone(memory["depth"])
+        self.assertIn("used", report["shared_memory_filesystem"])
+
+    def test_text_output(self):
+        """tests that run() writes a table of the objects"""
+        output = io.StringIO()
+        _top.run(self.prefix, interval=0.01, count=1, output=output)
+        self.assertIn(self.prefix + "_mem", output.getvalue())
+        self.assertIn("1.2K", output.getvalue())
+
+    def test_command_line_errors(self):
+        """tests that invalid command lines are rejected"""
+        stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            self.assertRaises(SystemExit, main, [])
+            self.assertRaises(SystemExit, main, ["top", "--interval", "0"])
+        finally:
+            sys.stderr = stderr
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+# Python imports
+import unittest
+import os
+
+# Project imports
+import posix_ipc
+# Hack -- add tests directory to sys.path so Python 3 can find base.py.
+import sys
+sys.path.insert(0, os.path.join(os.getcwd(), 'tests'))
+import base as tests_base  # noqa
+
+
+class TestVersionedSegment(tests_base.Base):
+    """Exercise posix_ipc.VersionedSegment"""
+    def setUp(self):
+        self.versioned = posix_ipc.VersionedSegment(None)
+
+    def tearDown(self):
+        self.versioned.unlink()
+        self.versioned.close()
+
+    def publish(self, data):
+        with self.versioned.build(len(data)) as draft:
+            draft.buffer[:] = data
+        return draft.generation
+
+    def generation_exists(self, generation):
+        name = "%s.%d" % (self.versioned.name, generation)
+        return bool(posix_ipc.list_objects(name, "shared_memory"))
+
+    def test_nothing_published(self):
+        """tests that pinning before anything is published raises ExistentialError"""
+        self.assertEqual(self.versioned.generation, 0)
+        self.assertRaises(posix_ipc.ExistentialError, self.versioned.pin)
+
+    def test_publish_and_pin(self):
+        """tests that readers see the most recently published generation"""
+        self.assertEqual(self.publish(b'one'), 1)
+        self.assertEqual(self.publish(b'two!'), 2)
+        self.assertEqual(self.versioned.generation, 2)
+        with self.versioned.pin() as version:
+            self.assertEqual(version.generation, 2)
+            self.assertEqual(version.size, 4)
+            self.assertEqual(bytes(version.buffer), b'two!')
+            self.assertTrue(version.buffer.readonly)
+
+    def test_pinned_generation_survives(self):
+        """tests that a pinned generation is unchanged by publication and unlinked on release"""
+        self.publish(b'one')
+        version = self.versioned.pin()
+        self.publish(b'two')
+        self.publish(b'three')
+        self.assertEqual(bytes(version.buffer), b'one')
+        self.assertTrue(self.generation_exists(1))
+        # Generation 2 was never pinned, so it was unlinked when 3 was published.
+        self.assertFalse(self.generation_exists(2))
+        version.release()
+        self.assertFalse(self.generation_exists(1))
+        self.assertTrue(self.generation_exists(3))
+
+    def test_draft_discarded_on_error(self):
+        """tests that an exception in a draft's with block discards it"""
+        self.publish(b'one')
+        with self.assertRaises(ZeroDivisionError):
+            with self.versioned.build(10) as draft:
+                1 / 0
+        self.assertFalse(self.generation_exists(draft.generation))
+        self.assertEqual(self.versioned.generation, 1)
+        self.assertRaises(posix_ipc.ExistentialError, draft.publish)
+
+    def test_superseded_draft(self):
+        """tests that publishing a draft older than the current generation discards it"""
+        old = self.versioned.build(3)
+        self.publish(b'new')
+        self.assertFalse(old.publish())
+        self.assertFalse(self.generation_exists(old.generation))
+        with self.versioned.pin() as version:
+            self.assertEqual(bytes(version.buffer), b'new')
+
+    def test_concurrent_drafts(self):
+        """tests that two drafts being built at once get their own slots"""
+        self.publish(b'one')
+        first = self.versioned.build(3)
+        second = self.versioned.build(3)
+        self.assertNotEqual(first._slot, second._slot)
+        first.buffer[:] = b'two'
+        self.assertTrue(first.publish())
+        self.assertTrue(self.generation_exists(first.generation))
+        with self.versioned.pin() as version:
+            self.assertEqual(bytes(version.buffer), b'two')
+        second.discard()
+        self.assertFalse(self.generation_exists(second.generation))
+        with self.versioned.pin() as version:
+            self.assertEqual(bytes(version.buffer), b'two')
+
+    def test_too_many_pinned(self):
+        """tests that build() raises BusyError when every slot is current or pinned"""
+        versions = []
+        for i in range(posix_ipc._versioned.SLOTS):
+            self.publish(b'x')
+            versions.append(self.versioned.pin())
+        self.assertRaises(posix_ipc.BusyError, self.versioned.build, 1)
+        # Any generation that's released frees a slot.
+        versions[3].release()
+        # build() failed, so there's a gap in the generation numbers.
+        self.assertEqual(self.publish(b'y'), posix_ipc._versioned.SLOTS + 2)
+        versions[0].release()
+        self.assertEqual(self.publish(b'z'), posix_ipc._versioned.SLOTS + 3)
+        versions.pop(3)
+        for version in versions[1:]:
+            version.release()
+
+    def test_open_existing(self):
+        """tests that another process sees the generations published by this one"""
+        self.publish(b'hello')
+        version = self.versioned.pin()
+        pid = os.fork()
+        if not pid:
+            try:
+                versioned = posix_ipc.VersionedSegment(self.versioned.name)
+                with versioned.pin() as version:
+                    ok = bytes(version.buffer) == b'hello'
+                with versioned.build(7) as draft:
+                    draft.buffer[:] = b'goodbye'
+                os._exit(0 if ok else 1)
+            except BaseException:
+                os._exit(2)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertEqual(bytes(version.buffer), b'hello')
+        version.release()
+        with self.versioned.pin() as version:
+            self.assertEqual(bytes(version.buffer), b'goodbye')
+
+    def test_o_crex_existing(self):
+        """tests that O_CREX won't open an existing VersionedSegment"""
+        self.assertRaises(posix_ipc.ExistentialError, posix_ipc.VersionedSegment,
+                          self.versioned.name, posix_ipc.O_CREX)
+
+    def test_not_a_versioned_segment(self):
+        """tests that opening some other segment raises ValueError"""
+        memory = posix_ipc.SharedMemory(None, posix_ipc.O_CREX, size=4096)
+        os.pwrite(memory.fd, b'x' * 8, 0)
+        memory.close_fd()
+        try:
+            self.assertRaises(ValueError, posix_ipc.VersionedSegment, memory.name)
+        finally:
+            memory.unlink()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# Python imports
+import unittest
+import concurrent.futures
+import os
+
+# Project imports
+import posix_ipc
+# Hack -- add tests directory to sys.path so Python 3 can find base.py.
+import sys
+sys.path.insert(0, os.path.join(os.getcwd(), 'tests'))
+import base as tests_base  # noqa
+import executor_base  # noqa
+from executor_base import add_one, get_pid  # noqa
+
+
+def wait_for_semaphore(name):
+    with posix_ipc.Semaphore(name):
+        pass
+    return os.getpid()
+
+
+class TestWorkStealingPool(executor_base.ExecutorTests, tests_base.Base):
+    """Exercise posix_ipc.WorkStealingPool"""
+    executor_class = posix_ipc.WorkStealingPool
+    small_options = {'capacity': 2}
+
+    @staticmethod
+    def ipc_objects(pool):
+        return [(posix_ipc.SharedMemory, pool._memory.name),
+                (posix_ipc.Semaphore, pool._work.name),
+                (posix_ipc.Semaphore, pool._results_available.name)]
+
+    def test_stealing(self):
+        """tests that tasks queued behind a long task are stolen by the other worker"""
+        sem = posix_ipc.Semaphore(None, posix_ipc.O_CREX)
+        try:
+            blocked = self.executor.submit(wait_for_semaphore, sem.name)
+            # Tasks are handed to the workers' deques in turn, so half of these are queued
+            # behind the blocked task.
+            futures = [self.executor.submit(get_pid, None) for i in range(20)]
+            done, not_done = concurrent.futures.wait(futures, timeout=10)
+            self.assertFalse(not_done)
+            self.assertFalse(blocked.done())
+            sem.release()
+            self.assertNotIn(blocked.result(), {future.result() for future in futures})
+        finally:
+            sem.unlink()
+            sem.close()
+
+    def test_full_deques(self):
+        """tests that submit() waits for room when every deque is full"""
+        with posix_ipc.WorkStealingPool(max_workers=1, capacity=2) as pool:
+            self.assertEqual(list(pool.map(add_one, range(100))), list(range(1, 101)))
+
+    def test_bad_parameters(self):
+        """tests that capacity and slot_size are checked"""
+        self.assertRaises(ValueError, posix_ipc.WorkStealingPool, capacity=0)
+        self.assertRaises(ValueError, posix_ipc.WorkStealingPool, slot_size=8)
+
+
+if __name__ == '__main__':
+    unittest.main()